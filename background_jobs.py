@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tarefas longas das rotas executadas em segundo plano.
+
+Rotas como /force_download varrem seletores, rolam a página, tentam três
+formas de clique e aguardam o CAPTCHA, o que leva dezenas de segundos. Em vez
+de manter a requisição HTTP aberta, a rota cria uma tarefa e retorna o seu
+identificador na hora; a tarefa roda no executor da sessão de navegador (um
+por sessão, com uma única thread) e o progresso e o resultado chegam aos
+clientes pelo socket.io:
+
+    background_job           estado completo da tarefa a cada transição
+    background_job_progress  cada mensagem de progresso (também em server_log)
+
+O executor serializa apenas as tarefas da sessão entre si: o monitor e o
+encaminhamento de entrada continuam usando o mesmo driver ao mesmo tempo,
+como faziam quando essas rotas rodavam na thread da requisição.
+
+Pedidos repetidos enquanto uma tarefa igual (mesma sessão e mesma chave)
+está na fila ou executando recebem essa tarefa, em vez de criar outra. O
+cancelamento é cooperativo: a tarefa para no próximo ponto de verificação
+(progress, sleep ou check_cancelled).
+
+Cada execução é um trace (webdriver_tracing) chamado "tarefa <nome>", com os
+comandos WebDriver da tarefa, já que a thread do executor não tem o trace da
+rota que a criou.
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from webdriver_tracing import tracer
+
+logger = logging.getLogger('background_jobs')
+
+# Estados de uma tarefa
+TASK_QUEUED = 'na_fila'
+TASK_RUNNING = 'executando'
+TASK_DONE = 'concluido'
+TASK_FAILED = 'falhou'
+TASK_CANCELLED = 'cancelado'
+
+FINAL_STATES = (TASK_DONE, TASK_FAILED, TASK_CANCELLED)
+
+# Tarefas finalizadas mantidas para consulta
+MAX_FINISHED = 200
+
+
+class JobCancelled(BaseException):
+    """
+    A tarefa foi cancelada e parou em um ponto de verificação.
+
+    Deriva de BaseException para atravessar os "except Exception" do código
+    da rota, que tratam falhas de seletores e cliques.
+    """
+
+
+class BackgroundJob:
+    """Uma execução de rota longa, com progresso e cancelamento."""
+
+    def __init__(self, name, session_id, key, emit):
+        self.job_id = uuid.uuid4().hex
+        self.name = name
+        self.session_id = session_id
+        self.key = key
+        self.state = TASK_QUEUED
+        self.result = None
+        self.error = None
+        self.progress_messages = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._emit = emit
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Interrompe a tarefa se o cancelamento foi pedido."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, message, level='info'):
+        """Publica uma mensagem de progresso (e verifica o cancelamento)."""
+        self.progress_messages.append({'message': message, 'level': level, 'ts': time.time()})
+        self._emit('server_log', {'message': message, 'level': level})
+        self._emit('background_job_progress', {'job_id': self.job_id, 'name': self.name,
+                                               'message': message, 'level': level})
+        self.check_cancelled()
+
+    def sleep(self, seconds):
+        """Aguarda, interrompendo a espera se a tarefa for cancelada."""
+        if self._cancel.wait(seconds):
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'session_id': self.session_id,
+            'state': self.state,
+            'result': self.result,
+            'error': self.error,
+            'progress': self.progress_messages[-1]['message'] if self.progress_messages else None,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class BackgroundJobs:
+    """Executa as tarefas longas no executor de cada sessão de navegador."""
+
+    def __init__(self, emit=None, max_finished=MAX_FINISHED):
+        """
+        Args:
+            emit: Função (evento, dados) para notificar os clientes
+            max_finished: Tarefas finalizadas mantidas para consulta
+        """
+        self.emit = emit or (lambda event, data: None)
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._active = {}  # (session_id, chave) -> BackgroundJob na fila ou executando
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, name, fn, key=None):
+        """
+        Cria uma tarefa, ou devolve a tarefa igual que já está em andamento.
+
+        Args:
+            session_id: Sessão de navegador usada pela tarefa (define o executor)
+            name: Nome da tarefa (ex.: 'force_download')
+            fn: Função (job) que executa o trabalho e retorna o resultado
+            key: Chave de agrupamento de pedidos repetidos (padrão: name)
+
+        Returns:
+            tuple: (BackgroundJob, coalesced)
+        """
+        key = key or name
+        with self._lock:
+            active = self._active.get((session_id, key))
+            if active and active.state not in FINAL_STATES and not active.cancel_requested:
+                logger.info(f"Pedido de {name} agrupado na tarefa {active.job_id}")
+                return active, True
+
+            job = BackgroundJob(name, session_id, key, self._safe_emit)
+            self._jobs[job.job_id] = job
+            self._active[(session_id, key)] = job
+            executor = self._executors.get(session_id)
+            if not executor:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"tarefas-{session_id}")
+                self._executors[session_id] = executor
+            self._prune()
+
+        self._publish(job)
+        job.future = executor.submit(self._run, job, fn)
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        Pede o cancelamento de uma tarefa.
+
+        Returns:
+            BackgroundJob: A tarefa, ou None se não existe
+        """
+        job = self.get(job_id)
+        if not job or job.state in FINAL_STATES:
+            return job
+        job._cancel.set()
+        if job.future and job.future.cancel():
+            # Ainda não tinha começado
+            self._finish(job, TASK_CANCELLED)
+        else:
+            self._publish(job)
+        return job
+
+    def shutdown(self):
+        """Cancela as tarefas pendentes e encerra os executores."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.state not in FINAL_STATES]
+            executors, self._executors = list(self._executors.values()), {}
+        for job in jobs:
+            self.cancel(job.job_id)
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+    def _run(self, job, fn):
+        if job.cancel_requested:
+            self._finish(job, TASK_CANCELLED)
+            return
+        job.state = TASK_RUNNING
+        job.started_at = time.time()
+        self._publish(job)
+        try:
+            with tracer.span(f"tarefa {job.name}", 'tarefa', job_id=job.job_id, session=job.session_id):
+                job.result = fn(job)
+        except JobCancelled:
+            logger.info(f"Tarefa {job.job_id} ({job.name}) cancelada")
+            self._finish(job, TASK_CANCELLED)
+            return
+        except Exception as e:
+            logger.error(f"Erro na tarefa {job.job_id} ({job.name}): {str(e)}")
+            job.error = str(e)
+            self._finish(job, TASK_FAILED)
+            return
+        self._finish(job, TASK_DONE)
+
+    def _finish(self, job, state):
+        with self._lock:
+            job.state = state
+            job.finished_at = time.time()
+            if self._active.get((job.session_id, job.key)) is job:
+                del self._active[(job.session_id, job.key)]
+        self._publish(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _publish(self, job):
+        self._safe_emit('background_job', job.to_dict())
+
+    def _safe_emit(self, event, data):
+        try:
+            self.emit(event, data)
+        except Exception as e:
+            logger.error(f"Erro ao notificar tarefa: {str(e)}")
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark de ponta a ponta contra o SICAR simulado (fake_sicar.py).
+
+Sobe o SICAR simulado em uma porta local, aponta o captcha_mirror para ele e
+mede, com o Chrome real:
+
+    deteccao      latência de check_for_captcha com o CAPTCHA na tela, por variante
+    clique        tempo do clique em btnDownloadShapefileUC até a imagem do CAPTCHA
+    acoes         bytes e eventos Socket.IO emitidos por ação do operador
+    vazao         downloads por hora do pool de sessões, com a bancada fazendo o
+                  papel do operador (as respostas vêm do próprio SICAR simulado)
+    perfil        tempo de carregamento e bytes da página do SICAR real (ou de
+                  --profile-url) com e sem o perfil de bloqueio de recursos
+    cache         a mesma página em Chrome recém-iniciado com perfil novo (frio)
+                  e com o perfil persistente já usado (quente)
+
+Cada execução é acrescentada a data/benchmarks/results.jsonl com o commit,
+o ambiente e a configuração, para comparar resultados entre commits:
+
+    python benchmark.py --rounds 5 --jobs 10 --pool 2
+    python benchmark.py --suites perfil --profile leve
+    python benchmark.py --compare 5
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import sicar_automation
+import resource_profile
+from fake_sicar import FakeSicar, FakeSicarServer, VARIANTS, DEFAULT_ANSWER
+from captcha_queue import CaptchaQueue, percentile
+from metrics import payload_size
+
+logger = logging.getLogger('benchmark')
+
+BASE_DIR = Path(__file__).resolve().parent
+RESULTS_PATH = BASE_DIR / "data" / "benchmarks" / "results.jsonl"
+
+# Página medida pela suíte perfil: o SICAR real, antes de apontar para o simulado
+SICAR_PROFILE_URL = sicar_automation.sicar_url(sicar_automation.SICAR_INDEX_PATH)
+
+# Espera após cada ação do operador pelos eventos emitidos em segundo plano
+ACTION_SETTLE = 1.0
+
+# Lote de coordenadas de um arrasto curto, como enviado pelo cliente
+MOUSE_BATCH = [{'type': 'mousemove', 'x': 0.40 + step * 0.01, 'y': 0.5} for step in range(10)]
+
+
+def summarize(values):
+    """Média e percentis de uma lista de durações (segundos)."""
+    values = [value for value in values if value is not None]
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def git_revision():
+    """Commit atual e se há alterações não commitadas."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                               capture_output=True, text=True, timeout=10).stdout.strip() != ''
+        return {'commit': commit or None, 'dirty': dirty}
+    except (OSError, subprocess.SubprocessError):
+        return {'commit': None, 'dirty': None}
+
+
+def synthetic_car_code(index):
+    """Código do CAR fictício no formato UF-IBGE-HASH."""
+    return f"MT-5100250-{uuid.uuid4().hex[:8].upper()}{index:04d}"
+
+
+def open_captcha(driver, timeout):
+    """
+    Abre um imóvel novo no SICAR simulado e clica no download.
+
+    Returns:
+        tuple: (segundos de navegação, segundos do clique até a imagem do CAPTCHA ou None)
+    """
+    started = time.perf_counter()
+    if not sicar_automation.open_property(driver, synthetic_car_code(0), timeout=timeout):
+        return None, None
+    navigation = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sicar_automation.click_download_button(driver)
+    element = sicar_automation.wait_for_any(driver, sicar_automation.CAPTCHA_IMAGE_SELECTORS, timeout)
+    return navigation, (time.perf_counter() - started) if element else None
+
+
+def current_answer(driver, sicar):
+    """Resposta do CAPTCHA exibido, consultada no SICAR simulado pelo token da página."""
+    token = driver.execute_script("const campo = document.getElementById('tokenCaptcha'); return campo ? campo.value : null;")
+    return sicar.answer_for(token) if token else None
+
+
+def bench_detection(mirror, sicar, variants, rounds, timeout):
+    """Navegação, clique até o CAPTCHA e latência de check_for_captcha por variante."""
+    results = {}
+    for variant in variants:
+        sicar.variant = variant
+        navigation, click, detection, detected = [], [], [], 0
+        for _ in range(rounds):
+            nav_seconds, click_seconds = open_captcha(mirror.driver, timeout)
+            navigation.append(nav_seconds)
+            click.append(click_seconds)
+
+            started = time.perf_counter()
+            if mirror.check_for_captcha():
+                detected += 1
+            detection.append(time.perf_counter() - started)
+            mirror.captcha_queue.cancel_session(mirror.DEFAULT_SESSION_ID)
+
+        results[variant] = {
+            'navigation': summarize(navigation),
+            'click_to_captcha': summarize(click),
+            'captcha_visible_rate': sum(1 for value in click if value is not None) / rounds,
+            'detection': summarize(detection),
+            'detection_rate': detected / rounds,
+        }
+        logger.info(f"Detecção ({variant}): {results[variant]['detection']}")
+    return results
+
+
+def bench_operator_actions(mirror, sicar, rounds, timeout):
+    """Bytes e eventos Socket.IO emitidos por ação do operador na sessão interativa."""
+    events_counter = mirror.SOCKET_EVENTS
+    bytes_counter = mirror.SOCKET_BYTES
+    client = mirror.app.test_client()
+    socket_client = mirror.socketio.test_client(mirror.app)
+    sicar.variant = 'normal'
+
+    actions = {
+        'clique': lambda: client.post('/browser_click', json={'x': 0.5, 'y': 0.5}),
+        'entrada': lambda: socket_client.emit('browser_input', {'events': MOUSE_BATCH}),
+        'screenshot': lambda: client.get('/get_screenshot'),
+        'captcha': lambda: client.post('/send_captcha', json={'text': current_answer(mirror.driver, sicar)}),
+    }
+    measured = {name: {'bytes': [], 'events': [], 'seconds': []} for name in actions}
+
+    for _ in range(rounds):
+        open_captcha(mirror.driver, timeout)
+        mirror.check_for_captcha()
+        for name, action in actions.items():
+            bytes_before, events_before = bytes_counter.total(), events_counter.total()
+            started = time.perf_counter()
+            action()
+            seconds = time.perf_counter() - started
+            time.sleep(ACTION_SETTLE)
+            socket_client.get_received()
+            measured[name]['bytes'].append(bytes_counter.total() - bytes_before)
+            measured[name]['events'].append(events_counter.total() - events_before)
+            measured[name]['seconds'].append(seconds)
+        mirror.captcha_queue.cancel_session(mirror.DEFAULT_SESSION_ID)
+
+    socket_client.disconnect()
+    return {name: {'bytes': summarize(values['bytes']), 'events': summarize(values['events']),
+                   'seconds': summarize(values['seconds'])}
+            for name, values in measured.items()}
+
+
+def bench_profile(profile_name, url, rounds, timeout, work_dir):
+    """Carregamento da página sem e com o perfil de recursos, alternando os dois a cada rodada."""
+    from browser_session import create_chrome_driver
+    from cdp_events import CdpEventPump
+
+    profile = resource_profile.get_profile(profile_name)
+    measured = {'completo': [], profile_name: []}
+    drivers = {}
+    try:
+        for name in measured:
+            driver = create_chrome_driver(os.path.join(work_dir, f"perfil-{name}"), performance_log=True,
+                                          resource_profile=profile if name == profile_name else None)
+            drivers[name] = (driver, CdpEventPump(driver))
+
+        for _ in range(rounds):
+            for name, (driver, pump) in drivers.items():
+                measured[name].append(resource_profile.measure_page_load(driver, pump, url, timeout))
+    finally:
+        for driver, _ in drivers.values():
+            driver.quit()
+
+    results = {'url': url, 'profile': profile.to_dict()}
+    for name, loads in measured.items():
+        results[name] = {key: summarize([load[key] for load in loads])
+                         for key in ('wall_s', 'dom_content_loaded_s', 'load_s', 'bytes', 'requests', 'blocked')}
+    full, light = results['completo'], results[profile_name]
+    if full['load_s'].get('n') and light['load_s'].get('n'):
+        results['savings'] = {
+            'load_s': full['load_s']['mean'] - light['load_s']['mean'],
+            'bytes': full['bytes']['mean'] - light['bytes']['mean'],
+        }
+    logger.info(f"Perfil {profile_name}: {results.get('savings')}")
+    return results
+
+
+def bench_profile_cache(url, rounds, timeout, work_dir):
+    """Início e carregamento da página com perfil descartável e com perfil persistente reaproveitado."""
+    from browser_session import create_chrome_driver
+    from browser_profiles import ProfileManager
+    from cdp_events import CdpEventPump
+
+    def load(manager, slot):
+        path = manager.acquire(slot)
+        started = time.perf_counter()
+        driver = create_chrome_driver(os.path.join(work_dir, 'cache-downloads'), performance_log=True,
+                                      extra_arguments=manager.chrome_arguments(path))
+        start_seconds = time.perf_counter() - started
+        try:
+            return dict(resource_profile.measure_page_load(driver, CdpEventPump(driver), url, timeout,
+                                                           disable_cache=False), start_s=start_seconds)
+        finally:
+            driver.quit()
+            manager.release(slot)
+
+    warm_manager = ProfileManager(os.path.join(work_dir, 'perfis-quentes'))
+    load(warm_manager, 'bancada')  # primeira carga preenche o cache
+
+    measured = {'frio': [], 'quente': []}
+    for index in range(rounds):
+        measured['frio'].append(load(ProfileManager(os.path.join(work_dir, f"perfil-frio-{index}")), 'bancada'))
+        measured['quente'].append(load(warm_manager, 'bancada'))
+
+    results = {'url': url}
+    for name, loads in measured.items():
+        results[name] = {key: summarize([load[key] for load in loads])
+                         for key in ('start_s', 'wall_s', 'load_s', 'bytes', 'requests')}
+    if results['frio']['load_s'].get('n') and results['quente']['load_s'].get('n'):
+        results['savings'] = {
+            'load_s': results['frio']['load_s']['mean'] - results['quente']['load_s']['mean'],
+            'bytes': results['frio']['bytes']['mean'] - results['quente']['bytes']['mean'],
+        }
+    logger.info(f"Cache do perfil: {results.get('savings')}")
+    return results
+
+
+def bench_throughput(sicar, jobs, pool_size, operator_delay, timeout, work_dir):
+    """Downloads por hora do pool de sessões, com a bancada respondendo os CAPTCHAs."""
+    from browser_session import BrowserSession
+    from job_scheduler import JobScheduler, KIND_PROPERTY, FINAL_STATES, JOB_DONE
+    from download_watcher import DownloadWatcher
+
+    download_dir = Path(work_dir) / "downloads"
+    download_dir.mkdir(parents=True, exist_ok=True)
+    emitted = {'bytes': 0, 'events': 0}
+    sicar.variant = 'normal'
+
+    def on_operator_event(operator_id, event, data):
+        # A bancada faz o papel do operador: responde depois de operator_delay segundos.
+        # A tarefa traz só a imagem, então a vazão usa a resposta fixa do SICAR simulado
+        if event == 'captcha_task':
+            threading.Timer(operator_delay, captcha_queue.solve,
+                            (operator_id, data['task_id'], sicar.answer)).start()
+
+    def on_emit(event, data):
+        emitted['events'] += 1
+        emitted['bytes'] += payload_size(data)
+
+    captcha_queue = CaptchaQueue(on_operator_event, assignment_timeout=30, task_ttl=120)
+    threading.Thread(target=captcha_queue.run_maintenance, daemon=True).start()
+    captcha_queue.register_operator('bancada', 'Bancada')
+
+    scheduler = JobScheduler(
+        lambda index: BrowserSession(f"pool-{index + 1}", download_dir / f"pool-{index + 1}"),
+        captcha_queue,
+        pool_size=pool_size,
+        emit=on_emit,
+        navigation_timeout=timeout,
+    )
+    watcher = DownloadWatcher(download_dir, scheduler.notify_download)
+    watcher.start()
+
+    started = time.time()
+    batch_id, _ = scheduler.submit_batch([(KIND_PROPERTY, synthetic_car_code(index)) for index in range(jobs)])
+    deadline = started + max(600, jobs * 120)
+    while time.time() < deadline:
+        batch = scheduler.batch_status(batch_id)
+        if all(job['state'] in FINAL_STATES for job in batch['jobs']):
+            break
+        time.sleep(1)
+    elapsed = time.time() - started
+
+    batch = scheduler.batch_status(batch_id)
+    status = scheduler.status()
+    queue_metrics = captcha_queue.metrics()
+    scheduler.stop()
+    watcher.stop()
+
+    done = sum(1 for job in batch['jobs'] if job['state'] == JOB_DONE)
+    return {
+        'jobs': jobs,
+        'done': done,
+        'failed': sum(1 for job in batch['jobs'] if job['state'] != JOB_DONE),
+        'elapsed': elapsed,
+        'downloads_per_hour': done / elapsed * 3600 if elapsed > 0 else 0.0,
+        'avg_job_seconds': status['avg_job_seconds'],
+        'captcha_wait_p95': queue_metrics['wait_p95'],
+        'bytes_per_job': emitted['bytes'] / jobs if jobs else 0,
+        'events_per_job': emitted['events'] / jobs if jobs else 0,
+        'sicar': sicar.stats(),
+    }
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='captcha_mirror_bench_')
+    sicar = FakeSicar(answer=args.answer, slow_delay=args.slow_delay, late_dom_delay=args.late_dom_delay)
+    server = FakeSicarServer(sicar, port=args.port).start()
+
+    # O captcha_mirror e o pool navegam no SICAR simulado
+    os.environ['SICAR_BASE_URL'] = server.url
+    sicar_automation.SICAR_BASE_URL = server.url
+
+    record = {
+        'timestamp': time.time(),
+        'revision': git_revision(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'config': {key: value for key, value in vars(args).items() if key != 'compare'},
+        'results': {},
+    }
+
+    try:
+        import captcha_mirror as mirror
+        from browser_session import create_chrome_driver
+
+        if 'deteccao' in args.suites or 'acoes' in args.suites:
+            # Mesma configuração do navegador interativo aberto por "Iniciar Navegador"
+            mirror.driver = create_chrome_driver(os.path.join(work_dir, 'principal'))
+            record['environment']['chrome'] = mirror.driver.capabilities.get('browserVersion')
+            try:
+                if 'deteccao' in args.suites:
+                    record['results']['deteccao'] = bench_detection(mirror, sicar, args.variants, args.rounds,
+                                                                    args.timeout)
+                if 'acoes' in args.suites:
+                    record['results']['acoes'] = bench_operator_actions(mirror, sicar, args.rounds, args.timeout)
+            finally:
+                mirror.driver.quit()
+                mirror.driver = None
+
+        if 'perfil' in args.suites:
+            record['results']['perfil'] = bench_profile(args.profile, args.profile_url, args.rounds,
+                                                        args.timeout, work_dir)
+
+        if 'cache' in args.suites:
+            record['results']['cache'] = bench_profile_cache(args.profile_url, args.rounds, args.timeout, work_dir)
+
+        if 'vazao' in args.suites:
+            record['results']['vazao'] = bench_throughput(sicar, args.jobs, args.pool, args.operator_delay,
+                                                          args.timeout, work_dir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_PATH, 'a', encoding='utf-8') as output:
+        output.write(json.dumps(record) + '\n')
+    logger.info(f"Resultado gravado em {RESULTS_PATH}")
+    return record
+
+
+def compare(count):
+    """Tabela com as métricas principais das últimas execuções."""
+    if not RESULTS_PATH.exists():
+        print("Nenhum resultado gravado ainda")
+        return
+
+    with open(RESULTS_PATH, encoding='utf-8') as results:
+        records = [json.loads(line) for line in results if line.strip()][-count:]
+
+    def milliseconds(summary):
+        return f"{summary['p50'] * 1000:.0f}" if summary and summary.get('n') else '-'
+
+    columns = ['commit', 'data']
+    rows = []
+    for record in records:
+        revision = record['revision']
+        row = {
+            'commit': (revision['commit'] or '?') + ('*' if revision.get('dirty') else ''),
+            'data': time.strftime('%Y-%m-%d %H:%M', time.localtime(record['timestamp'])),
+        }
+        for variant, result in record['results'].get('deteccao', {}).items():
+            row[f"det {variant} p50ms"] = milliseconds(result['detection'])
+            row[f"clique {variant} p50ms"] = milliseconds(result['click_to_captcha'])
+        for action, result in record['results'].get('acoes', {}).items():
+            row[f"bytes {action}"] = f"{result['bytes'].get('mean', 0):.0f}"
+        if 'vazao' in record['results']:
+            row['downloads/h'] = f"{record['results']['vazao']['downloads_per_hour']:.1f}"
+        savings = record['results'].get('perfil', {}).get('savings')
+        if savings:
+            row['perfil -s'] = f"{savings['load_s']:.2f}"
+            row['perfil -KB'] = f"{savings['bytes'] / 1024:.0f}"
+        savings = record['results'].get('cache', {}).get('savings')
+        if savings:
+            row['cache -s'] = f"{savings['load_s']:.2f}"
+            row['cache -KB'] = f"{savings['bytes'] / 1024:.0f}"
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+        rows.append(row)
+
+    widths = {column: max(len(column), *(len(row.get(column, '-')) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(row.get(column, '-').ljust(widths[column]) for column in columns))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Benchmark do captcha_mirror contra o SICAR simulado')
+    parser.add_argument('--suites', nargs='+', default=['deteccao', 'acoes', 'vazao'],
+                        choices=['deteccao', 'acoes', 'vazao', 'perfil', 'cache'])
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument('--rounds', type=int, default=5, help='Repetições por variante e por ação')
+    parser.add_argument('--jobs', type=int, default=10, help='Imóveis do lote de vazão')
+    parser.add_argument('--pool', type=int, default=2, help='Sessões do pool no teste de vazão')
+    parser.add_argument('--operator-delay', type=float, default=2.0, help='Tempo de resposta do operador simulado')
+    parser.add_argument('--timeout', type=float, default=30, help='Espera máxima por cada etapa da página')
+    parser.add_argument('--answer', default=DEFAULT_ANSWER, help='Resposta dos CAPTCHAs do SICAR simulado')
+    parser.add_argument('--slow-delay', type=float, default=2.0)
+    parser.add_argument('--late-dom-delay', type=float, default=3.0)
+    parser.add_argument('--port', type=int, default=0, help='Porta do SICAR simulado (0: livre)')
+    parser.add_argument('--profile', default='leve', choices=sorted(resource_profile.PROFILES),
+                        help='Perfil de recursos medido pela suíte perfil')
+    parser.add_argument('--profile-url', default=SICAR_PROFILE_URL, help='Página medida pelas suítes perfil e cache')
+    parser.add_argument('--compare', type=int, metavar='N', help='Mostra as últimas N execuções e sai')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        sys.exit(0)
+
+    result = run(args)
+    print(json.dumps(result['results'], indent=2, ensure_ascii=False))
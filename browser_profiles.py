@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Perfis persistentes do Chrome, um por sessão (slot).
+
+Sem --user-data-dir o Chrome usa um perfil descartável e baixa de novo, a
+cada início, os scripts, estilos e recursos do mapa do SICAR. Aqui cada slot
+('principal', 'pool-1'...) tem um diretório de perfil reaproveitado entre
+sessões, com o cache HTTP em disco limitado por --disk-cache-size.
+
+Antes de cada uso o perfil é verificado (trava de um Chrome que caiu,
+preferências corrompidas, tamanho acima do limite) e limpo: cookies,
+armazenamento local, histórico e sessões são apagados; os caches (HTTP, de
+código e de GPU) são mantidos.
+"""
+
+import os
+import json
+import shutil
+import socket
+import logging
+import threading
+
+logger = logging.getLogger('browser_profiles')
+
+PROFILE_DIRECTORY = 'Default'
+
+# Itens mantidos na limpeza entre usos (o resto do perfil é apagado)
+KEEP_IN_PROFILE = {'Cache', 'Code Cache', 'GPUCache', 'Preferences'}
+KEEP_IN_ROOT = {PROFILE_DIRECTORY, 'Local State', 'ShaderCache', 'GrShaderCache', 'GraphiteDawnCache'}
+
+# Arquivos de trava criados pelo Chrome em uso
+SINGLETON_FILES = ('SingletonLock', 'SingletonSocket', 'SingletonCookie')
+
+# Arquivos JSON do perfil que o Chrome não abre se estiverem corrompidos
+JSON_FILES = ('Local State', os.path.join(PROFILE_DIRECTORY, 'Preferences'))
+
+DEFAULT_CACHE_SIZE = 300 * 1024 * 1024
+DEFAULT_MAX_PROFILE_SIZE = 1024 * 1024 * 1024
+
+
+def directory_size(path):
+    """Tamanho total dos arquivos de um diretório, em bytes."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Sem permissão para sinalizar: o processo existe
+        return True
+
+
+class ProfileManager:
+    """Diretórios de perfil do Chrome por slot, reaproveitados entre sessões."""
+
+    def __init__(self, root, cache_size=DEFAULT_CACHE_SIZE, max_profile_size=DEFAULT_MAX_PROFILE_SIZE):
+        """
+        Args:
+            root: Diretório que guarda os perfis (um subdiretório por slot)
+            cache_size: Limite do cache HTTP em disco, passado ao Chrome
+            max_profile_size: Tamanho acima do qual o perfil é descartado antes do uso
+        """
+        self.root = str(root)
+        self.cache_size = cache_size
+        self.max_profile_size = max_profile_size
+        self._in_use = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, slot):
+        return os.path.join(self.root, slot)
+
+    def acquire(self, slot):
+        """
+        Prepara o perfil do slot para um novo Chrome.
+
+        Returns:
+            str: Diretório do perfil, ou None se outro Chrome ainda o usa (o
+                chamador deve seguir com um perfil descartável)
+        """
+        with self._lock:
+            if slot in self._in_use:
+                logger.warning(f"Perfil {slot} já está em uso neste processo")
+                return None
+            path = self.path_for(slot)
+            if not self._check_integrity(slot, path):
+                return None
+            self.clean(slot)
+            self._in_use.add(slot)
+        return path
+
+    def release(self, slot):
+        """Libera o perfil depois que o Chrome foi encerrado."""
+        with self._lock:
+            self._in_use.discard(slot)
+
+    def chrome_arguments(self, path):
+        """Argumentos do Chrome para usar o perfil."""
+        return [
+            f'--user-data-dir={path}',
+            f'--profile-directory={PROFILE_DIRECTORY}',
+            f'--disk-cache-size={self.cache_size}',
+        ]
+
+    def clean(self, slot):
+        """Apaga o estado de navegação do perfil, mantendo os caches."""
+        path = self.path_for(slot)
+        if not os.path.isdir(path):
+            return
+        for name in os.listdir(path):
+            if name not in KEEP_IN_ROOT:
+                remove_path(os.path.join(path, name))
+        profile = os.path.join(path, PROFILE_DIRECTORY)
+        if os.path.isdir(profile):
+            for name in os.listdir(profile):
+                if name not in KEEP_IN_PROFILE:
+                    remove_path(os.path.join(profile, name))
+
+    def reset(self, slot):
+        """Descarta o perfil inteiro, inclusive o cache."""
+        remove_path(self.path_for(slot))
+
+    def stats(self):
+        """Slots existentes, tamanho de cada perfil e do seu cache."""
+        slots = []
+        for slot in sorted(os.listdir(self.root)):
+            path = self.path_for(slot)
+            if not os.path.isdir(path):
+                continue
+            slots.append({
+                'slot': slot,
+                'in_use': slot in self._in_use,
+                'size': directory_size(path),
+                'cache_size': directory_size(os.path.join(path, PROFILE_DIRECTORY, 'Cache')),
+            })
+        return {'root': self.root, 'cache_limit': self.cache_size, 'max_profile_size': self.max_profile_size,
+                'slots': slots}
+
+    def _check_integrity(self, slot, path):
+        """Remove travas órfãs e arquivos corrompidos; False se outro Chrome usa o perfil."""
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+            return True
+
+        owner = self._lock_owner(path)
+        if owner is not None:
+            logger.warning(f"Perfil {slot} travado pelo processo {owner}, usando perfil descartável")
+            return False
+        for name in SINGLETON_FILES:
+            remove_path(os.path.join(path, name))
+
+        for name in JSON_FILES:
+            file_path = os.path.join(path, name)
+            if not os.path.exists(file_path):
+                continue
+            try:
+                with open(file_path, encoding='utf-8') as source:
+                    json.load(source)
+            except (OSError, ValueError) as e:
+                logger.warning(f"{name} corrompido no perfil {slot}, removendo: {str(e)}")
+                remove_path(file_path)
+
+        size = directory_size(path)
+        if size > self.max_profile_size:
+            logger.warning(f"Perfil {slot} com {size} bytes acima do limite, descartando")
+            self.reset(slot)
+            os.makedirs(path, exist_ok=True)
+        return True
+
+    def _lock_owner(self, path):
+        """PID do Chrome vivo que trava o perfil, ou None."""
+        lock_path = os.path.join(path, 'SingletonLock')
+        if not os.path.islink(lock_path):
+            return None
+        # No Linux e no macOS a trava é um link para "<host>-<pid>"
+        try:
+            host, _, pid = os.readlink(lock_path).rpartition('-')
+            pid = int(pid)
+        except (OSError, ValueError):
+            return None
+        if host != socket.gethostname():
+            return None
+        return pid if process_alive(pid) else None
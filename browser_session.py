@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Criação do Chrome controlado pelo Selenium e sessões de navegador do pool.
+
+A sessão interativa (aberta por "Iniciar Navegador") e as sessões usadas pelo
+agendador de downloads em lote compartilham a mesma configuração do Chrome;
+cada sessão do pool tem seu próprio diretório de downloads.
+"""
+
+import os
+import time
+import logging
+import threading
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from cdp_events import CdpEventPump, enable_performance_log
+from captcha_form import resolve_captcha_handles, submit_captcha
+import politeness
+from direct_download import DownloadCapture
+from network_captcha import NetworkCaptchaCapture
+from sicar_automation import (open_property, open_municipality, click_download_button, capture_captcha,
+                              captcha_present, sicar_url, DOWNLOAD_DIALOG)
+from readiness import inside_frame
+from webdriver_instrumentation import instrument_driver
+
+logger = logging.getLogger('browser_session')
+
+# Estratégia de carregamento: com "eager", driver.get() retorna no
+# DOMContentLoaded, sem esperar imagens, tiles e scripts tardios; a
+# prontidão de cada página é verificada pelas sondas de readiness
+PAGE_LOAD_STRATEGY = 'eager'
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_chromedriver_path():
+    """Obtém (e guarda) o caminho do ChromeDriver, baixando-o apenas uma vez."""
+    global _driver_path
+
+    with _driver_path_lock:
+        if not _driver_path:
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+def build_chrome_options(download_dir, performance_log=False, extra_arguments=(), page_load_strategy=PAGE_LOAD_STRATEGY):
+    """
+    Monta as opções do Chrome usadas por todas as sessões.
+
+    Args:
+        download_dir: Diretório onde o Chrome grava os downloads
+        performance_log: Registra os eventos CDP de rede e página (ver cdp_events)
+        extra_arguments: Argumentos adicionais (ex.: perfil persistente de browser_profiles)
+        page_load_strategy: 'normal', 'eager' ou 'none'
+
+    Returns:
+        Options: Opções do Chrome
+    """
+    chrome_options = Options()
+    chrome_options.page_load_strategy = page_load_strategy
+
+    # Configurações adicionais - NÃO use headless para permitir interação e visualização
+    chrome_options.add_argument('--start-maximized')  # Inicia maximizado
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--disable-popup-blocking')
+    chrome_options.add_argument('--disable-infobars')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-gpu')
+    for argument in extra_arguments:
+        chrome_options.add_argument(argument)
+
+    # Desativa a mensagem "Chrome está sendo controlado por automação"
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+
+    # Configura o diretório de downloads
+    prefs = {
+        'download.default_directory': str(download_dir),
+        'download.prompt_for_download': False,
+        'download.directory_upgrade': True,
+        'safebrowsing.enabled': False
+    }
+    chrome_options.add_experimental_option('prefs', prefs)
+
+    if performance_log:
+        enable_performance_log(chrome_options)
+
+    return chrome_options
+
+
+def create_chrome_driver(download_dir, implicit_wait=10, performance_log=False, session_id='principal',
+                         resource_profile=None, extra_arguments=()):
+    """
+    Inicia um Chrome controlado pelo Selenium.
+
+    Args:
+        download_dir: Diretório onde o Chrome grava os downloads
+        implicit_wait: Espera implícita para encontrar elementos, em segundos
+        performance_log: Registra os eventos CDP de rede e página
+        session_id: Sessão dona do driver, usada nas métricas dos comandos WebDriver
+        resource_profile: ResourceProfile com os recursos a bloquear (None carrega tudo)
+        extra_arguments: Argumentos adicionais do Chrome
+
+    Returns:
+        WebDriver: Driver inicializado
+    """
+    os.makedirs(download_dir, exist_ok=True)
+
+    # Inicializa o serviço do ChromeDriver com o driver automaticamente baixado
+    service = Service(get_chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=build_chrome_options(download_dir, performance_log, extra_arguments))
+    instrument_driver(driver, session_id)
+    if resource_profile:
+        resource_profile.apply(driver)
+
+    # Define timeout padrão
+    driver.set_page_load_timeout(30)
+    driver.implicitly_wait(implicit_wait)
+
+    return driver
+
+
+class BrowserSession:
+    """
+    Uma sessão de navegador do pool de downloads em lote.
+
+    O Chrome é iniciado sob demanda e reiniciado se parar de responder.
+    As sessões do pool usam espera implícita zero: as buscas por elementos
+    ausentes retornam imediatamente e as esperas são sempre explícitas.
+
+    Com performance_log, a sessão mantém a leitura dos eventos CDP e a
+    captura dos pedidos de download usadas pelo download direto; com
+    network_captcha, também a captura das imagens de CAPTCHA pela rede. Com
+    profiles (ProfileManager), o Chrome usa o perfil persistente do slot da
+    sessão e reaproveita o cache HTTP entre reinícios.
+
+    As etapas do fluxo de download são métodos da sessão (open_property,
+    capture_captcha, submit_captcha...), para que o agendador use da mesma
+    forma uma sessão local ou uma WorkerSession em outro processo.
+    """
+
+    def __init__(self, session_id, download_dir, performance_log=False, network_captcha=False, resource_profile=None,
+                 profiles=None, extra_arguments=()):
+        self.session_id = session_id
+        self.download_dir = download_dir
+        self.resource_profile = resource_profile
+        self.profiles = profiles
+        self.extra_arguments = list(extra_arguments)
+        self.profile_path = None
+        self.network_captcha_enabled = network_captcha
+        self.performance_log = performance_log or network_captcha
+        self.driver = None
+        self.event_pump = None
+        self.download_capture = None
+        self.network_captcha = None
+        self.started_at = None
+        self.pages_loaded = 0
+        self.current_job_id = None
+        self.captcha_handles = None
+        self.captcha_frame = None  # Verificação do diálogo do CAPTCHA (iframe onde está o formulário)
+        self.recycle_reason = None
+        self.recycles = 0
+
+    def ensure_driver(self):
+        """Garante que há um Chrome ativo para a sessão e o retorna."""
+        if self.driver and self.is_alive():
+            return self.driver
+
+        self.close()
+        logger.info(f"Iniciando Chrome da sessão {self.session_id}")
+        self.profile_path = self.profiles.acquire(self.session_id) if self.profiles else None
+        arguments = self.profiles.chrome_arguments(self.profile_path) if self.profile_path else []
+        arguments = list(arguments) + self.extra_arguments
+        try:
+            self.driver = create_chrome_driver(self.download_dir, implicit_wait=0, performance_log=self.performance_log,
+                                               session_id=self.session_id, resource_profile=self.resource_profile,
+                                               extra_arguments=arguments)
+        except Exception:
+            self._release_profile()
+            raise
+        if self.performance_log:
+            self.event_pump = CdpEventPump(self.driver)
+            self.download_capture = DownloadCapture(self.event_pump)
+            if self.network_captcha_enabled:
+                self.network_captcha = NetworkCaptchaCapture(self.event_pump)
+        self.started_at = time.time()
+        self.pages_loaded = 0
+        self.recycle_reason = None
+        return self.driver
+
+    def reset_captures(self):
+        """Descarta os pedidos de download e CAPTCHAs capturados pela rede no trabalho anterior."""
+        if self.download_capture:
+            self.download_capture.reset()
+        if self.network_captcha:
+            self.network_captcha.reset()
+
+    # Etapas do fluxo de download (ver sicar_automation e captcha_form)
+
+    def open_property(self, car_code, timeout=60):
+        return open_property(self.driver, car_code, timeout)
+
+    def open_municipality(self, uf, municipio, timeout=60):
+        return open_municipality(self.driver, uf, municipio, timeout)
+
+    def click_download_button(self):
+        return click_download_button(self.driver)
+
+    def capture_captcha(self, timeout=15):
+        """Imagem PNG do CAPTCHA, ou None se nenhum apareceu no tempo limite."""
+        return capture_captcha(self.driver, timeout=timeout, network=self.network_captcha)
+
+    def prepare_captcha(self):
+        """Localiza o campo e o botão de envio do CAPTCHA exibido (no iframe do diálogo, se houver)."""
+        self.captcha_frame = DOWNLOAD_DIALOG.check(self.driver)
+        with inside_frame(self.driver, self.captcha_frame):
+            self.captcha_handles = resolve_captcha_handles(self.driver)
+
+    def submit_captcha(self, text):
+        """Envia a resposta do CAPTCHA e retorna o resultado (ver captcha_form)."""
+        # O envio dispara o download no SICAR
+        with politeness.scheduler.slot(sicar_url('/'), politeness.KIND_DOWNLOAD, timed=False):
+            with inside_frame(self.driver, self.captcha_frame or {}):
+                result, self.captcha_handles = submit_captcha(self.driver, self.captcha_handles, text)
+        return result
+
+    def captcha_present(self):
+        return captcha_present(self.driver)
+
+    def screenshot(self):
+        """Captura da tela em PNG."""
+        return self.driver.get_screenshot_as_png()
+
+    def request_recycle(self, reason):
+        """Marca o Chrome para ser reiniciado no próximo ponto seguro (ver resource_governor)."""
+        self.recycle_reason = reason
+
+    def recycle(self):
+        """Encerra o Chrome marcado para reciclagem; o próximo ensure_driver() inicia outro."""
+        logger.info(f"Reciclando Chrome da sessão {self.session_id} ({self.recycle_reason})")
+        self.close()
+        self.recycles += 1
+        self.recycle_reason = None
+
+    def is_alive(self):
+        """Verifica se o Chrome da sessão ainda responde."""
+        if not self.driver:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """Encerra o Chrome da sessão."""
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning(f"Erro ao encerrar Chrome da sessão {self.session_id}: {str(e)}")
+        self.driver = None
+        self.event_pump = None
+        self.download_capture = None
+        self.network_captcha = None
+        self.captcha_handles = None
+        self.captcha_frame = None
+        self._release_profile()
+
+    def _release_profile(self):
+        if self.profile_path:
+            self.profiles.release(self.session_id)
+            self.profile_path = None
+
+    def to_dict(self):
+        """Estado resumido da sessão."""
+        return {
+            'session_id': self.session_id,
+            'active': self.driver is not None,
+            'started_at': self.started_at,
+            'pages_loaded': self.pages_loaded,
+            'current_job_id': self.current_job_id,
+            'profile': self.profile_path,
+            'recycles': self.recycles,
+            'recycle_reason': self.recycle_reason,
+        }
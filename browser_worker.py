@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sessões de navegador do pool em processos separados.
+
+Cada WorkerSession controla um processo filho dono do Chrome e do Selenium;
+o servidor web só troca mensagens curtas com ele por uma conexão local. Um Chrome que
+trava ou cai afeta apenas o seu processo: o comando expira, o processo é
+encerrado e o próximo ensure_driver() inicia outro. Os processos do Chrome
+que sobrarem de um filho encerrado à força são recolhidos pelo governador de
+recursos (ResourceGovernor.reap).
+
+Protocolo (tuplas de quatro campos enviadas pela conexão):
+    pai -> filho:  (CMD, id, comando, argumentos)
+                   (STOP, None, None, None)
+    filho -> pai:  (REPLY, id, ok, resultado ou mensagem de erro)
+                   (EVENT, None, nome, dados)   # 'log' e 'frame' (PNG da tela)
+                   (EVENT, id, 'politeness', observações)  # antes do REPLY do comando id
+
+Os comandos são os métodos de BrowserSession listados em REMOTE_METHODS;
+elementos do WebDriver nunca atravessam a conexão, só bytes, textos e
+dicionários.
+
+O filho é um interpretador novo que executa browser_worker_main.py, e não um
+multiprocessing.Process: com "spawn", o filho reexecuta o módulo principal do
+pai (captcha_mirror, como __mp_main__), o que criaria no filho o servidor
+socket.io, os bancos SQLite, o nó do cluster, os handlers de sinal e a
+configuração de politeness. Assim o filho importa apenas browser_worker e a
+BrowserSession, e não herda as threads do servidor. A conexão é um socket
+local: o pai escuta em 127.0.0.1, o filho conecta e se identifica com um
+token aleatório (passado pela variável de ambiente BROWSER_WORKER_TOKEN)
+antes que o pai envie qualquer mensagem ou leia algum objeto.
+"""
+
+import os
+import sys
+import hmac
+import time
+import socket
+import logging
+import secrets
+import itertools
+import threading
+import subprocess
+from multiprocessing.connection import Connection
+
+import politeness
+from browser_session import BrowserSession
+from resource_governor import driver_pid
+from sicar_automation import sicar_url, SICAR_INDEX_PATH
+
+logger = logging.getLogger('browser_worker')
+
+# Tipos de mensagem
+CMD = 'cmd'
+REPLY = 'reply'
+EVENT = 'event'
+STOP = 'stop'
+
+# Métodos da BrowserSession que o processo pai pode chamar
+REMOTE_METHODS = ('reset_captures', 'open_property', 'open_municipality', 'click_download_button',
+                  'capture_captcha', 'prepare_captcha', 'submit_captcha', 'captcha_present', 'screenshot',
+                  'is_alive')
+
+# Folga sobre o tempo limite da própria etapa antes de dar o processo como travado
+COMMAND_MARGIN = 30
+PING_TIMEOUT = 15
+CLOSE_GRACE = 20
+
+# Ponto de entrada do processo filho e variável com o token da conexão
+BOOTSTRAP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'browser_worker_main.py')
+TOKEN_ENV = 'BROWSER_WORKER_TOKEN'
+TOKEN_BYTES = 32
+
+
+class WorkerError(Exception):
+    """O processo da sessão não respondeu, caiu ou o comando falhou nele."""
+
+
+class ConnectionLogHandler(logging.Handler):
+    """Encaminha os logs do processo filho ao processo pai."""
+
+    def __init__(self, send):
+        super().__init__(logging.INFO)
+        self.send = send
+
+    def emit(self, record):
+        try:
+            self.send((EVENT, None, 'log', {'name': record.name, 'level': record.levelno,
+                                            'message': record.getMessage()}))
+        except Exception:
+            self.handleError(record)
+
+
+def execute(session, name, kwargs):
+    """Executa um comando do processo pai na sessão local do filho."""
+    if name == 'ensure_driver':
+        session.ensure_driver()
+        return {'driver_pid': driver_pid(session.driver), 'started_at': session.started_at}
+    if name not in REMOTE_METHODS:
+        raise ValueError(f"Comando desconhecido: {name}")
+    return getattr(session, name)(**kwargs)
+
+
+def worker_main(argv, environ=None):
+    """
+    Início do processo filho: conecta ao pai, recebe os argumentos da sessão
+    e executa run_worker().
+
+    Args:
+        argv: [host, porta] em que o processo pai escuta
+        environ: Variáveis de ambiente (o token vem de BROWSER_WORKER_TOKEN)
+    """
+    environ = os.environ if environ is None else environ
+    host, port = argv[0], int(argv[1])
+    token = environ.pop(TOKEN_ENV, '')
+
+    sock = socket.create_connection((host, port))
+    sock.sendall(token.encode('ascii'))
+    conn = Connection(sock.detach())
+    session_id, download_dir, options, frame_interval = conn.recv()
+    run_worker(conn, session_id, download_dir, options, frame_interval)
+    return 0
+
+
+def run_worker(conn, session_id, download_dir, options, frame_interval=None):
+    """
+    Laço do processo filho: executa os comandos recebidos pela conexão, um por vez.
+
+    Args:
+        conn: Conexão do filho com o processo pai
+        session_id: Sessão (slot) controlada pelo processo
+        download_dir: Diretório de downloads da sessão
+        options: Argumentos de BrowserSession
+        frame_interval: Intervalo entre quadros da tela enviados ao pai (None desativa)
+    """
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    root = logging.getLogger()
+    root.handlers = [ConnectionLogHandler(send)]
+    root.setLevel(logging.INFO)
+
+    session = BrowserSession(session_id, download_dir, **options)
+    try:
+        while True:
+            try:
+                if not conn.poll(frame_interval):
+                    # Ocioso: envia um quadro da tela entre dois comandos
+                    if session.driver:
+                        try:
+                            send((EVENT, None, 'frame', session.screenshot()))
+                        except Exception:
+                            pass
+                    continue
+                kind, request_id, name, kwargs = conn.recv()
+            except (EOFError, OSError):
+                # O processo pai fechou a conexão
+                break
+            if kind == STOP:
+                break
+
+            # Duração e páginas de erro das navegações do comando, aplicadas pelo
+            # processo pai à sua vez no controle de cortesia
+            with politeness.collect_observations() as observations:
+                try:
+                    reply = (REPLY, request_id, True, execute(session, name, kwargs))
+                except Exception as e:
+                    reply = (REPLY, request_id, False, f"{type(e).__name__}: {str(e)}")
+            try:
+                if observations:
+                    send((EVENT, request_id, 'politeness', observations))
+                send(reply)
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                # Resultado que não pode ser serializado
+                try:
+                    send((REPLY, request_id, False, f"Resposta de {name} inválida: {str(e)}"))
+                except (EOFError, OSError):
+                    break
+    finally:
+        session.close()
+
+
+class WorkerSession:
+    """
+    Sessão do pool cujo Chrome roda em um processo filho.
+
+    Tem a mesma interface de BrowserSession usada pelo agendador e pelo
+    governador de recursos. driver, download_capture e network_captcha ficam
+    None no processo pai: o download direto não está disponível nessas
+    sessões e o arquivo é baixado pelo Chrome.
+    """
+
+    remote = True
+
+    def __init__(self, session_id, download_dir, command_timeout=180, start_timeout=120, frame_interval=None,
+                 on_event=None, profiles=None, **options):
+        """
+        Args:
+            session_id: Identificador (slot) da sessão
+            download_dir: Diretório de downloads da sessão
+            command_timeout: Tempo máximo de um comando sem tempo limite próprio
+            start_timeout: Tempo máximo para iniciar o Chrome
+            frame_interval: Intervalo entre quadros da tela enviados pelo filho (None desativa)
+            on_event: Função (sessão, nome, dados) chamada com os eventos do filho
+            profiles: ProfileManager; o perfil do slot é reservado pelo processo pai
+            options: Demais argumentos de BrowserSession (performance_log, resource_profile...)
+        """
+        self.session_id = session_id
+        self.download_dir = download_dir
+        self.command_timeout = command_timeout
+        self.start_timeout = start_timeout
+        self.frame_interval = frame_interval
+        self.on_event = on_event
+        self.profiles = profiles
+        self.options = options
+        self.profile_path = None
+
+        # O WebDriver e as capturas de rede vivem no processo filho
+        self.driver = None
+        self.download_capture = None
+        self.network_captcha = None
+
+        self.driver_pid = None
+        self.started_at = None
+        self.pages_loaded = 0
+        self.current_job_id = None
+        self.recycle_reason = None
+        self.recycles = 0
+        self.restarts = 0
+
+        self.process = None
+        self._conn = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    # Processo filho
+
+    def _running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _start(self):
+        self.profile_path = self.profiles.acquire(self.session_id) if self.profiles else None
+        options = dict(self.options)
+        if self.profile_path:
+            options['extra_arguments'] = (list(options.get('extra_arguments', ())) +
+                                          self.profiles.chrome_arguments(self.profile_path))
+
+        token = secrets.token_hex(TOKEN_BYTES)
+        server = socket.create_server(('127.0.0.1', 0))
+        process = None
+        try:
+            host, port = server.getsockname()[:2]
+            process = subprocess.Popen([sys.executable, BOOTSTRAP_SCRIPT, host, str(port)],
+                                       env=dict(os.environ, **{TOKEN_ENV: token}))
+            parent_conn = self._accept(server, process, token)
+            parent_conn.send((self.session_id, self.download_dir, options, self.frame_interval))
+        except Exception:
+            if process and process.poll() is None:
+                process.kill()
+                process.wait(5)
+            self._release_profile()
+            raise
+        finally:
+            server.close()
+
+        self.process, self._conn = process, parent_conn
+        threading.Thread(target=self._read, args=(parent_conn,), daemon=True,
+                         name=f"browser-worker-reader-{self.session_id}").start()
+        logger.info(f"Processo {process.pid} iniciado para a sessão {self.session_id}")
+
+    def _accept(self, server, process, token):
+        """Aguarda a conexão do filho e confere o token antes de aceitá-la."""
+        deadline = time.monotonic() + self.start_timeout
+        server.settimeout(1)
+        while True:
+            if process.poll() is not None:
+                raise WorkerError(f"Processo da sessão {self.session_id} terminou ao iniciar "
+                                  f"(código {process.returncode})")
+            if time.monotonic() > deadline:
+                raise WorkerError(f"Processo da sessão {self.session_id} não conectou em {self.start_timeout}s")
+            try:
+                sock, _ = server.accept()
+            except socket.timeout:
+                continue
+            sock.settimeout(PING_TIMEOUT)
+            received = b''
+            try:
+                while len(received) < len(token):
+                    chunk = sock.recv(len(token) - len(received))
+                    if not chunk:
+                        break
+                    received += chunk
+            except OSError:
+                pass
+            if hmac.compare_digest(received, token.encode('ascii')):
+                sock.settimeout(None)
+                return Connection(sock.detach())
+            logger.warning(f"Conexão recusada na porta da sessão {self.session_id}: token inválido")
+            sock.close()
+
+    def _stop_process(self, grace):
+        """Encerra o processo filho: pede a parada e, passado grace segundos, o mata."""
+        process, conn = self.process, self._conn
+        self.process, self._conn = None, None
+        self.driver_pid = None
+
+        if conn and grace:
+            try:
+                with self._send_lock:
+                    conn.send((STOP, None, None, None))
+            except (OSError, ValueError):
+                pass
+        if process:
+            if not self._wait(process, grace):
+                logger.warning(f"Processo {process.pid} da sessão {self.session_id} não terminou, encerrando")
+                process.terminate()
+            if not self._wait(process, 5):
+                process.kill()
+                self._wait(process, 5)
+        if conn:
+            conn.close()
+        self._release_profile()
+
+    @staticmethod
+    def _wait(process, timeout):
+        """Aguarda o fim do processo; retorna False se ele ainda está rodando."""
+        try:
+            process.wait(timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    def _release_profile(self):
+        if self.profile_path:
+            self.profiles.release(self.session_id)
+            self.profile_path = None
+
+    def _read(self, conn):
+        while True:
+            try:
+                # poll() antes de recv(): no modo de produção (gevent/eventlet) a
+                # espera coopera com o servidor em vez de bloquear o processo
+                if not conn.poll(1):
+                    continue
+                kind, request_id, first, second = conn.recv()
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                logger.error(f"Erro ao ler mensagem da sessão {self.session_id}: {str(e)}")
+                continue
+
+            if kind == REPLY:
+                with self._lock:
+                    waiter = self._pending.get(request_id)
+                if waiter:
+                    waiter['reply'] = (first, second)
+                    waiter['event'].set()
+            elif kind == EVENT and request_id is not None:
+                # Observações de um comando, recebidas antes da sua resposta
+                with self._lock:
+                    waiter = self._pending.get(request_id)
+                if waiter:
+                    waiter['observations'].extend(second)
+            elif kind == EVENT:
+                self._handle_event(first, second)
+
+        # O processo terminou: os comandos à espera dele falham na hora
+        with self._lock:
+            waiters = [waiter for waiter in self._pending.values() if waiter['conn'] is conn]
+        for waiter in waiters:
+            waiter['reply'] = (False, f"Processo da sessão {self.session_id} encerrado")
+            waiter['event'].set()
+
+    def _handle_event(self, name, data):
+        if name == 'log':
+            logging.getLogger(data['name']).log(data['level'], f"[{self.session_id}] {data['message']}")
+            return
+        if self.on_event:
+            try:
+                self.on_event(self, name, data)
+            except Exception as e:
+                logger.error(f"Erro ao tratar evento {name} da sessão {self.session_id}: {str(e)}")
+
+    def call(self, name, kwargs=None, timeout=None, slot=None):
+        """
+        Executa um comando no processo filho e aguarda a resposta.
+
+        Args:
+            slot: politeness.Slot do comando, que recebe a duração e as páginas
+                de erro das navegações feitas pelo filho
+
+        Raises:
+            WorkerError: Se o processo não está rodando, caiu, não respondeu
+                no tempo limite (e foi encerrado) ou o comando falhou nele
+        """
+        conn = self._conn
+        if not conn or not self._running():
+            raise WorkerError(f"Processo da sessão {self.session_id} não está em execução")
+
+        timeout = timeout or self.command_timeout
+        request_id = next(self._ids)
+        waiter = {'event': threading.Event(), 'reply': None, 'conn': conn, 'observations': []}
+        with self._lock:
+            self._pending[request_id] = waiter
+        try:
+            try:
+                with self._send_lock:
+                    conn.send((CMD, request_id, name, kwargs or {}))
+            except (OSError, ValueError) as e:
+                raise WorkerError(f"Erro ao enviar {name} à sessão {self.session_id}: {str(e)}")
+
+            if not waiter['event'].wait(timeout):
+                # Chrome travado: o processo inteiro é descartado
+                logger.error(f"Sessão {self.session_id} não respondeu a {name} em {timeout}s, encerrando o processo")
+                self._stop_process(grace=0)
+                raise WorkerError(f"Sessão {self.session_id} não respondeu a {name} em {timeout}s")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+        if slot:
+            for observation in waiter['observations']:
+                slot.report(observation['elapsed'], observation['error'])
+        ok, value = waiter['reply']
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+    # Interface de BrowserSession
+
+    def ensure_driver(self):
+        """Garante um processo e um Chrome ativos. O driver fica no filho; retorna None."""
+        if not self._running():
+            if self.process is not None:
+                logger.warning(f"Processo da sessão {self.session_id} terminou inesperadamente, reiniciando")
+                self._stop_process(grace=0)
+                self.restarts += 1
+            self._start()
+
+        info = self.call('ensure_driver', timeout=self.start_timeout)
+        if info['started_at'] != self.started_at:
+            # Chrome novo no processo filho
+            self.pages_loaded = 0
+            self.recycle_reason = None
+        self.driver_pid = info['driver_pid']
+        self.started_at = info['started_at']
+
+    def reset_captures(self):
+        self.call('reset_captures', timeout=PING_TIMEOUT)
+
+    # A vez no controle de cortesia é obtida aqui, no processo pai: o scheduler
+    # de politeness é por processo e o dos filhos fica desativado. O comando
+    # inclui as esperas da página, então a duração do bloco não conta; vale a
+    # da navegação, medida pelo filho e aplicada ao slot por call().
+
+    def open_property(self, car_code, timeout=60):
+        with politeness.scheduler.slot(sicar_url(SICAR_INDEX_PATH), timed=False) as slot:
+            return self.call('open_property', {'car_code': car_code, 'timeout': timeout}, timeout + COMMAND_MARGIN,
+                             slot=slot)
+
+    def open_municipality(self, uf, municipio, timeout=60):
+        with politeness.scheduler.slot(sicar_url(SICAR_INDEX_PATH), timed=False) as slot:
+            return self.call('open_municipality', {'uf': uf, 'municipio': municipio, 'timeout': timeout},
+                             timeout + COMMAND_MARGIN, slot=slot)
+
+    def click_download_button(self):
+        return self.call('click_download_button')
+
+    def capture_captcha(self, timeout=15):
+        return self.call('capture_captcha', {'timeout': timeout}, timeout + COMMAND_MARGIN)
+
+    def prepare_captcha(self):
+        self.call('prepare_captcha')
+
+    def submit_captcha(self, text):
+        with politeness.scheduler.slot(sicar_url('/'), politeness.KIND_DOWNLOAD, timed=False) as slot:
+            return self.call('submit_captcha', {'text': text}, slot=slot)
+
+    def captcha_present(self):
+        return self.call('captcha_present', timeout=PING_TIMEOUT)
+
+    def screenshot(self):
+        return self.call('screenshot', timeout=PING_TIMEOUT)
+
+    def request_recycle(self, reason):
+        """Marca o Chrome para ser reiniciado no próximo ponto seguro (ver resource_governor)."""
+        self.recycle_reason = reason
+
+    def recycle(self):
+        """Encerra o processo marcado para reciclagem; o próximo ensure_driver() inicia outro."""
+        logger.info(f"Reciclando processo da sessão {self.session_id} ({self.recycle_reason})")
+        self.close()
+        self.recycles += 1
+        self.recycle_reason = None
+
+    def is_alive(self):
+        """Verifica se o processo e o Chrome da sessão ainda respondem."""
+        if not self._running():
+            return False
+        try:
+            return self.call('is_alive', timeout=PING_TIMEOUT)
+        except WorkerError:
+            return False
+
+    def close(self):
+        """Encerra o Chrome e o processo da sessão."""
+        if self.process or self._conn:
+            self._stop_process(grace=CLOSE_GRACE)
+
+    def to_dict(self):
+        """Estado resumido da sessão."""
+        return {
+            'session_id': self.session_id,
+            'active': self.driver_pid is not None and self._running(),
+            'started_at': self.started_at,
+            'pages_loaded': self.pages_loaded,
+            'current_job_id': self.current_job_id,
+            'profile': self.profile_path,
+            'recycles': self.recycles,
+            'recycle_reason': self.recycle_reason,
+            'worker_pid': self.process.pid if self.process else None,
+            'worker_restarts': self.restarts,
+        }
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ponto de entrada dos processos das sessões do pool (ver browser_worker).
+
+Executado pelo WorkerSession em um interpretador novo, com o endereço em que
+o processo pai escuta. Importa apenas browser_worker: o captcha_mirror e o
+que ele cria ao ser importado (servidor socket.io, bancos, cluster, handlers
+de sinal) ficam só no processo pai.
+"""
+
+import sys
+
+from browser_worker import worker_main
+
+if __name__ == '__main__':
+    if 'captcha_mirror' in sys.modules:
+        raise RuntimeError("O processo da sessão não deve importar o captcha_mirror")
+    sys.exit(worker_main(sys.argv[1:]))
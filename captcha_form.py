@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Localização e preenchimento do formulário de CAPTCHA do SICAR.
+
+O campo de entrada e o botão de envio são resolvidos no momento da detecção
+e guardados, de modo que o envio da resposta do operador seja uma única
+chamada dentro da página (preencher e enviar), sem novas buscas por XPath.
+"""
+
+import time
+import logging
+from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException
+
+logger = logging.getLogger('captcha_form')
+
+# Resultados possíveis do envio
+SUBMIT_OK = 'enviado'
+SUBMIT_NO_BUTTON = 'sem_botao'
+SUBMIT_STALE = 'obsoleto'
+
+# Resolve o campo e o botão em uma única ida ao navegador. Os critérios são
+# os mesmos das buscas por XPath usadas anteriormente em send_captcha_text().
+RESOLVE_HANDLES_SCRIPT = """
+    const input = document.querySelector("input[id*='captcha'], input[name*='captcha']");
+    if (!input) {
+        return null;
+    }
+
+    const submitSelector = "button[type='submit'], input[type='submit']";
+    let submit = input.form ? input.form.querySelector(submitSelector) : null;
+
+    if (!submit) {
+        submit = document.querySelector(submitSelector);
+    }
+    if (!submit) {
+        submit = Array.from(document.querySelectorAll('button')).find(button =>
+            button.textContent.includes('Download') || button.textContent.includes('Baixar')) || null;
+    }
+    return [input, submit];
+"""
+
+# Preenche o campo e envia o formulário em uma única chamada. O valor é
+# definido pelo setter nativo e os eventos input/change são disparados para
+# que frameworks da página percebam a alteração.
+FILL_AND_SUBMIT_SCRIPT = """
+    const input = arguments[0];
+    const submit = arguments[1];
+    const text = arguments[2];
+
+    if (!input || !input.isConnected || (submit && !submit.isConnected)) {
+        return 'obsoleto';
+    }
+
+    input.focus();
+    const setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    setter.call(input, text);
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+    input.dispatchEvent(new Event('change', {bubbles: true}));
+
+    if (submit) {
+        submit.click();
+        return 'enviado';
+    }
+    if (input.form) {
+        if (input.form.requestSubmit) {
+            input.form.requestSubmit();
+        } else {
+            input.form.submit();
+        }
+        return 'enviado';
+    }
+    return 'sem_botao';
+"""
+
+
+def resolve_captcha_handles(driver):
+    """
+    Localiza o campo de entrada e o botão de envio do CAPTCHA.
+
+    Args:
+        driver: Instância do WebDriver
+
+    Returns:
+        dict: {'input', 'submit', 'url', 'resolved_at'} ou None se não houver campo
+    """
+    try:
+        result = driver.execute_script(RESOLVE_HANDLES_SCRIPT)
+    except Exception as e:
+        logger.error(f"Erro ao localizar formulário do CAPTCHA: {str(e)}")
+        return None
+
+    if not result:
+        return None
+
+    return {
+        'input': result[0],
+        'submit': result[1],
+        'url': driver.current_url,
+        'resolved_at': time.time(),
+    }
+
+
+def fill_and_submit(driver, handles, text):
+    """
+    Preenche e envia o CAPTCHA usando os elementos já resolvidos.
+
+    Args:
+        driver: Instância do WebDriver
+        handles: Dicionário retornado por resolve_captcha_handles()
+        text: Texto digitado pelo operador
+
+    Returns:
+        str: SUBMIT_OK, SUBMIT_NO_BUTTON ou SUBMIT_STALE
+    """
+    if not handles:
+        return SUBMIT_STALE
+
+    try:
+        return driver.execute_script(FILL_AND_SUBMIT_SCRIPT, handles['input'], handles['submit'], text)
+    except (StaleElementReferenceException, NoSuchElementException):
+        # A referência pertence a um documento que não existe mais
+        return SUBMIT_STALE
+
+
+def submit_captcha(driver, handles, text):
+    """
+    Envia o CAPTCHA, resolvendo os elementos novamente se os guardados estiverem obsoletos.
+
+    Args:
+        driver: Instância do WebDriver
+        handles: Elementos guardados na detecção (ou None)
+        text: Texto digitado pelo operador
+
+    Returns:
+        tuple: (resultado, handles efetivamente usados)
+    """
+    result = fill_and_submit(driver, handles, text)
+
+    if result == SUBMIT_STALE:
+        logger.info("Elementos do CAPTCHA obsoletos ou ausentes, resolvendo novamente")
+        handles = resolve_captcha_handles(driver)
+        if not handles:
+            return SUBMIT_STALE, None
+        result = fill_and_submit(driver, handles, text)
+
+    return result, handles
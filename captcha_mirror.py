@@ -1,14 +1,16 @@
-from flask import Flask, render_template, request, jsonify, url_for, Response, send_from_directory
-from flask_socketio import SocketIO, emit
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
+# O modo de produção (serving.py) aplica o monkey patching do gevent/eventlet,
+# que precisa vir antes de qualquer outro import
+import serving
+if __name__ == '__main__':
+    serving.setup()
+
+from flask import Flask, render_template, request, jsonify, url_for, Response, send_from_directory, g
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.common.exceptions import WebDriverException, TimeoutException, NoSuchElementException
-from webdriver_manager.chrome import ChromeDriverManager
 import base64
 import os
 import time
@@ -19,10 +21,44 @@ import sys
 import json
 import uuid
 import signal
+import socket
 from io import BytesIO
 from PIL import Image
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlparse
+from werkzeug.utils import safe_join
+from input_forwarding import dispatch_input_batch, ScreenStreamer
+from captcha_form import resolve_captcha_handles, submit_captcha, SUBMIT_OK, SUBMIT_NO_BUTTON
+from captcha_queue import CaptchaQueue, CAPTCHAS_SOLVED
+from browser_session import create_chrome_driver, BrowserSession
+from browser_worker import WorkerSession
+from background_jobs import BackgroundJobs
+from cluster import ClusterNode, RedisBus, global_session_id
+from job_scheduler import JobScheduler, parse_batch
+from job_journal import JobJournal
+from download_watcher import DownloadWatcher
+from direct_download import DirectDownloader
+from shapefile_store import ShapefileStore, file_sha256
+from shapefile_reader import inspect_shapefile
+from shapefile_catalog import ShapefileCatalog, parse_bbox
+from columnar_export import ColumnarExporter
+from property_preview import PreviewCache
+from metrics import registry, StageTimer, payload_size, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from webdriver_tracing import tracer
+from sicar_automation import sicar_url, SICAR_INDEX_PATH, DOWNLOAD_BUTTON_SELECTORS, INDEX_PAGE, PROPERTY_PAGE, load_page
+from readiness import wait_until_ready
+from dom_snapshots import SnapshotRecorder
+from cdp_events import CdpEventPump
+from network_captcha import NetworkCaptchaCapture
+from resource_profile import get_profile
+from browser_profiles import ProfileManager
+from resource_governor import ResourceGovernor
+from driver_guard import DriverGuard
+import politeness
+import offline_detection
+from offline_detection import (DOWNLOAD_KEYWORDS, CAPTCHA_IMAGE_XPATH, CAPTCHA_TEXT_XPATH,
+                               CAPTCHA_INPUT_XPATH, CAPTCHA_DIV_XPATH, STRATEGY_SETS)
 
 # Configuração de logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -31,17 +67,62 @@ logger = logging.getLogger('captcha_mirror')
 # Configuração da aplicação Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'erosoftware_captcha_mirror'
-socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25, 
-                   engineio_logger=True, async_mode='threading')
+
+# Porta do servidor e, no modo de produção, quantas conexões o servidor
+# assíncrono atende ao mesmo tempo (greenlets, não threads do sistema)
+SERVER_PORT = 5001
+SERVER_WORKERS = 1000
+
+# Vários nós atrás de um Redis compartilhado (cluster.py, requer o pacote redis):
+# eventos socket.io entre nós, registro de sessões e fila de CAPTCHAs comum.
+# None executa um nó isolado
+CLUSTER_REDIS_URL = None
+CLUSTER_NODE_ID = f"{socket.gethostname()}:{SERVER_PORT}"
+
+socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25,
+                   engineio_logger=not serving.is_production(), async_mode=serving.ASYNC_MODE,
+                   transports=serving.socket_transports(), message_queue=CLUSTER_REDIS_URL)
+
+def node_room(node_id):
+    """Sala socket.io dos clientes que acompanham o navegador interativo de um nó."""
+    return f"no:{node_id}"
+
+# Tela e CAPTCHA do navegador interativo vão só para quem acompanha este nó;
+# sem cluster, para todos os clientes
+BROWSER_ROOM = node_room(CLUSTER_NODE_ID) if CLUSTER_REDIS_URL else None
+
+# Métricas expostas em /metrics
+CAPTCHA_CHECK_LATENCY = registry.histogram(
+    'captcha_check_seconds', 'Duração de cada estratégia de check_for_captcha', ('strategy',))
+CAPTCHA_FORCE_LATENCY = registry.histogram(
+    'captcha_force_detection_seconds', 'Duração da detecção forçada de CAPTCHA')
+SCREENSHOT_LATENCY = registry.histogram(
+    'screenshot_seconds', 'Captura, codificação e gravação de screenshots', ('stage',))
+CAPTCHA_SUBMIT_LATENCY = registry.histogram(
+    'captcha_submit_seconds', 'Envio da resposta do CAPTCHA ao site (send_captcha_text)', ('result',))
+SOCKET_EVENTS = registry.counter('socketio_events_total', 'Eventos Socket.IO emitidos', ('event',))
+SOCKET_BYTES = registry.counter('socketio_event_bytes_total', 'Bytes aproximados emitidos por evento Socket.IO', ('event',))
+
+# Conta eventos e bytes de todas as emissões feitas por socketio.emit
+_socketio_emit = socketio.emit
+
+def emit_with_metrics(event, *args, **kwargs):
+    SOCKET_EVENTS.inc(event=event)
+    SOCKET_BYTES.inc(payload_size(args[0]) if args else 0, event=event)
+    return _socketio_emit(event, *args, **kwargs)
+
+socketio.emit = emit_with_metrics
 
 # Configuração de caminhos
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 DOWNLOAD_DIR = BASE_DIR / "downloads"
+DATA_DIR = BASE_DIR / "data"
 
 # Criar diretórios necessários
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
 
 # Variáveis globais
 driver = None
@@ -50,10 +131,281 @@ captcha_visible = False
 in_captcha_page = False
 last_screenshot = None
 client_count = 0
+captcha_handles = None  # Campo e botão do CAPTCHA resolvidos na detecção
+network_captcha = None  # Captura das imagens de CAPTCHA pela rede (NETWORK_CAPTCHA_DETECTION)
+# Usos do driver interativo (compartilhados) e sua troca (exclusiva: iniciar, parar, reciclar)
+driver_guard = DriverGuard()
+
+# Identificador da sessão interativa (o navegador aberto por "Iniciar Navegador")
+DEFAULT_SESSION_ID = 'principal'
+
+# Fila de CAPTCHAs para operadores: tempo para responder e validade do CAPTCHA
+CAPTCHA_ASSIGNMENT_TIMEOUT = 30
+CAPTCHA_TASK_TTL = 120
+
+# Pool de sessões para downloads em lote
+JOB_POOL_SIZE = 2
+JOB_MAX_ATTEMPTS = 3
+
+# Cada sessão do pool roda em um processo separado (browser_worker): um Chrome
+# travado ou que caiu não bloqueia o servidor. O download direto precisa do
+# driver neste processo, então com DIRECT_DOWNLOAD_ENABLED as sessões rodam aqui
+PROCESS_WORKERS = True
+WORKER_COMMAND_TIMEOUT = 180
+# Intervalo entre quadros da tela das sessões do pool (evento session_frame); None desativa
+WORKER_FRAME_INTERVAL = None
+
+# Download direto: o pedido do Chrome é capturado via CDP e o arquivo é baixado
+# fora do navegador, liberando a sessão do pool para o próximo imóvel
+DIRECT_DOWNLOAD_ENABLED = False
+DIRECT_DOWNLOAD_WORKERS = 4
+# Fora de DOWNLOAD_DIR: o observador de downloads não deve ver esses arquivos
+DIRECT_DOWNLOAD_DIR = DATA_DIR / "downloads_diretos"
+
+# Detecção do CAPTCHA pelas respostas de rede (eventos CDP): a imagem é obtida
+# assim que chega ao Chrome, sem varrer o DOM nem tirar screenshot
+NETWORK_CAPTCHA_DETECTION = False
+NETWORK_CAPTCHA_POLL_INTERVAL = 0.5
+
+# Perfil de recursos bloqueados no Chrome (resource_profile.PROFILES, ex.: 'leve'
+# sem mapa base, fontes e analytics); None carrega a página inteira
+RESOURCE_PROFILE = None
+
+# Espera máxima até o campo de busca do SICAR ficar interativo ao abrir o navegador
+PAGE_READY_TIMEOUT = 30
+
+# Perfis persistentes do Chrome por sessão: o cache HTTP (scripts, estilos e
+# recursos do mapa) é reaproveitado entre inícios; cookies e histórico são
+# apagados a cada uso
+PERSISTENT_PROFILES = True
+PROFILE_DIR = DATA_DIR / "profiles"
+PROFILE_CACHE_SIZE = 300 * 1024 * 1024
+PROFILE_MAX_SIZE = 1024 * 1024 * 1024
+
+# Governador de recursos: cada navegador é reiniciado no próximo ponto seguro
+# ao passar do limite de memória (RSS da árvore de processos, requer psutil),
+# de navegações ou de idade; processos chromedriver/chrome órfãos são encerrados
+GOVERNOR_ENABLED = True
+GOVERNOR_INTERVAL = 15
+GOVERNOR_MAX_RSS = 1536 * 1024 * 1024
+GOVERNOR_MAX_PAGES = 200
+GOVERNOR_MAX_AGE = 6 * 3600
+
+# Controle de cortesia dos pedidos ao SICAR, comum a todas as sessões deste
+# processo (em cluster, cada nó aplica os limites separadamente): taxa em
+# pedidos/s, rajada, pedidos simultâneos e atraso aleatório máximo; a taxa cai
+# pela metade em respostas mais lentas que POLITENESS_SLOW_THRESHOLD segundos
+# ou em páginas de erro e volta aos poucos. POLITENESS_INTERACTIVE_RESERVE
+# vagas dos pedidos simultâneos ficam para o navegador interativo, que não
+# espera o pool (com JOB_POOL_SIZE sessões) terminar os seus comandos
+POLITENESS_ENABLED = True
+POLITENESS_RATE = 0.5
+POLITENESS_BURST = 2
+POLITENESS_MAX_CONCURRENT = 3
+POLITENESS_INTERACTIVE_RESERVE = 1
+POLITENESS_JITTER = 1.0
+POLITENESS_SLOW_THRESHOLD = 15.0
+
+# Armazenamento dos shapefiles por código do CAR: downloads mais recentes que a
+# validade são reaproveitados sem abrir o navegador
+SHAPEFILE_STORE_DIR = DATA_DIR / "shapefiles"
+SHAPEFILE_TTL = 30 * 24 * 3600
+
+# Conjunto GeoParquet particionado por estado/município (requer pyarrow)
+EXPORT_DIR = DATA_DIR / "geoparquet"
+
+# Traces exportados (formato JSON de trace do Chrome) e rotas que não abrem trace
+TRACE_DIR = DATA_DIR / "traces"
+TRACE_SKIP_ENDPOINTS = {'serve_static', 'metrics', 'traces_list', 'trace_detail', 'traces_export'}
+
+# Gravação de snapshots do DOM a cada verificação do monitor, para avaliar a
+# detecção offline (offline_detection.py); desligada por padrão
+SNAPSHOT_RECORDING = False
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+
+# Qualidade JPEG dos quadros enviados ao espelho do navegador
+SCREEN_JPEG_QUALITY = 60
+
+# Fila de CAPTCHAs para operadores humanos
+captcha_queue = CaptchaQueue(
+    lambda operator_id, event, data: socketio.emit(event, data, to=operator_id),
+    assignment_timeout=CAPTCHA_ASSIGNMENT_TIMEOUT,
+    task_ttl=CAPTCHA_TASK_TTL
+)
+
+profile_manager = ProfileManager(PROFILE_DIR, cache_size=PROFILE_CACHE_SIZE,
+                                 max_profile_size=PROFILE_MAX_SIZE) if PERSISTENT_PROFILES else None
+
+def on_worker_event(session, name, data):
+    """Eventos dos processos das sessões do pool."""
+    if name == 'frame':
+        socketio.emit('session_frame', {'session_id': session.session_id,
+                                        'image': base64.b64encode(data).decode('ascii')})
+
+# Agendador de downloads em lote; cada sessão do pool baixa em seu próprio diretório
+def create_pool_session(index):
+    session_id = f"pool-{index + 1}"
+    if PROCESS_WORKERS and not DIRECT_DOWNLOAD_ENABLED:
+        return WorkerSession(session_id, DOWNLOAD_DIR / session_id, command_timeout=WORKER_COMMAND_TIMEOUT,
+                             frame_interval=WORKER_FRAME_INTERVAL, on_event=on_worker_event,
+                             profiles=profile_manager, network_captcha=NETWORK_CAPTCHA_DETECTION,
+                             resource_profile=get_profile(RESOURCE_PROFILE))
+    return BrowserSession(session_id, DOWNLOAD_DIR / session_id, performance_log=DIRECT_DOWNLOAD_ENABLED,
+                          network_captcha=NETWORK_CAPTCHA_DETECTION, resource_profile=get_profile(RESOURCE_PROFILE),
+                          profiles=profile_manager)
+
+direct_downloader = DirectDownloader(max_workers=DIRECT_DOWNLOAD_WORKERS) if DIRECT_DOWNLOAD_ENABLED else None
+shapefile_store = ShapefileStore(SHAPEFILE_STORE_DIR, ttl=SHAPEFILE_TTL)
+shapefile_catalog = ShapefileCatalog(DATA_DIR / "catalog.db")
+columnar_exporter = ColumnarExporter(EXPORT_DIR)
+preview_cache = PreviewCache(DATA_DIR / "previews")
+
+# Corpus de snapshots do DOM (gravação contínua só com SNAPSHOT_RECORDING)
+snapshot_recorder = SnapshotRecorder(SNAPSHOT_DIR)
+
+job_scheduler = JobScheduler(
+    create_pool_session,
+    captcha_queue,
+    pool_size=JOB_POOL_SIZE,
+    emit=lambda event, data: socketio.emit(event, data),
+    max_attempts=JOB_MAX_ATTEMPTS,
+    captcha_timeout=CAPTCHA_TASK_TTL,
+    journal=JobJournal(DATA_DIR / "jobs.db"),
+    direct_downloader=direct_downloader,
+    direct_download_dir=DIRECT_DOWNLOAD_DIR,
+    store=shapefile_store,
+    catalog=shapefile_catalog,
+    exporter=columnar_exporter
+)
+
+# Observador do diretório de downloads: liga cada arquivo à sessão e ao trabalho que o baixou
+def on_download_started(info):
+    socketio.emit('download_started', info)
+
+def on_download_complete(info):
+    job = job_scheduler.notify_download(info)
+    event = dict(info, job_id=job.job_id if job else None, value=job.value if job else None)
+    if not job and info['file'].lower().endswith('.zip'):
+        event['preview_url'] = '/preview/download/' + os.path.relpath(info['path'], DOWNLOAD_DIR).replace(os.sep, '/')
+    socketio.emit('download_complete', event)
+    socketio.emit('server_log', {'message': f"Download concluído: {info['file']} ({info['size']} bytes em {info['duration']:.1f}s)", 'level': 'success'})
+
+    # Downloads dos trabalhos em lote são validados pelo agendador; os da sessão
+    # interativa são validados e catalogados aqui (se ainda estiverem no lugar)
+    if not job and info['file'].lower().endswith('.zip') and os.path.exists(info['path']):
+        validate_and_catalog(info['path'])
+
+def validate_and_catalog(path):
+    """Valida um zip baixado pela sessão interativa e indexa suas feições."""
+    report = inspect_shapefile(path, with_geometry=True)
+    socketio.emit('shapefile_validation', {
+        'path': path,
+        'valid': report['valid'],
+        'errors': report['errors'],
+        'layers': [{'name': layer['name'], 'records': layer['record_count']} for layer in report['layers']],
+    })
+    if not report['valid']:
+        socketio.emit('server_log', {'message': f"Shapefile inválido: {'; '.join(report['errors'][:3])}", 'level': 'error'})
+        return
+
+    try:
+        sha256 = file_sha256(path)
+        count = shapefile_catalog.add(None, report, sha256=sha256)
+        columnar_exporter.export(shapefile_catalog.key_for(sha256) or path, report, sha256)
+        socketio.emit('server_log', {'message': f"Shapefile válido, {count} feições catalogadas", 'level': 'success'})
+    except Exception as e:
+        logger.error(f"Erro ao catalogar shapefile: {str(e)}")
+
+download_watcher = DownloadWatcher(
+    DOWNLOAD_DIR,
+    on_download_complete,
+    on_started=on_download_started,
+    root_session_id=DEFAULT_SESSION_ID
+)
+
+# O navegador interativo visto pelo governador de recursos, com a mesma
+# interface de BrowserSession
+class InteractiveBrowser:
+    session_id = DEFAULT_SESSION_ID
+
+    def __init__(self):
+        self.started_at = None
+        self.recycle_reason = None
+
+    @property
+    def driver(self):
+        return driver
+
+    def request_recycle(self, reason):
+        self.recycle_reason = reason
+
+interactive_browser = InteractiveBrowser()
+
+governor = ResourceGovernor(
+    lambda: [interactive_browser] + job_scheduler.sessions(),
+    max_rss=GOVERNOR_MAX_RSS,
+    max_pages=GOVERNOR_MAX_PAGES,
+    max_age=GOVERNOR_MAX_AGE,
+    interval=GOVERNOR_INTERVAL,
+    emit=lambda event, data: socketio.emit(event, data)
+) if GOVERNOR_ENABLED else None
+
+politeness.scheduler.configure(
+    enabled=POLITENESS_ENABLED,
+    policy=politeness.HostPolicy(
+        rate=POLITENESS_RATE,
+        burst=POLITENESS_BURST,
+        max_concurrent=POLITENESS_MAX_CONCURRENT,
+        jitter=POLITENESS_JITTER,
+        slow_threshold=POLITENESS_SLOW_THRESHOLD,
+        interactive_reserve=POLITENESS_INTERACTIVE_RESERVE
+    )
+)
+
+# Tarefas longas das rotas (/force_download...), executadas no executor da
+# sessão do navegador com progresso pelo socket.io
+background_jobs = BackgroundJobs(emit=lambda event, data: socketio.emit(event, data))
+
+# Nó do cluster; as sessões registradas são o navegador interativo e as do pool
+cluster_node = ClusterNode(
+    CLUSTER_NODE_ID,
+    RedisBus(CLUSTER_REDIS_URL),
+    captcha_queue,
+    sessions=lambda: ([DEFAULT_SESSION_ID] if driver else []) + [s.session_id for s in job_scheduler.sessions()]
+) if CLUSTER_REDIS_URL else None
+
+# Nó acompanhado por cada cliente (sid -> nó), quando não é este
+watched_nodes = {}
+
+# Medidores lidos a cada coleta de /metrics
+def session_gauge():
+    sessions = job_scheduler.status()['sessions']
+    return {
+        (DEFAULT_SESSION_ID, 'interativa'): 1 if driver else 0,
+        ('pool', 'ativa'): sum(1 for session in sessions if session['active']),
+        ('pool', 'ocupada'): sum(1 for session in sessions if session['current_job_id']),
+    }
+
+registry.gauge('browser_sessions', 'Sessões de navegador abertas', ('session', 'state'), function=session_gauge)
+registry.gauge('socketio_clients', 'Clientes Socket.IO conectados', function=lambda: client_count)
+registry.gauge('captcha_queue_depth', 'CAPTCHAs aguardando operador',
+               function=lambda: captcha_queue.metrics()['queue_depth'])
+registry.gauge('captcha_operators', 'Operadores da fila de CAPTCHAs', ('state',),
+               function=lambda: {'conectado': captcha_queue.metrics()['operators'],
+                                 'livre': captcha_queue.metrics()['operators_free']})
+registry.gauge('job_queue_depth', 'Trabalhos de download aguardando sessão do pool',
+               function=lambda: job_scheduler.status()['queue_depth'])
+registry.gauge('jobs', 'Trabalhos de download por estado', ('state',),
+               function=lambda: job_scheduler.status()['counts'])
+registry.gauge('direct_downloads_active', 'Downloads diretos em andamento',
+               function=lambda: job_scheduler.status()['direct_downloads_active'])
 
 # Registro de handlers de sinal para shutdown limpo
 def signal_handler(sig, frame):
     logger.info("Sinal de encerramento recebido, fechando aplicação...")
+    job_scheduler.stop()
+    if direct_downloader:
+        direct_downloader.shutdown()
     if driver:
         close_driver()
     sys.exit(0)
@@ -64,54 +416,75 @@ signal.signal(signal.SIGTERM, signal_handler)
 # Configuração do Selenium WebDriver
 def setup_selenium_driver():
     """Configura o driver do Selenium para Chrome."""
-    global driver
+    global driver, network_captcha
     
     try:
         # Log de início
         logger.info("Configurando driver do Selenium")
         
-        # Configuração do Chrome
-        chrome_options = Options()
-        
-        # Configurações adicionais - NÃO use headless para permitir interação e visualização
-        chrome_options.add_argument('--start-maximized')  # Inicia maximizado
-        chrome_options.add_argument('--disable-extensions')
-        chrome_options.add_argument('--disable-popup-blocking')
-        chrome_options.add_argument('--disable-infobars')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-gpu')
-        
-        # Desativa a mensagem "Chrome está sendo controlado por automação"
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        
-        # Configura o diretório de downloads
-        prefs = {
-            'download.default_directory': str(DOWNLOAD_DIR),
-            'download.prompt_for_download': False,
-            'download.directory_upgrade': True,
-            'safebrowsing.enabled': False
-        }
-        chrome_options.add_experimental_option('prefs', prefs)
-        
-        # Inicializa o serviço do ChromeDriver com o driver automaticamente baixado
-        service = Service(ChromeDriverManager().install())
-        
-        # Inicializa o driver
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        
-        # Define timeout padrão
-        driver.set_page_load_timeout(30)
-        driver.implicitly_wait(10)  # Espera implícita para encontrar elementos
+        # Inicializa o driver com a configuração compartilhada com o pool de sessões
+        profile_path = profile_manager.acquire(DEFAULT_SESSION_ID) if profile_manager else None
+        driver = create_chrome_driver(DOWNLOAD_DIR, performance_log=NETWORK_CAPTCHA_DETECTION,
+                                      resource_profile=get_profile(RESOURCE_PROFILE),
+                                      extra_arguments=profile_manager.chrome_arguments(profile_path) if profile_path else ())
+        interactive_browser.started_at = time.time()
+        interactive_browser.recycle_reason = None
+        network_captcha = NetworkCaptchaCapture(CdpEventPump(driver)) if NETWORK_CAPTCHA_DETECTION else None
         
         logger.info("Driver do Selenium configurado com sucesso")
         socketio.emit('driver_status', {'active': True})
         return True
     except Exception as e:
         logger.error(f"Erro ao configurar driver do Selenium: {str(e)}")
+        release_profile()
         socketio.emit('driver_status', {'active': False, 'error': str(e)})
         return False
 
+def release_profile():
+    """Libera o perfil persistente do navegador interativo para o próximo início."""
+    if profile_manager:
+        profile_manager.release(DEFAULT_SESSION_ID)
+
+# Função para reiniciar o navegador interativo pedido pelo governador de recursos
+def recycle_interactive_browser():
+    """
+    Reinicia o navegador interativo e volta à mesma URL.
+
+    Adiado (retorna False) enquanto houver CAPTCHA na tela ou alguém estiver
+    usando o driver; o pedido continua em recycle_reason para a próxima vez.
+    """
+    if captcha_visible:
+        return False
+    
+    with driver_guard.exclusive(timeout=0) as acquired:
+        if not acquired:
+            return False
+        
+        reason = interactive_browser.recycle_reason
+        try:
+            url = driver.current_url
+        except Exception:
+            url = None
+        
+        logger.info(f"Reciclando navegador interativo ({reason}), URL atual: {url}")
+        socketio.emit('server_log', {'message': f'Reiniciando o navegador para liberar recursos ({reason})...', 'level': 'warning'})
+        close_driver()
+        if not setup_selenium_driver():
+            return False
+        
+        if url and url.startswith('http'):
+            load_page(driver, url, interactive=True)
+            # Só a página inicial tem sonda própria; nas demais basta o carregamento
+            if urlparse(url).path.rstrip('/') == SICAR_INDEX_PATH:
+                wait_until_ready(driver, INDEX_PAGE, PAGE_READY_TIMEOUT)
+        else:
+            open_sicar_browser()
+        
+        socketio.emit('browser_recycled', {'reason': reason, 'url': url})
+        socketio.emit('server_log', {'message': 'Navegador reiniciado na mesma página', 'level': 'success'})
+        screen_streamer.request_update(delay=0.5)
+        return True
+
 # Função para abrir o navegador no SICAR
 def open_sicar_browser():
     """Abre o navegador no site do SICAR."""
@@ -119,30 +492,22 @@ def open_sicar_browser():
         # Emite log para o cliente
         socketio.emit('server_log', {'message': 'Tentando abrir site do SICAR...', 'level': 'info'})
         
-        # Define um timeout maior para carregar o site
-        driver.set_page_load_timeout(60)
-        
-        try:
-            driver.get("https://consultapublica.car.gov.br/publico/imoveis/index")
-        except Exception as timeout_err:
-            socketio.emit('server_log', {'message': f'Timeout ao carregar SICAR: {str(timeout_err)}', 'level': 'error'})
-            logger.error(f"Timeout ao carregar site do SICAR: {str(timeout_err)}")
-            
-            # Mesmo com timeout, tenta continuar
-            socketio.emit('server_log', {'message': 'Tentando continuar mesmo com timeout...', 'level': 'warning'})
-            
+        # Com a estratégia "eager" o get() retorna no DOMContentLoaded; o mapa
+        # e demais recursos continuam carregando enquanto o fluxo segue. Como
+        # as sessões do pool, aguarda a vez no controle de cortesia (nas vagas
+        # reservadas ao navegador interativo) e continua mesmo com timeout
+        load_page(driver, sicar_url(SICAR_INDEX_PATH), interactive=True)
+
         logger.info("Request para site do SICAR enviado")
         socketio.emit('server_log', {'message': 'Site do SICAR requisitado, aguardando carregamento...', 'level': 'info'})
         
-        # Aguarda pelo menos um elemento da página carregar com timeout maior
-        try:
-            WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            socketio.emit('server_log', {'message': 'Elemento body encontrado na página', 'level': 'success'})
-        except TimeoutException:
-            socketio.emit('server_log', {'message': 'Timeout aguardando elemento body', 'level': 'error'})
-            logger.error("Timeout aguardando elemento body")
+        # Aguarda o campo de busca ficar interativo
+        readiness = wait_until_ready(driver, INDEX_PAGE, PAGE_READY_TIMEOUT)
+        if readiness['ready']:
+            socketio.emit('server_log', {'message': f"Campo de busca pronto em {readiness['elapsed']:.1f}s", 'level': 'success'})
+        else:
+            socketio.emit('server_log', {'message': f"Timeout aguardando a página ficar pronta (faltando: {', '.join(readiness['missing'])})", 'level': 'error'})
+            logger.error("Timeout aguardando o campo de busca do SICAR")
             # Continua mesmo assim
         
         # Tenta detectar se a página carregou corretamente
@@ -159,12 +524,11 @@ def open_sicar_browser():
         except Exception as title_err:
             socketio.emit('server_log', {'message': f'Erro ao verificar título/URL: {str(title_err)}', 'level': 'error'})
         
-        # Tenta executar JavaScript para confirmar que a página está funcional
-        try:
-            js_works = driver.execute_script("return document.readyState")
-            socketio.emit('server_log', {'message': f'Estado da página: {js_works}', 'level': 'info'})
-        except Exception as js_err:
-            socketio.emit('server_log', {'message': f'JavaScript não funcionou: {str(js_err)}', 'level': 'error'})
+        # O estado do documento vem da própria verificação de prontidão
+        if readiness['document_state']:
+            socketio.emit('server_log', {'message': f"Estado da página: {readiness['document_state']}", 'level': 'info'})
+        else:
+            socketio.emit('server_log', {'message': f"JavaScript não funcionou: {readiness.get('error', 'sem resposta')}", 'level': 'error'})
         
         logger.info("Página do SICAR carregada com sucesso")
         socketio.emit('server_log', {'message': 'Página do SICAR carregada com sucesso', 'level': 'success'})
@@ -186,12 +550,14 @@ def open_sicar_browser():
 # Função para fechar o driver
 def close_driver():
     """Fecha o driver do Selenium."""
-    global driver
+    global driver, network_captcha
     
     if driver:
         try:
             driver.quit()
             driver = None
+            network_captcha = None
+            release_profile()
             logger.info("Driver do Selenium fechado com sucesso")
             socketio.emit('driver_status', {'active': False})
             return True
@@ -203,29 +569,40 @@ def close_driver():
         return True
 
 # Função para capturar o CAPTCHA
+@tracer.traced()
 def check_for_captcha():
     """Verifica se há um CAPTCHA na página e o captura."""
     global captcha_image, captcha_visible, in_captcha_page
     
+    stages = StageTimer(CAPTCHA_CHECK_LATENCY)
     try:
         # Verifica se o driver está ativo antes de continuar
+        stages.start('driver')
         if not is_driver_alive():
             return False
+        
+        # Imagem do CAPTCHA já recebida pela rede: dispensa a varredura do DOM
+        if network_captcha:
+            stages.start('rede')
+            if check_network_captcha():
+                return True
             
         logger.info("Verificando se há CAPTCHA na página...")
         socketio.emit('server_log', {'message': 'Verificando se há CAPTCHA na página...', 'level': 'info'})
         
         # Salva screenshot para debug
+        stages.start('screenshot_debug')
         debug_screenshot = str(STATIC_DIR / "debug_screenshot.png")
         driver.save_screenshot(debug_screenshot)
         
         # Método 0: Verifica se estamos na página de download que costuma ter CAPTCHA
+        stages.start('url_titulo')
         try:
             # Verifica por palavras-chave específicas na URL ou título
             current_url = driver.current_url
             page_title = driver.title
             
-            download_keywords = ["download", "baixar", "shapefile", "captcha"]
+            download_keywords = DOWNLOAD_KEYWORDS
             found_keyword = False
             
             for keyword in download_keywords:
@@ -245,7 +622,7 @@ def check_for_captcha():
                 driver.save_screenshot(full_screenshot_path)
                 
                 # Emite evento para o cliente
-                socketio.emit('captcha_detected', {'image': captcha_image})
+                publish_captcha(captcha_image)
                 socketio.emit('server_log', {'message': 'Screenshot da página de CAPTCHA enviado. Por favor, procure o CAPTCHA na imagem.', 'level': 'warning'})
                 socketio.emit('log_message', {'message': 'Possível CAPTCHA detectado. Veja o screenshot completo da página.', 'level': 'warning'})
                 
@@ -257,7 +634,8 @@ def check_for_captcha():
         
         # Verifica se está na página com CAPTCHA por diferentes métodos
         # Método 1: Busca a imagem do CAPTCHA diretamente
-        captcha_elements = driver.find_elements(By.XPATH, "//img[contains(@src, 'captcha')]")
+        stages.start('imagem')
+        captcha_elements = driver.find_elements(By.XPATH, CAPTCHA_IMAGE_XPATH)
         
         if captcha_elements:
             captcha_element = captcha_elements[0]
@@ -277,7 +655,7 @@ def check_for_captcha():
                 captcha_element.screenshot(captcha_local_path)
                 
                 # Emite evento para o cliente
-                socketio.emit('captcha_detected', {'image': captcha_image})
+                publish_captcha(captcha_image)
                 
                 logger.info("CAPTCHA capturado e enviado para o cliente")
                 socketio.emit('server_log', {'message': 'CAPTCHA capturado e enviado para o cliente', 'level': 'success'})
@@ -290,8 +668,8 @@ def check_for_captcha():
                 socketio.emit('server_log', {'message': f'Erro ao capturar imagem do CAPTCHA: {str(img_err)}', 'level': 'error'})
         
         # Método 2: Busca por elementos de texto relacionados a CAPTCHA
-        captcha_references = driver.find_elements(By.XPATH, 
-            "//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'captcha')]")
+        stages.start('texto')
+        captcha_references = driver.find_elements(By.XPATH, CAPTCHA_TEXT_XPATH)
         
         if captcha_references:
             logger.info("Referência a CAPTCHA encontrada no texto da página (método 2)")
@@ -336,7 +714,7 @@ def check_for_captcha():
                     captcha_elem.screenshot(captcha_local_path)
                     
                     # Emite evento para o cliente
-                    socketio.emit('captcha_detected', {'image': captcha_image})
+                    publish_captcha(captcha_image)
                     
                     logger.info("CAPTCHA capturado e enviado para o cliente")
                     socketio.emit('server_log', {'message': 'CAPTCHA capturado e enviado para o cliente', 'level': 'success'})
@@ -383,7 +761,7 @@ def check_for_captcha():
                 driver.save_screenshot(captcha_local_path)
                 
                 # Emite evento para o cliente
-                socketio.emit('captcha_detected', {'image': captcha_image})
+                publish_captcha(captcha_image)
                 socketio.emit('server_log', {'message': 'Screenshot da página de CAPTCHA enviado. Por favor, procure o CAPTCHA na imagem.', 'level': 'warning'})
                 socketio.emit('log_message', {'message': 'Possível CAPTCHA detectado. Veja o screenshot completo da página.', 'level': 'warning'})
                 
@@ -393,8 +771,8 @@ def check_for_captcha():
                 socketio.emit('server_log', {'message': f'Erro ao tentar capturar área de CAPTCHA: {str(e)}', 'level': 'error'})
         
         # Método 3: Verifica por campos de entrada relacionados a CAPTCHA
-        captcha_inputs = driver.find_elements(By.XPATH, 
-            "//input[contains(@id, 'captcha') or contains(@name, 'captcha')]")
+        stages.start('campo')
+        captcha_inputs = driver.find_elements(By.XPATH, CAPTCHA_INPUT_XPATH)
         
         if captcha_inputs:
             logger.info("Campo de entrada de CAPTCHA encontrado (método 3)")
@@ -435,7 +813,7 @@ def check_for_captcha():
                 driver.save_screenshot(captcha_local_path)
                 
                 # Emite evento para o cliente
-                socketio.emit('captcha_detected', {'image': captcha_image})
+                publish_captcha(captcha_image)
                 socketio.emit('log_message', {'message': 'Campo de CAPTCHA detectado. Por favor, verifique o screenshot e digite o código do CAPTCHA.', 'level': 'warning'})
                 socketio.emit('server_log', {'message': 'Campo de CAPTCHA detectado - enviando screenshot da página completa', 'level': 'info'})
                 
@@ -446,6 +824,7 @@ def check_for_captcha():
                 socketio.emit('server_log', {'message': f'Erro ao destacar campo de CAPTCHA: {str(highlight_err)}', 'level': 'error'})
         
         # Método 4: Última tentativa - busca por imagens próximas a textos com "código"
+        stages.start('codigo')
         try:
             driver.execute_script("""
                 // Busca por textos com "código" ou "code"
@@ -500,7 +879,7 @@ def check_for_captcha():
                 driver.save_screenshot(captcha_local_path)
                 
                 # Emite evento para o cliente
-                socketio.emit('captcha_detected', {'image': captcha_image})
+                publish_captcha(captcha_image)
                 socketio.emit('log_message', {'message': 'Possíveis elementos relacionados a CAPTCHA encontrados. Verifique o screenshot e digite o código, se presente.', 'level': 'warning'})
                 socketio.emit('server_log', {'message': 'Elementos com texto "código"/"code" encontrados - enviando screenshot', 'level': 'warning'})
                 
@@ -520,39 +899,91 @@ def check_for_captcha():
         logger.error(f"Erro ao verificar CAPTCHA: {str(e)}")
         socketio.emit('server_log', {'message': f'Erro ao verificar CAPTCHA: {str(e)}', 'level': 'error'})
         return False
+    finally:
+        stages.finish()
+
+# Função para publicar o CAPTCHA recebido pela rede
+def check_network_captcha():
+    """Publica a imagem de CAPTCHA mais recente recebida pela rede, se houver."""
+    global captcha_image, captcha_visible, in_captcha_page
+    
+    captured = network_captcha.take() if network_captcha else None
+    if not captured:
+        return False
+    
+    logger.info(f"CAPTCHA recebido pela rede: {captured['url']}")
+    socketio.emit('server_log', {'message': 'CAPTCHA detectado na resposta de rede da imagem', 'level': 'success'})
+    captcha_image = captured['image']
+    captcha_visible = True
+    in_captcha_page = True
+    
+    # Guarda a imagem original para /captcha
+    try:
+        with open(STATIC_DIR / "captcha.png", 'wb') as image_file:
+            image_file.write(base64.b64decode(captcha_image.split(',', 1)[1]))
+    except Exception as e:
+        logger.warning(f"Erro ao salvar imagem do CAPTCHA: {str(e)}")
+    
+    publish_captcha(captcha_image)
+    return True
+
+# Função para publicar um CAPTCHA detectado
+def publish_captcha(image):
+    """Envia o CAPTCHA detectado aos clientes, guarda o formulário e cria a tarefa na fila de operadores."""
+    global captcha_handles
+    
+    socketio.emit('captcha_detected', {'image': image}, to=BROWSER_ROOM)
+    
+    # Resolve o formulário agora para que o envio seja imediato
+    handles = resolve_captcha_handles(driver)
+    if handles:
+        captcha_handles = handles
+        logger.info("Campo e botão do CAPTCHA resolvidos e guardados")
+    
+    captcha_queue.submit(DEFAULT_SESSION_ID, image, on_solution=solve_principal_captcha)
+
+def solve_principal_captcha(task, text):
+    """Repassa ao navegador interativo a resposta dada por um operador da fila."""
+    success = send_captcha_text(text)
+    # Resposta vinda de outro nó (solve_remote) não tem operador local; sem
+    # destino, o emit iria para todos os clientes de todos os nós
+    if task.operator_id:
+        socketio.emit('captcha_result', {'task_id': task.task_id, 'success': success}, to=task.operator_id)
+    if success:
+        socketio.start_background_task(take_screenshot)
+        screen_streamer.request_update(delay=0.5)
 
 # Função para enviar o texto do CAPTCHA
+@tracer.traced()
+@driver_guard.uses_driver
 def send_captcha_text(text):
     """Envia o texto do CAPTCHA para o campo apropriado no site."""
+    global captcha_handles
+    
+    started = time.perf_counter()
+    result = 'erro'
     try:
-        # Procura pelo campo de input do CAPTCHA
-        captcha_inputs = driver.find_elements(By.XPATH, "//input[contains(@id, 'captcha') or contains(@name, 'captcha')]")
+        # Preenche e envia em uma única chamada, validando os elementos guardados
+        result, handles = submit_captcha(driver, captcha_handles, text)
+        captcha_handles = handles
         
-        if captcha_inputs:
-            # Preenche o campo com o texto
-            captcha_input = captcha_inputs[0]
-            captcha_input.clear()
-            captcha_input.send_keys(text)
-            logger.info(f"Texto do CAPTCHA '{text}' inserido no campo")
-            
-            # Busca o botão de envio
-            submit_buttons = driver.find_elements(By.XPATH, "//button[@type='submit'] | //input[@type='submit'] | //button[contains(text(), 'Download')] | //button[contains(text(), 'Baixar')]")
-            
-            if submit_buttons:
-                submit_buttons[0].click()
-                logger.info("Botão de envio do CAPTCHA clicado")
-                return True
-            else:
-                logger.warning("Botão de envio do CAPTCHA não encontrado")
-                return False
+        if result == SUBMIT_OK:
+            logger.info(f"Texto do CAPTCHA '{text}' inserido e formulário enviado")
+            return True
+        elif result == SUBMIT_NO_BUTTON:
+            logger.warning("Botão de envio do CAPTCHA não encontrado")
+            return False
         else:
             logger.warning("Campo de input do CAPTCHA não encontrado")
             return False
     except Exception as e:
         logger.error(f"Erro ao enviar texto do CAPTCHA: {str(e)}")
         return False
+    finally:
+        CAPTCHA_SUBMIT_LATENCY.observe(time.perf_counter() - started, result=result)
 
 # Função para clicar no botão de download
+@tracer.traced()
 def click_on_download_button():
     """Tenta clicar no botão de download no site do SICAR."""
     try:
@@ -562,24 +993,11 @@ def click_on_download_button():
         driver.execute_script("document.body.style.zoom='80%'")
         time.sleep(1)
         
-        # Aguarda para garantir que a página está carregada
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
+        # Aguarda o botão de download ficar clicável (segue com os seletores mesmo sem ele)
+        wait_until_ready(driver, PROPERTY_PAGE, 10)
         
         # Lista de seletores possíveis para o botão de download
-        download_button_selectors = [
-            (By.ID, "btnDownloadShapefileUC"),
-            (By.XPATH, "//button[contains(text(), 'Baixar Shapefile')]"),
-            (By.XPATH, "//button[contains(text(), 'Download') and contains(text(), 'Shapefile')]"),
-            (By.XPATH, "//a[contains(text(), 'Baixar Shapefile')]"),
-            (By.XPATH, "//a[contains(@href, 'shapefile') or contains(@href, 'download')]"),
-            (By.XPATH, "//button[contains(@onclick, 'shapefile') or contains(@onclick, 'download')]"),
-            (By.XPATH, "//button[@title='Baixar shapefile']"),
-            (By.XPATH, "//a[@title='Baixar shapefile']"),
-            (By.XPATH, "//button[contains(@class, 'download')]"),
-            (By.XPATH, "//a[contains(@class, 'download')]")
-        ]
+        download_button_selectors = DOWNLOAD_BUTTON_SELECTORS
         
         logger.info(f"Procurando botão de download com {len(download_button_selectors)} seletores diferentes")
         
@@ -718,6 +1136,8 @@ def click_on_download_button():
         return False
 
 # Função para obter o screenshot atual
+@tracer.traced()
+@driver_guard.uses_driver
 def take_screenshot():
     """Tira um screenshot da página atual e retorna como base64."""
     global last_screenshot
@@ -727,12 +1147,15 @@ def take_screenshot():
             logger.error("Driver não inicializado para capturar screenshot")
             return None
         
-        screenshot = driver.get_screenshot_as_base64
-        last_screenshot = f"data:image/png;base64,{screenshot}"
+        with SCREENSHOT_LATENCY.time(stage='captura'):
+            screenshot = driver.get_screenshot_as_base64()
+        with SCREENSHOT_LATENCY.time(stage='codificacao'):
+            last_screenshot = f"data:image/png;base64,{screenshot}"
         
         # Salva o screenshot no diretório estático
         screenshot_path = str(STATIC_DIR / "browser_screenshot.png")
-        driver.save_screenshot(screenshot_path)
+        with SCREENSHOT_LATENCY.time(stage='gravacao'):
+            driver.save_screenshot(screenshot_path)
         
         # Verifica por CAPTCHA após screenshot
         check_for_captcha()
@@ -742,7 +1165,25 @@ def take_screenshot():
         logger.error(f"Erro ao capturar screenshot: {str(e)}")
         return None
 
+# Função para capturar um quadro leve da tela para o espelho do navegador
+@driver_guard.uses_driver
+def capture_screen_frame():
+    """Captura a área visível como JPEG via CDP e retorna como data URL."""
+    if not driver:
+        return None
+    
+    with SCREENSHOT_LATENCY.time(stage='quadro'):
+        frame = driver.execute_cdp_cmd('Page.captureScreenshot', {'format': 'jpeg', 'quality': SCREEN_JPEG_QUALITY})
+    return f"data:image/jpeg;base64,{frame['data']}"
+
+screen_streamer = ScreenStreamer(
+    capture_screen_frame,
+    lambda frame: socketio.emit('screen_update', {'image': frame}, to=BROWSER_ROOM)
+)
+
 # Função especial para detecção forçada de CAPTCHA
+@CAPTCHA_FORCE_LATENCY.time()
+@tracer.traced()
 def captcha_force_detection():
     """Método especial para forçar a detecção de CAPTCHA quando os métodos normais falham."""
     global captcha_image, captcha_visible, in_captcha_page
@@ -766,8 +1207,7 @@ def captcha_force_detection():
         found_captcha = False
         
         # Método 1: Busca por DIVS relacionadas a CAPTCHA
-        captcha_div = driver.find_elements(By.XPATH, 
-            "//div[contains(@id, 'captcha') or contains(@class, 'captcha') or contains(@id, 'CAPTCHA') or contains(@class, 'CAPTCHA')]")
+        captcha_div = driver.find_elements(By.XPATH, CAPTCHA_DIV_XPATH)
             
         if captcha_div:
             socketio.emit('server_log', {'message': f'Encontrado div de CAPTCHA: {len(captcha_div)} elementos', 'level': 'success'})
@@ -792,7 +1232,7 @@ def captcha_force_detection():
                         img.screenshot(img_local_path)
                         
                         # Emite evento para o cliente
-                        socketio.emit('captcha_detected', {'image': captcha_image})
+                        publish_captcha(captcha_image)
                         socketio.emit('server_log', {'message': 'Imagem de CAPTCHA capturada com sucesso!', 'level': 'success'})
                         
                         captcha_visible = True
@@ -814,7 +1254,7 @@ def captcha_force_detection():
                     captcha_div[0].screenshot(div_local_path)
                     
                     # Emite evento para o cliente
-                    socketio.emit('captcha_detected', {'image': captcha_image})
+                    publish_captcha(captcha_image)
                     socketio.emit('server_log', {'message': 'Screenshot da div de CAPTCHA enviado', 'level': 'success'})
                     
                     captcha_visible = True
@@ -858,7 +1298,7 @@ def captcha_force_detection():
                                 driver.execute_script("arguments[0].style.border = '2px solid purple';", img)
                             
                             # Emite o conteúdo do iframe como CAPTCHA
-                            socketio.emit('captcha_detected', {'image': iframe_image})
+                            publish_captcha(iframe_image)
                             socketio.emit('server_log', {'message': f'Conteúdo do iframe {i+1} enviado como possível CAPTCHA', 'level': 'success'})
                             
                             captcha_visible = True
@@ -875,7 +1315,7 @@ def captcha_force_detection():
         # Método 3: Se não encontrou nada específico, envia o screenshot completo como último recurso
         if not found_captcha:
             socketio.emit('server_log', {'message': 'Nenhum elemento específico de CAPTCHA encontrado. Enviando screenshot completo.', 'level': 'warning'})
-            socketio.emit('captcha_detected', {'image': full_captcha_image})
+            publish_captcha(full_captcha_image)
             socketio.emit('log_message', {'message': 'Possível CAPTCHA na página. Por favor, localize e digite o código do CAPTCHA visível na imagem.', 'level': 'warning'})
             
             captcha_visible = True
@@ -891,7 +1331,7 @@ def captcha_force_detection():
 # Função para verificar se o driver ainda está ativo
 def is_driver_alive():
     """Verifica se o driver Selenium ainda está respondendo."""
-    global driver
+    global driver, network_captcha
     
     if not driver:
         return False
@@ -904,6 +1344,8 @@ def is_driver_alive():
         # Se qualquer exceção ocorrer, considera que o driver não está mais ativo
         logger.warning("Driver não está mais respondendo, marcando como inativo")
         driver = None
+        network_captcha = None
+        release_profile()
         socketio.emit('browser_status', {'active': False})
         socketio.emit('server_log', {'message': 'Conexão com o navegador perdida. Por favor, reinicie o navegador.', 'level': 'error'})
         socketio.emit('log_message', {'message': 'Conexão com o navegador perdida. Por favor, clique em "Iniciar Navegador" novamente.', 'level': 'error'})
@@ -935,10 +1377,24 @@ def check_driver():
         return False
 
 # Rotas da API
+# Cada requisição abre um trace com os comandos WebDriver que ela disparou
+@app.before_request
+def begin_request_trace():
+    if request.endpoint in TRACE_SKIP_ENDPOINTS:
+        return
+    g.traced = True
+    tracer.begin(request.url_rule.rule if request.url_rule else request.path, 'rota',
+                 method=request.method, path=request.path)
+
+@app.teardown_request
+def end_request_trace(error=None):
+    if g.get('traced'):
+        tracer.end(error=error)
+
 @app.route('/')
 def index():
     """Rota principal da aplicação."""
-    return render_template('captcha_mirror.html')
+    return render_template('captcha_mirror.html', socket_transports=serving.socket_transports())
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
@@ -955,6 +1411,7 @@ def serve_captcha():
         return "", 404
 
 @app.route('/start_browser', methods=['POST'])
+@driver_guard.replaces_driver
 def start_browser():
     """Inicia o navegador SICAR."""
     global driver
@@ -974,6 +1431,7 @@ def start_browser():
             return jsonify({'success': False, 'error': 'Erro ao abrir site do SICAR'})
         
         take_screenshot()
+        screen_streamer.request_update()
         socketio.emit('browser_status', {'active': True})
         return jsonify({'success': True})
     except Exception as e:
@@ -984,9 +1442,10 @@ def start_browser():
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/stop', methods=['POST'])
+@driver_guard.replaces_driver
 def stop_browser():
     """Para o navegador SICAR."""
-    global driver, captcha_image, captcha_visible, in_captcha_page
+    global driver, captcha_image, captcha_visible, in_captcha_page, captcha_handles
     
     if not driver:
         return jsonify({'success': False, 'message': 'Navegador não está em execução'})
@@ -996,6 +1455,8 @@ def stop_browser():
         captcha_image = None
         captcha_visible = False
         in_captcha_page = False
+        captcha_handles = None
+        captcha_queue.cancel_session(DEFAULT_SESSION_ID)
         socketio.emit('browser_status', {'active': False})
         return jsonify({'success': True})
     else:
@@ -1017,7 +1478,13 @@ def send_captcha():
         return jsonify({'success': False, 'error': 'Texto do CAPTCHA não fornecido'})
     
     if send_captcha_text(captcha_text):
-        take_screenshot()  # Atualiza o screenshot após enviar o CAPTCHA
+        # O CAPTCHA foi resolvido por este caminho; retira a tarefa da fila
+        CAPTCHAS_SOLVED.inc(session=DEFAULT_SESSION_ID, via='direto')
+        captcha_queue.cancel_session(DEFAULT_SESSION_ID)
+        
+        # Atualiza o screenshot após enviar o CAPTCHA sem atrasar a resposta
+        socketio.start_background_task(take_screenshot)
+        screen_streamer.request_update(delay=0.5)
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'Erro ao enviar texto do CAPTCHA'})
@@ -1030,6 +1497,213 @@ def check_captcha_status():
         'captcha_url': '/captcha_image?t=' + str(time.time()) if captcha_visible else None
     })
 
+@app.route('/captcha_queue/status', methods=['GET'])
+def captcha_queue_status():
+    """Obtém a profundidade da fila de CAPTCHAs, a ocupação dos operadores e as latências."""
+    return jsonify(captcha_queue.metrics())
+
+@app.route('/jobs', methods=['POST'])
+def submit_jobs():
+    """Recebe um lote de códigos do CAR e/ou municípios para download automatizado."""
+    data = request.json or {}
+    items = parse_batch(data)
+    
+    if not items:
+        return jsonify({'success': False, 'error': 'Nenhum código do CAR ou município fornecido'})
+    
+    batch_id, jobs = job_scheduler.submit_batch(items, force=bool(data.get('force')))
+    socketio.emit('server_log', {'message': f'Lote com {len(jobs)} downloads enfileirado', 'level': 'info'})
+    return jsonify({'success': True, 'batch_id': batch_id, 'job_ids': [job.job_id for job in jobs]})
+
+@app.route('/jobs', methods=['GET'])
+def jobs_status():
+    """Obtém a contagem de trabalhos por estado, a vazão e o estado das sessões do pool."""
+    return jsonify(job_scheduler.status())
+
+@app.route('/jobs/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Obtém o estado dos trabalhos de um lote."""
+    status = job_scheduler.batch_status(batch_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    return jsonify(status)
+
+@app.route('/store', methods=['GET'])
+def store_status():
+    """Obtém o tamanho do armazenamento de shapefiles."""
+    return jsonify(shapefile_store.stats())
+
+@app.route('/store/<path:key>', methods=['GET'])
+def store_history(key):
+    """Obtém os downloads armazenados de um código do CAR e se ainda estão na validade."""
+    return jsonify({'key': key, 'fresh': shapefile_store.fresh(key) is not None, 'entries': shapefile_store.history(key)})
+
+@app.route('/catalog', methods=['GET'])
+def catalog_status():
+    """Obtém a quantidade de zips e feições catalogados."""
+    return jsonify(shapefile_catalog.stats())
+
+@app.route('/export', methods=['GET'])
+def export_status():
+    """Obtém o estado da exportação GeoParquet."""
+    return jsonify(columnar_exporter.stats())
+
+@app.route('/catalog/search', methods=['GET'])
+def catalog_search():
+    """Busca as feições que cruzam uma área (bbox=min_x,min_y,max_x,max_y)."""
+    try:
+        bbox = parse_bbox(request.args.get('bbox', ''))
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    started = time.time()
+    features = shapefile_catalog.search(bbox, layer=request.args.get('layer'), limit=limit)
+    return jsonify({
+        'success': True,
+        'count': len(features),
+        'elapsed_ms': (time.time() - started) * 1000,
+        'features': features,
+    })
+
+@app.route('/catalog/<path:key>', methods=['GET'])
+def catalog_features(key):
+    """Obtém as feições catalogadas de um código do CAR."""
+    return jsonify({'key': key, 'features': shapefile_catalog.features(key)})
+
+@app.route('/preview/store/<path:key>', methods=['GET'])
+def preview_stored(key):
+    """Obtém a pré-visualização GeoJSON do último download armazenado de um código do CAR."""
+    entry = shapefile_store.latest(key)
+    if not entry:
+        return jsonify({'success': False, 'error': 'Código não encontrado no armazenamento'}), 404
+    preview = preview_cache.get(entry['path'], sha256=entry['sha256'])
+    if preview is None:
+        return jsonify({'success': False, 'error': 'Shapefile inválido'}), 422
+    return jsonify(preview)
+
+@app.route('/preview/download/<path:name>', methods=['GET'])
+def preview_download(name):
+    """Obtém a pré-visualização GeoJSON de um zip do diretório de downloads."""
+    path = safe_join(str(DOWNLOAD_DIR), name)
+    if not path or not os.path.isfile(path):
+        return jsonify({'success': False, 'error': 'Arquivo não encontrado'}), 404
+    preview = preview_cache.get(path)
+    if preview is None:
+        return jsonify({'success': False, 'error': 'Shapefile inválido'}), 422
+    return jsonify(preview)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato de texto do Prometheus."""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/traces', methods=['GET'])
+def traces_list():
+    """Resumo dos traces recentes (filtros: name, min_ms, limit)."""
+    try:
+        min_duration = float(request.args['min_ms']) if request.args.get('min_ms') else None
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'min_ms e limit devem ser numéricos'}), 400
+    return jsonify({'success': True, 'traces': tracer.recent(limit, request.args.get('name'), min_duration)})
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def trace_detail(trace_id):
+    """Um trace no formato JSON de trace do Chrome (abre em chrome://tracing ou no Perfetto)."""
+    trace = tracer.get(trace_id)
+    if not trace:
+        return jsonify({'success': False, 'error': 'Trace não encontrado'}), 404
+    response = jsonify(trace.to_chrome())
+    response.headers['Content-Disposition'] = f'attachment; filename=trace-{trace_id}.json'
+    return response
+
+@app.route('/traces/export', methods=['POST'])
+def traces_export():
+    """Grava os traces em memória (ou os informados em trace_ids) em data/traces."""
+    data = request.get_json(silent=True) or {}
+    path = TRACE_DIR / f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    try:
+        count = tracer.export(str(path), data.get('trace_ids'))
+    except Exception as e:
+        logger.error(f"Erro ao exportar traces: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({'success': True, 'path': str(path), 'traces': count})
+
+@app.route('/governor', methods=['GET'])
+def governor_status():
+    """Memória, CPU e navegações de cada navegador e os limites do governador de recursos."""
+    if not governor:
+        return jsonify({'success': False, 'error': 'Governador de recursos desativado'})
+    return jsonify(dict(governor.status(), success=True))
+
+@app.route('/politeness', methods=['GET'])
+def politeness_status():
+    """Taxa atual, fichas, pedidos em andamento e fila de espera de cada host."""
+    return jsonify(dict(politeness.scheduler.status(), success=True))
+
+@app.route('/cluster', methods=['GET'])
+def cluster_status():
+    """Nós do cluster, sessões de cada nó e tarefas de CAPTCHA trocadas."""
+    if not cluster_node:
+        return jsonify({'success': False, 'error': 'Cluster desativado (CLUSTER_REDIS_URL)'})
+    try:
+        return jsonify(dict(cluster_node.status(), success=True))
+    except Exception as e:
+        logger.error(f"Erro ao consultar o cluster: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/profiles', methods=['GET'])
+def profiles_status():
+    """Perfis persistentes do Chrome: tamanho de cada slot e do seu cache."""
+    if not profile_manager:
+        return jsonify({'success': False, 'error': 'Perfis persistentes desativados'})
+    return jsonify(dict(profile_manager.stats(), success=True))
+
+@app.route('/snapshots', methods=['GET'])
+def snapshots_stats():
+    """Tamanho do corpus de snapshots do DOM."""
+    return jsonify(dict(snapshot_recorder.stats(), success=True, recording=SNAPSHOT_RECORDING,
+                        offline_available=offline_detection.is_available()))
+
+@app.route('/snapshots', methods=['POST'])
+@driver_guard.uses_driver
+def snapshots_record():
+    """Grava um snapshot da página atual, opcionalmente já rotulado (captcha: true/false)."""
+    if not is_driver_alive():
+        return jsonify({'success': False, 'error': 'Navegador não está inicializado'})
+    data = request.get_json(silent=True) or {}
+    label = data.get('captcha')
+    _, snapshot_id = snapshot_recorder.record(
+        driver, label=bool(label) if label is not None else None, source='manual')
+    if not snapshot_id:
+        return jsonify({'success': False, 'error': 'Página igual ao último snapshot ou limite de snapshots atingido'})
+    return jsonify({'success': True, 'snapshot_id': snapshot_id})
+
+@app.route('/snapshots/<snapshot_id>/label', methods=['POST'])
+def snapshots_label(snapshot_id):
+    """Rotula um snapshot: {"captcha": true/false, "note": "..."}."""
+    data = request.get_json(silent=True) or {}
+    if 'captcha' not in data:
+        return jsonify({'success': False, 'error': 'Informe captcha: true ou false'}), 400
+    snapshot_recorder.label(snapshot_id, bool(data['captcha']), data.get('note'))
+    return jsonify({'success': True})
+
+@app.route('/snapshots/evaluate', methods=['GET'])
+def snapshots_evaluate():
+    """Avalia offline as estratégias de detecção sobre o corpus (conjunto: check ou force)."""
+    if not offline_detection.is_available():
+        return jsonify({'success': False, 'error': 'lxml não instalado; avaliação offline indisponível'})
+    strategies = STRATEGY_SETS.get(request.args.get('set', 'check'))
+    if not strategies:
+        return jsonify({'success': False, 'error': f"Conjunto inválido; use {', '.join(STRATEGY_SETS)}"}), 400
+    try:
+        report = offline_detection.evaluate(SNAPSHOT_DIR, strategies)
+    except Exception as e:
+        logger.error(f"Erro na avaliação offline: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({'success': True, 'report': report})
+
 @app.route('/get_screenshot', methods=['GET'])
 def get_screenshot():
     """Obtém o screenshot atual."""
@@ -1042,16 +1716,22 @@ def get_screenshot():
     else:
         return jsonify({'url': None, 'error': 'Erro ao capturar screenshot'})
 
+@driver_guard.uses_driver
+def run_force_download_button(job):
+    """Clica no botão de download (tarefa de /force_download_button)."""
+    job.progress('Procurando o botão de download...', 'info')
+    if click_on_download_button():
+        return {'success': True}
+    return {'success': False, 'message': 'Não foi possível encontrar ou clicar no botão de download'}
+
 @app.route('/force_download_button', methods=['POST'])
 def force_download_button():
-    """Força um clique no botão de download."""
+    """Força um clique no botão de download; retorna a tarefa em segundo plano."""
     if not driver:
         return jsonify({'success': False, 'message': 'Navegador não está inicializado'})
     
-    if click_on_download_button():
-        return jsonify({'success': True})
-    else:
-        return jsonify({'success': False, 'message': 'Não foi possível encontrar ou clicar no botão de download'})
+    job, coalesced = background_jobs.submit(DEFAULT_SESSION_ID, 'force_download_button', run_force_download_button)
+    return jsonify({'success': True, 'job_id': job.job_id, 'state': job.state, 'coalesced': coalesced}), 202
 
 @app.route('/check_driver', methods=['GET'])
 def check_driver():
@@ -1070,6 +1750,7 @@ def get_browser_status():
     return jsonify({'driver_active': driver is not None})
 
 @app.route('/browser_click', methods=['POST'])
+@driver_guard.uses_driver
 def browser_click():
     """Processa cliques no navegador."""
     if not driver:
@@ -1170,16 +1851,12 @@ def browser_click():
         logger.error(f"Erro ao processar clique: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/force_download', methods=['POST'])
-def force_download():
-    """Rota para forçar o download do shapefile, mesmo sem detectar CAPTCHA."""
+@driver_guard.uses_driver
+def run_force_download(job):
+    """Força o download do shapefile, mesmo sem detectar CAPTCHA (tarefa de /force_download)."""
     global in_captcha_page
     
-    # Verifica se o driver está ativo antes de prosseguir
-    if not is_driver_alive():
-        return jsonify({'success': False, 'message': 'Navegador não está respondendo. Por favor, reinicie o navegador.'})
-    
-    socketio.emit('server_log', {'message': 'Tentando forçar download do shapefile...', 'level': 'info'})
+    job.progress('Tentando forçar download do shapefile...', 'info')
     
     try:
         # Primeiro tenta encontrar o botão de download
@@ -1189,33 +1866,33 @@ def force_download():
         try:
             buttons = driver.find_elements(By.XPATH, "//button[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'baixar') or contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'download') or contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'shapefile')]")
             download_buttons.extend(buttons)
-            socketio.emit('server_log', {'message': f'Encontrados {len(buttons)} botões com texto para download', 'level': 'info'})
+            job.progress(f'Encontrados {len(buttons)} botões com texto para download', 'info')
         except Exception as e:
-            socketio.emit('server_log', {'message': f'Erro ao buscar botões por texto: {str(e)}', 'level': 'error'})
+            job.progress(f'Erro ao buscar botões por texto: {str(e)}', 'error')
         
         # Método 2: Busca por links com os mesmos textos
         try:
             links = driver.find_elements(By.XPATH, "//a[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'baixar') or contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'download') or contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'shapefile')]")
             download_buttons.extend(links)
-            socketio.emit('server_log', {'message': f'Encontrados {len(links)} links com texto para download', 'level': 'info'})
+            job.progress(f'Encontrados {len(links)} links com texto para download', 'info')
         except Exception as e:
-            socketio.emit('server_log', {'message': f'Erro ao buscar links por texto: {str(e)}', 'level': 'error'})
+            job.progress(f'Erro ao buscar links por texto: {str(e)}', 'error')
         
         # Método 3: Busca por elementos com ID ou classe que contenha "download"
         try:
             id_elements = driver.find_elements(By.CSS_SELECTOR, "[id*='download'], [id*='baixar'], [class*='download'], [class*='baixar']")
             download_buttons.extend(id_elements)
-            socketio.emit('server_log', {'message': f'Encontrados {len(id_elements)} elementos com ID/classe de download', 'level': 'info'})
+            job.progress(f'Encontrados {len(id_elements)} elementos com ID/classe de download', 'info')
         except Exception as e:
-            socketio.emit('server_log', {'message': f'Erro ao buscar elementos por ID/classe: {str(e)}', 'level': 'error'})
+            job.progress(f'Erro ao buscar elementos por ID/classe: {str(e)}', 'error')
             
         # Se encontrou botões, tenta clicar no primeiro
         if download_buttons:
             try:
                 # Primeiro tenta rolar até o botão para garantir que esteja visível
-                socketio.emit('server_log', {'message': 'Rolando até o botão de download...', 'level': 'info'})
+                job.progress('Rolando até o botão de download...', 'info')
                 driver.execute_script("arguments[0].scrollIntoView({block: 'center', behavior: 'smooth'});", download_buttons[0])
-                time.sleep(1)
+                job.sleep(1)
                 
                 # Tenta destacar visualmente o botão
                 driver.execute_script("arguments[0].style.border = '3px solid red';", download_buttons[0])
@@ -1223,64 +1900,64 @@ def force_download():
                 # Captura um screenshot antes de clicar
                 button_screenshot = str(STATIC_DIR / "download_button.png")
                 driver.save_screenshot(button_screenshot)
-                socketio.emit('server_log', {'message': 'Screenshot capturado com o botão destacado', 'level': 'info'})
+                job.progress('Screenshot capturado com o botão destacado', 'info')
                 
                 # Tenta clicar no botão usando diferentes métodos
                 try:
                     # Método 1: Clique normal
                     download_buttons[0].click()
-                    socketio.emit('server_log', {'message': 'Clique normal realizado no botão de download', 'level': 'info'})
+                    job.progress('Clique normal realizado no botão de download', 'info')
                 except Exception as click_err:
-                    socketio.emit('server_log', {'message': f'Erro no clique normal: {str(click_err)}', 'level': 'warning'})
+                    job.progress(f'Erro no clique normal: {str(click_err)}', 'warning')
                     
                     try:
                         # Método 2: Clique via JavaScript
                         driver.execute_script("arguments[0].click();", download_buttons[0])
-                        socketio.emit('server_log', {'message': 'Clique via JavaScript realizado no botão de download', 'level': 'info'})
+                        job.progress('Clique via JavaScript realizado no botão de download', 'info')
                     except Exception as js_click_err:
-                        socketio.emit('server_log', {'message': f'Erro no clique via JavaScript: {str(js_click_err)}', 'level': 'warning'})
+                        job.progress(f'Erro no clique via JavaScript: {str(js_click_err)}', 'warning')
                         
                         try:
                             # Método 3: Actions chains
                             ActionChains(driver).move_to_element(download_buttons[0]).click().perform()
-                            socketio.emit('server_log', {'message': 'Clique via ActionChains realizado no botão de download', 'level': 'info'})
+                            job.progress('Clique via ActionChains realizado no botão de download', 'info')
                         except Exception as action_click_err:
-                            socketio.emit('server_log', {'message': f'Erro no clique via ActionChains: {str(action_click_err)}', 'level': 'error'})
-                            return jsonify({'success': False, 'message': 'Não foi possível clicar no botão de download'})
+                            job.progress(f'Erro no clique via ActionChains: {str(action_click_err)}', 'error')
+                            return {'success': False, 'message': 'Não foi possível clicar no botão de download'}
                 
                 # Marca que estamos em uma página que pode ter CAPTCHA
                 in_captcha_page = True
                 
                 # Espera um pouco para que o CAPTCHA apareça
-                socketio.emit('server_log', {'message': 'Aguardando possível aparecimento de CAPTCHA...', 'level': 'info'})
-                time.sleep(3)
+                job.progress('Aguardando possível aparecimento de CAPTCHA...', 'info')
+                job.sleep(3)
                 
                 # Forçar uma verificação imediata de CAPTCHA
                 captcha_found = check_for_captcha()
                 
                 if captcha_found:
-                    socketio.emit('server_log', {'message': 'CAPTCHA detectado após clique no botão de download!', 'level': 'success'})
-                    return jsonify({'success': True, 'captcha_detected': True})
+                    job.progress('CAPTCHA detectado após clique no botão de download!', 'success')
+                    return {'success': True, 'captcha_detected': True}
                 else:
                     # Se não achou CAPTCHA, tenta usar captcha_force_detection especial
-                    socketio.emit('server_log', {'message': 'CAPTCHA não detectado pelos métodos normais. Tentando detecção forçada...', 'level': 'warning'})
-                    time.sleep(1)
+                    job.progress('CAPTCHA não detectado pelos métodos normais. Tentando detecção forçada...', 'warning')
+                    job.sleep(1)
                     captcha_found = captcha_force_detection()
                     
                     if captcha_found:
-                        socketio.emit('server_log', {'message': 'CAPTCHA detectado após detecção forçada!', 'level': 'success'})
-                        return jsonify({'success': True, 'captcha_detected': True})
+                        job.progress('CAPTCHA detectado após detecção forçada!', 'success')
+                        return {'success': True, 'captcha_detected': True}
                     else:
-                        socketio.emit('server_log', {'message': 'Nenhum CAPTCHA detectado mesmo após detecção forçada', 'level': 'warning'})
-                        return jsonify({'success': True, 'captcha_detected': False})
+                        job.progress('Nenhum CAPTCHA detectado mesmo após detecção forçada', 'warning')
+                        return {'success': True, 'captcha_detected': False}
             
             except Exception as button_err:
-                socketio.emit('server_log', {'message': f'Erro ao interagir com botão de download: {str(button_err)}', 'level': 'error'})
-                return jsonify({'success': False, 'message': str(button_err)})
+                job.progress(f'Erro ao interagir com botão de download: {str(button_err)}', 'error')
+                return {'success': False, 'message': str(button_err)}
         
         else:
             # Se não encontrou botões, tenta usar JavaScript para verificar a página
-            socketio.emit('server_log', {'message': 'Nenhum botão de download encontrado. Tentando busca avançada...', 'level': 'warning'})
+            job.progress('Nenhum botão de download encontrado. Tentando busca avançada...', 'warning')
             
             # Captura um screenshot da página
             page_screenshot = str(STATIC_DIR / "page_screenshot.png")
@@ -1298,21 +1975,52 @@ def force_download():
             # Captura screenshot com elementos destacados
             elements_screenshot = str(STATIC_DIR / "elements_screenshot.png")
             driver.save_screenshot(elements_screenshot)
-            socketio.emit('server_log', {'message': 'Screenshot com elementos interativos destacados foi gerado', 'level': 'info'})
+            job.progress('Screenshot com elementos interativos destacados foi gerado', 'info')
             
             # Força detecção de CAPTCHA mesmo sem clicar
             captcha_found = captcha_force_detection()
             
             if captcha_found:
-                socketio.emit('server_log', {'message': 'CAPTCHA detectado após busca na página!', 'level': 'success'})
-                return jsonify({'success': True, 'captcha_detected': True})
+                job.progress('CAPTCHA detectado após busca na página!', 'success')
+                return {'success': True, 'captcha_detected': True}
             else:
-                socketio.emit('server_log', {'message': 'Nenhum botão de download ou CAPTCHA encontrado', 'level': 'error'})
-                return jsonify({'success': False, 'message': 'Nenhum botão de download encontrado'})
+                job.progress('Nenhum botão de download ou CAPTCHA encontrado', 'error')
+                return {'success': False, 'message': 'Nenhum botão de download encontrado'}
     
     except Exception as e:
-        socketio.emit('server_log', {'message': f'Erro ao forçar download: {str(e)}', 'level': 'error'})
-        return jsonify({'success': False, 'message': str(e)})
+        job.progress(f'Erro ao forçar download: {str(e)}', 'error')
+        return {'success': False, 'message': str(e)}
+
+@app.route('/force_download', methods=['POST'])
+def force_download():
+    """Rota para forçar o download do shapefile; retorna a tarefa em segundo plano."""
+    # Verifica se o driver está ativo antes de prosseguir
+    if not is_driver_alive():
+        return jsonify({'success': False, 'message': 'Navegador não está respondendo. Por favor, reinicie o navegador.'})
+    
+    job, coalesced = background_jobs.submit(DEFAULT_SESSION_ID, 'force_download', run_force_download)
+    return jsonify({'success': True, 'job_id': job.job_id, 'state': job.state, 'coalesced': coalesced}), 202
+
+@app.route('/background_jobs', methods=['GET'])
+def background_jobs_list():
+    """Tarefas em segundo plano recentes."""
+    return jsonify({'success': True, 'jobs': background_jobs.list()})
+
+@app.route('/background_jobs/<job_id>', methods=['GET'])
+def background_job_status(job_id):
+    """Estado, progresso e resultado de uma tarefa em segundo plano."""
+    job = background_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Tarefa não encontrada'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/background_jobs/<job_id>/cancel', methods=['POST'])
+def background_job_cancel(job_id):
+    """Pede o cancelamento de uma tarefa em segundo plano."""
+    job = background_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Tarefa não encontrada'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
 
 # Rota para o navigate_to_douradina foi removida pois o botão foi removido da interface
 
@@ -1325,9 +2033,26 @@ def monitor_captcha():
     
     while True:
         try:
-            if is_driver_alive():
-                check_for_captcha()
-            time.sleep(2)  # Verifica a cada 2 segundos
+            # Reciclagem pedida pelo governador; fora do uso compartilhado, que a
+            # impediria. Sem CAPTCHA pendente e com o driver livre, senão fica
+            # para a próxima volta
+            if driver and interactive_browser.recycle_reason and not captcha_visible:
+                if recycle_interactive_browser():
+                    continue
+            
+            with driver_guard.shared():
+                alive = is_driver_alive()
+                polling_network = alive and network_captcha is not None
+                if polling_network:
+                    # Só lê os eventos de rede: a imagem é publicada assim que chega
+                    check_network_captcha()
+                elif alive:
+                    with tracer.span('monitor_tick', 'monitor'):
+                        if SNAPSHOT_RECORDING:
+                            snapshot_recorder.record(driver, check_for_captcha)
+                        else:
+                            check_for_captcha()
+            time.sleep(NETWORK_CAPTCHA_POLL_INTERVAL if polling_network else 2)
         except Exception as e:
             logger.error(f"Erro na thread de monitoramento: {str(e)}")
             time.sleep(5)  # Espera um pouco mais se houver erro
@@ -1340,6 +2065,8 @@ def handle_connect():
     
     client_count += 1
     logger.info(f"Cliente conectado: {request.sid} (Total: {client_count})")
+    if BROWSER_ROOM:
+        join_room(BROWSER_ROOM)
     emit('status_update', {'driver_active': driver is not None})
     
     # Verifica se já existe CAPTCHA
@@ -1353,12 +2080,116 @@ def handle_disconnect():
     
     client_count = max(0, client_count - 1)
     logger.info(f"Cliente desconectado: {request.sid} (Restantes: {client_count})")
+    
+    # Se era um operador, a tarefa com ele volta para a fila
+    captcha_queue.unregister_operator(request.sid)
+    watched_nodes.pop(request.sid, None)
+
+@socketio.on('operator_join')
+def handle_operator_join(data=None):
+    """Registra o cliente como operador disponível na fila de CAPTCHAs."""
+    name = (data or {}).get('name')
+    captcha_queue.register_operator(request.sid, name)
+    emit('captcha_queue_status', captcha_queue.metrics())
+
+@socketio.on('operator_leave')
+def handle_operator_leave():
+    """Retira o cliente da fila de operadores."""
+    captcha_queue.unregister_operator(request.sid)
+    emit('captcha_queue_status', captcha_queue.metrics())
+
+@socketio.on('captcha_solution')
+def handle_captcha_solution(data):
+    """Recebe a resposta digitada por um operador para uma tarefa da fila."""
+    task_id = (data or {}).get('task_id')
+    text = (data or {}).get('text', '').strip()
+    
+    if not task_id or not text:
+        emit('captcha_result', {'task_id': task_id, 'success': False, 'error': 'Tarefa ou texto não fornecido'})
+        return
+    
+    if not captcha_queue.solve(request.sid, task_id, text):
+        emit('captcha_result', {'task_id': task_id, 'success': False, 'error': 'Tarefa não está mais atribuída a você'})
+
+@socketio.on('captcha_skip')
+def handle_captcha_skip(data):
+    """Devolve uma tarefa à fila para que outro operador a resolva."""
+    captcha_queue.skip(request.sid, (data or {}).get('task_id'))
 
 @socketio.on('ping_server')
 def handle_ping():
     """Responde a pings do cliente para manter a conexão viva."""
     emit('pong_response', {'timestamp': time.time()})
 
+@socketio.on('watch_node')
+def handle_watch_node(data):
+    """Passa a acompanhar (tela, CAPTCHA e entrada) o navegador interativo de outro nó do cluster."""
+    if not cluster_node:
+        emit('server_log', {'message': 'Cluster desativado', 'level': 'warning'})
+        return
+    node_id = (data or {}).get('node_id') or CLUSTER_NODE_ID
+    if not cluster_node.owner(global_session_id(node_id, DEFAULT_SESSION_ID)):
+        emit('server_log', {'message': f'Nó {node_id} não tem navegador ativo', 'level': 'warning'})
+        return
+    
+    leave_room(node_room(watched_nodes.get(request.sid, CLUSTER_NODE_ID)))
+    join_room(node_room(node_id))
+    watched_nodes[request.sid] = node_id
+    emit('watching_node', {'node_id': node_id})
+    cluster_node.route(global_session_id(node_id, DEFAULT_SESSION_ID), 'request_screen', {})
+
+@socketio.on('browser_input')
+@driver_guard.uses_driver
+def handle_browser_input(data):
+    """Recebe um lote de eventos de entrada e os despacha no navegador via CDP."""
+    # Cliente acompanhando outro nó: a entrada vai para o nó dono do navegador
+    node_id = watched_nodes.get(request.sid)
+    if cluster_node and node_id and node_id != CLUSTER_NODE_ID:
+        cluster_node.route(global_session_id(node_id, DEFAULT_SESSION_ID), 'browser_input',
+                           {'events': (data or {}).get('events', [])})
+        return
+    
+    if not driver:
+        emit('server_log', {'message': 'Navegador não está inicializado', 'level': 'warning'})
+        return
+    
+    events = (data or {}).get('events', [])
+    if not events:
+        return
+    
+    try:
+        dispatch_input_batch(driver, events)
+    except Exception as e:
+        logger.error(f"Erro ao processar lote de entrada: {str(e)}")
+        emit('server_log', {'message': f'Erro ao processar entrada remota: {str(e)}', 'level': 'error'})
+    
+    # A tela é atualizada de forma assíncrona, sem bloquear o próximo lote
+    screen_streamer.request_update()
+
+@socketio.on('request_screen')
+def handle_request_screen():
+    """Solicita uma atualização da tela do navegador remoto."""
+    node_id = watched_nodes.get(request.sid)
+    if cluster_node and node_id and node_id != CLUSTER_NODE_ID:
+        cluster_node.route(global_session_id(node_id, DEFAULT_SESSION_ID), 'request_screen', {})
+    elif driver:
+        screen_streamer.request_update()
+
+# Comandos de operadores conectados a outros nós, encaminhados pelo cluster
+@driver_guard.uses_driver
+def cluster_browser_input(session_id, data):
+    if session_id == DEFAULT_SESSION_ID and driver:
+        dispatch_input_batch(driver, data.get('events', []))
+        screen_streamer.request_update()
+
+def cluster_request_screen(session_id, data):
+    if session_id == DEFAULT_SESSION_ID and driver:
+        screen_streamer.request_update()
+
+if cluster_node:
+    cluster_node.handle('browser_input', cluster_browser_input)
+    cluster_node.handle('request_screen', cluster_request_screen)
+
 # Inicialização
 if __name__ == '__main__':
     try:
@@ -1366,12 +2197,37 @@ if __name__ == '__main__':
         monitoring_thread = threading.Thread(target=monitor_captcha, daemon=True)
         monitoring_thread.start()
         
+        # Inicia a manutenção da fila de CAPTCHAs (prazos e reatribuições)
+        queue_thread = threading.Thread(target=captcha_queue.run_maintenance, daemon=True)
+        queue_thread.start()
+        
+        # Inicia o observador de downloads
+        download_watcher.start()
+        
+        # Inicia o governador de recursos dos navegadores
+        if governor:
+            governor.start()
+        
+        # Entra no cluster (registro de sessões e fila de CAPTCHAs comum)
+        if cluster_node:
+            cluster_node.start()
+        
+        # Retoma os downloads em lote que estavam inacabados antes do reinício.
+        # Com o recarregador do modo debug este bloco roda também no processo
+        # pai, que não atende requisições; só o processo filho retoma.
+        if serving.is_production() or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            job_scheduler.resume()
+        
         # Inicia o servidor
-        port = 5001
-        logger.info(f"Iniciando servidor na porta {port}")
-        socketio.run(app, host='0.0.0.0', port=port, debug=True, allow_unsafe_werkzeug=True)
+        port = SERVER_PORT
+        logger.info(f"Iniciando servidor na porta {port} ({serving.describe()})")
+        socketio.run(app, host='0.0.0.0', port=port, **serving.server_options(SERVER_WORKERS))
     except KeyboardInterrupt:
         logger.info("Encerrando aplicação por interrupção do teclado")
+        background_jobs.shutdown()
+        job_scheduler.stop()
+        if cluster_node:
+            cluster_node.stop()
         if driver:
             close_driver()
     except Exception as e:
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fila de trabalho de CAPTCHAs para operadores humanos.
+
+Cada CAPTCHA detectado em uma sessão do navegador vira uma tarefa com
+identificador da sessão, imagem e prazo. As tarefas são distribuídas ao
+próximo operador livre, com reatribuição quando o operador não responde e
+expiração quando o prazo do CAPTCHA termina. A resolução é sempre feita por
+uma pessoa; esta fila apenas organiza quem vê qual CAPTCHA e quando.
+
+Com vários nós (cluster.py), a função claim decide se uma tarefa pode ser
+atribuída aqui: uma tarefa reivindicada por outro nó fica de fora da
+distribuição local até ser resolvida lá (solve_remote) ou expirar. A reserva
+pode ser uma ida ao Redis, então é feita fora da trava da fila: _dispatch()
+deixa de lado as tarefas ainda não reservadas e _notify(), já sem a trava,
+as reserva (uma vez por tarefa) e distribui de novo.
+"""
+
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import deque
+
+from metrics import registry
+
+logger = logging.getLogger('captcha_queue')
+
+CAPTCHAS_DETECTED = registry.counter('captchas_detected_total', 'CAPTCHAs detectados por sessão', ('session',))
+CAPTCHAS_SOLVED = registry.counter('captchas_solved_total', 'CAPTCHAs respondidos por sessão e origem da resposta',
+                                   ('session', 'via'))
+
+# Estados de uma tarefa
+TASK_PENDING = 'pendente'
+TASK_ASSIGNED = 'atribuida'
+TASK_SOLVED = 'resolvida'
+TASK_EXPIRED = 'expirada'
+TASK_CANCELLED = 'cancelada'
+
+# Tamanho da janela usada para as métricas de latência
+LATENCY_WINDOW = 500
+
+
+def percentile(values, fraction):
+    """Calcula um percentil simples (vizinho mais próximo) de uma lista de valores."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class CaptchaTask:
+    """Um CAPTCHA aguardando resolução por um operador humano."""
+
+    def __init__(self, session_id, image, ttl, on_solution=None, on_expired=None, claim_key=None):
+        self.task_id = uuid.uuid4().hex
+        # Chave disputada entre os nós; a cópia de uma tarefa de outro nó usa a da original
+        self.claim_key = claim_key or self.task_id
+        self.session_id = session_id
+        self.image = image
+        self.image_hash = hashlib.sha1(image.encode('utf-8')).hexdigest() if image else None
+        self.created_at = time.time()
+        # Entrada na fila (criação ou última devolução), base da latência de espera
+        self.queued_at = self.created_at
+        self.deadline = self.created_at + ttl
+        self.on_solution = on_solution
+        self.on_expired = on_expired
+        self.status = TASK_PENDING
+        # Resultado da reserva entre nós: None (ainda não pedida), True ou False
+        self.claimed = None
+        self.operator_id = None
+        self.assigned_at = None
+        self.attempts = 0
+        self.excluded_operators = set()
+
+    def to_dict(self, include_image=True):
+        """Representação enviada aos operadores."""
+        data = {
+            'task_id': self.task_id,
+            'session_id': self.session_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'deadline': self.deadline,
+            'remaining': max(0.0, self.deadline - time.time()),
+            'attempts': self.attempts,
+        }
+        if include_image:
+            data['image'] = self.image
+        return data
+
+
+class CaptchaQueue:
+    """
+    Distribui tarefas de CAPTCHA entre operadores conectados.
+
+    Justiça: as tarefas são atendidas em ordem de chegada (reatribuídas voltam
+    para o início) e os operadores livres são escolhidos pelo que está há mais
+    tempo sem receber tarefa. Cada sessão tem no máximo uma tarefa aberta; uma
+    nova detecção na mesma sessão apenas atualiza a imagem.
+    """
+
+    def __init__(self, emit_to_operator, assignment_timeout=30, task_ttl=120):
+        """
+        Args:
+            emit_to_operator: Função (operator_id, evento, dados) para notificar um operador
+            assignment_timeout: Segundos que um operador tem para responder antes da reatribuição
+            task_ttl: Validade padrão de um CAPTCHA, em segundos
+        """
+        self.emit_to_operator = emit_to_operator
+        self.assignment_timeout = assignment_timeout
+        self.task_ttl = task_ttl
+        # Função (tarefa) -> bool que reserva a tarefa para este nó (ver cluster.py)
+        self.claim = None
+
+        self._lock = threading.RLock()
+        self._pending = deque()
+        self._tasks = {}
+        self._session_tasks = {}
+        self._free_operators = deque()
+        self._operators = {}
+        self._claiming = set()  # Tarefas com reserva em andamento em outra thread
+
+        self._wait_latencies = deque(maxlen=LATENCY_WINDOW)
+        self._solve_latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {'submitted': 0, 'solved': 0, 'expired': 0, 'reassigned': 0, 'cancelled': 0}
+
+    # Operadores
+
+    def register_operator(self, operator_id, name=None):
+        """Registra um operador como disponível para receber tarefas."""
+        notifications = []
+        with self._lock:
+            if operator_id not in self._operators:
+                self._operators[operator_id] = {
+                    'name': name or operator_id[:8],
+                    'task_id': None,
+                    'joined_at': time.time(),
+                    'solved': 0,
+                    'timeouts': 0,
+                }
+                self._free_operators.append(operator_id)
+                logger.info(f"Operador registrado: {operator_id} (Total: {len(self._operators)})")
+            notifications = self._dispatch()
+        self._notify(notifications)
+
+    def unregister_operator(self, operator_id):
+        """Remove um operador; a tarefa que estava com ele volta para a fila."""
+        notifications = []
+        with self._lock:
+            operator = self._operators.pop(operator_id, None)
+            if not operator:
+                return
+            if operator_id in self._free_operators:
+                self._free_operators.remove(operator_id)
+
+            task = self._tasks.get(operator['task_id'])
+            if task and task.status == TASK_ASSIGNED:
+                self._requeue(task)
+            logger.info(f"Operador removido: {operator_id} (Restantes: {len(self._operators)})")
+            notifications = self._dispatch()
+        self._notify(notifications)
+
+    # Tarefas
+
+    def submit(self, session_id, image, ttl=None, on_solution=None, on_expired=None, claim_key=None):
+        """
+        Registra um CAPTCHA detectado em uma sessão.
+
+        Args:
+            session_id: Identificador da sessão do navegador
+            image: Imagem do CAPTCHA (data URL)
+            ttl: Validade em segundos (padrão: task_ttl)
+            on_solution: Função (tarefa, texto) chamada com a resposta do operador
+            on_expired: Função (tarefa) chamada se o prazo terminar sem resposta
+            claim_key: Chave de reserva entre nós (tarefas recebidas de outro nó)
+
+        Returns:
+            CaptchaTask: Tarefa nova ou a tarefa já aberta da sessão
+        """
+        notifications = []
+        with self._lock:
+            task = self._tasks.get(self._session_tasks.get(session_id))
+
+            if task and task.status in (TASK_PENDING, TASK_ASSIGNED):
+                # Mesma sessão: atualiza a imagem se o CAPTCHA mudou
+                image_hash = hashlib.sha1(image.encode('utf-8')).hexdigest() if image else None
+                if image_hash != task.image_hash:
+                    task.image = image
+                    task.image_hash = image_hash
+                    if task.status == TASK_ASSIGNED:
+                        notifications.append((task.operator_id, 'captcha_task', task.to_dict()))
+                if on_solution:
+                    task.on_solution = on_solution
+                if on_expired:
+                    task.on_expired = on_expired
+            else:
+                task = CaptchaTask(session_id, image, ttl or self.task_ttl, on_solution, on_expired, claim_key)
+                self._tasks[task.task_id] = task
+                self._session_tasks[session_id] = task.task_id
+                self._pending.append(task.task_id)
+                self._counters['submitted'] += 1
+                CAPTCHAS_DETECTED.inc(session=session_id)
+                logger.info(f"Tarefa de CAPTCHA {task.task_id} criada para a sessão {session_id}")
+
+            notifications.extend(self._dispatch())
+        self._notify(notifications)
+        return task
+
+    def solve(self, operator_id, task_id, text):
+        """
+        Entrega a resposta digitada por um operador.
+
+        Returns:
+            bool: True se a resposta foi aceita e repassada à sessão
+        """
+        notifications = []
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task.status != TASK_ASSIGNED or task.operator_id != operator_id:
+                logger.warning(f"Resposta ignorada para a tarefa {task_id}: não está atribuída a {operator_id}")
+                return False
+
+            now = time.time()
+            task.status = TASK_SOLVED
+            self._solve_latencies.append(now - task.assigned_at)
+            self._counters['solved'] += 1
+            CAPTCHAS_SOLVED.inc(session=task.session_id, via='operador')
+            self._close(task)
+
+            operator = self._operators.get(operator_id)
+            if operator:
+                operator['task_id'] = None
+                operator['solved'] += 1
+                self._free_operators.append(operator_id)
+            notifications = self._dispatch()
+
+        # O callback faz chamadas ao navegador; roda fora da trava
+        if task.on_solution:
+            try:
+                task.on_solution(task, text)
+            except Exception as e:
+                logger.error(f"Erro ao repassar resposta da tarefa {task_id}: {str(e)}")
+        self._notify(notifications)
+        return True
+
+    def solve_remote(self, task_id, text):
+        """
+        Entrega a resposta dada por um operador de outro nó a uma tarefa deste.
+
+        Returns:
+            bool: True se a tarefa ainda estava aberta
+        """
+        notifications = []
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task.status not in (TASK_PENDING, TASK_ASSIGNED):
+                return False
+            if task.status == TASK_ASSIGNED:
+                notifications.append((task.operator_id, 'captcha_task_cancelled', task.to_dict(include_image=False)))
+                self._release_operator(task.operator_id)
+            task.status = TASK_SOLVED
+            self._counters['solved'] += 1
+            CAPTCHAS_SOLVED.inc(session=task.session_id, via='outro_no')
+            self._close(task)
+            notifications.extend(self._dispatch())
+
+        if task.on_solution:
+            try:
+                task.on_solution(task, text)
+            except Exception as e:
+                logger.error(f"Erro ao repassar resposta da tarefa {task_id}: {str(e)}")
+        self._notify(notifications)
+        return True
+
+    def waiting_tasks(self, min_age):
+        """Tarefas pendentes há pelo menos min_age segundos, sem operador livre neste nó."""
+        with self._lock:
+            if self._free_operators:
+                return []
+            now = time.time()
+            return [self._tasks[task_id] for task_id in self._pending
+                    if task_id in self._tasks and now - self._tasks[task_id].created_at >= min_age
+                    and self._tasks[task_id].status == TASK_PENDING]
+
+    def open_task_ids(self):
+        """Identificadores das tarefas pendentes ou atribuídas."""
+        with self._lock:
+            return set(self._tasks)
+
+    def free_operator_count(self):
+        with self._lock:
+            return len(self._free_operators)
+
+    def skip(self, operator_id, task_id):
+        """Devolve uma tarefa à fila para que outro operador a resolva."""
+        notifications = []
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task.status != TASK_ASSIGNED or task.operator_id != operator_id:
+                return False
+            task.excluded_operators.add(operator_id)
+            self._requeue(task)
+            operator = self._operators.get(operator_id)
+            if operator:
+                operator['task_id'] = None
+                self._free_operators.append(operator_id)
+            notifications = self._dispatch()
+        self._notify(notifications)
+        return True
+
+    def cancel_session(self, session_id):
+        """Cancela a tarefa aberta de uma sessão (resolvida por outro caminho ou sessão encerrada)."""
+        notifications = []
+        with self._lock:
+            task = self._tasks.get(self._session_tasks.get(session_id))
+            if not task or task.status not in (TASK_PENDING, TASK_ASSIGNED):
+                return False
+
+            if task.status == TASK_ASSIGNED:
+                notifications.append((task.operator_id, 'captcha_task_cancelled', task.to_dict(include_image=False)))
+                self._release_operator(task.operator_id)
+            task.status = TASK_CANCELLED
+            self._counters['cancelled'] += 1
+            self._close(task)
+            notifications.extend(self._dispatch())
+        self._notify(notifications)
+        return True
+
+    def tick(self):
+        """Expira tarefas vencidas e reatribui as que ficaram sem resposta."""
+        notifications = []
+        expired = []
+        with self._lock:
+            now = time.time()
+            for task in list(self._tasks.values()):
+                if task.status not in (TASK_PENDING, TASK_ASSIGNED):
+                    continue
+
+                if now >= task.deadline:
+                    if task.status == TASK_ASSIGNED:
+                        notifications.append((task.operator_id, 'captcha_task_cancelled', task.to_dict(include_image=False)))
+                        self._release_operator(task.operator_id)
+                    task.status = TASK_EXPIRED
+                    self._counters['expired'] += 1
+                    self._close(task)
+                    expired.append(task)
+                    logger.warning(f"Tarefa de CAPTCHA {task.task_id} expirou sem resposta")
+                elif task.status == TASK_ASSIGNED and now - task.assigned_at >= self.assignment_timeout:
+                    operator_id = task.operator_id
+                    notifications.append((operator_id, 'captcha_task_cancelled', task.to_dict(include_image=False)))
+                    task.excluded_operators.add(operator_id)
+                    self._requeue(task)
+                    operator = self._operators.get(operator_id)
+                    if operator:
+                        operator['task_id'] = None
+                        operator['timeouts'] += 1
+                        # Operador que não respondeu vai para o fim da fila de livres
+                        self._free_operators.append(operator_id)
+                    logger.warning(f"Operador {operator_id} não respondeu à tarefa {task.task_id}, reatribuindo")
+
+            notifications.extend(self._dispatch())
+
+        for task in expired:
+            if task.on_expired:
+                try:
+                    task.on_expired(task)
+                except Exception as e:
+                    logger.error(f"Erro ao tratar expiração da tarefa {task.task_id}: {str(e)}")
+        self._notify(notifications)
+
+    def run_maintenance(self, interval=1.0):
+        """Laço de manutenção para rodar em uma thread dedicada."""
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Erro na manutenção da fila de CAPTCHA: {str(e)}")
+            time.sleep(interval)
+
+    def metrics(self):
+        """Profundidade da fila, ocupação dos operadores e latências."""
+        with self._lock:
+            wait = list(self._wait_latencies)
+            solve = list(self._solve_latencies)
+            assigned = sum(1 for op in self._operators.values() if op['task_id'])
+            return {
+                'queue_depth': len(self._pending),
+                'assigned': assigned,
+                'operators': len(self._operators),
+                'operators_free': len(self._free_operators),
+                'wait_avg': sum(wait) / len(wait) if wait else None,
+                'wait_p95': percentile(wait, 0.95),
+                'solve_avg': sum(solve) / len(solve) if solve else None,
+                'solve_p95': percentile(solve, 0.95),
+                'counters': dict(self._counters),
+            }
+
+    # Auxiliares (chamados com a trava adquirida)
+
+    def _requeue(self, task):
+        task.status = TASK_PENDING
+        task.operator_id = None
+        task.assigned_at = None
+        task.queued_at = time.time()
+        self._pending.appendleft(task.task_id)
+        self._counters['reassigned'] += 1
+
+    def _close(self, task):
+        if self._session_tasks.get(task.session_id) == task.task_id:
+            del self._session_tasks[task.session_id]
+        self._tasks.pop(task.task_id, None)
+        if task.task_id in self._pending:
+            self._pending.remove(task.task_id)
+
+    def _release_operator(self, operator_id):
+        operator = self._operators.get(operator_id)
+        if operator:
+            operator['task_id'] = None
+            if operator_id not in self._free_operators:
+                self._free_operators.append(operator_id)
+
+    def _dispatch(self):
+        """Atribui tarefas pendentes aos operadores livres; retorna as notificações."""
+        notifications = []
+        now = time.time()
+        skipped = []
+
+        while self._pending and self._free_operators:
+            task = self._tasks.get(self._pending.popleft())
+            if not task or task.status != TASK_PENDING or now >= task.deadline:
+                continue
+
+            # Sem reserva deste nó (ainda não pedida, ou feita por outro nó): fica
+            # pendente aqui; a reserva é pedida por _notify(), fora da trava
+            if self.claim and task.claimed is not True:
+                skipped.append(task.task_id)
+                continue
+
+            # Evita devolver a tarefa a quem já a recusou, se houver outra pessoa livre
+            candidates = [op for op in self._free_operators if op not in task.excluded_operators]
+            if not candidates:
+                # Operadores conectados que não recusaram a tarefa (os que saíram
+                # não contam) e estão ocupados com outra: aguarda um deles ficar livre
+                others = set(self._operators) - task.excluded_operators
+                if any(self._operators[op]['task_id'] for op in others):
+                    skipped.append(task.task_id)
+                    continue
+                task.excluded_operators.clear()
+                candidates = list(self._free_operators)
+
+            operator_id = candidates[0]
+            self._free_operators.remove(operator_id)
+
+            task.status = TASK_ASSIGNED
+            task.operator_id = operator_id
+            task.assigned_at = now
+            task.attempts += 1
+            self._operators[operator_id]['task_id'] = task.task_id
+            self._wait_latencies.append(now - task.queued_at)
+            notifications.append((operator_id, 'captcha_task', task.to_dict()))
+
+        self._pending.extendleft(reversed(skipped))
+        return notifications
+
+    def _notify(self, notifications):
+        """Envia as notificações e reserva as tarefas à espera de reserva (chamado sem a trava)."""
+        self._emit(notifications)
+        if self.claim:
+            self._claim_pending()
+
+    def _emit(self, notifications):
+        for operator_id, event, data in notifications:
+            try:
+                self.emit_to_operator(operator_id, event, data)
+            except Exception as e:
+                logger.error(f"Erro ao notificar operador {operator_id}: {str(e)}")
+
+    def _claim_pending(self):
+        """
+        Reserva as próximas tarefas pendentes, uma por operador livre, e as distribui.
+
+        A reserva (claim) é chamada sem a trava: um Redis lento ou fora do ar
+        atrasa só esta thread, e não o envio de respostas e a distribuição dos
+        outros operadores. Se a reserva falhar, a tarefa continua sem reserva
+        e é tentada de novo na próxima distribuição.
+        """
+        claim = self.claim
+        while claim:
+            with self._lock:
+                unclaimed = [self._tasks[task_id] for task_id in self._pending
+                             if task_id in self._tasks and task_id not in self._claiming
+                             and self._tasks[task_id].claimed is None]
+                tasks = unclaimed[:len(self._free_operators)]
+                self._claiming.update(task.task_id for task in tasks)
+            if not tasks:
+                return
+
+            results = []
+            try:
+                for task in tasks:
+                    try:
+                        results.append((task, bool(claim(task))))
+                    except Exception as e:
+                        logger.error(f"Erro ao reservar tarefa {task.task_id}: {str(e)}")
+                        break
+            finally:
+                with self._lock:
+                    self._claiming.difference_update(task.task_id for task in tasks)
+
+            with self._lock:
+                for task, claimed in results:
+                    if task.claimed is None:
+                        task.claimed = claimed
+                notifications = self._dispatch()
+            self._emit(notifications)
+            if len(results) < len(tasks):
+                return
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Leitura dos eventos do Chrome DevTools Protocol pelo log de desempenho.
+
+O Selenium não entrega eventos CDP diretamente; com a capacidade
+"goog:loggingPrefs" = {'performance': 'ALL'}, o ChromeDriver guarda os
+eventos Network.* e Page.* no log "performance". Ler esse log o esvazia,
+então cada driver deve ter um único CdpEventPump que distribui os eventos
+para quem se inscreveu.
+"""
+
+import json
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger('cdp_events')
+
+PERFORMANCE_LOG_CAPABILITY = 'goog:loggingPrefs'
+
+
+def enable_performance_log(chrome_options):
+    """Ativa o log de desempenho (eventos CDP) nas opções do Chrome."""
+    chrome_options.set_capability(PERFORMANCE_LOG_CAPABILITY, {'performance': 'ALL'})
+    return chrome_options
+
+
+class CdpEventPump:
+    """Distribui os eventos CDP de um driver para os inscritos, por nome de método."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, method, handler):
+        """
+        Inscreve uma função para um evento CDP.
+
+        Args:
+            method: Nome do evento (ex.: 'Network.responseReceived')
+            handler: Função (params) chamada a cada evento
+        """
+        with self._lock:
+            self._handlers[method].append(handler)
+
+    def unsubscribe(self, method, handler):
+        """Cancela a inscrição de uma função."""
+        with self._lock:
+            if handler in self._handlers.get(method, []):
+                self._handlers[method].remove(handler)
+
+    def poll(self):
+        """
+        Lê os eventos acumulados desde a última leitura e os distribui.
+
+        Returns:
+            int: Quantidade de eventos lidos
+        """
+        with self._lock:
+            try:
+                entries = self.driver.get_log('performance')
+            except Exception as e:
+                logger.warning(f"Erro ao ler log de desempenho: {str(e)}")
+                return 0
+            handlers = {method: list(callbacks) for method, callbacks in self._handlers.items() if callbacks}
+
+        for entry in entries:
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+
+            for handler in handlers.get(message.get('method'), []):
+                try:
+                    handler(message.get('params', {}))
+                except Exception as e:
+                    logger.error(f"Erro ao tratar evento {message.get('method')}: {str(e)}")
+
+        return len(entries)
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Vários nós do espelho de CAPTCHA atrás de um barramento compartilhado.
+
+Um processo do captcha_mirror controla quantos Chromes a máquina comporta.
+Com CLUSTER_REDIS_URL, vários nós compartilham um Redis, que é usado para:
+
+- a difusão dos eventos socket.io entre nós (message_queue do Flask-SocketIO),
+  de modo que um cliente conectado a qualquer nó receba os eventos de todos;
+- o registro de sessões: cada nó publica suas sessões de navegador com o
+  identificador global "<nó>/<sessão>", e os comandos de um operador para
+  uma sessão (entrada no navegador, atualização da tela) são encaminhados ao
+  nó dono do navegador pelo canal desse nó;
+- a fila de CAPTCHAs: uma tarefa que espera sem operador livre no seu nó é
+  oferecida aos demais; o nó que tiver operador livre a reivindica (SET NX),
+  atende com uma cópia local e devolve a resposta ao nó de origem, que a
+  repassa ao navegador.
+
+LocalBus implementa em memória o subconjunto de comandos do Redis usado aqui
+(pub/sub, hashes, SET NX, listas), para testar vários nós em um processo sem
+servidor Redis. RedisBus usa o pacote redis, que é opcional.
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+
+from metrics import registry
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger('cluster')
+
+CLUSTER_NODES = registry.gauge('cluster_nodes', 'Nós ativos no cluster')
+CLUSTER_CAPTCHAS = registry.counter('cluster_captchas_total', 'Tarefas de CAPTCHA trocadas entre nós', ('direction',))
+CLUSTER_COMMANDS = registry.counter('cluster_commands_total', 'Comandos de operador encaminhados a outro nó',
+                                    ('command',))
+
+# Chaves e canais no barramento
+NODES_KEY = 'captcha_mirror:nodes'
+SESSIONS_KEY = 'captcha_mirror:sessions'
+CAPTCHA_OFFERS_KEY = 'captcha_mirror:captchas'
+CLAIM_PREFIX = 'captcha_mirror:claim:'
+CHANNEL_PREFIX = 'captcha_mirror:node:'
+
+# Tempo limite de conexão e de cada comando ao Redis, em segundos
+REDIS_TIMEOUT = 2.0
+
+# Tipos de mensagem entre nós
+MSG_COMMAND = 'comando'
+MSG_CAPTCHA_SOLUTION = 'captcha_resposta'
+MSG_CAPTCHA_CANCELLED = 'captcha_cancelada'
+
+
+def global_session_id(node_id, session_id):
+    return f"{node_id}/{session_id}"
+
+
+def split_session_id(global_id):
+    """Separa "<nó>/<sessão>" em (nó, sessão)."""
+    node_id, _, session_id = global_id.partition('/')
+    return node_id, session_id
+
+
+def is_available():
+    """Indica se o pacote redis está instalado."""
+    return redis is not None
+
+
+class LocalBus:
+    """Barramento em memória com a mesma interface de RedisBus (um só processo)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._expires = {}
+        self._hashes = defaultdict(dict)
+        self._lists = defaultdict(deque)
+        self._subscribers = defaultdict(list)
+
+    def publish(self, channel, message):
+        with self._lock:
+            handlers = list(self._subscribers.get(channel, ()))
+        payload = json.dumps(message)
+        for handler in handlers:
+            # Entrega assíncrona, como no Redis
+            threading.Thread(target=handler, args=(json.loads(payload),), daemon=True).start()
+        return len(handlers)
+
+    def subscribe(self, channel, handler):
+        with self._lock:
+            self._subscribers[channel].append(handler)
+
+    def close(self):
+        with self._lock:
+            self._subscribers.clear()
+
+    def hset(self, key, field, value):
+        with self._lock:
+            self._hashes[key][field] = value
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._hashes[key].get(field)
+
+    def hdel(self, key, field):
+        with self._lock:
+            self._hashes[key].pop(field, None)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hashes[key])
+
+    def set_nx(self, key, value, ttl):
+        with self._lock:
+            self._expire(key)
+            if key in self._values:
+                return False
+            self._values[key] = value
+            self._expires[key] = time.time() + ttl
+            return True
+
+    def get(self, key):
+        with self._lock:
+            self._expire(key)
+            return self._values.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+
+    def rpush(self, key, value):
+        with self._lock:
+            self._lists[key].append(value)
+
+    def lpop(self, key):
+        with self._lock:
+            items = self._lists[key]
+            return items.popleft() if items else None
+
+    def _expire(self, key):
+        if key in self._expires and self._expires[key] <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+
+
+class RedisBus:
+    """Barramento sobre um servidor Redis (requer o pacote redis)."""
+
+    def __init__(self, url, timeout=REDIS_TIMEOUT):
+        """
+        Args:
+            url: Endereço do Redis (redis://...)
+            timeout: Tempo limite de conexão e de cada comando, em segundos; a
+                reserva de CAPTCHAs é feita a cada distribuição e não pode
+                prender a fila se o Redis ficar lento ou fora do ar
+        """
+        if redis is None:
+            raise RuntimeError("Pacote redis não instalado (pip install redis)")
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=timeout,
+                                           socket_connect_timeout=timeout)
+        # A assinatura espera mensagens indefinidamente e usa uma conexão sem tempo limite
+        self._pubsub = redis.Redis.from_url(url, decode_responses=True).pubsub(ignore_subscribe_messages=True)
+        self._listener = None
+
+    def publish(self, channel, message):
+        return self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel, handler):
+        def on_message(message):
+            try:
+                handler(json.loads(message['data']))
+            except Exception as e:
+                logger.error(f"Erro ao tratar mensagem do canal {channel}: {str(e)}")
+
+        self._pubsub.subscribe(**{channel: on_message})
+        if not self._listener:
+            self._listener = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+        self._pubsub.close()
+
+    def hset(self, key, field, value):
+        self.client.hset(key, field, value)
+
+    def hget(self, key, field):
+        return self.client.hget(key, field)
+
+    def hdel(self, key, field):
+        self.client.hdel(key, field)
+
+    def hgetall(self, key):
+        return self.client.hgetall(key)
+
+    def set_nx(self, key, value, ttl):
+        return bool(self.client.set(key, value, nx=True, ex=max(1, int(ttl))))
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def rpush(self, key, value):
+        self.client.rpush(key, value)
+
+    def lpop(self, key):
+        return self.client.lpop(key)
+
+
+class ClusterNode:
+    """Um nó do cluster: registro de sessões, roteamento de comandos e fila de CAPTCHAs compartilhada."""
+
+    def __init__(self, node_id, bus, captcha_queue, sessions=None, interval=2.0, node_ttl=15.0, offer_after=5.0):
+        """
+        Args:
+            node_id: Identificador único do nó
+            bus: LocalBus ou RedisBus
+            captcha_queue: CaptchaQueue local
+            sessions: Função sem argumentos que retorna os ids das sessões locais
+            interval: Intervalo entre batimentos (registro, ofertas e coleta de CAPTCHAs)
+            node_ttl: Tempo sem batimento após o qual um nó é dado como inativo
+            offer_after: Espera sem operador livre antes de oferecer uma tarefa aos outros nós
+        """
+        self.node_id = node_id
+        self.bus = bus
+        self.captcha_queue = captcha_queue
+        self.sessions_fn = sessions or (lambda: [])
+        self.interval = interval
+        self.node_ttl = node_ttl
+        self.offer_after = offer_after
+
+        self._handlers = {}
+        # _offered e _counters mudam na thread dos batimentos, na do pub/sub e
+        # nas rotas; só são acessados com _lock (nunca durante pedidos ao bus)
+        self._lock = threading.Lock()
+        self._offered = {}  # task_id -> sessão local da tarefa oferecida
+        self._registered = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {'offered': 0, 'claimed_remote': 0, 'solved_remote': 0, 'commands_sent': 0,
+                          'commands_received': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @property
+    def channel(self):
+        return CHANNEL_PREFIX + self.node_id
+
+    def start(self):
+        """Entra no cluster: assina o canal do nó e inicia os batimentos."""
+        self.captcha_queue.claim = self.claim
+        self.bus.subscribe(self.channel, self._on_message)
+        self._stop.clear()
+        self.tick()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='cluster-node')
+        self._thread.start()
+        logger.info(f"Nó {self.node_id} entrou no cluster")
+
+    def stop(self):
+        """Sai do cluster e remove o nó e suas sessões do registro."""
+        self._stop.set()
+        self.captcha_queue.claim = None
+        for key in self._registered:
+            self.bus.hdel(SESSIONS_KEY, key)
+        self._registered.clear()
+        self.bus.hdel(NODES_KEY, self.node_id)
+        self.bus.close()
+
+    # Registro de sessões e roteamento
+
+    def handle(self, command, handler):
+        """Registra a função (sessão local, dados) que executa um comando neste nó."""
+        self._handlers[command] = handler
+
+    def nodes(self):
+        """Nós registrados e se estão ativos."""
+        now = time.time()
+        nodes = []
+        for node_id, last_seen in self.bus.hgetall(NODES_KEY).items():
+            last_seen = float(last_seen)
+            nodes.append({'node_id': node_id, 'last_seen': last_seen, 'alive': now - last_seen <= self.node_ttl})
+        return sorted(nodes, key=lambda node: node['node_id'])
+
+    def sessions(self):
+        """Sessões de todos os nós ativos."""
+        alive = {node['node_id'] for node in self.nodes() if node['alive']}
+        sessions = []
+        for key, value in self.bus.hgetall(SESSIONS_KEY).items():
+            entry = json.loads(value)
+            if entry['node_id'] in alive:
+                sessions.append(dict(entry, id=key))
+        return sorted(sessions, key=lambda entry: entry['id'])
+
+    def owner(self, global_id):
+        """Nó ativo dono de uma sessão ("<nó>/<sessão>"), ou None."""
+        value = self.bus.hget(SESSIONS_KEY, global_id)
+        if not value:
+            return None
+        node_id = json.loads(value)['node_id']
+        last_seen = self.bus.hget(NODES_KEY, node_id)
+        if not last_seen or time.time() - float(last_seen) > self.node_ttl:
+            return None
+        return node_id
+
+    def route(self, global_id, command, data):
+        """
+        Executa um comando de operador no nó dono da sessão.
+
+        Returns:
+            bool: True se o comando foi executado aqui ou enviado ao dono
+        """
+        node_id, session_id = split_session_id(global_id)
+        if node_id == self.node_id:
+            return self._execute(command, session_id, data)
+
+        owner = self.owner(global_id)
+        if not owner:
+            logger.warning(f"Comando {command} para {global_id} descartado: sessão sem nó ativo")
+            return False
+        self.bus.publish(CHANNEL_PREFIX + owner, {'type': MSG_COMMAND, 'command': command,
+                                                  'session_id': session_id, 'data': data})
+        self._count('commands_sent')
+        CLUSTER_COMMANDS.inc(command=command)
+        return True
+
+    def _execute(self, command, session_id, data):
+        handler = self._handlers.get(command)
+        if not handler:
+            logger.warning(f"Comando desconhecido no nó {self.node_id}: {command}")
+            return False
+        try:
+            handler(session_id, data)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao executar comando {command} na sessão {session_id}: {str(e)}")
+            return False
+
+    # Fila de CAPTCHAs compartilhada
+
+    def claim(self, task):
+        """Reserva a tarefa para este nó; False se outro nó já a reservou."""
+        key = CLAIM_PREFIX + task.claim_key
+        if self.bus.set_nx(key, self.node_id, max(1.0, task.deadline - time.time()) + self.interval):
+            return True
+        return self.bus.get(key) == self.node_id
+
+    def _offer_waiting_tasks(self):
+        for task in self.captcha_queue.waiting_tasks(self.offer_after):
+            # Cópias de tarefas de outros nós não são oferecidas de novo
+            if task.claim_key != task.task_id:
+                continue
+            with self._lock:
+                if task.task_id in self._offered:
+                    continue
+                self._offered[task.task_id] = task.session_id
+            self.bus.rpush(CAPTCHA_OFFERS_KEY, json.dumps({
+                'task_id': task.task_id,
+                'node_id': self.node_id,
+                'session_id': task.session_id,
+                'image': task.image,
+                'deadline': task.deadline,
+            }))
+            self._count('offered')
+            CLUSTER_CAPTCHAS.inc(direction='oferecida')
+            logger.info(f"Tarefa de CAPTCHA {task.task_id} oferecida aos outros nós")
+
+    def _take_offered_tasks(self):
+        """Atende tarefas oferecidas por outros nós enquanto houver operador livre aqui."""
+        skipped = []
+        while self.captcha_queue.free_operator_count() > 0:
+            raw = self.bus.lpop(CAPTCHA_OFFERS_KEY)
+            if not raw:
+                break
+            offer = json.loads(raw)
+            remaining = offer['deadline'] - time.time()
+            if remaining <= 0:
+                continue
+            if offer['node_id'] == self.node_id:
+                # Oferta deste nó: volta para a lista para os outros
+                skipped.append(raw)
+                continue
+            key = CLAIM_PREFIX + offer['task_id']
+            if not self.bus.set_nx(key, self.node_id, remaining + self.interval):
+                continue
+
+            origin = offer['node_id']
+            task_id = offer['task_id']
+
+            def on_solution(task, text, origin=origin, task_id=task_id):
+                self.bus.publish(CHANNEL_PREFIX + origin, {'type': MSG_CAPTCHA_SOLUTION, 'task_id': task_id,
+                                                           'text': text, 'node_id': self.node_id})
+                self._count('solved_remote')
+
+            self.captcha_queue.submit(global_session_id(origin, offer['session_id']), offer['image'],
+                                      ttl=remaining, on_solution=on_solution, claim_key=task_id)
+            self._count('claimed_remote')
+            CLUSTER_CAPTCHAS.inc(direction='recebida')
+            logger.info(f"Tarefa de CAPTCHA {task_id} do nó {origin} atendida neste nó")
+
+        for raw in skipped:
+            self.bus.rpush(CAPTCHA_OFFERS_KEY, raw)
+
+    def _forget_closed_offers(self):
+        """Avisa o nó que reivindicou uma tarefa oferecida que ela foi encerrada aqui."""
+        open_ids = self.captcha_queue.open_task_ids()
+        with self._lock:
+            closed = [(task_id, session_id) for task_id, session_id in self._offered.items()
+                      if task_id not in open_ids]
+            for task_id, _ in closed:
+                del self._offered[task_id]
+
+        for task_id, session_id in closed:
+            key = CLAIM_PREFIX + task_id
+            holder = self.bus.get(key)
+            if holder and holder != self.node_id:
+                self.bus.publish(CHANNEL_PREFIX + holder, {'type': MSG_CAPTCHA_CANCELLED,
+                                                           'session_id': global_session_id(self.node_id, session_id)})
+            self.bus.delete(key)
+
+    # Batimentos e mensagens
+
+    def tick(self):
+        """Registra o nó e as sessões, oferece e atende tarefas de CAPTCHA."""
+        now = time.time()
+        self.bus.hset(NODES_KEY, self.node_id, str(now))
+
+        current = set()
+        for session_id in self.sessions_fn():
+            key = global_session_id(self.node_id, session_id)
+            current.add(key)
+            self.bus.hset(SESSIONS_KEY, key, json.dumps({'node_id': self.node_id, 'session_id': session_id,
+                                                         'updated_at': now}))
+        for key in self._registered - current:
+            self.bus.hdel(SESSIONS_KEY, key)
+        self._registered = current
+
+        self._forget_closed_offers()
+        self._offer_waiting_tasks()
+        self._take_offered_tasks()
+        CLUSTER_NODES.set(sum(1 for node in self.nodes() if node['alive']))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Erro no batimento do nó {self.node_id}: {str(e)}")
+
+    def _on_message(self, message):
+        kind = message.get('type')
+        if kind == MSG_COMMAND:
+            self._count('commands_received')
+            self._execute(message['command'], message['session_id'], message.get('data'))
+        elif kind == MSG_CAPTCHA_SOLUTION:
+            if self.captcha_queue.solve_remote(message['task_id'], message['text']):
+                logger.info(f"Resposta da tarefa {message['task_id']} recebida do nó {message['node_id']}")
+            with self._lock:
+                self._offered.pop(message['task_id'], None)
+        elif kind == MSG_CAPTCHA_CANCELLED:
+            self.captcha_queue.cancel_session(message['session_id'])
+
+    def status(self):
+        with self._lock:
+            offered_pending = len(self._offered)
+            counters = dict(self._counters)
+        return {
+            'node_id': self.node_id,
+            'nodes': self.nodes(),
+            'sessions': self.sessions(),
+            'offered_pending': offered_pending,
+            'counters': counters,
+        }
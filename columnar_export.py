@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Exportação colunar (GeoParquet) dos shapefiles baixados.
+
+Cada download validado vira um arquivo Parquet novo dentro da partição do
+seu estado e município (uf=MT/municipio=5100250/...), com a geometria em
+WKB e os metadados "geo" do GeoParquet. O conjunto de dados só cresce: nada
+é reescrito, e um manifesto em JSON Lines registra cada parte gravada. Para
+ler apenas as colunas e partições necessárias:
+
+    pyarrow.dataset.dataset(EXPORT_DIR, format='parquet', partitioning='hive')
+        .to_table(columns=['car_code', 'num_area'], filter=ds.field('uf') == 'MT')
+
+Depende de pyarrow, que é opcional: sem ele a exportação fica desativada.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from shapefile_reader import to_wkb, WKB_TYPES, WKB_NAMES
+from shapefile_catalog import feature_car_code
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger('columnar_export')
+
+GEOPARQUET_VERSION = '1.0.0'
+MANIFEST_NAME = '_manifest.jsonl'
+
+# SIRGAS 2000, o sistema de referência dos shapefiles do SICAR (PROJJSON resumido)
+SIRGAS_2000_CRS = {
+    'type': 'GeographicCRS',
+    'name': 'SIRGAS 2000',
+    'id': {'authority': 'EPSG', 'code': 4674},
+}
+
+
+# Campos do .dbf do SICAR exportados como colunas próprias: nome -> (tipo Python, tipo Arrow)
+SICAR_COLUMNS = {
+    'num_area': (float, 'float64'),
+    'num_modulo': (float, 'float64'),
+    'cod_estado': (str, 'string'),
+    'nom_munici': (str, 'string'),
+    'tipo_imovel': (str, 'string'),
+    'situacao': (str, 'string'),
+    'condicao_i': (str, 'string'),
+}
+
+
+def attribute_value(attributes, name):
+    """Valor de um atributo do .dbf, sem diferenciar maiúsculas."""
+    if name in attributes:
+        return attributes[name]
+    return next((value for field, value in attributes.items() if field.lower() == name), None)
+
+
+def coerce(value, kind):
+    """Converte um atributo para o tipo da coluna (None se não for possível)."""
+    if value is None or value == '':
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_available():
+    """Indica se o pyarrow está instalado."""
+    return pa is not None
+
+
+def partition_for(car_code):
+    """
+    Extrai estado e município (código IBGE) de um código do CAR.
+
+    O código tem o formato UF-CODIGOIBGE-HASH (ex.: MT-5100250-0A1B...); para
+    trabalhos de município o valor é UF/Nome.
+    """
+    text = str(car_code or '')
+    if '/' in text:
+        uf, _, municipality = text.partition('/')
+        return uf.strip().upper() or 'desconhecido', municipality.strip() or 'desconhecido'
+
+    parts = text.split('-')
+    if len(parts) >= 2 and len(parts[0]) == 2 and parts[1].isdigit():
+        return parts[0].upper(), parts[1]
+    return 'desconhecido', 'desconhecido'
+
+
+def crs_from_prj(prj):
+    """CRS do GeoParquet a partir do .prj (None quando desconhecido)."""
+    if prj and 'SIRGAS' in prj.upper() and '2000' in prj:
+        return SIRGAS_2000_CRS
+    return None
+
+
+class ColumnarExporter:
+    """Acrescenta os downloads validados a um conjunto de dados GeoParquet particionado."""
+
+    def __init__(self, root, compression='zstd'):
+        """
+        Args:
+            root: Diretório raiz do conjunto de dados
+            compression: Compressão das partes Parquet
+        """
+        self.root = str(root)
+        self.compression = compression
+        self.manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._exported = set()
+
+        if not is_available():
+            logger.warning("pyarrow não instalado; exportação GeoParquet desativada")
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as manifest:
+                for line in manifest:
+                    if line.strip():
+                        self._exported.add(json.loads(line)['sha256'])
+
+    def export(self, key, report, sha256, fetched_at=None):
+        """
+        Grava as feições de um zip validado como novas partes do conjunto.
+
+        Args:
+            key: Código do CAR (ou UF/Município) do download
+            report: Resultado de inspect_shapefile(path, with_geometry=True)
+            sha256: Hash do zip; um zip já exportado não é gravado de novo
+            fetched_at: Momento do download (padrão: agora)
+
+        Returns:
+            list: Caminhos das partes gravadas
+        """
+        if not is_available():
+            return []
+
+        with self._lock:
+            if sha256 in self._exported:
+                return []
+
+        fetched_at = fetched_at or time.time()
+        rows_by_partition = {}
+        for layer in report['layers']:
+            for feature in layer['features']:
+                car_code = feature_car_code(feature['attributes']) or key
+                rows_by_partition.setdefault(partition_for(car_code), []).append((layer, feature, car_code))
+
+        written = []
+        for (uf, municipality), rows in sorted(rows_by_partition.items()):
+            directory = os.path.join(self.root, f"uf={uf}", f"municipio={municipality}")
+            os.makedirs(directory, exist_ok=True)
+            name = f"part-{int(fetched_at * 1000)}-{sha256[:12]}.parquet"
+            path = os.path.join(directory, name)
+            temporary = os.path.join(directory, f".{name}.tmp")
+
+            table = self._build_table(rows, key, sha256, fetched_at, report)
+            # Grava em arquivo oculto e renomeia: leitores nunca veem uma parte incompleta
+            pq.write_table(table, temporary, compression=self.compression)
+            os.replace(temporary, path)
+            written.append(path)
+
+        with self._lock:
+            with open(self.manifest_path, 'a', encoding='utf-8') as manifest:
+                manifest.write(json.dumps({
+                    'key': key,
+                    'sha256': sha256,
+                    'fetched_at': fetched_at,
+                    'parts': [os.path.relpath(path, self.root) for path in written],
+                }) + '\n')
+            self._exported.add(sha256)
+
+        logger.info(f"{key} exportado em {len(written)} partes GeoParquet")
+        return written
+
+    def stats(self):
+        """Quantidade de downloads exportados."""
+        return {'available': is_available(), 'root': self.root, 'exported': len(self._exported)}
+
+    def _build_table(self, rows, key, sha256, fetched_at, report):
+        geometries = []
+        geometry_types = set()
+        bounds = [float('inf'), float('inf'), float('-inf'), float('-inf')]
+        columns = {name: [] for name in ('key', 'car_code', 'layer', 'record', 'sha256', 'fetched_at',
+                                         'min_x', 'min_y', 'max_x', 'max_y', 'attributes')}
+
+        for layer, feature, car_code in rows:
+            base_type, parts = feature.get('geometry') or (None, [])
+            geometries.append(to_wkb(base_type, parts) if parts else None)
+            if parts:
+                geometry_types.add(WKB_NAMES[WKB_TYPES[base_type]])
+
+            min_x, min_y, max_x, max_y = feature['bbox']
+            bounds = [min(bounds[0], min_x), min(bounds[1], min_y), max(bounds[2], max_x), max(bounds[3], max_y)]
+            for name, value in (('key', key), ('car_code', car_code), ('layer', layer['name']),
+                                ('record', feature['record']), ('sha256', sha256), ('fetched_at', fetched_at),
+                                ('min_x', min_x), ('min_y', min_y), ('max_x', max_x), ('max_y', max_y),
+                                ('attributes', json.dumps(feature['attributes'], ensure_ascii=False))):
+                columns[name].append(value)
+
+        arrays = {name: pa.array(values) for name, values in columns.items()}
+
+        # Atributos conhecidos do SICAR viram colunas tipadas, presentes em todas as
+        # partes para que o esquema do conjunto não varie entre downloads
+        for name, (kind, type_name) in SICAR_COLUMNS.items():
+            values = [coerce(attribute_value(feature['attributes'], name), kind) for _, feature, _ in rows]
+            arrays[name] = pa.array(values, type=getattr(pa, type_name)())
+        arrays['geometry'] = pa.array(geometries, type=pa.binary())
+
+        prj = next((layer['prj'] for layer in report['layers'] if layer.get('prj')), None)
+        geo = {
+            'version': GEOPARQUET_VERSION,
+            'primary_column': 'geometry',
+            'columns': {
+                'geometry': {
+                    'encoding': 'WKB',
+                    'geometry_types': sorted(geometry_types),
+                    'crs': crs_from_prj(prj),
+                    'bbox': bounds,
+                },
+            },
+        }
+        table = pa.table(arrays)
+        return table.replace_schema_metadata({b'geo': json.dumps(geo).encode('utf-8')})
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Download direto do shapefile após a resolução humana do CAPTCHA.
+
+Depois que o operador envia o CAPTCHA, o pedido de download feito pelo
+Chrome (URL, cabeçalhos e cookies da sessão) é capturado pelos eventos CDP e
+o arquivo é baixado por um cliente HTTP com pool de conexões, gravando em
+blocos no disco, retomando com requisições Range em caso de queda e
+verificando o checksum. O navegador fica livre para o próximo imóvel
+enquanto arquivos grandes são transferidos em paralelo.
+
+O diretório de destino deve ficar fora do diretório observado pelo
+DownloadWatcher: a conclusão é informada por on_done, e o arquivo é movido
+para o armazenamento logo em seguida.
+"""
+
+import os
+import re
+import time
+import base64
+import binascii
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+
+import politeness
+
+logger = logging.getLogger('direct_download')
+
+# Cabeçalhos do Chrome que não devem ser repetidos pelo cliente HTTP
+SKIPPED_HEADERS = {'host', 'content-length', 'connection', 'accept-encoding', 'cookie', 'range', 'if-range'}
+
+# Tipos de conteúdo que indicam página de erro em vez do arquivo
+ERROR_CONTENT_TYPES = ('text/html', 'application/json')
+
+# Tamanho de cada digest, em bytes
+DIGEST_SIZES = {'md5': 16, 'sha256': 32}
+
+
+def filename_from_response(response, url, suggested=None):
+    """Determina o nome do arquivo pelo Content-Disposition, pelo nome sugerido ou pela URL."""
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+    if not match:
+        match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+
+    name = unquote(match.group(1).strip()) if match else (suggested or os.path.basename(urlparse(url).path))
+    name = os.path.basename(name.replace('\\', '/')) or 'shapefile.zip'
+    return name
+
+
+def decode_digest(algorithm, value):
+    """
+    Converte um digest anunciado (base64 ou hexadecimal) para hexadecimal.
+
+    Returns:
+        str: Digest em hexadecimal, ou None se o valor não é um digest válido do algoritmo
+    """
+    size = DIGEST_SIZES[algorithm]
+    value = value.strip()
+    if re.fullmatch(r'[0-9a-fA-F]+', value) and len(value) == size * 2:
+        return value.lower()
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == size else None
+
+
+def expected_checksums(headers):
+    """
+    Extrai checksums anunciados pelo servidor (Content-MD5, Digest, Repr-Digest).
+
+    Valores malformados são ignorados: o arquivo só deixa de ser verificado
+    por aquele algoritmo, em vez de o download falhar.
+    """
+    announced = [('md5', headers.get('Content-MD5', ''))]
+    for header in ('Digest', 'Repr-Digest'):
+        for part in headers.get(header, '').split(','):
+            algorithm, _, value = part.strip().partition('=')
+            announced.append((algorithm.lower().replace('-', ''), value.strip().strip(':')))
+
+    checksums = {}
+    for algorithm, value in announced:
+        if algorithm not in DIGEST_SIZES or not value:
+            continue
+        digest = decode_digest(algorithm, value)
+        if digest:
+            checksums[algorithm] = digest
+        else:
+            logger.warning(f"Checksum {algorithm} malformado ignorado: {value[:80]}")
+    return checksums
+
+
+class DownloadCapture:
+    """
+    Registra os pedidos de rede de um driver para reconstruir o pedido de download.
+
+    Usa Network.requestWillBeSent para guardar método, cabeçalhos e corpo de
+    cada pedido e Page.downloadWillBegin para saber qual deles virou download.
+    """
+
+    def __init__(self, pump):
+        self.pump = pump
+        self._requests = {}
+        self._downloads = []
+        self._lock = threading.Lock()
+        pump.subscribe('Network.requestWillBeSent', self._on_request)
+        pump.subscribe('Page.downloadWillBegin', self._on_download)
+
+    def reset(self):
+        """Descarta eventos acumulados (ex.: da navegação até o botão de download)."""
+        self.pump.poll()
+        with self._lock:
+            self._requests.clear()
+            self._downloads.clear()
+
+    def wait(self, timeout=30):
+        """
+        Aguarda o Chrome iniciar um download e retorna o pedido correspondente.
+
+        Returns:
+            dict: {'url', 'method', 'headers', 'body', 'guid', 'filename'} ou None
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.pump.poll()
+            with self._lock:
+                if self._downloads:
+                    download = self._downloads.pop(0)
+                    request = self._requests.get(download['url'], {})
+                    return {
+                        'url': download['url'],
+                        'guid': download.get('guid'),
+                        'filename': download.get('suggestedFilename'),
+                        'method': request.get('method', 'GET'),
+                        'headers': request.get('headers', {}),
+                        'body': request.get('postData'),
+                    }
+            time.sleep(0.2)
+        return None
+
+    def _on_request(self, params):
+        request = params.get('request', {})
+        with self._lock:
+            self._requests[request.get('url')] = request
+            # Mantém apenas os pedidos mais recentes
+            if len(self._requests) > 500:
+                self._requests.pop(next(iter(self._requests)))
+
+    def _on_download(self, params):
+        with self._lock:
+            self._downloads.append(params)
+
+
+class DirectDownloader:
+    """Baixa arquivos com um pool de conexões HTTP, em paralelo ao navegador."""
+
+    def __init__(self, max_workers=4, pool_maxsize=8, chunk_size=256 * 1024, max_retries=5):
+        """
+        Args:
+            max_workers: Downloads simultâneos
+            pool_maxsize: Conexões mantidas por host
+            chunk_size: Tamanho dos blocos gravados no disco
+            max_retries: Retomadas permitidas após queda da conexão
+        """
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.http = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=pool_maxsize,
+            block=True,
+            retries=False,
+            timeout=urllib3.Timeout(connect=15, read=60),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='direct-download')
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def build_request(self, driver, capture):
+        """Completa o pedido capturado com os cookies da sessão para a URL."""
+        headers = {name: value for name, value in capture['headers'].items()
+                   if name.lower() not in SKIPPED_HEADERS and not name.startswith(':')}
+
+        cookies = driver.execute_cdp_cmd('Network.getCookies', {'urls': [capture['url']]}).get('cookies', [])
+        if cookies:
+            headers['Cookie'] = '; '.join(f"{cookie['name']}={cookie['value']}" for cookie in cookies)
+
+        return dict(capture, headers=headers)
+
+    def start(self, driver, capture, dest_dir, on_done, on_started=None):
+        """
+        Abre a conexão do download direto e, se o servidor responder com o
+        arquivo, cancela o download do Chrome e continua a transferência em
+        segundo plano.
+
+        Args:
+            driver: Instância do WebDriver da sessão
+            capture: Pedido retornado por DownloadCapture.wait()
+            dest_dir: Diretório de destino do arquivo
+            on_done: Função (info, erro) chamada ao final; info tem path, size e sha256
+            on_started: Função (path) opcional chamada com o caminho final do arquivo
+                antes de a transferência começar
+
+        Returns:
+            bool: True se a transferência direta foi iniciada; False mantém o download do Chrome
+        """
+        try:
+            request = self.build_request(driver, capture)
+            response = self._open(request)
+        except Exception as e:
+            logger.warning(f"Download direto indisponível, mantendo download do Chrome: {str(e)}")
+            return False
+
+        content_type = response.headers.get('Content-Type', '').lower()
+        if response.status not in (200, 206) or content_type.startswith(ERROR_CONTENT_TYPES):
+            logger.warning(f"Resposta inesperada no download direto ({response.status}, {content_type}), mantendo Chrome")
+            response.release_conn()
+            return False
+
+        # O servidor respondeu com o arquivo: o Chrome não precisa mais baixá-lo
+        if capture.get('guid'):
+            try:
+                driver.execute_cdp_cmd('Browser.cancelDownload', {'guid': capture['guid']})
+            except Exception as e:
+                logger.warning(f"Não foi possível cancelar o download do Chrome: {str(e)}")
+
+        os.makedirs(dest_dir, exist_ok=True)
+        path = os.path.join(str(dest_dir), filename_from_response(response, request['url'], capture.get('filename')))
+        if on_started:
+            on_started(path)
+        self.executor.submit(self._transfer, request, response, path, on_done)
+        return True
+
+    def active(self):
+        """Downloads diretos em andamento: caminho -> bytes recebidos."""
+        with self._lock:
+            return dict(self._active)
+
+    def shutdown(self, wait=True):
+        """
+        Para de aceitar downloads.
+
+        Args:
+            wait: Aguarda os downloads em andamento e então libera as conexões; sem
+                wait, descarta os que ainda não começaram e mantém as conexões dos
+                que estão transferindo
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        if wait:
+            self.http.clear()
+
+    def _open(self, request, offset=0, validator=None):
+        headers = dict(request['headers'])
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+            if validator:
+                headers['If-Range'] = validator
+        with politeness.scheduler.slot(request['url'], politeness.KIND_DOWNLOAD) as slot:
+            try:
+                response = self.http.request(
+                    request['method'],
+                    request['url'],
+                    body=request.get('body'),
+                    headers=headers,
+                    preload_content=False,
+                    redirect=True,
+                )
+            except urllib3.exceptions.HTTPError:
+                # Conexão recusada, timeout ou resposta inválida do servidor
+                slot.error()
+                raise
+            if response.status in politeness.ERROR_STATUSES:
+                slot.error()
+            return response
+
+    def _transfer(self, request, response, path, on_done):
+        partial_path = path + '.part'
+        started_at = time.time()
+        accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        checksums = {}
+        received = 0
+        retries = 0
+
+        try:
+            # Dentro do try: qualquer erro aqui ainda chega a on_done
+            checksums = expected_checksums(response.headers)
+            with open(partial_path, 'wb') as output:
+                while True:
+                    try:
+                        for chunk in response.stream(self.chunk_size):
+                            output.write(chunk)
+                            received += len(chunk)
+                            with self._lock:
+                                self._active[path] = received
+                        response.release_conn()
+                        break
+                    except (urllib3.exceptions.HTTPError, OSError) as e:
+                        response.release_conn()
+                        retries += 1
+                        if retries > self.max_retries:
+                            raise
+                        logger.warning(f"Conexão interrompida em {received} bytes ({str(e)}), retomando")
+                        time.sleep(min(2 ** retries, 30))
+
+                        response = self._open(request, received if accepts_ranges else 0, validator)
+                        if response.status == 206:
+                            continue
+                        if response.status != 200:
+                            raise ValueError(f"Resposta {response.status} ao retomar o download")
+                        # O servidor não retomou: recomeça do início
+                        output.seek(0)
+                        output.truncate()
+                        received = 0
+
+            sha256, md5 = self._hash_file(partial_path)
+            actual = {'sha256': sha256, 'md5': md5}
+            for algorithm, expected in checksums.items():
+                if actual[algorithm] != expected:
+                    raise ValueError(f"Checksum {algorithm} não confere (esperado {expected}, obtido {actual[algorithm]})")
+
+            # A renomeação final é o que o observador de downloads enxerga
+            os.replace(partial_path, path)
+            info = {
+                'path': path,
+                'size': received,
+                'sha256': sha256,
+                'checksum_verified': bool(checksums),
+                'duration': time.time() - started_at,
+                'retries': retries,
+            }
+            logger.info(f"Download direto concluído: {path} ({received} bytes)")
+            on_done(info, None)
+        except Exception as e:
+            logger.error(f"Erro no download direto de {request['url']}: {str(e)}")
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            on_done(None, str(e))
+        finally:
+            with self._lock:
+                self._active.pop(path, None)
+
+    def _hash_file(self, path):
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                sha256.update(block)
+                md5.update(block)
+        return sha256.hexdigest(), md5.hexdigest()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gravação de snapshots do DOM das páginas visitadas pelo espelho.
+
+Cada snapshot guarda o HTML da página (e dos iframes), a URL, o título, um
+screenshot e o resultado da detecção ao vivo. Os snapshots formam o corpus
+usado por offline_detection.py para avaliar as estratégias de detecção sem
+navegador. O rótulo (há ou não CAPTCHA na página) é atribuído depois, por
+uma pessoa olhando o screenshot, e fica em labels.jsonl.
+
+Estrutura do diretório:
+    index.jsonl          metadados, um snapshot por linha
+    labels.jsonl         rótulos, o último de cada snapshot prevalece
+    <id>.html.gz         HTML da página e dos iframes (JSON comprimido)
+    <id>.png             screenshot
+"""
+
+import os
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from selenium.webdriver.common.by import By
+
+logger = logging.getLogger('dom_snapshots')
+
+INDEX_NAME = 'index.jsonl'
+LABELS_NAME = 'labels.jsonl'
+DEFAULT_MAX_SNAPSHOTS = 5000
+
+
+def read_jsonl(path):
+    """Linhas de um arquivo JSON Lines (lista vazia se não existir)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as lines:
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class SnapshotRecorder:
+    """Grava snapshots do DOM, ignorando páginas que não mudaram desde o último."""
+
+    def __init__(self, directory, max_snapshots=DEFAULT_MAX_SNAPSHOTS, screenshots=True):
+        """
+        Args:
+            directory: Diretório do corpus
+            max_snapshots: Limite de snapshots; ao atingi-lo a gravação para
+            screenshots: Guarda também o screenshot de cada snapshot
+        """
+        self.directory = str(directory)
+        self.max_snapshots = max_snapshots
+        self.screenshots = screenshots
+        self._lock = threading.Lock()
+        self._last_hash = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._count = len(read_jsonl(os.path.join(self.directory, INDEX_NAME)))
+
+    def record(self, driver, detect=None, label=None, source='monitor'):
+        """
+        Captura a página atual e, se informada, executa a detecção ao vivo.
+
+        O DOM é capturado antes da detecção, que destaca elementos na página.
+
+        Args:
+            driver: WebDriver na página a gravar
+            detect: Função sem argumentos que detecta o CAPTCHA (ex.: check_for_captcha)
+            label: Rótulo conhecido (True/False), se houver
+            source: Origem do snapshot ('monitor', 'manual'...)
+
+        Returns:
+            tuple: (resultado de detect ou None, id do snapshot ou None se não gravado)
+        """
+        snapshot = None
+        try:
+            snapshot = self._capture(driver)
+        except Exception as e:
+            logger.warning(f"Erro ao capturar snapshot do DOM: {str(e)}")
+
+        detected = detect() if detect else None
+        if snapshot is None:
+            return detected, None
+
+        snapshot_id = self._save(snapshot, detected, label, source)
+        return detected, snapshot_id
+
+    def label(self, snapshot_id, has_captcha, note=None):
+        """Registra o rótulo verdadeiro de um snapshot."""
+        with self._lock:
+            with open(os.path.join(self.directory, LABELS_NAME), 'a', encoding='utf-8') as labels:
+                labels.write(json.dumps({'id': snapshot_id, 'captcha': bool(has_captcha), 'note': note,
+                                         'labeled_at': time.time()}) + '\n')
+
+    def stats(self):
+        """Quantidade de snapshots e de rótulos."""
+        labels = {entry['id'] for entry in read_jsonl(os.path.join(self.directory, LABELS_NAME))}
+        return {'directory': self.directory, 'snapshots': self._count, 'labeled': len(labels),
+                'max_snapshots': self.max_snapshots}
+
+    def _capture(self, driver):
+        if self._count >= self.max_snapshots:
+            return None
+
+        html = driver.page_source
+        digest = hashlib.sha1(html.encode('utf-8')).hexdigest()
+        if digest == self._last_hash:
+            return None
+
+        frames = []
+        for index, frame in enumerate(driver.find_elements(By.TAG_NAME, 'iframe')):
+            try:
+                driver.switch_to.frame(frame)
+                frames.append({'index': index, 'url': driver.execute_script('return document.URL;'),
+                               'html': driver.page_source})
+            except Exception as e:
+                frames.append({'index': index, 'error': str(e)})
+            finally:
+                driver.switch_to.default_content()
+
+        return {
+            'hash': digest,
+            'url': driver.current_url,
+            'title': driver.title,
+            'html': html,
+            'frames': frames,
+            'screenshot': driver.get_screenshot_as_png() if self.screenshots else None,
+        }
+
+    def _save(self, snapshot, detected, label, source):
+        snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        base = os.path.join(self.directory, snapshot_id)
+
+        with gzip.open(base + '.html.gz', 'wt', encoding='utf-8') as output:
+            json.dump({'html': snapshot['html'], 'frames': snapshot['frames']}, output)
+        if snapshot['screenshot']:
+            with open(base + '.png', 'wb') as output:
+                output.write(snapshot['screenshot'])
+
+        with self._lock:
+            with open(os.path.join(self.directory, INDEX_NAME), 'a', encoding='utf-8') as index:
+                index.write(json.dumps({
+                    'id': snapshot_id,
+                    'url': snapshot['url'],
+                    'title': snapshot['title'],
+                    'hash': snapshot['hash'],
+                    'captured_at': time.time(),
+                    'source': source,
+                    'live_detected': detected,
+                    'frames': len(snapshot['frames']),
+                }) + '\n')
+            self._count += 1
+            self._last_hash = snapshot['hash']
+
+        if label is not None:
+            self.label(snapshot_id, label)
+        return snapshot_id
+
+
+def load_corpus(directory, labeled_only=False):
+    """
+    Carrega os metadados do corpus com os rótulos aplicados.
+
+    Returns:
+        list: Dicionários do index.jsonl com 'label' (True, False ou None)
+    """
+    labels = {}
+    for entry in read_jsonl(os.path.join(str(directory), LABELS_NAME)):
+        labels[entry['id']] = entry['captcha']
+
+    corpus = []
+    for entry in read_jsonl(os.path.join(str(directory), INDEX_NAME)):
+        entry['label'] = labels.get(entry['id'])
+        if labeled_only and entry['label'] is None:
+            continue
+        corpus.append(entry)
+    return corpus
+
+
+def load_snapshot_html(directory, snapshot_id):
+    """HTML da página e dos iframes de um snapshot: {'html', 'frames'}."""
+    with gzip.open(os.path.join(str(directory), f"{snapshot_id}.html.gz"), 'rt', encoding='utf-8') as source:
+        return json.load(source)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Observação do diretório de downloads do Chrome.
+
+Usa inotify (Linux) para acompanhar os arquivos parciais ".crdownload" até o
+arquivo final aparecer; em outros sistemas, ou se o inotify não estiver
+disponível, faz varreduras periódicas. Cada download concluído é atribuído à
+sessão dona do subdiretório em que caiu (o diretório raiz pertence à sessão
+interativa) e informado com tamanho e duração.
+"""
+
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+logger = logging.getLogger('download_watcher')
+
+# Sufixos de arquivos ainda em download
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+
+# Constantes do inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_partial(name):
+    """Indica se o nome é de um arquivo ainda em download."""
+    return name.endswith(PARTIAL_SUFFIXES) or name.startswith('.com.google.Chrome')
+
+
+class DownloadWatcher:
+    """
+    Acompanha downloads em um diretório e em seus subdiretórios de sessão.
+
+    Para cada download concluído chama on_complete com um dicionário contendo
+    sessão, caminho, tamanho, início, fim e duração.
+    """
+
+    def __init__(self, root, on_complete, on_started=None, root_session_id='principal', poll_interval=1.0):
+        """
+        Args:
+            root: Diretório de downloads observado
+            on_complete: Função (info) chamada quando um arquivo termina de baixar
+            on_started: Função (info) opcional chamada quando um download começa
+            root_session_id: Sessão dona de arquivos gravados diretamente na raiz
+            poll_interval: Intervalo da varredura quando não há inotify
+        """
+        self.root = os.path.abspath(str(root))
+        self.on_complete = on_complete
+        self.on_started = on_started
+        self.root_session_id = root_session_id
+        self.poll_interval = poll_interval
+
+        self.mode = None
+        self._pending = {}  # arquivo parcial -> início do download em andamento
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # API pública
+
+    def start(self):
+        """Inicia a observação em uma thread dedicada."""
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='download-watcher')
+        self._thread.start()
+
+    def stop(self):
+        """Interrompe a observação."""
+        self._stop.set()
+
+    def session_for(self, path):
+        """Retorna a sessão dona de um caminho dentro do diretório observado."""
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(path)), self.root)
+        if relative in ('.', ''):
+            return self.root_session_id
+        return relative.split(os.sep)[0]
+
+    # Registro de eventos (comum ao inotify e à varredura)
+
+    def _partial_seen(self, directory, name):
+        path = os.path.join(directory, name)
+        with self._lock:
+            if path in self._pending:
+                return
+            # O Chrome renomeia o parcial ("Unconfirmed 123.crdownload" ->
+            # "imovel.zip.crdownload"): é o mesmo download, que já foi anunciado
+            renamed_at = self._take_renamed(directory)
+            started_at = renamed_at or time.time()
+            self._pending[path] = started_at
+        if renamed_at:
+            return
+
+        info = {
+            'session_id': self.session_for(path),
+            'file': name,
+            'started_at': started_at,
+        }
+        logger.info(f"Download iniciado na sessão {info['session_id']}: {name}")
+        if self.on_started:
+            self._call(self.on_started, info)
+
+    def _completed(self, directory, name):
+        path = os.path.join(directory, name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+
+        finished_at = time.time()
+        with self._lock:
+            started_at = None
+            for suffix in PARTIAL_SUFFIXES:
+                started_at = self._pending.pop(path + suffix, None)
+                if started_at is not None:
+                    break
+            if started_at is None:
+                # Parcial com nome sem relação com o final (ex.: "Unconfirmed 123.crdownload")
+                started_at = self._take_renamed(directory)
+        if started_at is None:
+            # O arquivo chegou sem parcial observado (ex.: download muito pequeno)
+            try:
+                started_at = min(os.path.getctime(path), finished_at)
+            except OSError:
+                started_at = finished_at
+
+        info = {
+            'session_id': self.session_for(path),
+            'path': path,
+            'file': name,
+            'size': size,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'duration': finished_at - started_at,
+        }
+        logger.info(f"Download concluído na sessão {info['session_id']}: {name} ({size} bytes, {info['duration']:.1f}s)")
+        self._call(self.on_complete, info)
+
+    def _take_renamed(self, directory):
+        """
+        Retira o parcial mais antigo do diretório que já não existe no disco
+        (renomeado); retorna o início dele ou None. Chamado com a trava.
+        """
+        gone = [(started_at, path) for path, started_at in self._pending.items()
+                if os.path.dirname(path) == directory and not os.path.exists(path)]
+        if not gone:
+            return None
+        started_at, path = min(gone)
+        del self._pending[path]
+        return started_at
+
+    def _call(self, callback, info):
+        try:
+            callback(info)
+        except Exception as e:
+            logger.error(f"Erro ao tratar evento de download: {str(e)}")
+
+    # Execução
+
+    def _run(self):
+        fd = self._init_inotify()
+        if fd is not None:
+            self.mode = 'inotify'
+            try:
+                self._run_inotify(fd)
+            finally:
+                os.close(fd)
+        else:
+            self.mode = 'varredura'
+            self._run_polling()
+
+    def _init_inotify(self):
+        if not hasattr(select, 'select') or not os.path.isdir('/proc'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1')
+            self._libc = libc
+            self._watches = {}
+            self._add_watch_tree(fd, self.root)
+            logger.info(f"Observando {self.root} com inotify")
+            return fd
+        except Exception as e:
+            logger.warning(f"inotify indisponível, usando varredura periódica: {str(e)}")
+            return None
+
+    def _add_watch_tree(self, fd, directory):
+        for current, dirnames, _ in os.walk(directory):
+            wd = self._libc.inotify_add_watch(fd, current.encode(), WATCH_MASK)
+            if wd < 0:
+                logger.warning(f"Não foi possível observar {current}")
+                continue
+            self._watches[wd] = current
+
+    def _run_inotify(self, fd):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if not readable:
+                continue
+
+            buffer = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                raw_name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length]
+                offset += EVENT_HEADER.size + length
+
+                directory = self._watches.get(wd)
+                name = raw_name.rstrip(b'\0').decode('utf-8', errors='replace')
+                if not directory or not name:
+                    continue
+
+                if mask & IN_ISDIR:
+                    # Diretório de uma nova sessão
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_watch_tree(fd, os.path.join(directory, name))
+                    continue
+
+                if is_partial(name):
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._partial_seen(directory, name)
+                    elif mask & IN_DELETE:
+                        # Download cancelado: o parcial foi apagado sem virar arquivo final
+                        with self._lock:
+                            self._pending.pop(os.path.join(directory, name), None)
+                elif mask & IN_MOVED_TO:
+                    # O Chrome renomeia o parcial para o nome final ao terminar
+                    self._completed(directory, name)
+                elif mask & IN_CLOSE_WRITE:
+                    self._completed(directory, name)
+
+    def _scan(self):
+        files = {}
+        for current, _, filenames in os.walk(self.root):
+            for name in filenames:
+                try:
+                    files[(current, name)] = os.path.getsize(os.path.join(current, name))
+                except OSError:
+                    continue
+        return files
+
+    def _run_polling(self):
+        logger.info(f"Observando {self.root} por varredura a cada {self.poll_interval}s")
+        known = self._scan()
+        candidates = {}
+
+        while not self._stop.wait(self.poll_interval):
+            current = self._scan()
+            for (directory, name), size in current.items():
+                if (directory, name) in known:
+                    continue
+                if is_partial(name):
+                    self._partial_seen(directory, name)
+                    continue
+                # Só conclui quando o tamanho se mantém entre duas varreduras
+                if candidates.get((directory, name)) == size:
+                    candidates.pop((directory, name))
+                    self._completed(directory, name)
+                else:
+                    candidates[(directory, name)] = size
+            known = {key: size for key, size in current.items()
+                     if key not in candidates and not is_partial(key[1])}
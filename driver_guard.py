@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Controle de acesso ao driver do navegador interativo.
+
+Rotas, eventos socket.io, o monitor de CAPTCHA, a transmissão de tela e as
+tarefas em segundo plano usam o mesmo driver ao mesmo tempo; isso continua
+permitido (uso compartilhado). Trocar o driver (iniciar, parar ou reciclar
+o navegador) exige acesso exclusivo: espera os usos em andamento
+terminarem e impede novos usos enquanto o driver é trocado, para que
+ninguém receba uma sessão morta ou ainda em construção.
+
+Ambos são reentrantes na mesma thread, e quem tem o acesso exclusivo também
+pode usar o driver normalmente (ex.: tirar um screenshot após reiniciá-lo).
+"""
+
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+
+class DriverGuard:
+    """Uso compartilhado do driver e acesso exclusivo para substituí-lo."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._holders = {}  # thread -> usos compartilhados em aberto
+        self._owner = None
+        self._owner_depth = 0
+        self._exclusive_waiting = 0
+
+    @contextmanager
+    def shared(self):
+        """Bloco que usa o driver; aguarda se ele estiver sendo substituído."""
+        me = threading.get_ident()
+        with self._cond:
+            # Quem já usa o driver (ou é o dono exclusivo) não espera: evita impasse
+            if me not in self._holders and self._owner != me:
+                while self._owner is not None or self._exclusive_waiting:
+                    self._cond.wait()
+            self._holders[me] = self._holders.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._holders[me] -= 1
+                if not self._holders[me]:
+                    del self._holders[me]
+                self._cond.notify_all()
+
+    def uses_driver(self, function):
+        """Decorador: a função inteira é um uso compartilhado do driver."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.shared():
+                return function(*args, **kwargs)
+        return wrapper
+
+    def replaces_driver(self, function):
+        """Decorador: a função inteira tem acesso exclusivo, esperando o quanto for preciso."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.exclusive():
+                return function(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def exclusive(self, timeout=None):
+        """
+        Bloco que substitui o driver.
+
+        Args:
+            timeout: Espera máxima pelos usos em andamento; None espera o quanto for preciso
+
+        Yields:
+            bool: True se o acesso exclusivo foi obtido; False se o tempo acabou
+        """
+        acquired = self._acquire_exclusive(timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._release_exclusive()
+
+    def _acquire_exclusive(self, timeout):
+        me = threading.get_ident()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._owner == me:
+                self._owner_depth += 1
+                return True
+
+            self._exclusive_waiting += 1
+            try:
+                # Os usos da própria thread não contam: ela mesma está pedindo a troca
+                while self._owner is not None or any(holder != me for holder in self._holders):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._owner = me
+                self._owner_depth = 1
+                return True
+            finally:
+                self._exclusive_waiting -= 1
+                self._cond.notify_all()
+
+    def _release_exclusive(self):
+        with self._cond:
+            self._owner_depth -= 1
+            if not self._owner_depth:
+                self._owner = None
+                self._cond.notify_all()
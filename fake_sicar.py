@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SICAR simulado para testes e benchmarks locais.
+
+Reproduz o caminho percorrido pelo captcha_mirror e pelo pool de sessões:
+busca do imóvel em /publico/imoveis/index, botão btnDownloadShapefileUC,
+janela com a imagem do CAPTCHA e download do shapefile (um zip válido,
+gerado na hora). A resposta de cada CAPTCHA é fornecida pela bancada de
+teste (parâmetro answer), que também pode consultá-la em
+/__bancada/captcha/<token>.
+
+Variantes da página (parâmetro ?variante= ou padrão do servidor):
+    normal   tudo imediato
+    lento    busca, imagem do CAPTCHA e download respondem com atraso
+    tardio   o painel do imóvel e o botão entram no DOM depois de um tempo
+    iframe   o CAPTCHA fica dentro de um iframe
+
+Uso isolado:
+    python fake_sicar.py --port 5055
+    SICAR_BASE_URL=http://127.0.0.1:5055 python captcha_mirror.py
+"""
+
+import io
+import math
+import time
+import uuid
+import struct
+import random
+import logging
+import zipfile
+import argparse
+import threading
+import hashlib
+from datetime import date
+
+from flask import Flask, render_template, request, jsonify, Response, abort
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger('fake_sicar')
+
+VARIANTS = ('normal', 'lento', 'tardio', 'iframe')
+DEFAULT_ANSWER = 'SICAR1'
+
+PRJ_SIRGAS_2000 = ('GEOGCS["GCS_SIRGAS_2000",DATUM["D_SIRGAS_2000",SPHEROID["GRS_1980",6378137.0,298.257222101]],'
+                   'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+
+# Geração do shapefile
+
+def property_ring(car_code, vertices=64):
+    """Anel (sentido horário, fechado) de um imóvel fictício, determinístico pelo código."""
+    seed = int(hashlib.sha1(car_code.encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    center_x = -56.0 + rng.uniform(-2, 2)
+    center_y = -12.0 + rng.uniform(-2, 2)
+    radius = rng.uniform(0.005, 0.02)
+
+    ring = []
+    for index in range(vertices):
+        # Ângulo decrescente: sentido horário, como o anel externo do shapefile
+        angle = -2 * math.pi * index / vertices
+        distance = radius * rng.uniform(0.85, 1.15)
+        ring.append((center_x + distance * math.cos(angle), center_y + distance * math.sin(angle)))
+    ring.append(ring[0])
+    return ring
+
+
+def build_shapefile_zip(car_code, vertices=64):
+    """
+    Monta o zip do shapefile de um imóvel (camada AREA_IMOVEL com um polígono).
+
+    Returns:
+        bytes: Conteúdo do zip (.shp, .shx, .dbf, .prj e .cpg)
+    """
+    ring = property_ring(car_code, vertices)
+    xs = [x for x, _ in ring]
+    ys = [y for _, y in ring]
+    bbox = (min(xs), min(ys), max(xs), max(ys))
+
+    content = struct.pack('<i4d2i', 5, *bbox, 1, len(ring)) + struct.pack('<i', 0)
+    content += b''.join(struct.pack('<2d', x, y) for x, y in ring)
+    record = struct.pack('>2i', 1, len(content) // 2) + content
+
+    def header(length_bytes):
+        return (struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length_bytes // 2)
+                + struct.pack('<2i', 1000, 5) + struct.pack('<4d', *bbox) + struct.pack('<4d', 0, 0, 0, 0))
+
+    shp = header(100 + len(record)) + record
+    shx = header(100 + 8) + struct.pack('>2i', 50, len(content) // 2)
+
+    parts = car_code.split('-')
+    fields = [
+        ('cod_imovel', 'C', 60, 0, car_code),
+        ('cod_estado', 'C', 2, 0, parts[0] if parts else ''),
+        ('nom_munici', 'C', 40, 0, 'Municipio Simulado'),
+        ('num_area', 'N', 16, 4, f"{(bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) * 1e4:.4f}"),
+        ('tipo_imove', 'C', 3, 0, 'IRU'),
+        ('situacao', 'C', 2, 0, 'AT'),
+    ]
+    record_length = 1 + sum(field[2] for field in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    today = date.today()
+    dbf = struct.pack('<4BIHH20x', 3, today.year - 1900, today.month, today.day, 1, header_length, record_length)
+    for name, kind, length, decimals, _ in fields:
+        dbf += struct.pack('<11sc4xBB14x', name.encode('ascii'), kind.encode('ascii'), length, decimals)
+    dbf += b'\r '
+    for _, kind, length, _, value in fields:
+        encoded = str(value).encode('utf-8')[:length]
+        dbf += encoded.rjust(length) if kind == 'N' else encoded.ljust(length)
+    dbf += b'\x1a'
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('AREA_IMOVEL.shp', shp)
+        archive.writestr('AREA_IMOVEL.shx', shx)
+        archive.writestr('AREA_IMOVEL.dbf', dbf)
+        archive.writestr('AREA_IMOVEL.prj', PRJ_SIRGAS_2000)
+        archive.writestr('AREA_IMOVEL.cpg', 'UTF-8')
+    return output.getvalue()
+
+
+def captcha_png(text, seed):
+    """Imagem PNG de CAPTCHA com ruído, determinística pela semente."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (180, 60), (235, 235, 235))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        draw.line([(rng.randint(0, 180), rng.randint(0, 60)), (rng.randint(0, 180), rng.randint(0, 60))],
+                  fill=(rng.randint(100, 200),) * 3, width=2)
+    try:
+        font = ImageFont.load_default(size=32)
+    except TypeError:
+        font = ImageFont.load_default()
+    draw.text((18, 10), text, fill=(30, 30, 30), font=font)
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+class FakeSicar:
+    """Estado e configuração do SICAR simulado."""
+
+    def __init__(self, answer=DEFAULT_ANSWER, variant='normal', slow_delay=2.0, late_dom_delay=3.0,
+                 vertices=64):
+        """
+        Args:
+            answer: Resposta dos CAPTCHAs: texto fixo ou função (token) -> texto
+            variant: Variante usada quando a página não informa ?variante=
+            slow_delay: Atraso das respostas na variante lenta, em segundos
+            late_dom_delay: Atraso do painel do imóvel na variante tardia, em segundos
+            vertices: Vértices do polígono de cada imóvel (tamanho do zip)
+        """
+        self.answer = answer
+        self.variant = variant
+        self.slow_delay = slow_delay
+        self.late_dom_delay = late_dom_delay
+        self.vertices = vertices
+        self._captchas = {}   # token -> {'answer', 'car', 'variant'}
+        self._downloads = {}  # token do download -> código do CAR
+        self._lock = threading.Lock()
+        self.counters = {'pages': 0, 'searches': 0, 'captchas': 0, 'captchas_ok': 0, 'captchas_wrong': 0,
+                         'downloads': 0, 'download_bytes': 0}
+
+    def answer_for(self, token):
+        """Resposta correta de um CAPTCHA emitido."""
+        with self._lock:
+            captcha = self._captchas.get(token)
+        return captcha['answer'] if captcha else None
+
+    def new_captcha(self, car_code, variant):
+        token = uuid.uuid4().hex
+        answer = self.answer(token) if callable(self.answer) else self.answer
+        with self._lock:
+            self._captchas[token] = {'answer': str(answer), 'car': car_code, 'variant': variant}
+            self.counters['captchas'] += 1
+        return token
+
+    def check_captcha(self, token, text):
+        """Valida a resposta; retorna o token do download ou None."""
+        with self._lock:
+            captcha = self._captchas.pop(token, None)
+            if not captcha or captcha['answer'].strip().upper() != str(text or '').strip().upper():
+                self.counters['captchas_wrong'] += 1
+                return None
+            self.counters['captchas_ok'] += 1
+            download_token = uuid.uuid4().hex
+            self._downloads[download_token] = captcha['car']
+            return download_token
+
+    def take_download(self, download_token):
+        with self._lock:
+            return self._downloads.pop(download_token, None)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending_captchas=len(self._captchas))
+
+    def delay(self, variant):
+        if variant == 'lento':
+            time.sleep(self.slow_delay)
+
+
+def create_app(sicar=None):
+    """Aplicação Flask do SICAR simulado."""
+    sicar = sicar or FakeSicar()
+    app = Flask(__name__)
+    app.config['FAKE_SICAR'] = sicar
+
+    def current_variant():
+        variant = request.args.get('variante') or sicar.variant
+        return variant if variant in VARIANTS else 'normal'
+
+    @app.route('/publico/imoveis/index')
+    def property_index():
+        sicar.count('pages')
+        return render_template('fake_sicar.html', variant=current_variant(), late_dom_delay=sicar.late_dom_delay)
+
+    @app.route('/publico/imoveis/buscar')
+    def property_search():
+        variant = current_variant()
+        sicar.count('searches')
+        sicar.delay(variant)
+        car_code = request.args.get('car', '').strip()
+        if not car_code:
+            return jsonify({'success': False, 'error': 'Informe o código do CAR'})
+        return jsonify({'success': True, 'car': car_code, 'municipio': 'Municipio Simulado'})
+
+    @app.route('/publico/imoveis/captcha')
+    def captcha_start():
+        """Emite um CAPTCHA novo para o imóvel; devolve o token."""
+        variant = current_variant()
+        token = sicar.new_captcha(request.args.get('car', ''), variant)
+        return jsonify({'token': token, 'image': f"/publico/captcha/{token}.png?variante={variant}"})
+
+    @app.route('/publico/captcha/<token>.png')
+    def captcha_image(token):
+        answer = sicar.answer_for(token)
+        if answer is None:
+            abort(404)
+        sicar.delay(current_variant())
+        return Response(captcha_png(answer, token), mimetype='image/png',
+                        headers={'Cache-Control': 'no-store'})
+
+    @app.route('/publico/captcha/formulario')
+    def captcha_frame():
+        """Formulário do CAPTCHA carregado dentro do iframe (variante iframe)."""
+        token = sicar.new_captcha(request.args.get('car', ''), 'iframe')
+        return render_template('fake_sicar_captcha.html', token=token, car=request.args.get('car', ''))
+
+    @app.route('/publico/imoveis/validar', methods=['POST'])
+    def captcha_validate():
+        data = request.get_json(silent=True) or request.form
+        download_token = sicar.check_captcha(data.get('token'), data.get('captcha'))
+        if not download_token:
+            return jsonify({'success': False, 'error': 'Código de verificação incorreto'})
+        return jsonify({'success': True, 'url': f"/publico/imoveis/shapefile/{download_token}"})
+
+    @app.route('/publico/imoveis/shapefile/<download_token>')
+    def shapefile_download(download_token):
+        car_code = sicar.take_download(download_token)
+        if not car_code:
+            abort(404)
+        sicar.delay(current_variant())
+        payload = build_shapefile_zip(car_code, sicar.vertices)
+        sicar.count('downloads')
+        sicar.count('download_bytes', len(payload))
+        filename = f"SHAPE_{car_code.replace('/', '_')}.zip"
+        return Response(payload, mimetype='application/zip', headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Content-Length': str(len(payload)),
+        })
+
+    # Rotas da bancada de teste
+
+    @app.route('/__bancada/captcha/<token>')
+    def harness_answer(token):
+        answer = sicar.answer_for(token)
+        if answer is None:
+            return jsonify({'success': False, 'error': 'Token desconhecido'}), 404
+        return jsonify({'success': True, 'answer': answer})
+
+    @app.route('/__bancada/estatisticas')
+    def harness_stats():
+        return jsonify(sicar.stats())
+
+    return app
+
+
+class FakeSicarServer:
+    """Servidor do SICAR simulado rodando em uma thread (para a bancada de teste)."""
+
+    def __init__(self, sicar=None, host='127.0.0.1', port=0):
+        from werkzeug.serving import make_server
+
+        self.sicar = sicar or FakeSicar()
+        self._server = make_server(host, port, create_app(self.sicar), threaded=True)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"SICAR simulado em {self.url}")
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='SICAR simulado para testes locais')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--answer', default=DEFAULT_ANSWER, help='Resposta de todos os CAPTCHAs')
+    parser.add_argument('--variant', default='normal', choices=VARIANTS)
+    parser.add_argument('--slow-delay', type=float, default=2.0)
+    parser.add_argument('--late-dom-delay', type=float, default=3.0)
+    args = parser.parse_args()
+
+    sicar = FakeSicar(answer=args.answer, variant=args.variant, slow_delay=args.slow_delay,
+                      late_dom_delay=args.late_dom_delay)
+    create_app(sicar).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Encaminhamento de entrada remota (mouse, arrasto, roda e teclado) para o
+navegador controlado, usando os eventos Input do Chrome DevTools Protocol.
+
+O cliente agrupa os eventos em lotes e os envia por socket.io; cada lote é
+despachado de uma vez, sem pausas nem screenshots intermediários. As
+atualizações de tela são produzidas de forma assíncrona pelo ScreenStreamer.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('input_forwarding')
+
+# Máscaras de modificadores usadas pelo CDP
+MODIFIER_ALT = 1
+MODIFIER_CTRL = 2
+MODIFIER_META = 4
+MODIFIER_SHIFT = 8
+
+# Máscaras de botões pressionados (campo "buttons" do CDP)
+BUTTON_MASKS = {'left': 1, 'right': 2, 'middle': 4}
+
+# Botões do DOM (MouseEvent.button) para os nomes usados pelo CDP
+DOM_BUTTONS = {0: 'left', 1: 'middle', 2: 'right'}
+
+MOUSE_TYPES = {
+    'mousemove': 'mouseMoved',
+    'mousedown': 'mousePressed',
+    'mouseup': 'mouseReleased',
+    'wheel': 'mouseWheel',
+}
+
+KEY_TYPES = ('keydown', 'keyup')
+
+# Limite de eventos por lote para evitar que um cliente trave o navegador
+MAX_BATCH_SIZE = 500
+
+
+def get_viewport_size(driver):
+    """
+    Obtém o tamanho da área visível da página em pixels CSS.
+
+    Args:
+        driver: Instância do WebDriver
+
+    Returns:
+        tuple: (largura, altura)
+    """
+    metrics = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+    viewport = metrics.get('cssLayoutViewport') or metrics.get('layoutViewport', {})
+    return viewport.get('clientWidth', 0), viewport.get('clientHeight', 0)
+
+
+def get_modifiers(event):
+    """Converte os modificadores enviados pelo cliente na máscara do CDP."""
+    modifiers = 0
+    if event.get('altKey'):
+        modifiers |= MODIFIER_ALT
+    if event.get('ctrlKey'):
+        modifiers |= MODIFIER_CTRL
+    if event.get('metaKey'):
+        modifiers |= MODIFIER_META
+    if event.get('shiftKey'):
+        modifiers |= MODIFIER_SHIFT
+    return modifiers
+
+
+def coalesce_events(events):
+    """
+    Reduz um lote de eventos sem alterar o resultado no navegador.
+
+    Movimentos consecutivos do mouse são reduzidos ao último, e giros
+    consecutivos da roda na mesma posição têm seus deltas somados.
+
+    Args:
+        events: Lista de eventos enviados pelo cliente
+
+    Returns:
+        list: Lista de eventos reduzida
+    """
+    coalesced = []
+    for event in events[:MAX_BATCH_SIZE]:
+        event_type = event.get('type')
+        previous = coalesced[-1] if coalesced else None
+
+        if previous and previous.get('type') == event_type:
+            if event_type == 'mousemove' and previous.get('buttons') == event.get('buttons'):
+                coalesced[-1] = event
+                continue
+            if (event_type == 'wheel' and previous.get('x') == event.get('x')
+                    and previous.get('y') == event.get('y')):
+                merged = dict(previous)
+                merged['deltaX'] = float(previous.get('deltaX', 0)) + float(event.get('deltaX', 0))
+                merged['deltaY'] = float(previous.get('deltaY', 0)) + float(event.get('deltaY', 0))
+                coalesced[-1] = merged
+                continue
+
+        coalesced.append(event)
+    return coalesced
+
+
+def build_mouse_params(event, width, height):
+    """
+    Monta os parâmetros de Input.dispatchMouseEvent para um evento de mouse.
+
+    As coordenadas chegam relativas (0 a 1) à imagem exibida ao operador e
+    são convertidas para pixels CSS da área visível.
+    """
+    rel_x = min(max(float(event.get('x', 0)), 0.0), 1.0)
+    rel_y = min(max(float(event.get('y', 0)), 0.0), 1.0)
+
+    params = {
+        'type': MOUSE_TYPES[event['type']],
+        'x': rel_x * width,
+        'y': rel_y * height,
+        'modifiers': get_modifiers(event),
+    }
+
+    button = DOM_BUTTONS.get(event.get('button'), 'none')
+    buttons = int(event.get('buttons', 0))
+
+    if event['type'] == 'wheel':
+        params['button'] = 'none'
+        params['deltaX'] = float(event.get('deltaX', 0))
+        params['deltaY'] = float(event.get('deltaY', 0))
+    elif event['type'] == 'mousemove':
+        # Durante um arrasto o CDP precisa saber qual botão continua pressionado
+        pressed = [name for name, mask in BUTTON_MASKS.items() if buttons & mask]
+        params['button'] = pressed[0] if pressed else 'none'
+        params['buttons'] = buttons
+    else:
+        params['button'] = button
+        params['buttons'] = buttons
+        params['clickCount'] = int(event.get('detail', 1)) or 1
+
+    return params
+
+
+def build_key_params(event):
+    """
+    Monta os parâmetros de Input.dispatchKeyEvent para um evento de teclado.
+
+    Teclas imprimíveis geram "keyDown" com texto; as demais (setas, Tab,
+    Backspace...) geram "rawKeyDown", como o próprio Chrome faz.
+    """
+    key = event.get('key', '')
+    params = {
+        'key': key,
+        'code': event.get('code', ''),
+        'windowsVirtualKeyCode': int(event.get('keyCode', 0)),
+        'nativeVirtualKeyCode': int(event.get('keyCode', 0)),
+        'modifiers': get_modifiers(event),
+    }
+
+    if event['type'] == 'keyup':
+        params['type'] = 'keyUp'
+        return params
+
+    text = None
+    if key == 'Enter':
+        text = '\r'
+    elif len(key) == 1 and not (event.get('ctrlKey') or event.get('metaKey')):
+        text = key
+
+    if text:
+        params['type'] = 'keyDown'
+        params['text'] = text
+        params['unmodifiedText'] = text
+    else:
+        params['type'] = 'rawKeyDown'
+    return params
+
+
+def dispatch_input_batch(driver, events):
+    """
+    Despacha um lote de eventos de entrada no navegador.
+
+    Args:
+        driver: Instância do WebDriver
+        events: Lista de eventos enviados pelo cliente
+
+    Returns:
+        int: Quantidade de comandos CDP efetivamente enviados
+    """
+    events = coalesce_events(events)
+    if not events:
+        return 0
+
+    # Uma única consulta do tamanho da área visível vale para o lote inteiro
+    width, height = 0, 0
+    if any(event.get('type') in MOUSE_TYPES for event in events):
+        width, height = get_viewport_size(driver)
+
+    dispatched = 0
+    for event in events:
+        event_type = event.get('type')
+        try:
+            if event_type in MOUSE_TYPES:
+                driver.execute_cdp_cmd('Input.dispatchMouseEvent',
+                                       build_mouse_params(event, width, height))
+            elif event_type in KEY_TYPES:
+                driver.execute_cdp_cmd('Input.dispatchKeyEvent', build_key_params(event))
+            else:
+                logger.warning(f"Tipo de evento de entrada desconhecido: {event_type}")
+                continue
+            dispatched += 1
+        except Exception as e:
+            logger.error(f"Erro ao despachar evento '{event_type}': {str(e)}")
+
+    return dispatched
+
+
+class ScreenStreamer:
+    """
+    Envia atualizações de tela de forma assíncrona.
+
+    Pedidos de atualização são agrupados: enquanto uma captura está em
+    andamento, novos pedidos apenas marcam que outra captura é necessária,
+    e capturas consecutivas respeitam um intervalo mínimo.
+    """
+
+    def __init__(self, capture_frame, emit_frame, min_interval=0.15):
+        """
+        Args:
+            capture_frame: Função sem argumentos que retorna a imagem (data URL) ou None
+            emit_frame: Função que recebe a imagem e a envia aos clientes
+            min_interval: Intervalo mínimo entre capturas, em segundos
+        """
+        self.capture_frame = capture_frame
+        self.emit_frame = emit_frame
+        self.min_interval = min_interval
+        self._condition = threading.Condition()
+        # Momento (time.time()) a partir do qual a próxima captura pedida deve
+        # sair, ou None sem pedido pendente
+        self._pending = None
+        self._thread = None
+
+    def request_update(self, delay=0.0):
+        """Solicita uma nova atualização de tela, opcionalmente após um atraso."""
+        with self._condition:
+            due = time.time() + delay
+            # O atraso maior prevalece: ex.: esperar a página reagir a um clique
+            self._pending = due if self._pending is None else max(self._pending, due)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        last_capture = 0.0
+        while True:
+            with self._condition:
+                if self._pending is None:
+                    # Encerra a thread quando não há mais pedidos pendentes
+                    if not self._condition.wait(timeout=5):
+                        self._thread = None
+                        return
+                    continue
+                due = max(self._pending, last_capture + self.min_interval)
+                now = time.time()
+                if due > now:
+                    self._condition.wait(timeout=due - now)
+                    continue
+                self._pending = None
+
+            try:
+                frame = self.capture_frame()
+                if frame:
+                    self.emit_frame(frame)
+            except Exception as e:
+                logger.error(f"Erro ao enviar atualização de tela: {str(e)}")
+            last_capture = time.time()
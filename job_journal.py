@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Diário persistente dos trabalhos de download em lote.
+
+Cada trabalho e cada mudança de estado são acrescentados a um banco SQLite em
+modo WAL; nada é sobrescrito. Ao reiniciar, o estado atual de cada trabalho é
+o último evento registrado, o que permite retomar os trabalhos inacabados sem
+repetir downloads já concluídos.
+"""
+
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('job_journal')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        batch_id TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS job_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL REFERENCES jobs(job_id),
+        state TEXT NOT NULL,
+        ts REAL NOT NULL,
+        attempts INTEGER NOT NULL,
+        session_id TEXT,
+        error TEXT,
+        file_path TEXT,
+        detail TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS job_events_job ON job_events(job_id, seq);
+"""
+
+# Último evento de cada trabalho
+LATEST_EVENTS_QUERY = """
+    SELECT j.job_id, j.kind, j.value, j.batch_id, j.created_at,
+           e.state, e.ts, e.attempts, e.session_id, e.error, e.file_path, e.detail
+    FROM jobs j
+    JOIN job_events e ON e.seq = (SELECT MAX(seq) FROM job_events WHERE job_id = j.job_id)
+"""
+
+ROW_FIELDS = ('job_id', 'kind', 'value', 'batch_id', 'created_at', 'state', 'ts',
+              'attempts', 'session_id', 'error', 'file_path', 'detail')
+
+
+class JobJournal:
+    """Registro somente-acréscimo das transições dos trabalhos."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Caminho do arquivo SQLite
+        """
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+
+        # WAL: escritas são acrescentadas ao log e sobrevivem a uma queda do processo.
+        # synchronous=NORMAL é seguro contra queda da aplicação com WAL.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        logger.info(f"Diário de trabalhos aberto em {self.path}")
+
+    def record_job(self, job):
+        """Registra um trabalho novo e seu estado inicial."""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO jobs (job_id, kind, value, batch_id, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (job.job_id, job.kind, job.value, job.batch_id, job.created_at))
+                self._insert_event(job)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def record_transition(self, job, detail=None):
+        """
+        Acrescenta o estado atual de um trabalho ao diário.
+
+        Args:
+            job: DownloadJob
+            detail: Dicionário opcional com informações extras da transição
+        """
+        with self._lock:
+            self._insert_event(job, detail)
+
+    def latest_states(self):
+        """Retorna o último evento de cada trabalho, em ordem de criação."""
+        with self._lock:
+            rows = self._conn.execute(LATEST_EVENTS_QUERY + ' ORDER BY j.created_at').fetchall()
+
+        results = []
+        for row in rows:
+            data = dict(zip(ROW_FIELDS, row))
+            data['detail'] = json.loads(data['detail']) if data['detail'] else {}
+            results.append(data)
+        return results
+
+    def history(self, job_id):
+        """Retorna todas as transições de um trabalho."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT state, ts, attempts, session_id, error, file_path FROM job_events WHERE job_id = ? ORDER BY seq',
+                (job_id,)).fetchall()
+        return [dict(zip(('state', 'ts', 'attempts', 'session_id', 'error', 'file_path'), row)) for row in rows]
+
+    def close(self):
+        """Fecha o banco, consolidando o WAL."""
+        with self._lock:
+            try:
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                self._conn.close()
+
+    def _insert_event(self, job, detail=None):
+        self._conn.execute(
+            'INSERT INTO job_events (job_id, state, ts, attempts, session_id, error, file_path, detail) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job.job_id, job.state, job.updated_at, job.attempts, job.session_id, job.error,
+             job.file_path, json.dumps(detail) if detail else None))
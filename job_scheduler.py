@@ -0,0 +1,758 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Agendador de downloads em lote de shapefiles do SICAR.
+
+Recebe lotes de códigos do CAR (ou municípios) e distribui os trabalhos entre
+um pool de sessões de navegador. Cada sessão navega sozinha até o download e
+pausa apenas na etapa do CAPTCHA, que é enviada à fila de operadores humanos.
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import deque
+
+from captcha_form import SUBMIT_OK
+from shapefile_reader import inspect_shapefile
+from shapefile_store import file_sha256
+from webdriver_tracing import tracer
+
+logger = logging.getLogger('job_scheduler')
+
+# Estados de um trabalho
+JOB_QUEUED = 'na_fila'
+JOB_NAVIGATING = 'navegando'
+JOB_AWAITING_CAPTCHA = 'aguardando_captcha'
+JOB_DOWNLOADING = 'baixando'
+JOB_DONE = 'concluido'
+JOB_FAILED = 'falhou'
+
+FINAL_STATES = (JOB_DONE, JOB_FAILED)
+JOB_STATES = (JOB_QUEUED, JOB_NAVIGATING, JOB_AWAITING_CAPTCHA, JOB_DOWNLOADING, JOB_DONE, JOB_FAILED)
+
+# Tipos de trabalho
+KIND_PROPERTY = 'imovel'
+KIND_MUNICIPALITY = 'municipio'
+
+# Extensões de arquivos ainda em download pelo Chrome
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+
+# Tentativas de CAPTCHA por trabalho (resposta errada ou expirada)
+MAX_CAPTCHA_ROUNDS = 3
+
+
+def parse_batch(data):
+    """
+    Converte o corpo de uma requisição de lote em uma lista de (tipo, valor).
+
+    Aceita {'car_codes': [...]} e/ou {'municipios': [...]}, onde cada
+    município é 'UF/Nome' ou {'uf': 'UF', 'municipio': 'Nome'}.
+    """
+    items = []
+    for car_code in data.get('car_codes', []) or []:
+        car_code = str(car_code).strip()
+        if car_code:
+            items.append((KIND_PROPERTY, car_code))
+
+    for municipality in data.get('municipios', []) or []:
+        if isinstance(municipality, dict):
+            uf = str(municipality.get('uf', '')).strip().upper()
+            name = str(municipality.get('municipio', '')).strip()
+        else:
+            uf, _, name = str(municipality).partition('/')
+            uf, name = uf.strip().upper(), name.strip()
+        if uf and name:
+            items.append((KIND_MUNICIPALITY, f"{uf}/{name}"))
+
+    return items
+
+
+class DownloadJob:
+    """Um download de shapefile (imóvel ou município) e seu histórico de estados."""
+
+    def __init__(self, kind, value, batch_id, job_id=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.value = value
+        self.batch_id = batch_id
+        self.state = JOB_QUEUED
+        self.attempts = 0
+        self.error = None
+        self.session_id = None
+        self.file_path = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.started_at = None
+        self.finished_at = None
+        self.history = [(JOB_QUEUED, self.created_at)]
+
+        # Resposta do CAPTCHA entregue pela fila de operadores
+        self.captcha_event = threading.Event()
+        self.captcha_answer = None
+
+        # Baixa mesmo que o armazenamento tenha uma cópia dentro da validade
+        self.force = False
+
+    def to_dict(self):
+        """Representação do trabalho para a API e os eventos socket.io."""
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'value': self.value,
+            'batch_id': self.batch_id,
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'session_id': self.session_id,
+            'file_path': self.file_path,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobScheduler:
+    """Distribui trabalhos de download entre as sessões de um pool de navegadores."""
+
+    def __init__(self, session_factory, captcha_queue, pool_size=2, emit=None, max_attempts=3,
+                 navigation_timeout=60, captcha_timeout=120, download_timeout=300, journal=None,
+                 direct_downloader=None, direct_download_dir=None, direct_capture_timeout=30, store=None,
+                 catalog=None, exporter=None):
+        """
+        Args:
+            session_factory: Função (índice) que cria uma BrowserSession (ou WorkerSession)
+            captcha_queue: CaptchaQueue que recebe os CAPTCHAs das sessões
+            pool_size: Quantidade de sessões de navegador simultâneas
+            emit: Função (evento, dados) para notificar os clientes
+            max_attempts: Tentativas por trabalho antes de marcá-lo como falho
+            navigation_timeout: Tempo máximo para chegar ao botão de download
+            captcha_timeout: Tempo máximo aguardando a resposta de um operador
+            download_timeout: Tempo máximo para o arquivo terminar de baixar
+            journal: JobJournal opcional onde cada transição é registrada
+            direct_downloader: DirectDownloader opcional; quando presente, o arquivo é
+                baixado fora do navegador e a sessão segue para o próximo trabalho
+            direct_download_dir: Diretório dos downloads diretos (um subdiretório por trabalho),
+                fora do diretório observado pelo DownloadWatcher; sem ele não há download direto
+            direct_capture_timeout: Tempo máximo aguardando o Chrome iniciar o download
+            store: ShapefileStore opcional; downloads concluídos são guardados nele e
+                imóveis com cópia dentro da validade não passam pelo navegador
+            catalog: ShapefileCatalog opcional; cada zip é validado antes de concluir o
+                trabalho (zips inválidos são baixados de novo) e suas feições indexadas
+            exporter: ColumnarExporter opcional que acrescenta cada download ao GeoParquet
+        """
+        self.session_factory = session_factory
+        self.captcha_queue = captcha_queue
+        self.pool_size = pool_size
+        self.emit = emit
+        self.max_attempts = max_attempts
+        self.navigation_timeout = navigation_timeout
+        self.captcha_timeout = captcha_timeout
+        self.download_timeout = download_timeout
+        self.journal = journal
+        self.direct_downloader = direct_downloader
+        self.direct_download_dir = direct_download_dir
+        self.direct_capture_timeout = direct_capture_timeout
+        self.store = store
+        self.catalog = catalog
+        self.exporter = exporter
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._batches = {}
+        self._sessions = []
+        self._workers = []
+        self._stop = threading.Event()
+        self._first_started_at = None
+        self._completions = deque(maxlen=10000)
+        self._download_events = {}
+        self._direct_jobs = {}  # arquivo do download direto -> job_id
+        self._served_from_store = 0
+
+    # API pública
+
+    def submit_batch(self, items, force=False):
+        """
+        Enfileira um lote de trabalhos.
+
+        Itens com cópia dentro da validade no armazenamento são concluídos na
+        hora, sem abrir navegador nem gerar CAPTCHA.
+
+        Args:
+            items: Lista de (tipo, valor), como retornada por parse_batch()
+            force: Baixa de novo mesmo os itens com cópia válida
+
+        Returns:
+            tuple: (batch_id, lista de DownloadJob)
+        """
+        batch_id = uuid.uuid4().hex
+        jobs = []
+        new_jobs = []
+
+        with self._lock:
+            # Um imóvel que já está em andamento não é enfileirado de novo
+            active = {(job.kind, job.value): job for job in self._jobs.values() if job.state not in FINAL_STATES}
+            for kind, value in items:
+                job = active.get((kind, value))
+                if not job:
+                    job = DownloadJob(kind, value, batch_id)
+                    job.force = force
+                    self._jobs[job.job_id] = job
+                    active[(kind, value)] = job
+                    new_jobs.append(job)
+                jobs.append(job)
+            self._batches[batch_id] = [job.job_id for job in jobs]
+
+        queued = 0
+        for job in new_jobs:
+            if self.journal:
+                self.journal.record_job(job)
+            if not self._serve_from_store(job):
+                self._queue.put(job.job_id)
+                queued += 1
+
+        logger.info(f"Lote {batch_id} recebido com {len(jobs)} trabalhos ({len(new_jobs)} novos, "
+                    f"{len(new_jobs) - queued} já armazenados)")
+        if queued:
+            self.start()
+        return batch_id, jobs
+
+    def resume(self):
+        """
+        Recarrega os trabalhos do diário e retoma os inacabados.
+
+        Trabalhos concluídos ou falhos não são repetidos. Um trabalho que estava
+        baixando quando o processo parou é dado como concluído se o arquivo
+        terminou de chegar ao diretório da sessão; os demais voltam para a fila.
+
+        Returns:
+            int: Quantidade de trabalhos retomados
+        """
+        if not self.journal:
+            return 0
+
+        records = self.journal.latest_states()
+        claimed = {record['file_path'] for record in records if record['state'] == JOB_DONE and record['file_path']}
+        resumed = []
+        recovered = []
+
+        with self._lock:
+            for record in records:
+                if record['job_id'] in self._jobs:
+                    continue
+
+                job = DownloadJob(record['kind'], record['value'], record['batch_id'], job_id=record['job_id'])
+                job.created_at = record['created_at']
+                job.updated_at = record['ts']
+                job.state = record['state']
+                job.attempts = record['attempts']
+                job.session_id = record['session_id']
+                job.error = record['error']
+                job.file_path = record['file_path']
+                job.history = [(record['state'], record['ts'])]
+                if job.state in FINAL_STATES:
+                    job.finished_at = record['ts']
+
+                self._jobs[job.job_id] = job
+                self._batches.setdefault(job.batch_id, []).append(job.job_id)
+
+                if job.state in FINAL_STATES:
+                    continue
+
+                file_path = None
+                if job.state == JOB_DOWNLOADING:
+                    file_path = self._find_completed_download(record['detail'], claimed)
+                if file_path:
+                    claimed.add(file_path)
+                    job.file_path = file_path
+                    recovered.append(job)
+                else:
+                    resumed.append(job)
+
+        for job in recovered:
+            logger.info(f"Download do trabalho {job.job_id} concluído antes do reinício: {job.file_path}")
+            self._finish(job)
+
+        for job in resumed:
+            self._transition(job, JOB_QUEUED, error='Retomado após reinício')
+            self._queue.put(job.job_id)
+
+        if resumed:
+            logger.info(f"{len(resumed)} trabalhos inacabados retomados do diário")
+            self.start()
+        return len(resumed)
+
+    def start(self):
+        """Inicia as sessões do pool, se ainda não estiverem rodando."""
+        with self._lock:
+            if self._workers:
+                return
+            # Cada geração do pool tem seu evento: um worker antigo que ainda não
+            # saiu de um comando do navegador não é reativado por este start()
+            self._stop = threading.Event()
+            for index in range(self.pool_size):
+                session = self.session_factory(index)
+                worker = threading.Thread(target=self._worker, args=(session, self._stop), daemon=True,
+                                          name=f"job-worker-{session.session_id}")
+                self._sessions.append(session)
+                self._workers.append(worker)
+                worker.start()
+        logger.info(f"Pool de {self.pool_size} sessões iniciado")
+
+    def stop(self):
+        """Encerra as sessões do pool. Trabalhos interrompidos voltam ao estado na_fila."""
+        self._stop.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout=5)
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            self.captcha_queue.cancel_session(session.session_id)
+            session.close()
+
+    def sessions(self):
+        """Sessões do pool em execução."""
+        with self._lock:
+            return list(self._sessions)
+
+    def _recycle(self, session):
+        reason = session.recycle_reason
+        session.recycle()
+        if self.emit:
+            self.emit('session_recycled', {'session_id': session.session_id, 'reason': reason})
+
+    def notify_download(self, info):
+        """
+        Recebe a notificação de um download concluído (ver DownloadWatcher).
+
+        Returns:
+            DownloadJob: Trabalho da sessão que baixou o arquivo, ou None
+        """
+        with self._lock:
+            # Um download direto pertence ao seu trabalho, não ao que a sessão executa agora
+            job = self._jobs.get(self._direct_jobs.get(info['path']))
+            if job:
+                return job
+            events = self._download_events.setdefault(info['session_id'], queue.Queue())
+            session = next((s for s in self._sessions if s.session_id == info['session_id']), None)
+            job = self._jobs.get(session.current_job_id) if session and session.current_job_id else None
+        events.put(info)
+        return job
+
+    def get_job(self, job_id):
+        """Obtém um trabalho pelo identificador."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def batch_status(self, batch_id):
+        """Estado dos trabalhos de um lote, ou None se o lote não existe."""
+        with self._lock:
+            job_ids = self._batches.get(batch_id)
+            if job_ids is None:
+                return None
+            jobs = [self._jobs[job_id].to_dict() for job_id in job_ids]
+        return {'batch_id': batch_id, 'counts': self._count_states(jobs), 'jobs': jobs}
+
+    def status(self):
+        """Contagem por estado, vazão e estado das sessões."""
+        now = time.time()
+        with self._lock:
+            jobs = [job.to_dict() for job in self._jobs.values()]
+            sessions = [session.to_dict() for session in self._sessions]
+            completions = list(self._completions)
+            first_started_at = self._first_started_at
+
+        done = completions
+        last_hour = [finished for finished in done if now - finished <= 3600]
+        elapsed = now - first_started_at if first_started_at else 0
+        durations = [job['finished_at'] - job['started_at'] for job in jobs
+                     if job['state'] == JOB_DONE and job['started_at'] and job['finished_at']]
+
+        return {
+            'counts': self._count_states(jobs),
+            'queue_depth': self._queue.qsize(),
+            'sessions': sessions,
+            'throughput_per_hour': (len(done) / elapsed * 3600) if elapsed > 0 else 0.0,
+            'completed_last_hour': len(last_hour),
+            'avg_job_seconds': (sum(durations) / len(durations)) if durations else None,
+            'direct_downloads_active': len(self.direct_downloader.active()) if self.direct_downloader else 0,
+            'served_from_store': self._served_from_store,
+        }
+
+    # Execução
+
+    def _worker(self, session, stop):
+        while not stop.is_set():
+            try:
+                job_id = self._queue.get(timeout=1)
+            except queue.Empty:
+                # Ocioso: é um ponto seguro para reciclar o navegador
+                if session.recycle_reason:
+                    self._recycle(session)
+                continue
+
+            job = self.get_job(job_id)
+            if not job or job.state in FINAL_STATES:
+                continue
+            # Outro lote pode ter baixado o mesmo imóvel enquanto este esperava na fila
+            if self._serve_from_store(job):
+                continue
+
+            # Entre dois trabalhos: o trabalho já retirado da fila segue no Chrome novo
+            if session.recycle_reason:
+                self._recycle(session)
+
+            session.current_job_id = job.job_id
+            try:
+                # Cada tentativa é um trace com os comandos WebDriver da sessão
+                with tracer.span(f"trabalho {job.kind}", 'trabalho', job_id=job.job_id,
+                                 value=job.value, session=session.session_id):
+                    self._run_job(session, job, stop)
+            except Exception as e:
+                logger.error(f"Erro no trabalho {job.job_id} ({job.value}): {str(e)}")
+                self._fail_or_retry(job, str(e), stop)
+                # Um erro inesperado pode ter deixado o navegador em estado ruim
+                if not session.is_alive():
+                    session.close()
+            finally:
+                session.current_job_id = None
+                self.captcha_queue.cancel_session(session.session_id)
+
+        session.close()
+
+    def _run_job(self, session, job, stop):
+        with self._lock:
+            job.attempts += 1
+            job.session_id = session.session_id
+            job.error = None
+            if not job.started_at:
+                job.started_at = time.time()
+            if not self._first_started_at:
+                self._first_started_at = job.started_at
+
+        self._transition(job, JOB_NAVIGATING)
+        session.ensure_driver()
+        # Descarta eventos de rede do trabalho anterior
+        session.reset_captures()
+
+        if job.kind == KIND_MUNICIPALITY:
+            uf, _, name = job.value.partition('/')
+            reached = session.open_municipality(uf, name, self.navigation_timeout)
+        else:
+            reached = session.open_property(job.value, self.navigation_timeout) and session.click_download_button()
+        session.pages_loaded += 1
+
+        if not reached:
+            self._fail_or_retry(job, 'Não foi possível chegar ao botão de download', stop)
+            return
+
+        before = self._list_files(session.download_dir)
+        requested_at = time.time()
+        self._drain_download_events(session.session_id)
+
+        if not self._solve_captchas(session, job, stop):
+            return
+
+        if self._start_direct_download(session, job, requested_at):
+            # O arquivo segue baixando em paralelo; a sessão fica livre
+            return
+
+        self._transition(job, JOB_DOWNLOADING, detail={
+            'download_dir': str(session.download_dir),
+            'requested_at': requested_at,
+        })
+        file_path = self._wait_for_download(session, before, requested_at, stop)
+        if not file_path:
+            self._fail_or_retry(job, 'Download não concluído no tempo limite', stop)
+            return
+
+        job.file_path = file_path
+        self._finish(job)
+
+    def _solve_captchas(self, session, job, stop):
+        """Encaminha os CAPTCHAs da sessão aos operadores até que a página os aceite."""
+        for captcha_round in range(MAX_CAPTCHA_ROUNDS):
+            image = session.capture_captcha(timeout=15 if captcha_round == 0 else 5)
+            if not image:
+                # Sem CAPTCHA (ou já aceito): segue para o download
+                return True
+
+            session.prepare_captcha()
+            self._transition(job, JOB_AWAITING_CAPTCHA)
+
+            text = self._await_captcha_answer(session, job, image, stop)
+            if stop.is_set():
+                self._fail_or_retry(job, 'CAPTCHA interrompido pelo encerramento do pool', stop)
+                return False
+            if text is None:
+                # Expirou sem resposta: pede um CAPTCHA novo clicando de novo no download
+                logger.warning(f"CAPTCHA do trabalho {job.job_id} expirou, solicitando outro")
+                session.click_download_button()
+                continue
+
+            result = session.submit_captcha(text)
+            if result != SUBMIT_OK:
+                self._fail_or_retry(job, f'Falha ao enviar o CAPTCHA ({result})', stop)
+                return False
+
+            # Dá tempo para a página validar a resposta
+            time.sleep(1.5)
+            if not session.captcha_present():
+                return True
+            logger.info(f"CAPTCHA do trabalho {job.job_id} não foi aceito, tentando novamente")
+
+        self._fail_or_retry(job, 'CAPTCHA não aceito após várias tentativas', stop)
+        return False
+
+    def _serve_from_store(self, job):
+        """Conclui o trabalho com a cópia do armazenamento, se houver uma dentro da validade."""
+        if not self.store or job.force:
+            return False
+
+        entry = self.store.fresh(job.value)
+        if not entry:
+            return False
+
+        with self._lock:
+            job.file_path = entry['path']
+            self._served_from_store += 1
+        self._transition(job, JOB_DONE, detail={
+            'from_store': True,
+            'sha256': entry['sha256'],
+            'fetched_at': entry['fetched_at'],
+        })
+        return True
+
+    def _start_direct_download(self, session, job, requested_at):
+        """
+        Captura o pedido de download do Chrome e o transfere ao DirectDownloader.
+
+        Returns:
+            bool: True se o download direto começou; False para aguardar o Chrome
+        """
+        if not self.direct_downloader or not self.direct_download_dir or not session.download_capture:
+            return False
+
+        capture = session.download_capture.wait(timeout=self.direct_capture_timeout)
+        if not capture:
+            logger.warning(f"Pedido de download do trabalho {job.job_id} não capturado, aguardando o Chrome")
+            return False
+
+        target_dir = os.path.join(str(self.direct_download_dir), job.job_id)
+        paths = []
+
+        def on_started(path):
+            paths.append(path)
+            with self._lock:
+                self._direct_jobs[path] = job.job_id
+
+        def on_done(info, error):
+            with self._lock:
+                for path in paths:
+                    self._direct_jobs.pop(path, None)
+            if info:
+                job.file_path = info['path']
+                self._finish(job, detail={
+                    'size': info['size'],
+                    'sha256': info['sha256'],
+                    'checksum_verified': info['checksum_verified'],
+                    'retries': info['retries'],
+                })
+            else:
+                self._fail_or_retry(job, f'Falha no download direto: {error}')
+
+        self._transition(job, JOB_DOWNLOADING, detail={
+            'download_dir': target_dir,
+            'requested_at': requested_at,
+            'direct': True,
+        })
+        return self.direct_downloader.start(session.driver, capture, target_dir, on_done, on_started)
+
+    def _await_captcha_answer(self, session, job, image, stop):
+        job.captcha_event.clear()
+        job.captcha_answer = None
+
+        def on_solution(task, text):
+            job.captcha_answer = text
+            job.captcha_event.set()
+
+        def on_expired(task):
+            job.captcha_event.set()
+
+        self.captcha_queue.submit(session.session_id, image, ttl=self.captcha_timeout,
+                                  on_solution=on_solution, on_expired=on_expired)
+
+        # Margem para a manutenção da fila marcar a expiração; espera em fatias
+        # para que stop() não fique preso atrás de um CAPTCHA sem operador
+        deadline = time.monotonic() + self.captcha_timeout + 5
+        while not job.captcha_event.wait(timeout=1):
+            if stop.is_set() or time.monotonic() >= deadline:
+                break
+        self.captcha_queue.cancel_session(session.session_id)
+        return job.captcha_answer
+
+    def _list_files(self, directory):
+        try:
+            return set(os.listdir(directory))
+        except FileNotFoundError:
+            return set()
+
+    def _drain_download_events(self, session_id):
+        with self._lock:
+            events = self._download_events.setdefault(session_id, queue.Queue())
+        while not events.empty():
+            events.get_nowait()
+        return events
+
+    def _wait_for_download(self, session, before, requested_at, stop):
+        """
+        Aguarda o arquivo da sessão terminar de baixar.
+
+        A conclusão chega por notify_download() assim que o arquivo aparece; a
+        varredura do diretório da sessão a cada segundo cobre o caso de não
+        haver observador de downloads ativo.
+        """
+        with self._lock:
+            events = self._download_events.setdefault(session.session_id, queue.Queue())
+        deadline = time.time() + self.download_timeout
+        sizes = {}
+
+        while time.time() < deadline and not stop.is_set():
+            try:
+                info = events.get(timeout=1)
+                if info['finished_at'] >= requested_at:
+                    return info['path']
+                continue
+            except queue.Empty:
+                pass
+
+            for name in self._list_files(session.download_dir) - before:
+                if name.endswith(PARTIAL_SUFFIXES):
+                    continue
+                path = os.path.join(session.download_dir, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                # Considera completo quando o tamanho para de mudar
+                if size > 0 and sizes.get(name) == size:
+                    return path
+                sizes[name] = size
+
+        return None
+
+    def _find_completed_download(self, detail, claimed):
+        """Procura um arquivo completo que chegou após o pedido de download registrado."""
+        directory = detail.get('download_dir')
+        requested_at = detail.get('requested_at', 0)
+        if not directory:
+            return None
+
+        for name in sorted(self._list_files(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith(PARTIAL_SUFFIXES) or path in claimed:
+                continue
+            try:
+                if os.path.getmtime(path) >= requested_at and os.path.getsize(path) > 0:
+                    return path
+            except OSError:
+                continue
+        return None
+
+    def _transition(self, job, state, error=None, detail=None):
+        with self._lock:
+            job.state = state
+            job.updated_at = time.time()
+            job.history.append((state, job.updated_at))
+            if error is not None:
+                job.error = error
+            if state in FINAL_STATES:
+                job.finished_at = job.updated_at
+                if state == JOB_DONE and job.started_at:
+                    # Trabalhos atendidos pelo armazenamento não contam na vazão de downloads
+                    self._completions.append(job.finished_at)
+            data = job.to_dict()
+
+        if self.journal:
+            try:
+                self.journal.record_transition(job, detail)
+            except Exception as e:
+                logger.error(f"Erro ao registrar transição no diário: {str(e)}")
+
+        logger.info(f"Trabalho {job.job_id} ({job.value}): {state}")
+        if self.emit:
+            try:
+                self.emit('job_update', data)
+            except Exception as e:
+                logger.error(f"Erro ao notificar atualização do trabalho: {str(e)}")
+
+    def _finish(self, job, detail=None):
+        detail = dict(detail or {})
+
+        report = None
+        if (self.catalog or self.exporter) and job.file_path:
+            report = inspect_shapefile(job.file_path, with_geometry=self.exporter is not None)
+            if not report['valid']:
+                self._reject_download(job, report)
+                return
+
+        if self.store and job.file_path:
+            try:
+                entry = self.store.add(job.value, job.file_path, sha256=detail.get('sha256'))
+                job.file_path = entry['path']
+                detail['sha256'] = entry['sha256']
+            except Exception as e:
+                logger.error(f"Erro ao guardar o download de {job.value} no armazenamento: {str(e)}")
+
+        if report and self.catalog:
+            try:
+                detail['features'] = self.catalog.add(job.value, report, sha256=detail.get('sha256'), path=job.file_path)
+            except Exception as e:
+                logger.error(f"Erro ao indexar {job.value} no catálogo: {str(e)}")
+
+        if report and self.exporter:
+            try:
+                sha256 = detail.get('sha256') or file_sha256(job.file_path)
+                detail['exported_parts'] = len(self.exporter.export(job.value, report, sha256))
+            except Exception as e:
+                logger.error(f"Erro ao exportar {job.value} para GeoParquet: {str(e)}")
+
+        self._transition(job, JOB_DONE, detail=detail or None)
+
+    def _reject_download(self, job, report):
+        """Descarta um zip corrompido ou incompleto e devolve o trabalho à fila."""
+        try:
+            os.remove(job.file_path)
+        except OSError:
+            pass
+        job.file_path = None
+        self._fail_or_retry(job, f"Shapefile inválido: {'; '.join(report['errors'][:3])}")
+
+    def _fail_or_retry(self, job, error, stop=None):
+        if (stop or self._stop).is_set():
+            # Interrompido pelo encerramento: não conta como falha e volta à fila,
+            # onde é retomado pelo próximo start()
+            with self._lock:
+                job.attempts = max(0, job.attempts - 1)
+            self._transition(job, JOB_QUEUED, error='Interrompido pelo encerramento do pool')
+            self._queue.put(job.job_id)
+        elif job.attempts < self.max_attempts:
+            logger.warning(f"Trabalho {job.job_id} falhou ({error}), tentando novamente")
+            self._transition(job, JOB_QUEUED, error=error)
+            self._queue.put(job.job_id)
+        else:
+            self._transition(job, JOB_FAILED, error=error)
+
+    def _count_states(self, jobs):
+        counts = {state: 0 for state in JOB_STATES}
+        for job in jobs:
+            counts[job['state']] += 1
+        return counts
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Métricas da aplicação no formato de texto do Prometheus.
+
+Contadores, medidores e histogramas com rótulos, registrados em um registro
+global e expostos pela rota /metrics. A implementação é própria e pequena
+para não acrescentar dependências; o formato segue a exposição em texto
+0.0.4 do Prometheus.
+"""
+
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+# Limites padrão dos histogramas de latência, em segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value):
+    """Formata um número como o Prometheus espera."""
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=None):
+    """Monta o bloco {nome="valor",...} de uma série."""
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """
+    Base das métricas: nome, ajuda, rótulos e séries por combinação de rótulos.
+
+    Com function, os valores são lidos a cada exposição: a função retorna um
+    número (sem rótulos) ou um dicionário {valor do rótulo ou tupla: valor}.
+    Serve para expor estados que já são contados em outro lugar (fila, pool).
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.function = function
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Métrica {self.name} espera os rótulos {self.label_names}, recebeu {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        if self.function:
+            self._refresh()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"]
+
+    def _refresh(self):
+        try:
+            result = self.function()
+        except Exception:
+            return
+        with self._lock:
+            if isinstance(result, dict):
+                self._series = {tuple(str(part) for part in (key if isinstance(key, tuple) else (key,))): value
+                                for key, value in result.items()}
+            elif result is not None:
+                self._series = {(): result}
+
+
+class Counter(Metric):
+    """Contador que só cresce."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def total(self):
+        """Soma de todas as séries do contador."""
+        with self._lock:
+            return sum(self._series.values())
+
+
+class Gauge(Metric):
+    """Medidor: valor que sobe e desce."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    """Histograma de latências com limites cumulativos."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            cumulative += count
+            labels = format_labels(self.label_names, key, {'le': format_value(float(bound))})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class StageTimer:
+    """
+    Mede etapas consecutivas de uma função em um histograma rotulado por etapa.
+
+    start('b') encerra a etapa anterior e começa 'b'; finish() encerra a
+    etapa aberta (use em um finally para cobrir os retornos antecipados).
+    """
+
+    def __init__(self, histogram, label='strategy'):
+        self.histogram = histogram
+        self.label = label
+        self._stage = None
+        self._started = None
+
+    def start(self, stage):
+        self.finish()
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def finish(self):
+        if self._stage is not None:
+            self.histogram.observe(time.perf_counter() - self._started, **{self.label: self._stage})
+        self._stage = None
+
+
+class Registry:
+    """Conjunto de métricas expostas juntas."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=(), function=None):
+        return self.register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Texto de exposição de todas as métricas."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Registro global usado pela aplicação
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def payload_size(data):
+    """Tamanho aproximado, em bytes, de um payload de evento (sem serializá-lo)."""
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data)
+    if isinstance(data, dict):
+        return sum(len(str(key)) + payload_size(value) + 4 for key, value in data.items()) + 2
+    if isinstance(data, (list, tuple)):
+        return sum(payload_size(value) + 1 for value in data) + 2
+    return len(str(data))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Detecção do CAPTCHA pelas respostas de rede do Chrome.
+
+A imagem do CAPTCHA chega ao navegador por HTTP antes de aparecer na página.
+Com os eventos CDP Network.responseReceived e Network.loadingFinished (lidos
+por um CdpEventPump), a resposta é reconhecida pela URL ou pelo tipo MIME e
+seus bytes são obtidos com Network.getResponseBody assim que terminam de
+chegar: sem procurar o elemento no DOM, rolar a página ou tirar screenshot.
+"""
+
+import time
+import base64
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+logger = logging.getLogger('network_captcha')
+
+# Trechos da URL que identificam a imagem do CAPTCHA
+CAPTCHA_URL_PATTERNS = ('captcha',)
+
+# Tipos MIME usados apenas pelo CAPTCHA no site (vazio: só a URL decide)
+CAPTCHA_MIME_TYPES = ()
+
+POLL_INTERVAL = 0.1
+
+# Quantidade de respostas aguardando o fim do carregamento
+MAX_PENDING = 100
+
+
+def is_captcha_response(response, resource_type=None, url_patterns=CAPTCHA_URL_PATTERNS,
+                        mime_types=CAPTCHA_MIME_TYPES):
+    """
+    Indica se uma resposta de rede é a imagem do CAPTCHA.
+
+    Args:
+        response: Campo 'response' de Network.responseReceived
+        resource_type: Tipo do recurso ('Image', 'XHR'...)
+        url_patterns: Trechos da URL que identificam o CAPTCHA
+        mime_types: Tipos MIME exclusivos do CAPTCHA
+    """
+    mime_type = (response.get('mimeType') or '').lower()
+    if not (mime_type.startswith('image/') or resource_type == 'Image'):
+        return False
+    if response.get('status', 200) >= 400:
+        return False
+    if mime_type in mime_types:
+        return True
+
+    parsed = urlparse(response.get('url', ''))
+    address = (parsed.path + '?' + parsed.query).lower()
+    return any(pattern in address for pattern in url_patterns)
+
+
+class NetworkCaptchaCapture:
+    """
+    Captura as imagens de CAPTCHA recebidas por um driver.
+
+    Cada imagem vira um dicionário {'image' (data URL), 'url', 'mime_type',
+    'size', 'request_id', 'captured_at'} guardado até ser consumido por take()
+    ou wait().
+    """
+
+    def __init__(self, pump, url_patterns=CAPTCHA_URL_PATTERNS, mime_types=CAPTCHA_MIME_TYPES):
+        self.pump = pump
+        self.url_patterns = url_patterns
+        self.mime_types = mime_types
+        self._pending = {}  # requestId -> resposta reconhecida, aguardando o corpo
+        self._captured = deque(maxlen=10)
+        self._lock = threading.Lock()
+        self.captured_count = 0
+        self.failed_count = 0
+        pump.subscribe('Network.responseReceived', self._on_response)
+        pump.subscribe('Network.loadingFinished', self._on_finished)
+        pump.subscribe('Network.loadingFailed', self._on_failed)
+
+    def reset(self):
+        """Descarta CAPTCHAs e respostas acumulados (ex.: de um trabalho anterior)."""
+        self.pump.poll()
+        with self._lock:
+            self._pending.clear()
+            self._captured.clear()
+
+    def take(self):
+        """Lê os eventos pendentes e retorna o CAPTCHA mais recente, ou None."""
+        self.pump.poll()
+        with self._lock:
+            if not self._captured:
+                return None
+            latest = self._captured.pop()
+            # Imagens mais antigas foram substituídas pela recente
+            self._captured.clear()
+            return latest
+
+    def wait(self, timeout=15):
+        """
+        Aguarda a chegada de uma imagem de CAPTCHA.
+
+        Returns:
+            dict: CAPTCHA capturado ou None se nenhum chegou no tempo limite
+        """
+        deadline = time.time() + timeout
+        while True:
+            captured = self.take()
+            if captured or time.time() >= deadline:
+                return captured
+            time.sleep(POLL_INTERVAL)
+
+    def _on_response(self, params):
+        response = params.get('response', {})
+        if not is_captcha_response(response, params.get('type'), self.url_patterns, self.mime_types):
+            return
+        with self._lock:
+            self._pending[params['requestId']] = {
+                'url': response.get('url'),
+                'mime_type': response.get('mimeType') or 'image/png',
+                'received_at': time.time(),
+            }
+            if len(self._pending) > MAX_PENDING:
+                self._pending.pop(next(iter(self._pending)))
+
+    def _on_finished(self, params):
+        with self._lock:
+            pending = self._pending.pop(params.get('requestId'), None)
+        if not pending:
+            return
+
+        # O corpo precisa ser lido logo: o Chrome descarta respostas antigas
+        try:
+            result = self.pump.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': params['requestId']})
+        except Exception as e:
+            self.failed_count += 1
+            logger.warning(f"Erro ao obter imagem do CAPTCHA de {pending['url']}: {str(e)}")
+            return
+
+        body = result.get('body', '')
+        data = body if result.get('base64Encoded') else base64.b64encode(body.encode('utf-8')).decode('ascii')
+        captured = dict(pending,
+                        request_id=params['requestId'],
+                        image=f"data:{pending['mime_type']};base64,{data}",
+                        size=params.get('encodedDataLength'),
+                        captured_at=time.time())
+        with self._lock:
+            self._captured.append(captured)
+            self.captured_count += 1
+        logger.info(f"Imagem do CAPTCHA recebida pela rede: {pending['url']}")
+
+    def _on_failed(self, params):
+        with self._lock:
+            self._pending.pop(params.get('requestId'), None)
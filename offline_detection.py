@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Detecção de CAPTCHA sem navegador sobre snapshots gravados do DOM.
+
+As estratégias de check_for_captcha() e captcha_force_detection() são
+definidas aqui (palavras-chave e XPaths usados também pelo captcha_mirror)
+e reaplicadas com lxml ao corpus de dom_snapshots, na mesma ordem da
+detecção ao vivo. O relatório traz precisão, revocação e tempo por
+estratégia, isoladas e em cascata, para ajustar a detecção na escala do
+corpus:
+
+    python offline_detection.py data/snapshots [--conjunto force] [--json]
+
+Depende de lxml, que é opcional: sem ele a avaliação fica indisponível.
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+
+from dom_snapshots import load_corpus, load_snapshot_html
+from captcha_queue import percentile
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+logger = logging.getLogger('offline_detection')
+
+# Estratégias compartilhadas com o captcha_mirror
+
+# Método 0: palavras na URL ou no título da página de download
+DOWNLOAD_KEYWORDS = ["download", "baixar", "shapefile", "captcha"]
+# Método 1: imagem com "captcha" no endereço
+CAPTCHA_IMAGE_XPATH = "//img[contains(@src, 'captcha')]"
+# Método 2: texto que menciona CAPTCHA
+CAPTCHA_TEXT_XPATH = ("//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', "
+                      "'abcdefghijklmnopqrstuvwxyz'), 'captcha')]")
+# Método 3: campo de entrada do CAPTCHA
+CAPTCHA_INPUT_XPATH = "//input[contains(@id, 'captcha') or contains(@name, 'captcha')]"
+# Método 4: textos com "código"/"code" (qualquer nó de texto do corpo, como o TreeWalker ao vivo)
+CODE_KEYWORDS = ('código', 'code')
+# Detecção forçada: divs de CAPTCHA
+CAPTCHA_DIV_XPATH = ("//div[contains(@id, 'captcha') or contains(@class, 'captcha') or "
+                     "contains(@id, 'CAPTCHA') or contains(@class, 'CAPTCHA')]")
+
+# Ordem das estratégias em cada função ao vivo
+CHECK_STRATEGIES = ('url_titulo', 'imagem', 'texto', 'campo', 'codigo')
+FORCE_STRATEGIES = ('div_captcha', 'iframe', 'pagina_inteira')
+STRATEGY_SETS = {
+    'check': CHECK_STRATEGIES,
+    'force': FORCE_STRATEGIES,
+}
+
+
+def is_available():
+    """Indica se o lxml está instalado."""
+    return lxml_html is not None
+
+
+def parse_document(html):
+    """Árvore lxml de um HTML (None para documento vazio)."""
+    if not html or not html.strip():
+        return None
+    return lxml_html.document_fromstring(html)
+
+
+class SnapshotPage:
+    """Um snapshot pronto para as estratégias: metadados e árvores já analisadas."""
+
+    def __init__(self, entry, content):
+        self.entry = entry
+        self.url = entry.get('url') or ''
+        self.title = entry.get('title') or ''
+        self.document = parse_document(content['html'])
+        self.frames = [parse_document(frame.get('html')) for frame in content.get('frames', [])]
+
+
+def match_url_title(page):
+    text = f"{page.url} {page.title}".lower()
+    return any(keyword in text for keyword in DOWNLOAD_KEYWORDS)
+
+
+def match_xpath(xpath):
+    def matcher(page):
+        return page.document is not None and bool(page.document.xpath(xpath))
+    return matcher
+
+
+def match_code_text(page):
+    if page.document is None:
+        return False
+    body = page.document.find('body')
+    if body is None:
+        return False
+    return any(keyword in text.lower() for text in body.xpath('.//text()') for keyword in CODE_KEYWORDS)
+
+
+def match_iframe_images(page):
+    # Ao vivo, um iframe conta quando tem alguma imagem
+    return any(frame is not None and bool(frame.xpath('//img')) for frame in page.frames)
+
+
+STRATEGIES = {
+    'url_titulo': match_url_title,
+    'imagem': match_xpath(CAPTCHA_IMAGE_XPATH),
+    'texto': match_xpath(CAPTCHA_TEXT_XPATH),
+    'campo': match_xpath(CAPTCHA_INPUT_XPATH),
+    'codigo': match_code_text,
+    'div_captcha': match_xpath(CAPTCHA_DIV_XPATH),
+    'iframe': match_iframe_images,
+    # Último recurso da detecção forçada: a página inteira é enviada como CAPTCHA
+    'pagina_inteira': lambda page: True,
+}
+
+
+def detect(page, strategies=CHECK_STRATEGIES):
+    """
+    Aplica as estratégias em ordem, como a detecção ao vivo.
+
+    Returns:
+        dict: {'detected', 'strategy' (a que encontrou), 'matches' {estratégia: bool},
+               'timings' {estratégia: segundos}}
+    """
+    matches = {}
+    timings = {}
+    first = None
+    for name in strategies:
+        started = time.perf_counter()
+        matched = STRATEGIES[name](page)
+        timings[name] = time.perf_counter() - started
+        matches[name] = matched
+        if matched and first is None:
+            first = name
+    return {'detected': first is not None, 'strategy': first, 'matches': matches, 'timings': timings}
+
+
+def confusion(predictions):
+    """Precisão e revocação de uma lista de (previsto, rótulo)."""
+    tp = sum(1 for predicted, label in predictions if predicted and label)
+    fp = sum(1 for predicted, label in predictions if predicted and not label)
+    fn = sum(1 for predicted, label in predictions if not predicted and label)
+    tn = sum(1 for predicted, label in predictions if not predicted and not label)
+    return {
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'precision': tp / (tp + fp) if tp + fp else None,
+        'recall': tp / (tp + fn) if tp + fn else None,
+    }
+
+
+def timing_summary(values):
+    return {
+        'mean_ms': sum(values) / len(values) * 1000 if values else None,
+        'p95_ms': percentile(values, 0.95) * 1000 if values else None,
+        'total_s': sum(values),
+    }
+
+
+def evaluate(directory, strategies=CHECK_STRATEGIES, limit=None):
+    """
+    Avalia as estratégias sobre os snapshots rotulados de um corpus.
+
+    Cada estratégia é medida isoladamente (todas rodam em todos os snapshots)
+    e em cascata, com a primeira que encontra decidindo, como ao vivo.
+
+    Args:
+        directory: Diretório do corpus gravado por SnapshotRecorder
+        strategies: Estratégias, na ordem da cascata
+        limit: Máximo de snapshots avaliados
+
+    Returns:
+        dict: Relatório com totais, cascata, estratégias e divergências com a detecção ao vivo
+    """
+    if not is_available():
+        raise RuntimeError('lxml não instalado; avaliação offline indisponível')
+
+    corpus = load_corpus(directory, labeled_only=True)[:limit]
+    started = time.perf_counter()
+    parse_times = []
+    per_strategy = {name: {'predictions': [], 'timings': []} for name in strategies}
+    cascade = []
+    first_hits = {}
+    live = []
+    misses = []
+
+    for entry in corpus:
+        try:
+            content = load_snapshot_html(directory, entry['id'])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Snapshot {entry['id']} ilegível: {str(e)}")
+            continue
+
+        parse_started = time.perf_counter()
+        page = SnapshotPage(entry, content)
+        parse_times.append(time.perf_counter() - parse_started)
+
+        result = detect(page, strategies)
+        label = entry['label']
+        for name in strategies:
+            per_strategy[name]['predictions'].append((result['matches'][name], label))
+            per_strategy[name]['timings'].append(result['timings'][name])
+
+        cascade.append((result['detected'], label))
+        if result['strategy']:
+            first_hits[result['strategy']] = first_hits.get(result['strategy'], 0) + 1
+        if entry.get('live_detected') is not None:
+            live.append((entry['live_detected'], label))
+        if result['detected'] != label:
+            misses.append({'id': entry['id'], 'url': entry.get('url'), 'label': label,
+                           'strategy': result['strategy']})
+
+    elapsed = time.perf_counter() - started
+    return {
+        'snapshots': len(cascade),
+        'elapsed_s': elapsed,
+        'snapshots_per_second': len(cascade) / elapsed if elapsed > 0 else None,
+        'parse': timing_summary(parse_times),
+        'cascade': dict(confusion(cascade), first_hits=first_hits),
+        'strategies': {name: dict(confusion(values['predictions']), **timing_summary(values['timings']))
+                       for name, values in per_strategy.items()},
+        'live': confusion(live) if live else None,
+        'errors': misses[:50],
+    }
+
+
+def format_report(report):
+    """Relatório em texto para o terminal."""
+    def ratio(value):
+        return f"{value:.3f}" if value is not None else '-'
+
+    lines = [
+        f"{report['snapshots']} snapshots em {report['elapsed_s']:.2f}s "
+        f"({report['snapshots_per_second'] or 0:.0f}/s; análise do HTML {report['parse']['mean_ms'] or 0:.2f} ms em média)",
+        '',
+        f"{'estratégia':<16}{'precisão':>10}{'revocação':>11}{'vp':>6}{'fp':>6}{'fn':>6}{'média ms':>10}{'p95 ms':>9}",
+    ]
+    for name, result in report['strategies'].items():
+        lines.append(f"{name:<16}{ratio(result['precision']):>10}{ratio(result['recall']):>11}"
+                     f"{result['tp']:>6}{result['fp']:>6}{result['fn']:>6}"
+                     f"{result['mean_ms'] or 0:>10.3f}{result['p95_ms'] or 0:>9.3f}")
+    cascade = report['cascade']
+    lines.append(f"{'cascata':<16}{ratio(cascade['precision']):>10}{ratio(cascade['recall']):>11}"
+                 f"{cascade['tp']:>6}{cascade['fp']:>6}{cascade['fn']:>6}")
+    if report['live']:
+        live = report['live']
+        lines.append(f"{'ao vivo':<16}{ratio(live['precision']):>10}{ratio(live['recall']):>11}"
+                     f"{live['tp']:>6}{live['fp']:>6}{live['fn']:>6}")
+    lines.append('')
+    lines.append('Primeira estratégia a encontrar: ' +
+                 ', '.join(f"{name} {count}" for name, count in sorted(cascade['first_hits'].items())))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Avalia as estratégias de detecção de CAPTCHA sobre snapshots do DOM')
+    parser.add_argument('directory', help='Diretório do corpus (ex.: data/snapshots)')
+    parser.add_argument('--conjunto', choices=sorted(STRATEGY_SETS), default='check',
+                        help='Estratégias de check_for_captcha ou de captcha_force_detection')
+    parser.add_argument('--limit', type=int, help='Máximo de snapshots avaliados')
+    parser.add_argument('--json', action='store_true', help='Imprime o relatório completo em JSON')
+    args = parser.parse_args()
+
+    if not is_available():
+        print('lxml não instalado: pip install lxml')
+        sys.exit(1)
+
+    report = evaluate(args.directory, STRATEGY_SETS[args.conjunto], args.limit)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Controle de cortesia dos pedidos ao SICAR, comum a todas as sessões.
+
+Com várias sessões navegando ao mesmo tempo, rajadas de pedidos levam a
+consultapublica.car.gov.br a responder devagar, com páginas de erro ou com
+bloqueio. Toda navegação e todo download passam antes por scheduler.slot(),
+que, por host:
+
+- limita a taxa com um balde de fichas (rate pedidos/s, até burst seguidos);
+- limita os pedidos simultâneos (max_concurrent), reservando parte deles
+  (interactive_reserve) ao navegador interativo;
+- acrescenta um atraso aleatório (jitter) a cada liberação;
+- atende em ordem de chegada, com os pedidos do navegador interativo à
+  frente dos pedidos do pool;
+- reduz a taxa pela metade e pausa o host quando uma resposta é lenta ou é
+  uma página de erro, e a recupera aos poucos a cada resposta normal
+  (aumento aditivo, redução multiplicativa).
+
+O objetivo é a maior vazão sustentável, em vez de rajadas seguidas de
+bloqueios. O scheduler do módulo começa desativado (sem espera nenhuma) e é
+configurado pelo captcha_mirror. Os processos das sessões do pool
+(browser_worker_main) não importam o captcha_mirror e o mantêm desativado: a
+vez é obtida pelo processo pai para cada comando, e o filho mede as
+navegações do comando (collect_observations) e envia a duração e as páginas
+de erro ao pai, que as aplica à vez com Slot.report().
+
+Como a vez de uma sessão do pool dura o comando inteiro (até alguns minutos),
+um pool ocupado poderia deixar o navegador interativo esperando por todo esse
+tempo. Por isso os pedidos do pool usam no máximo max_concurrent -
+interactive_reserve vagas, e os pedidos interativos (slot(...,
+interactive=True)) podem usar todas, passando à frente da fila do pool.
+
+Só contam como falha do host as respostas que o chamador marca com error()
+(página de erro, estado 429/5xx, erro de conexão com o servidor); exceções
+locais, como a queda do Chrome ou do processo da sessão, não reduzem a taxa.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from metrics import registry
+
+logger = logging.getLogger('politeness')
+
+POLITENESS_WAIT = registry.histogram('politeness_wait_seconds', 'Espera até a liberação de um pedido ao host',
+                                     ('host', 'kind'))
+POLITENESS_RATE = registry.gauge('politeness_rate', 'Taxa atual de pedidos liberados por segundo', ('host',))
+POLITENESS_WAITING = registry.gauge('politeness_waiting', 'Pedidos aguardando liberação', ('host',))
+POLITENESS_BACKOFFS = registry.counter('politeness_backoffs_total', 'Reduções de taxa por resposta lenta ou erro',
+                                       ('host', 'reason'))
+
+# Tipos de pedido
+KIND_NAVIGATION = 'navegacao'
+KIND_DOWNLOAD = 'download'
+
+# Motivos de redução da taxa
+REASON_SLOW = 'lenta'
+REASON_ERROR = 'erro'
+
+# Trechos de título que indicam página de erro, limitação ou bloqueio
+ERROR_PAGE_MARKERS = ('429', '502', '503', '504', 'too many requests', 'service unavailable', 'bad gateway',
+                      'gateway timeout', 'acesso negado', 'access denied', 'bloquead', 'indisponível')
+
+# Estados HTTP que indicam limitação ou sobrecarga do servidor
+ERROR_STATUSES = (429, 502, 503, 504)
+
+
+# Observações dos slots liberados na thread atual (ver collect_observations)
+_observations = threading.local()
+
+
+@contextmanager
+def collect_observations():
+    """
+    Coleta a duração e o resultado dos slots liberados na thread atual.
+
+    Usado pelo processo da sessão do pool para devolver ao processo pai o que
+    observou ao navegar, mesmo com o scheduler local desativado.
+
+    Yields:
+        list: Dicionários {'elapsed': segundos ou None, 'error': bool}
+    """
+    previous = getattr(_observations, 'items', None)
+    _observations.items = []
+    try:
+        yield _observations.items
+    finally:
+        _observations.items = previous
+
+
+def is_error_page(title):
+    """Indica se o título da página é de uma página de erro ou de bloqueio."""
+    lowered = (title or '').lower()
+    return any(marker in lowered for marker in ERROR_PAGE_MARKERS)
+
+
+class PolitenessTimeout(Exception):
+    """O pedido não foi liberado dentro do tempo limite."""
+
+
+class HostPolicy:
+    """Limites de pedidos a um host."""
+
+    def __init__(self, rate=0.5, burst=2, max_concurrent=2, jitter=1.0, min_rate=0.05, increase=0.02,
+                 backoff_factor=0.5, slow_threshold=15.0, pause=10.0, max_pause=300.0, interactive_reserve=1):
+        """
+        Args:
+            rate: Pedidos por segundo liberados em regime normal (teto da recuperação)
+            burst: Pedidos que podem sair seguidos depois de um período ocioso
+            max_concurrent: Pedidos simultâneos ao host
+            jitter: Atraso aleatório máximo, em segundos, acrescentado a cada liberação
+            min_rate: Piso da taxa depois das reduções
+            increase: Aumento da taxa a cada resposta normal
+            backoff_factor: Fator aplicado à taxa a cada resposta lenta ou de erro
+            slow_threshold: Duração, em segundos, acima da qual a resposta é lenta
+            pause: Pausa do host após um erro (dobra a cada erro seguido)
+            max_pause: Pausa máxima do host
+            interactive_reserve: Vagas de max_concurrent que os pedidos do pool
+                não usam, guardadas para o navegador interativo (o pool fica
+                com pelo menos uma)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.jitter = jitter
+        self.min_rate = min_rate
+        self.increase = increase
+        self.backoff_factor = backoff_factor
+        self.slow_threshold = slow_threshold
+        self.pause = pause
+        self.max_pause = max_pause
+        self.interactive_reserve = interactive_reserve
+
+    @property
+    def background_concurrent(self):
+        """Pedidos simultâneos do pool, descontada a reserva do navegador interativo."""
+        return max(1, self.max_concurrent - self.interactive_reserve)
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class HostState:
+    """Balde de fichas, pedidos em andamento e fila de espera de um host."""
+
+    def __init__(self, host, policy):
+        self.host = host
+        self.policy = policy
+        self.rate = policy.rate
+        self.tokens = float(policy.burst)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.active_interactive = 0
+        self.waiting = deque()
+        self.interactive_waiting = deque()
+        self.paused_until = 0.0
+        self.consecutive_errors = 0
+        self.counters = {'granted': 0, 'slow': 0, 'errors': 0, 'timeouts': 0}
+
+    def refill(self, now):
+        self.tokens = min(float(self.policy.burst), self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def wait_time(self, now):
+        """Tempo até a próxima ficha ou o fim da pausa."""
+        waits = [self.paused_until - now]
+        if self.tokens < 1:
+            waits.append((1 - self.tokens) / self.rate)
+        return max(0.05, *waits)
+
+    def to_dict(self, now):
+        return {
+            'host': self.host,
+            'rate': self.rate,
+            'configured_rate': self.policy.rate,
+            'tokens': round(self.tokens, 3),
+            'active': self.active,
+            'active_interactive': self.active_interactive,
+            'waiting': len(self.waiting) + len(self.interactive_waiting),
+            'interactive_waiting': len(self.interactive_waiting),
+            'paused_for': round(max(0.0, self.paused_until - now), 1),
+            'consecutive_errors': self.consecutive_errors,
+            'counters': dict(self.counters),
+        }
+
+
+class Slot:
+    """
+    Pedido liberado; ao sair do bloco with, informa a duração e o resultado.
+
+    Exceções do bloco não marcam falha do host: podem vir do Chrome, do
+    processo da sessão ou do formulário. Quem vê a resposta do servidor chama
+    error().
+    """
+
+    def __init__(self, scheduler, host, kind, timed=True, interactive=False):
+        self.scheduler = scheduler
+        self.host = host
+        self.kind = kind
+        self.timed = timed
+        self.interactive = interactive
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.failed = False
+        self._released = False
+
+    def error(self):
+        """Marca a resposta como página de erro ou limitação do servidor."""
+        self.failed = True
+
+    def report(self, elapsed=None, error=False):
+        """
+        Aplica um resultado medido em outro lugar (ex.: no processo da sessão).
+
+        Args:
+            elapsed: Duração da resposta, em segundos; prevalece sobre a do bloco
+            error: Se a resposta foi uma página de erro ou limitação
+        """
+        if elapsed is not None:
+            self.elapsed = max(self.elapsed or 0.0, elapsed)
+        if error:
+            self.failed = True
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        elapsed = self.elapsed
+        if elapsed is None and self.timed:
+            elapsed = time.monotonic() - self.started
+
+        items = getattr(_observations, 'items', None)
+        if items is not None and (elapsed is not None or self.failed):
+            items.append({'elapsed': elapsed, 'error': self.failed})
+        if self.scheduler:
+            self.scheduler._release(self.host, elapsed, self.failed, self.interactive)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class PolitenessScheduler:
+    """Libera os pedidos de todas as sessões respeitando os limites de cada host."""
+
+    def __init__(self, policy=None, enabled=False):
+        self.policy = policy or HostPolicy()
+        self.enabled = enabled
+        self.policies = {}
+        self._hosts = {}
+        self._cond = threading.Condition()
+        self._tickets = 0
+
+    def configure(self, enabled=True, policy=None, policies=None):
+        """
+        Args:
+            enabled: Ativa o controle; desativado, slot() libera na hora
+            policy: HostPolicy padrão
+            policies: HostPolicy específica por host
+        """
+        with self._cond:
+            self.enabled = enabled
+            if policy:
+                self.policy = policy
+            if policies:
+                self.policies.update(policies)
+            for state in self._hosts.values():
+                state.policy = self.policies.get(state.host, self.policy)
+                state.rate = min(state.rate, state.policy.rate)
+            self._cond.notify_all()
+
+    def slot(self, url, kind=KIND_NAVIGATION, timeout=None, timed=True, interactive=False):
+        """
+        Aguarda a vez de um pedido ao host da URL.
+
+        Args:
+            url: URL do pedido (o host define os limites)
+            kind: KIND_NAVIGATION ou KIND_DOWNLOAD
+            timeout: Espera máxima pela liberação, em segundos (None: sem limite)
+            timed: Se a duração do bloco mede a resposta do servidor; False
+                quando o bloco inclui outras esperas (ex.: um comando inteiro
+                de uma sessão em processo separado)
+            interactive: Pedido do navegador interativo: pode usar as vagas
+                reservadas e passa à frente dos pedidos do pool
+
+        Returns:
+            Slot: Contexto do pedido; use com "with" e chame error() em página de erro
+
+        Raises:
+            PolitenessTimeout: Se timeout (segundos) passar sem liberação
+        """
+        host = urlparse(url).hostname or url
+        if not self.enabled:
+            return Slot(None, host, kind, timed, interactive)
+
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        with self._cond:
+            state = self._host(host)
+            self._tickets += 1
+            ticket = self._tickets
+            queue = state.interactive_waiting if interactive else state.waiting
+            queue.append(ticket)
+            self._update_waiting(state)
+            try:
+                while True:
+                    now = time.monotonic()
+                    state.refill(now)
+                    if (queue[0] == ticket and self._has_room(state, interactive)
+                            and state.tokens >= 1 and now >= state.paused_until):
+                        break
+                    wait = state.wait_time(now)
+                    if deadline:
+                        if now >= deadline:
+                            state.counters['timeouts'] += 1
+                            raise PolitenessTimeout(f"Pedido a {host} não liberado em {timeout}s")
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            except BaseException:
+                queue.remove(ticket)
+                self._update_waiting(state)
+                self._cond.notify_all()
+                raise
+
+            queue.popleft()
+            state.tokens -= 1
+            state.active += 1
+            if interactive:
+                state.active_interactive += 1
+            state.counters['granted'] += 1
+            jitter = random.uniform(0, state.policy.jitter)
+            self._update_waiting(state)
+            # O próximo da fila pode já ter ficha (rajada)
+            self._cond.notify_all()
+
+        if jitter:
+            time.sleep(jitter)
+        POLITENESS_WAIT.observe(time.monotonic() - started, host=host, kind=kind)
+        return Slot(self, host, kind, timed, interactive)
+
+    def status(self):
+        """Estado de cada host: taxa atual, fichas, pedidos em andamento e na fila."""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'policy': self.policy.to_dict(),
+                'hosts': [state.to_dict(now) for state in self._hosts.values()],
+            }
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if not state:
+            state = HostState(host, self.policies.get(host, self.policy))
+            self._hosts[host] = state
+        return state
+
+    @staticmethod
+    def _has_room(state, interactive):
+        """Indica se cabe mais um pedido simultâneo do tipo ao host."""
+        if state.active >= state.policy.max_concurrent:
+            return False
+        if interactive:
+            return True
+        # Os pedidos do pool esperam os interativos e deixam a reserva livre
+        return (not state.interactive_waiting
+                and state.active - state.active_interactive < state.policy.background_concurrent)
+
+    @staticmethod
+    def _update_waiting(state):
+        POLITENESS_WAITING.set(len(state.waiting) + len(state.interactive_waiting), host=state.host)
+
+    def _release(self, host, elapsed, failed, interactive=False):
+        with self._cond:
+            state = self._host(host)
+            state.active = max(0, state.active - 1)
+            if interactive:
+                state.active_interactive = max(0, state.active_interactive - 1)
+            policy = state.policy
+            slow = elapsed is not None and elapsed > policy.slow_threshold
+            reason = REASON_ERROR if failed else (REASON_SLOW if slow else None)
+
+            if reason:
+                state.rate = max(policy.min_rate, state.rate * policy.backoff_factor)
+                state.counters['errors' if failed else 'slow'] += 1
+                POLITENESS_BACKOFFS.inc(host=host, reason=reason)
+                if failed:
+                    state.consecutive_errors += 1
+                    pause = min(policy.max_pause, policy.pause * 2 ** (state.consecutive_errors - 1))
+                    state.paused_until = max(state.paused_until, time.monotonic() + pause)
+                    # Depois da pausa, recomeça sem rajada
+                    state.tokens = min(state.tokens, 0.0)
+                    logger.warning(f"Resposta de erro de {host}: taxa reduzida para {state.rate:.3f}/s, "
+                                   f"pausa de {pause:.0f}s")
+                else:
+                    logger.info(f"Resposta lenta de {host} ({elapsed:.1f}s): taxa reduzida para {state.rate:.3f}/s")
+            else:
+                state.consecutive_errors = 0
+                state.rate = min(policy.rate, state.rate + policy.increase)
+
+            POLITENESS_RATE.set(state.rate, host=host)
+            self._cond.notify_all()
+
+
+# Scheduler comum a todas as sessões do processo
+scheduler = PolitenessScheduler()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pré-visualização simplificada dos shapefiles baixados.
+
+As geometrias são simplificadas com Douglas-Peucker vetorizado em NumPy: uma
+única passada calcula a importância de cada vértice (a tolerância a partir da
+qual ele seria removido), e a tolerância final é escolhida para caber em um
+orçamento total de vértices. O GeoJSON resultante é guardado em cache pelo
+hash do zip, em memória e em disco.
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from shapefile_reader import inspect_shapefile, group_rings
+from shapefile_store import file_sha256
+
+logger = logging.getLogger('property_preview')
+
+# Vértices totais da pré-visualização e casas decimais das coordenadas (~10 cm)
+DEFAULT_MAX_VERTICES = 4000
+COORDINATE_DECIMALS = 6
+
+
+def douglas_peucker_importance(points):
+    """
+    Importância de cada vértice de uma linha pelo Douglas-Peucker.
+
+    Um vértice com importância d permanece na linha simplificada com qualquer
+    tolerância menor que d. Em vez de recursão por trecho, cada passada divide
+    de uma vez todos os trechos abertos: as distâncias de todos os vértices às
+    cordas e o máximo de cada trecho (np.maximum.reduceat) são calculados em
+    NumPy, e o número de passadas é a profundidade da recursão do DP. A
+    importância de um vértice nunca passa a do vértice que abriu seu trecho,
+    então o corte por tolerância reproduz o DP.
+
+    Args:
+        points: Array (n, 2) de coordenadas
+
+    Returns:
+        ndarray: Importância por vértice (extremos com infinito)
+    """
+    count = len(points)
+    importance = np.zeros(count)
+    importance[0] = importance[-1] = np.inf
+    anchor = np.zeros(count, dtype=bool)
+    anchor[0] = anchor[-1] = True
+
+    while True:
+        inner = np.flatnonzero(~anchor)
+        if len(inner) == 0:
+            break
+
+        anchors = np.flatnonzero(anchor)
+        segment = np.searchsorted(anchors, inner, side='right') - 1
+        left = anchors[segment]
+        right = anchors[segment + 1]
+
+        origin = points[left]
+        direction = points[right] - origin
+        offsets = points[inner] - origin
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        cross = np.abs(direction[:, 0] * offsets[:, 1] - direction[:, 1] * offsets[:, 0])
+        # Corda de comprimento zero (anel fechado): distância ao ponto inicial
+        distances = np.where(length > 0, cross / np.where(length > 0, length, 1.0),
+                             np.hypot(offsets[:, 0], offsets[:, 1]))
+
+        # Máximo de cada trecho; os vértices de um trecho são contíguos em inner
+        starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+        maxima = np.maximum.reduceat(distances, starts)
+        is_max = distances == np.repeat(maxima, np.diff(np.r_[starts, len(inner)]))
+        candidates = np.flatnonzero(is_max)
+        first = candidates[np.r_[True, segment[candidates[1:]] != segment[candidates[:-1]]]]
+
+        # O vértice mais recente entre os dois extremos é o que abriu o trecho
+        parent = np.minimum(importance[left[first]], importance[right[first]])
+        chosen = inner[first]
+        importance[chosen] = np.minimum(distances[first], parent)
+        anchor[chosen] = True
+
+    return importance
+
+
+def simplification_tolerance(importances, max_vertices):
+    """Menor tolerância que mantém o total de vértices dentro do orçamento."""
+    if not importances:
+        return 0.0
+    values = np.concatenate(importances)
+    finite = values[np.isfinite(values)]
+    budget = max_vertices - (len(values) - len(finite))
+    if budget <= 0 or len(finite) == 0:
+        return float(finite.max()) if len(finite) else 0.0
+    if budget >= len(finite):
+        return 0.0
+    # Valor logo abaixo dos budget maiores: os vértices acima dele são mantidos
+    cut = len(finite) - budget - 1
+    return float(np.partition(finite, cut)[cut])
+
+
+def simplify(points, importance, tolerance, minimum):
+    """Mantém os vértices acima da tolerância, garantindo um mínimo (4 para anéis)."""
+    keep = importance > tolerance
+    if keep.sum() < minimum and len(points) >= minimum:
+        keep[np.argsort(importance)[-minimum:]] = True
+    return np.round(points[keep], COORDINATE_DECIMALS).tolist()
+
+
+def build_preview(report, max_vertices=DEFAULT_MAX_VERTICES):
+    """
+    Monta o GeoJSON simplificado de um zip inspecionado com with_geometry=True.
+
+    Returns:
+        dict: FeatureCollection com camada, registro e atributos em properties
+    """
+    # Primeiro converte todas as partes e calcula as importâncias, para escolher
+    # uma tolerância única para o arquivo todo
+    items = []
+    importances = []
+    for layer in report['layers']:
+        for feature in layer['features']:
+            base_type, parts = feature.get('geometry') or (None, [])
+            if not parts:
+                continue
+            arrays = [np.frombuffer(part, dtype='<f8').reshape(-1, 2) for part in parts]
+            if base_type in ('Polygon', 'MultiPatch', 'PolyLine'):
+                ranks = [douglas_peucker_importance(array) for array in arrays]
+            else:
+                ranks = [np.full(len(array), np.inf) for array in arrays]
+            importances.extend(ranks)
+            items.append((layer['name'], feature, base_type, parts, arrays, ranks))
+
+    tolerance = simplification_tolerance(importances, max_vertices)
+    features = []
+    vertices = 0
+
+    for layer_name, feature, base_type, parts, arrays, ranks in items:
+        if base_type in ('Polygon', 'MultiPatch'):
+            # group_rings devolve as mesmas partes agrupadas; a identidade liga cada anel ao seu array
+            index_by_ring = {id(part): index for index, part in enumerate(parts)}
+            coordinates = [
+                [simplify(arrays[index_by_ring[id(ring)]], ranks[index_by_ring[id(ring)]], tolerance, 4)
+                 for ring in rings]
+                for rings in group_rings(parts)
+            ]
+            geometry = {'type': 'MultiPolygon', 'coordinates': coordinates}
+            vertices += sum(len(ring) for polygon in coordinates for ring in polygon)
+        elif base_type == 'PolyLine':
+            coordinates = [simplify(array, rank, tolerance, 2) for array, rank in zip(arrays, ranks)]
+            geometry = {'type': 'MultiLineString', 'coordinates': coordinates}
+            vertices += sum(len(line) for line in coordinates)
+        else:
+            coordinates = np.round(np.concatenate(arrays), COORDINATE_DECIMALS).tolist()
+            geometry = {'type': 'MultiPoint', 'coordinates': coordinates}
+            vertices += len(coordinates)
+
+        features.append({
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': dict(feature['attributes'], _layer=layer_name, _record=feature['record']),
+        })
+
+    bounds = [min((layer['bbox'][0] for layer in report['layers']), default=None),
+              min((layer['bbox'][1] for layer in report['layers']), default=None),
+              max((layer['bbox'][2] for layer in report['layers']), default=None),
+              max((layer['bbox'][3] for layer in report['layers']), default=None)]
+
+    return {
+        'type': 'FeatureCollection',
+        'bbox': bounds,
+        'features': features,
+        'simplification': {
+            'tolerance': tolerance,
+            'vertices': vertices,
+            'original_vertices': int(sum(len(rank) for rank in importances)),
+        },
+    }
+
+
+class PreviewCache:
+    """Pré-visualizações por hash do zip, em memória (LRU) e em disco."""
+
+    def __init__(self, directory, max_vertices=DEFAULT_MAX_VERTICES, memory_items=64):
+        """
+        Args:
+            directory: Diretório do cache em disco
+            max_vertices: Orçamento de vértices de cada pré-visualização
+            memory_items: Pré-visualizações mantidas em memória
+        """
+        self.directory = str(directory)
+        self.max_vertices = max_vertices
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, path, sha256=None):
+        """
+        Obtém (ou gera) a pré-visualização GeoJSON de um zip.
+
+        Args:
+            path: Caminho do zip
+            sha256: Hash do zip, se já conhecido
+
+        Returns:
+            dict: GeoJSON simplificado, ou None se o zip for inválido
+        """
+        sha256 = sha256 or file_sha256(path)
+        with self._lock:
+            if sha256 in self._memory:
+                self._memory.move_to_end(sha256)
+                return self._memory[sha256]
+
+        cache_path = os.path.join(self.directory, f"{sha256}-{self.max_vertices}.json")
+        preview = None
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding='utf-8') as cached:
+                    preview = json.load(cached)
+            except (OSError, ValueError):
+                preview = None
+
+        if preview is None:
+            report = inspect_shapefile(path, with_geometry=True)
+            if not report['valid'] and not report['layers']:
+                return None
+            preview = build_preview(report, self.max_vertices)
+            preview['sha256'] = sha256
+            temporary = cache_path + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as output:
+                json.dump(preview, output, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temporary, cache_path)
+            logger.info(f"Pré-visualização de {sha256[:12]} gerada: {preview['simplification']['vertices']} de "
+                        f"{preview['simplification']['original_vertices']} vértices")
+
+        with self._lock:
+            self._memory[sha256] = preview
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return preview
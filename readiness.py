@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sondas de prontidão de página.
+
+Com a estratégia de carregamento "eager" (ou "none"), driver.get() retorna
+sem esperar imagens, tiles e scripts tardios. Cada tipo de página declara
+aqui o que o fluxo precisa para seguir (campo de busca interativo, botão de
+download clicável, imagem do CAPTCHA carregada) e wait_until_ready() devolve
+o controle assim que tudo isso está pronto.
+
+As sondas de uma página são avaliadas juntas em uma única chamada de
+JavaScript por verificação, em vez de um find_elements por seletor.
+
+Como a busca do CAPTCHA em captcha_mirror, a verificação também olha dentro
+dos iframes visíveis (inclusive de outra origem): se a página não está
+pronta no documento principal, o driver entra em cada iframe e avalia as
+sondas lá. Cada verificação começa e termina no documento principal, mesmo
+quando um iframe some no meio dela; o resultado guarda o caminho até o
+iframe dos elementos, e quem precisa usá-los entra nele com inside_frame().
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+
+from metrics import registry
+
+logger = logging.getLogger('readiness')
+
+PAGE_READY_LATENCY = registry.histogram(
+    'page_ready_seconds', 'Espera até a página ficar pronta para o fluxo', ('page', 'result'))
+
+# Estados exigidos de um elemento, do mais fraco ao mais forte
+PRESENT = 'presente'
+VISIBLE = 'visivel'
+INTERACTIVE = 'interativo'  # visível, habilitado e não coberto por outro elemento
+LOADED = 'carregada'        # imagem visível e decodificada
+
+POLL_INTERVAL = 0.1
+
+# Níveis de iframes aninhados percorridos pela verificação
+MAX_FRAME_DEPTH = 2
+
+PROBE_SCRIPT = """
+const probes = arguments[0];
+
+function find(type, value) {
+    if (type === 'xpath') {
+        const result = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        const nodes = [];
+        for (let i = 0; i < result.snapshotLength; i++) nodes.push(result.snapshotItem(i));
+        return nodes;
+    }
+    if (type === 'id') {
+        const node = document.getElementById(value);
+        return node ? [node] : [];
+    }
+    if (type === 'name') return Array.from(document.getElementsByName(value));
+    if (type === 'class name') return Array.from(document.getElementsByClassName(value));
+    if (type === 'tag name') return Array.from(document.getElementsByTagName(value));
+    return Array.from(document.querySelectorAll(value));
+}
+
+function visible(node) {
+    const rect = node.getBoundingClientRect();
+    const style = getComputedStyle(node);
+    return rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden' &&
+        style.display !== 'none' && parseFloat(style.opacity) > 0;
+}
+
+function interactive(node) {
+    if (!visible(node) || node.disabled || node.getAttribute('aria-disabled') === 'true') return false;
+    const rect = node.getBoundingClientRect();
+    const x = rect.left + rect.width / 2;
+    const y = rect.top + rect.height / 2;
+    // Fora da área visível não há como testar sobreposição; o clique rola até o elemento
+    if (x < 0 || y < 0 || x > window.innerWidth || y > window.innerHeight) return true;
+    const hit = document.elementFromPoint(x, y);
+    return !hit || node.contains(hit) || hit.contains(node);
+}
+
+function ready(node, state) {
+    if (state === 'presente') return true;
+    if (state === 'visivel') return visible(node);
+    if (state === 'interativo') return interactive(node);
+    if (state === 'carregada') return visible(node) && node.complete === true && node.naturalWidth > 0;
+    return false;
+}
+
+const results = {};
+for (const probe of probes) {
+    results[probe.name] = null;
+    search:
+    for (const [type, value] of probe.selectors) {
+        let nodes;
+        try { nodes = find(type, value); } catch (e) { continue; }
+        for (const node of nodes) {
+            if (ready(node, probe.state)) {
+                results[probe.name] = node;
+                break search;
+            }
+        }
+    }
+}
+// Iframes visíveis, onde as sondas são avaliadas se faltar algo neste documento
+const frames = Array.from(document.querySelectorAll('iframe, frame')).filter(visible);
+return {readyState: document.readyState, elements: results, frames: frames};
+"""
+
+
+class Probe:
+    """Um elemento que a página precisa ter, no estado exigido."""
+
+    def __init__(self, name, selectors, state=VISIBLE, optional=False):
+        """
+        Args:
+            name: Nome da sonda (chave em 'elements' do resultado)
+            selectors: Lista de tuplas (By, valor), em ordem de preferência
+            state: PRESENT, VISIBLE, INTERACTIVE ou LOADED
+            optional: Não bloqueia a prontidão; o elemento é devolvido se já estiver pronto
+        """
+        self.name = name
+        self.selectors = list(selectors)
+        self.state = state
+        self.optional = optional
+
+    def to_script(self):
+        return {'name': self.name, 'state': self.state,
+                'selectors': [[selector_type, value] for selector_type, value in self.selectors]}
+
+
+class PageReadiness:
+    """Conjunto de sondas que define quando um tipo de página está pronto."""
+
+    def __init__(self, name, probes):
+        self.name = name
+        self.probes = list(probes)
+
+    def check(self, driver):
+        """
+        Avalia as sondas uma vez, no documento principal e nos seus iframes.
+
+        O driver sempre volta ao documento principal; os elementos achados em um
+        iframe só podem ser usados dentro de inside_frame(driver, resultado).
+
+        Returns:
+            dict: {'ready', 'elements' {sonda: WebElement ou None}, 'missing', 'document_state',
+                   'frame_path' (iframes até os elementos), 'in_frame'}
+        """
+        driver.switch_to.default_content()
+        try:
+            result = self._evaluate(driver)
+            frame_path = []
+            if not result['ready'] and result['frames']:
+                found = self._search_frames(driver, result['frames'], MAX_FRAME_DEPTH, [])
+                if found:
+                    result, frame_path = found
+        finally:
+            driver.switch_to.default_content()
+
+        del result['frames']
+        result['frame_path'] = frame_path
+        result['in_frame'] = bool(frame_path)
+        return result
+
+    def _evaluate(self, driver):
+        result = driver.execute_script(PROBE_SCRIPT, [probe.to_script() for probe in self.probes]) or {}
+        elements = result.get('elements') or {}
+        missing = [probe.name for probe in self.probes if not probe.optional and not elements.get(probe.name)]
+        return {'ready': not missing, 'elements': elements, 'missing': missing,
+                'document_state': result.get('readyState'), 'frames': result.get('frames') or []}
+
+    def _search_frames(self, driver, frames, depth, path):
+        """Procura a página pronta em cada iframe; retorna (resultado, caminho) ou None."""
+        for frame in frames:
+            try:
+                driver.switch_to.frame(frame)
+                result = self._evaluate(driver)
+                if result['ready']:
+                    return result, path + [frame]
+                if depth > 1 and result['frames']:
+                    nested = self._search_frames(driver, result['frames'], depth - 1, path + [frame])
+                    if nested:
+                        return nested
+            except Exception:
+                # Iframe removido ou recarregado entre as chamadas
+                pass
+            # Volta ao iframe de origem pelo documento principal: parent_frame()
+            # falha se o iframe atual foi removido
+            enter_frames(driver, path)
+        return None
+
+
+def enter_frames(driver, frame_path):
+    """Entra, a partir do documento principal, na sequência de iframes indicada."""
+    driver.switch_to.default_content()
+    for frame in frame_path:
+        driver.switch_to.frame(frame)
+
+
+@contextmanager
+def inside_frame(driver, result):
+    """
+    Usa os elementos de uma verificação no iframe em que foram achados.
+
+    Args:
+        driver: Instância do WebDriver
+        result: Resultado de PageReadiness.check() ou wait_until_ready()
+    """
+    frame_path = result.get('frame_path') or []
+    if not frame_path:
+        yield
+        return
+
+    enter_frames(driver, frame_path)
+    try:
+        yield
+    finally:
+        driver.switch_to.default_content()
+
+
+def wait_until_ready(driver, page, timeout, poll_interval=POLL_INTERVAL):
+    """
+    Aguarda até que as sondas obrigatórias da página estejam prontas.
+
+    Args:
+        driver: Instância do WebDriver
+        page: PageReadiness da página esperada
+        timeout: Tempo máximo de espera, em segundos
+        poll_interval: Intervalo entre verificações
+
+    Returns:
+        dict: Resultado da última verificação, com 'page' e 'elapsed'
+    """
+    started = time.perf_counter()
+    deadline = time.time() + timeout
+    while True:
+        try:
+            result = page.check(driver)
+        except Exception as e:
+            # Página em transição (navegação, documento ainda vazio)
+            result = {'ready': False, 'elements': {}, 'missing': [probe.name for probe in page.probes],
+                      'document_state': None, 'frame_path': [], 'in_frame': False, 'error': str(e)}
+        if result['ready'] or time.time() >= deadline:
+            break
+        time.sleep(poll_interval)
+
+    result['page'] = page.name
+    result['elapsed'] = time.perf_counter() - started
+    PAGE_READY_LATENCY.observe(result['elapsed'], page=page.name, result='pronta' if result['ready'] else 'timeout')
+    if not result['ready']:
+        logger.warning(f"Página {page.name} não ficou pronta em {timeout}s (faltando: {', '.join(result['missing'])})")
+    return result
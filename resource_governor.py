@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Governador de recursos dos navegadores.
+
+Um Chrome que navega no mapa do SICAR por horas cresce em memória. O
+governador amostra periodicamente a árvore de processos de cada sessão
+(ChromeDriver, Chrome e seus processos filhos), com RSS e CPU, conta as
+navegações e pede a reciclagem da sessão quando ela passa do limite de
+memória, de páginas ou de idade. A reciclagem em si é feita pelo dono da
+sessão no próximo ponto seguro (entre dois trabalhos do pool, ou sem CAPTCHA
+pendente no navegador interativo), de modo que nenhum trabalho perde o
+lugar na fila.
+
+Também encerra processos chromedriver/chrome órfãos, deixados por execuções
+anteriores que terminaram sem fechar o navegador.
+
+A amostragem de memória/CPU e a limpeza de órfãos dependem de psutil, que é
+opcional; sem ele só os limites de páginas e de idade são aplicados.
+
+Cada sessão governada deve ter os atributos session_id, driver, started_at e
+recycle_reason e o método request_recycle(reason), como BrowserSession. Nas
+sessões em processo separado (browser_worker.WorkerSession, com remote=True)
+o PID do ChromeDriver e as navegações são os informados pelo processo filho.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from metrics import registry
+from webdriver_instrumentation import add_command_listener, remove_command_listener
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger('resource_governor')
+
+BROWSER_RSS = registry.gauge('browser_rss_bytes', 'Memória residente da árvore de processos do navegador', ('session',))
+BROWSER_CPU = registry.gauge('browser_cpu_percent', 'Uso de CPU da árvore de processos do navegador', ('session',))
+BROWSER_PROCESSES = registry.gauge('browser_processes', 'Processos na árvore do navegador', ('session',))
+BROWSER_RECYCLES = registry.counter('browser_recycles_total', 'Reciclagens de navegador pedidas pelo governador',
+                                    ('session', 'reason'))
+ORPHANS_REAPED = registry.counter('browser_orphans_reaped_total', 'Processos de navegador órfãos encerrados', ('name',))
+
+# Motivos de reciclagem
+REASON_MEMORY = 'memoria'
+REASON_PAGES = 'paginas'
+REASON_AGE = 'idade'
+
+# Nomes de processo considerados na busca por órfãos
+BROWSER_PROCESS_NAMES = ('chromedriver', 'chrome', 'chromium')
+
+# Argumentos que o ChromeDriver acrescenta ao Chrome que inicia
+WEBDRIVER_CHROME_MARKERS = ('--remote-debugging-port', '--test-type')
+
+
+def driver_pid(driver):
+    """PID do ChromeDriver de um driver (raiz da árvore de processos), ou None."""
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def session_pid(session):
+    """PID do ChromeDriver de uma sessão, local ou em processo separado."""
+    if getattr(session, 'remote', False):
+        return session.driver_pid
+    return driver_pid(session.driver) if session.driver else None
+
+
+def is_available():
+    """Indica se o psutil está instalado (amostragem de memória e limpeza de órfãos)."""
+    return psutil is not None
+
+
+class ResourceGovernor:
+    """Amostra os navegadores e pede a reciclagem dos que passam dos limites."""
+
+    def __init__(self, sessions, max_rss=None, max_pages=None, max_age=None, interval=15,
+                 reap_orphans=True, emit=None):
+        """
+        Args:
+            sessions: Função sem argumentos que retorna as sessões governadas
+            max_rss: Limite de memória residente por sessão, em bytes
+            max_pages: Navegações (driver.get) antes de reciclar
+            max_age: Idade máxima do navegador, em segundos
+            interval: Intervalo entre amostras, em segundos
+            reap_orphans: Encerra processos de navegador órfãos
+            emit: Função (evento, dados) para avisar os clientes
+        """
+        self.sessions = sessions
+        self.max_rss = max_rss
+        self.max_pages = max_pages
+        self.max_age = max_age
+        self.interval = interval
+        self.reap_orphans = reap_orphans and psutil is not None
+        self.emit = emit or (lambda event, data: None)
+
+        self._samples = {}
+        self._navigations = {}  # session_id -> [pid do driver, navegações]
+        self._processes = {}    # pid -> psutil.Process, para medir CPU entre amostras
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.orphans_reaped = 0
+
+    def start(self):
+        """Inicia a amostragem em uma thread dedicada."""
+        if self._thread and self._thread.is_alive():
+            return
+        if psutil is None:
+            logger.warning("psutil não instalado: só os limites de páginas e idade serão aplicados")
+        add_command_listener(self._on_command)
+        self._stop.clear()
+        if self.reap_orphans:
+            self.reap()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='resource-governor')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        remove_command_listener(self._on_command)
+
+    def status(self):
+        """Última amostra de cada sessão e os limites configurados."""
+        with self._lock:
+            samples = [dict(sample) for sample in self._samples.values()]
+        return {
+            'psutil': psutil is not None,
+            'limits': {'max_rss': self.max_rss, 'max_pages': self.max_pages, 'max_age': self.max_age},
+            'sessions': samples,
+            'orphans_reaped': self.orphans_reaped,
+        }
+
+    def sample_all(self):
+        """Amostra todas as sessões e pede reciclagem das que passaram dos limites."""
+        live_pids = set()
+        for session in list(self.sessions()):
+            pid = session_pid(session)
+            sample = self._sample(session, pid)
+            live_pids.update(sample.pop('pids', ()))
+            with self._lock:
+                self._samples[session.session_id] = sample
+
+            reason = self._limit_exceeded(sample)
+            if reason and not session.recycle_reason:
+                logger.warning(f"Sessão {session.session_id} será reciclada ({reason}): {sample}")
+                BROWSER_RECYCLES.inc(session=session.session_id, reason=reason)
+                session.request_recycle(reason)
+                self.emit('server_log', {'message': f"Navegador {session.session_id} será reciclado ({reason})",
+                                         'level': 'warning'})
+
+        # Esquece processos que já terminaram
+        with self._lock:
+            for pid in [pid for pid in self._processes if pid not in live_pids]:
+                self._processes.pop(pid)
+        return live_pids
+
+    def reap(self, live_pids=None):
+        """
+        Encerra processos chromedriver/chrome órfãos do usuário atual.
+
+        Um processo é órfão quando seu pai não existe mais (ou foi adotado pelo
+        init) e ele não pertence a nenhuma sessão viva. Do Chrome, só são
+        considerados os iniciados pelo ChromeDriver.
+
+        Returns:
+            int: Quantidade de processos encerrados
+        """
+        if psutil is None:
+            return 0
+        if live_pids is None:
+            live_pids = self.sample_all()
+
+        try:
+            username = psutil.Process().username()
+        except psutil.Error:
+            username = None
+
+        orphans = []
+        for process in psutil.process_iter(['pid', 'name', 'ppid', 'username', 'cmdline']):
+            info = process.info
+            name = (info.get('name') or '').lower()
+            if info['pid'] in live_pids or info['pid'] == os.getpid():
+                continue
+            if not any(browser in name for browser in BROWSER_PROCESS_NAMES):
+                continue
+            if username and info.get('username') != username:
+                continue
+            ppid = info.get('ppid')
+            if ppid not in (0, 1) and psutil.pid_exists(ppid):
+                continue
+            if 'chromedriver' not in name:
+                cmdline = ' '.join(info.get('cmdline') or [])
+                if not any(marker in cmdline for marker in WEBDRIVER_CHROME_MARKERS):
+                    continue
+            orphans.append(process)
+
+        for process in orphans:
+            try:
+                # Os filhos (renderizadores) vão junto
+                for child in process.children(recursive=True):
+                    child.terminate()
+                process.terminate()
+            except psutil.Error:
+                continue
+        gone, alive = psutil.wait_procs(orphans, timeout=3)
+        for process in alive:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+
+        for process in orphans:
+            ORPHANS_REAPED.inc(name=(process.info.get('name') or '?'))
+        if orphans:
+            logger.warning(f"{len(orphans)} processos de navegador órfãos encerrados: "
+                           f"{[process.info['pid'] for process in orphans]}")
+        self.orphans_reaped += len(orphans)
+        return len(orphans)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                live_pids = self.sample_all()
+                if self.reap_orphans:
+                    self.reap(live_pids)
+            except Exception as e:
+                logger.error(f"Erro no governador de recursos: {str(e)}")
+
+    def _on_command(self, session_id, name, started, duration, status, params, response):
+        if name != 'get':
+            return
+        with self._lock:
+            counter = self._navigations.setdefault(session_id, [None, 0])
+            counter[1] += 1
+
+    def _navigations_of(self, session, pid):
+        if not pid:
+            return 0
+        if getattr(session, 'remote', False):
+            # Os comandos WebDriver do processo filho não passam por este processo
+            return session.pages_loaded
+        return self._navigation_count(session.session_id, pid)
+
+    def _navigation_count(self, session_id, pid):
+        with self._lock:
+            counter = self._navigations.setdefault(session_id, [pid, 0])
+            if counter[0] is None:
+                counter[0] = pid
+            elif counter[0] != pid:
+                # Navegador novo: a contagem recomeça
+                counter[0], counter[1] = pid, 0
+            return counter[1]
+
+    def _sample(self, session, pid):
+        sample = {
+            'session_id': session.session_id,
+            'pid': pid,
+            'active': pid is not None,
+            'navigations': self._navigations_of(session, pid),
+            'age': time.time() - session.started_at if pid and session.started_at else None,
+            'rss': None,
+            'cpu_percent': None,
+            'processes': None,
+            'recycle_reason': session.recycle_reason,
+            'sampled_at': time.time(),
+        }
+        if not pid or psutil is None:
+            return sample
+
+        try:
+            root = psutil.Process(pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return sample
+
+        rss = 0
+        cpu = 0.0
+        pids = []
+        for process in tree:
+            with self._lock:
+                # Reaproveita o objeto para que cpu_percent meça desde a amostra anterior
+                process = self._processes.setdefault(process.pid, process)
+            try:
+                rss += process.memory_info().rss
+                cpu += process.cpu_percent(None)
+                pids.append(process.pid)
+            except psutil.Error:
+                continue
+
+        sample.update(rss=rss, cpu_percent=cpu, processes=len(pids), pids=pids)
+        BROWSER_RSS.set(rss, session=session.session_id)
+        BROWSER_CPU.set(cpu, session=session.session_id)
+        BROWSER_PROCESSES.set(len(pids), session=session.session_id)
+        return sample
+
+    def _limit_exceeded(self, sample):
+        if not sample['active']:
+            return None
+        if self.max_rss and sample['rss'] and sample['rss'] > self.max_rss:
+            return REASON_MEMORY
+        if self.max_pages and sample['navigations'] >= self.max_pages:
+            return REASON_PAGES
+        if self.max_age and sample['age'] and sample['age'] > self.max_age:
+            return REASON_AGE
+        return None
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Perfis de bloqueio de recursos para acelerar o carregamento do SICAR.
+
+A página de consulta pública carrega mapa base (tiles), fontes e scripts de
+analytics que o fluxo de download não usa. Um perfil lista classes de
+recursos e padrões de URL a bloquear e os aplica com Network.setBlockedURLs;
+as URLs protegidas (imagem do CAPTCHA, validação e download do shapefile)
+nunca são bloqueadas: padrões que as alcançariam são descartados ao montar o
+perfil.
+
+measure_page_load() mede tempo de carregamento, bytes transferidos e pedidos
+bloqueados pelos eventos CDP; o benchmark (suíte "perfil") compara a página
+com e sem o perfil.
+"""
+
+import re
+import time
+import logging
+
+logger = logging.getLogger('resource_profile')
+
+# Classes de recursos, em padrões de URL do Network.setBlockedURLs ("*" casa qualquer trecho)
+RESOURCE_CLASSES = {
+    'mapas': [
+        '*arcgisonline.com*', '*tile.openstreetmap.org*', '*basemaps.cartocdn.com*',
+        '*.google.com/vt*', '*.google.com/kh*', '*/MapServer/tile/*', '*/wmts*',
+    ],
+    'fontes': [
+        '*.woff', '*.woff2', '*.woff?*', '*.woff2?*', '*.ttf', '*.otf', '*.eot',
+        '*fonts.googleapis.com*', '*fonts.gstatic.com*',
+    ],
+    'analytics': [
+        '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+        '*hotjar.com*', '*clarity.ms*', '*facebook.net*',
+    ],
+}
+
+# URLs que o fluxo precisa (exemplos verificados contra cada padrão bloqueado)
+PROTECTED_URLS = [
+    'https://consultapublica.car.gov.br/publico/imoveis/index',
+    'https://consultapublica.car.gov.br/publico/imoveis/captcha',
+    'https://consultapublica.car.gov.br/publico/captcha/imagem.png',
+    'https://consultapublica.car.gov.br/publico/imoveis/validar',
+    'https://consultapublica.car.gov.br/publico/imoveis/shapefile/token',
+    'https://consultapublica.car.gov.br/publico/estados/downloads',
+]
+
+# Trechos de URL que tornam um padrão inaceitável, mesmo que não case com os exemplos
+PROTECTED_KEYWORDS = ('captcha', 'shapefile', 'download', 'validar')
+
+
+def pattern_matches(url, pattern):
+    """Casa uma URL com um padrão do Network.setBlockedURLs (só "*" é curinga)."""
+    regex = '.*'.join(re.escape(part) for part in pattern.lower().split('*'))
+    return re.fullmatch(regex, url.lower()) is not None
+
+
+class ResourceProfile:
+    """Conjunto de padrões de URL bloqueados, com as URLs do fluxo sempre liberadas."""
+
+    def __init__(self, name, block_classes=(), block_patterns=(), protected_urls=PROTECTED_URLS,
+                 protected_keywords=PROTECTED_KEYWORDS):
+        """
+        Args:
+            name: Nome do perfil
+            block_classes: Classes de RESOURCE_CLASSES a bloquear
+            block_patterns: Padrões de URL adicionais
+            protected_urls: URLs de exemplo que nenhum padrão pode alcançar
+            protected_keywords: Trechos que nenhum padrão pode conter
+        """
+        self.name = name
+        self.block_classes = list(block_classes)
+        self.protected_urls = list(protected_urls)
+        self.protected_keywords = protected_keywords
+        self.rejected = []
+
+        patterns = []
+        for resource_class in self.block_classes:
+            patterns.extend(RESOURCE_CLASSES[resource_class])
+        patterns.extend(block_patterns)
+
+        self.patterns = []
+        for pattern in patterns:
+            reason = self._protection_conflict(pattern)
+            if reason:
+                logger.warning(f"Padrão {pattern} descartado do perfil {name}: {reason}")
+                self.rejected.append({'pattern': pattern, 'reason': reason})
+            elif pattern not in self.patterns:
+                self.patterns.append(pattern)
+
+    def _protection_conflict(self, pattern):
+        lowered = pattern.lower()
+        for keyword in self.protected_keywords:
+            if keyword in lowered:
+                return f'contém "{keyword}"'
+        for url in self.protected_urls:
+            if pattern_matches(url, pattern):
+                return f'bloquearia {url}'
+        return None
+
+    def blocks(self, url):
+        """Indica se uma URL seria bloqueada pelo perfil."""
+        return any(pattern_matches(url, pattern) for pattern in self.patterns)
+
+    def apply(self, driver):
+        """Ativa o bloqueio no driver (vale para as próximas navegações)."""
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.patterns})
+        logger.info(f"Perfil de recursos {self.name} aplicado: {len(self.patterns)} padrões bloqueados")
+
+    def to_dict(self):
+        return {'name': self.name, 'classes': self.block_classes, 'patterns': self.patterns,
+                'rejected': self.rejected}
+
+
+def clear_profile(driver):
+    """Remove o bloqueio de recursos do driver."""
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': []})
+
+
+# Perfis disponíveis (RESOURCE_PROFILE no captcha_mirror)
+PROFILES = {
+    'leve': ResourceProfile('leve', block_classes=('mapas', 'fontes', 'analytics')),
+    'sem_analytics': ResourceProfile('sem_analytics', block_classes=('analytics',)),
+}
+
+
+def get_profile(name):
+    """Perfil pelo nome; None ou 'completo' carregam a página inteira."""
+    if not name or name == 'completo':
+        return None
+    if name not in PROFILES:
+        raise ValueError(f"Perfil de recursos desconhecido: {name} (disponíveis: {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def measure_page_load(driver, pump, url, timeout=60, settle=2.0, disable_cache=True):
+    """
+    Carrega uma página e mede o carregamento (por padrão com o cache desativado).
+
+    O driver deve ter o log de desempenho ativo (pump é o CdpEventPump dele).
+    Bytes e pedidos incluem o que a página busca até settle segundos depois
+    do evento load (tiles do mapa costumam chegar depois dele).
+
+    Returns:
+        dict: {'wall_s', 'dom_content_loaded_s', 'load_s', 'bytes', 'requests',
+               'blocked', 'failed'}
+    """
+    totals = {'bytes': 0, 'requests': 0, 'blocked': 0, 'failed': 0}
+
+    def on_request(params):
+        totals['requests'] += 1
+
+    def on_finished(params):
+        totals['bytes'] += params.get('encodedDataLength', 0)
+
+    def on_failed(params):
+        if params.get('blockedReason'):
+            totals['blocked'] += 1
+        else:
+            totals['failed'] += 1
+
+    driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': disable_cache})
+    pump.poll()  # descarta eventos anteriores
+    pump.subscribe('Network.requestWillBeSent', on_request)
+    pump.subscribe('Network.loadingFinished', on_finished)
+    pump.subscribe('Network.loadingFailed', on_failed)
+    try:
+        driver.set_page_load_timeout(timeout)
+        started = time.perf_counter()
+        try:
+            driver.get(url)
+        except Exception as e:
+            logger.warning(f"Timeout ao carregar {url} durante a medição: {str(e)}")
+        wall = time.perf_counter() - started
+
+        timing = driver.execute_script("""
+            const nav = performance.getEntriesByType('navigation')[0];
+            return nav ? {dcl: nav.domContentLoadedEventEnd, load: nav.loadEventEnd} : null;
+        """) or {}
+        time.sleep(settle)
+        pump.poll()
+    finally:
+        pump.unsubscribe('Network.requestWillBeSent', on_request)
+        pump.unsubscribe('Network.loadingFinished', on_finished)
+        pump.unsubscribe('Network.loadingFailed', on_failed)
+        driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': False})
+
+    return dict(totals,
+                wall_s=wall,
+                dom_content_loaded_s=timing['dcl'] / 1000 if timing.get('dcl') else None,
+                load_s=timing['load'] / 1000 if timing.get('load') else None)
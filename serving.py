@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Modos de execução do servidor web e socket.io.
+
+desenvolvimento: servidor do Werkzeug com uma thread por conexão, debug e
+    recarregamento automático (o comportamento original).
+producao: servidor assíncrono do gevent (ou do eventlet), em que cada conexão
+    é um greenlet em vez de uma thread; sem debug nem recarregador, com o
+    socket.io restrito ao transporte WebSocket. Sem gevent nem eventlet
+    instalados, usa o Werkzeug com threads, ainda sem recarregador.
+
+O modo vem da variável de ambiente CAPTCHA_MIRROR_MODE ou do argumento
+--producao, e não de uma constante do captcha_mirror: gevent e eventlet
+precisam aplicar o monkey patching antes que socket, ssl e threading sejam
+importados pelo resto da aplicação. Por isso este módulo importa apenas os e
+sys, e setup() é chamado no início do captcha_mirror.
+"""
+
+import os
+import sys
+
+MODE_DEVELOPMENT = 'desenvolvimento'
+MODE_PRODUCTION = 'producao'
+
+# Motores assíncronos do Flask-SocketIO, em ordem de preferência
+ASYNC_ENGINES = ('gevent', 'eventlet')
+
+SERVE_MODE = MODE_DEVELOPMENT
+ASYNC_MODE = 'threading'
+
+
+def requested_mode(argv=None, environ=None):
+    """Modo pedido pelo argumento --producao ou pela variável CAPTCHA_MIRROR_MODE."""
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    if '--producao' in argv:
+        return MODE_PRODUCTION
+    mode = environ.get('CAPTCHA_MIRROR_MODE', MODE_DEVELOPMENT).strip().lower()
+    return MODE_PRODUCTION if mode in (MODE_PRODUCTION, 'production') else MODE_DEVELOPMENT
+
+
+def available_engine():
+    """Primeiro motor assíncrono instalado, ou None."""
+    for engine in ASYNC_ENGINES:
+        try:
+            __import__(engine)
+            return engine
+        except ImportError:
+            continue
+    return None
+
+
+def setup():
+    """
+    Escolhe o modo de execução e, em produção, aplica o monkey patching.
+
+    Deve ser chamado apenas pelo processo principal, antes dos demais imports.
+
+    Returns:
+        str: async_mode a usar no SocketIO
+    """
+    global SERVE_MODE, ASYNC_MODE
+
+    SERVE_MODE = requested_mode()
+    if SERVE_MODE != MODE_PRODUCTION:
+        return ASYNC_MODE
+
+    engine = available_engine()
+    if engine == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    elif engine == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    ASYNC_MODE = engine or 'threading'
+    return ASYNC_MODE
+
+
+def is_production():
+    return SERVE_MODE == MODE_PRODUCTION
+
+
+def socket_transports():
+    """Transportes aceitos pelo socket.io (o cliente usa os mesmos)."""
+    return ['websocket'] if is_production() else ['polling', 'websocket']
+
+
+def server_options(workers):
+    """
+    Argumentos de socketio.run() para o modo atual.
+
+    Args:
+        workers: Conexões atendidas ao mesmo tempo no servidor assíncrono
+            (greenlets; não são threads do sistema)
+    """
+    if not is_production():
+        return {'debug': True, 'allow_unsafe_werkzeug': True}
+
+    options = {'debug': False, 'use_reloader': False, 'log_output': False}
+    if ASYNC_MODE == 'gevent':
+        options['spawn'] = workers
+    elif ASYNC_MODE == 'eventlet':
+        options['max_size'] = workers
+    else:
+        options['allow_unsafe_werkzeug'] = True
+    return options
+
+
+def describe():
+    """Modo e motor em uso, para os logs."""
+    return {'mode': SERVE_MODE, 'async_mode': ASYNC_MODE, 'transports': socket_transports()}
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Catálogo SQLite das feições dos shapefiles baixados.
+
+Os retângulos envolventes de cada registro ficam em um índice R-tree do
+SQLite e os atributos do .dbf em JSON, de modo que a pergunta "quais imóveis
+cruzam esta área" é respondida pelo índice, sem reabrir os zips.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from shapefile_store import file_sha256
+
+logger = logging.getLogger('shapefile_catalog')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archives (
+        sha256 TEXT PRIMARY KEY,
+        key TEXT NOT NULL,
+        path TEXT,
+        indexed_at REAL NOT NULL,
+        layers INTEGER NOT NULL,
+        features INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS features (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        car_code TEXT,
+        layer TEXT NOT NULL,
+        record INTEGER NOT NULL,
+        attributes TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS features_key ON features(key);
+    CREATE INDEX IF NOT EXISTS features_car_code ON features(car_code);
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS features_rtree USING rtree(id, min_x, max_x, min_y, max_y);
+"""
+
+FEATURE_QUERY = """
+    SELECT f.id, f.key, f.sha256, f.car_code, f.layer, f.record, f.attributes,
+           r.min_x, r.min_y, r.max_x, r.max_y
+    FROM features f JOIN features_rtree r ON r.id = f.id
+"""
+
+FEATURE_FIELDS = ('id', 'key', 'sha256', 'car_code', 'layer', 'record', 'attributes')
+
+# Campo do .dbf do SICAR com o código do imóvel
+CAR_CODE_FIELDS = ('cod_imovel', 'COD_IMOVEL')
+
+
+def parse_bbox(text):
+    """Converte 'min_x,min_y,max_x,max_y' em tupla; ValueError se inválido."""
+    values = [float(value) for value in str(text).split(',')]
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise ValueError('bbox deve ser min_x,min_y,max_x,max_y')
+    return tuple(values)
+
+
+def feature_car_code(attributes):
+    """Código do CAR de uma feição, pelos atributos do .dbf."""
+    for field in CAR_CODE_FIELDS:
+        if attributes.get(field):
+            return str(attributes[field])
+    return None
+
+
+class ShapefileCatalog:
+    """Índice espacial (R-tree) e de atributos das feições baixadas."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Caminho do arquivo SQLite do catálogo
+        """
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def add(self, key, report, sha256=None, path=None):
+        """
+        Indexa as feições de um zip validado, substituindo as anteriores do mesmo código.
+
+        Args:
+            key: Código do CAR (ou UF/Município); None usa o código do próprio .dbf
+            report: Resultado de shapefile_reader.inspect_shapefile()
+            sha256: Hash do zip (calculado se omitido)
+            path: Caminho atual do zip
+
+        Returns:
+            int: Quantidade de feições indexadas
+        """
+        path = path or report['path']
+        sha256 = sha256 or file_sha256(path)
+        if key is None:
+            key = next((feature_car_code(feature['attributes'])
+                        for layer in report['layers'] for feature in layer['features']
+                        if feature_car_code(feature['attributes'])), sha256)
+
+        count = 0
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute('DELETE FROM features_rtree WHERE id IN (SELECT id FROM features WHERE key = ?)', (key,))
+                self._conn.execute('DELETE FROM features WHERE key = ?', (key,))
+                self._conn.execute('DELETE FROM archives WHERE key = ?', (key,))
+
+                for layer in report['layers']:
+                    for feature in layer['features']:
+                        cursor = self._conn.execute(
+                            'INSERT INTO features (key, sha256, car_code, layer, record, attributes) VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, sha256, feature_car_code(feature['attributes']) or key, layer['name'],
+                             feature['record'], json.dumps(feature['attributes'], ensure_ascii=False)))
+                        min_x, min_y, max_x, max_y = feature['bbox']
+                        self._conn.execute(
+                            'INSERT INTO features_rtree (id, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?)',
+                            (cursor.lastrowid, min_x, max_x, min_y, max_y))
+                        count += 1
+
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO archives (sha256, key, path, indexed_at, layers, features) VALUES (?, ?, ?, ?, ?, ?)',
+                    (sha256, key, str(path), time.time(), len(report['layers']), count))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        logger.info(f"{count} feições de {key} indexadas no catálogo")
+        return count
+
+    def search(self, bbox, layer=None, limit=1000):
+        """
+        Feições cujo retângulo cruza a área informada.
+
+        Args:
+            bbox: (min_x, min_y, max_x, max_y)
+            layer: Nome da camada (ex.: 'AREA_IMOVEL'), opcional
+            limit: Máximo de feições retornadas
+
+        Returns:
+            list: Feições com código, camada, retângulo e atributos
+        """
+        min_x, min_y, max_x, max_y = bbox
+        query = FEATURE_QUERY + ' WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?'
+        params = [min_x, max_x, min_y, max_y]
+        if layer:
+            query += " AND (f.layer = ? OR f.layer LIKE '%/' || ?)"
+            params += [layer, layer]
+        query += ' LIMIT ?'
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._feature(row) for row in rows]
+
+    def features(self, key):
+        """Feições indexadas de um código do CAR."""
+        with self._lock:
+            rows = self._conn.execute(FEATURE_QUERY + ' WHERE f.key = ? ORDER BY f.layer, f.record', (key,)).fetchall()
+        return [self._feature(row) for row in rows]
+
+    def key_for(self, sha256):
+        """Código sob o qual um zip foi catalogado, ou None."""
+        with self._lock:
+            row = self._conn.execute('SELECT key FROM archives WHERE sha256 = ?', (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        """Quantidade de zips e feições indexados."""
+        with self._lock:
+            archives, features = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(features), 0) FROM archives').fetchone()
+        return {'archives': archives, 'features': features}
+
+    def close(self):
+        """Fecha o catálogo."""
+        with self._lock:
+            self._conn.close()
+
+    def _feature(self, row):
+        feature = dict(zip(FEATURE_FIELDS, row[:7]))
+        feature['attributes'] = json.loads(feature['attributes']) if feature['attributes'] else {}
+        feature['bbox'] = list(row[7:])
+        return feature
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Leitura e validação dos shapefiles baixados do SICAR.
+
+Os arquivos .shp, .shx, .dbf e .prj são lidos em fluxo diretamente do zip
+(inclusive de zips dentro do zip), sem extrair nada para o disco. A leitura
+completa de cada membro também confere o CRC do zip, então arquivos
+corrompidos são detectados aqui. De cada registro são extraídos o retângulo
+envolvente e os atributos do .dbf.
+"""
+
+import os
+import struct
+import zipfile
+import logging
+from datetime import date
+
+logger = logging.getLogger('shapefile_reader')
+
+SHP_FILE_CODE = 9994
+SHP_VERSION = 1000
+SHP_HEADER = struct.Struct('>7i2i4d4d')  # código, 5 vazios, tamanho | versão, tipo, bbox xy, bbox zm
+SHP_RECORD_HEADER = struct.Struct('>2i')
+SHP_HEADER_SIZE = 100
+SHX_RECORD_SIZE = 8
+
+DBF_HEADER = struct.Struct('<4BIHH20x')
+DBF_FIELD = struct.Struct('<11sc4xBB14x')
+
+# Tipos de geometria do formato shapefile
+SHAPE_TYPES = {
+    0: 'Null', 1: 'Point', 3: 'PolyLine', 5: 'Polygon', 8: 'MultiPoint',
+    11: 'PointZ', 13: 'PolyLineZ', 15: 'PolygonZ', 18: 'MultiPointZ',
+    21: 'PointM', 23: 'PolyLineM', 25: 'PolygonM', 28: 'MultiPointM', 31: 'MultiPatch',
+}
+POINT_TYPES = (1, 11, 21)
+
+REQUIRED_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj')
+
+# Tipos WKB equivalentes (sempre 2D; Z e M são descartados)
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+WKB_TYPES = {'Point': WKB_POINT, 'MultiPoint': WKB_MULTIPOINT, 'PolyLine': WKB_MULTILINESTRING,
+             'Polygon': WKB_MULTIPOLYGON, 'MultiPatch': WKB_MULTIPOLYGON}
+WKB_NAMES = {WKB_POINT: 'Point', WKB_MULTIPOINT: 'MultiPoint', WKB_MULTILINESTRING: 'MultiLineString',
+             WKB_MULTIPOLYGON: 'MultiPolygon'}
+
+
+class ShapefileError(Exception):
+    """Erro de estrutura em um dos arquivos do shapefile."""
+
+
+def read_exact(stream, size):
+    """Lê exatamente size bytes do fluxo; None no fim do arquivo."""
+    data = stream.read(size)
+    if not data:
+        return None
+    if len(data) != size:
+        raise ShapefileError(f"Arquivo truncado (esperados {size} bytes, lidos {len(data)})")
+    return data
+
+
+def iter_shp_records(stream, expected_length=None):
+    """
+    Percorre os registros de um .shp.
+
+    Args:
+        stream: Fluxo binário do .shp
+        expected_length: Tamanho do arquivo, para conferir com o cabeçalho
+
+    Yields:
+        dict: Primeiro o cabeçalho ({'shape_type', 'bbox'}), depois cada registro
+              ({'number', 'shape_type', 'bbox', 'content'})
+    """
+    header = read_exact(stream, SHP_HEADER_SIZE)
+    if header is None:
+        raise ShapefileError('.shp vazio')
+
+    values = SHP_HEADER.unpack(header)
+    file_code, file_length = values[0], values[6] * 2
+    version, shape_type = struct.unpack('<2i', header[28:36])
+    bbox = struct.unpack('<4d', header[36:68])
+
+    if file_code != SHP_FILE_CODE:
+        raise ShapefileError(f".shp com código de arquivo inválido ({file_code})")
+    if version != SHP_VERSION:
+        raise ShapefileError(f".shp com versão inválida ({version})")
+    if shape_type not in SHAPE_TYPES:
+        raise ShapefileError(f".shp com tipo de geometria desconhecido ({shape_type})")
+    if expected_length is not None and file_length != expected_length:
+        raise ShapefileError(f".shp com tamanho {expected_length} diferente do cabeçalho ({file_length})")
+
+    yield {'shape_type': shape_type, 'bbox': bbox}
+
+    while True:
+        record_header = read_exact(stream, SHP_RECORD_HEADER.size)
+        if record_header is None:
+            break
+        number, content_words = SHP_RECORD_HEADER.unpack(record_header)
+        content = read_exact(stream, content_words * 2)
+        if content is None or len(content) < 4:
+            raise ShapefileError(f"Registro {number} do .shp sem conteúdo")
+
+        record_type = struct.unpack_from('<i', content)[0]
+        if record_type == 0:
+            record_bbox = None
+        elif record_type in POINT_TYPES:
+            x, y = struct.unpack_from('<2d', content, 4)
+            record_bbox = (x, y, x, y)
+        else:
+            record_bbox = struct.unpack_from('<4d', content, 4)
+
+        yield {'number': number, 'shape_type': record_type, 'bbox': record_bbox, 'content': content}
+
+
+def shape_parts(content):
+    """
+    Separa as partes (anéis, linhas ou pontos) de um registro do .shp.
+
+    Cada parte é devolvida como bytes com os pares x, y em double little-endian,
+    o mesmo formato usado pelo WKB e por numpy.frombuffer(parte, '<f8').
+
+    Returns:
+        tuple: (nome do tipo base, lista de partes)
+    """
+    shape_type = struct.unpack_from('<i', content)[0]
+    base_type = SHAPE_TYPES.get(shape_type, 'Null').rstrip('ZM') or 'Null'
+
+    if base_type == 'Null':
+        return base_type, []
+    if base_type == 'Point':
+        return base_type, [bytes(content[4:20])]
+    if base_type == 'MultiPoint':
+        count = struct.unpack_from('<i', content, 36)[0]
+        return base_type, [bytes(content[40:40 + 16 * count])]
+
+    part_count, point_count = struct.unpack_from('<2i', content, 36)
+    starts = struct.unpack_from(f'<{part_count}i', content, 44)
+    points_offset = 44 + 4 * part_count
+    if base_type == 'MultiPatch':
+        # Tipos de parte vêm depois dos índices; os anéis são tratados como polígonos
+        points_offset += 4 * part_count
+
+    parts = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < part_count else point_count
+        parts.append(bytes(content[points_offset + 16 * start:points_offset + 16 * end]))
+    return base_type, parts
+
+
+def ring_signed_area(ring):
+    """Área com sinal de um anel (negativa no sentido horário, que é o anel externo)."""
+    values = struct.unpack(f'<{len(ring) // 8}d', ring)
+    xs, ys = values[0::2], values[1::2]
+    return sum(xs[i] * ys[i + 1] - xs[i + 1] * ys[i] for i in range(len(xs) - 1)) / 2.0
+
+
+def group_rings(rings):
+    """Agrupa os anéis em polígonos: cada anel horário abre um polígono e os anti-horários são seus buracos."""
+    polygons = []
+    for ring in rings:
+        if ring_signed_area(ring) <= 0 or not polygons:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)
+    return polygons
+
+
+def to_wkb(base_type, parts):
+    """
+    Converte as partes de um registro (ver shape_parts) em WKB little-endian.
+
+    Polígonos viram MultiPolygon, linhas MultiLineString e conjuntos de pontos
+    MultiPoint; as coordenadas são copiadas sem reconversão.
+
+    Returns:
+        bytes: Geometria WKB, ou None para registros nulos
+    """
+    if not parts:
+        return None
+
+    if base_type == 'Point':
+        return struct.pack('<BI', 1, WKB_POINT) + parts[0]
+
+    if base_type == 'MultiPoint':
+        points = parts[0]
+        body = b''.join(struct.pack('<BI', 1, WKB_POINT) + points[offset:offset + 16]
+                        for offset in range(0, len(points), 16))
+        return struct.pack('<BII', 1, WKB_MULTIPOINT, len(points) // 16) + body
+
+    if base_type == 'PolyLine':
+        body = b''.join(struct.pack('<BII', 1, WKB_LINESTRING, len(part) // 16) + part for part in parts)
+        return struct.pack('<BII', 1, WKB_MULTILINESTRING, len(parts)) + body
+
+    polygons = group_rings(parts)
+    body = b''.join(
+        struct.pack('<BII', 1, WKB_POLYGON, len(rings)) +
+        b''.join(struct.pack('<I', len(ring) // 16) + ring for ring in rings)
+        for rings in polygons)
+    return struct.pack('<BII', 1, WKB_MULTIPOLYGON, len(polygons)) + body
+
+
+def count_shx_records(stream, expected_length=None):
+    """Valida o cabeçalho de um .shx e retorna a quantidade de registros indexados."""
+    header = read_exact(stream, SHP_HEADER_SIZE)
+    if header is None:
+        raise ShapefileError('.shx vazio')
+    values = SHP_HEADER.unpack(header)
+    if values[0] != SHP_FILE_CODE:
+        raise ShapefileError(f".shx com código de arquivo inválido ({values[0]})")
+
+    size = SHP_HEADER_SIZE
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        size += len(chunk)
+
+    if values[6] * 2 != size or (expected_length is not None and size != expected_length):
+        raise ShapefileError(f".shx com tamanho {size} diferente do cabeçalho ({values[6] * 2})")
+    if (size - SHP_HEADER_SIZE) % SHX_RECORD_SIZE:
+        raise ShapefileError('.shx com tamanho que não é múltiplo de registros')
+    return (size - SHP_HEADER_SIZE) // SHX_RECORD_SIZE
+
+
+def decode_dbf_value(raw, field_type, decimals, encoding):
+    """Converte o valor bruto de um campo do .dbf."""
+    text = raw.decode(encoding, errors='replace').strip()
+    if field_type in ('N', 'F'):
+        if not text or text.startswith('*'):
+            return None
+        try:
+            return float(text) if decimals or '.' in text else int(text)
+        except ValueError:
+            return None
+    if field_type == 'L':
+        return text.upper() in ('T', 'Y', 'S') if text and text != '?' else None
+    if field_type == 'D':
+        try:
+            return date(int(text[:4]), int(text[4:6]), int(text[6:8])).isoformat()
+        except ValueError:
+            return None
+    return text
+
+
+def iter_dbf_records(stream, encoding='utf-8'):
+    """
+    Percorre os registros de um .dbf.
+
+    Yields:
+        Primeiro (quantidade de registros, lista de campos); depois um dicionário
+        de atributos por registro (None para registros apagados)
+    """
+    header = read_exact(stream, DBF_HEADER.size)
+    if header is None:
+        raise ShapefileError('.dbf vazio')
+    _, _, _, _, record_count, header_length, record_length = DBF_HEADER.unpack(header)
+
+    fields = []
+    for _ in range((header_length - DBF_HEADER.size - 1) // DBF_FIELD.size):
+        name, field_type, length, decimals = DBF_FIELD.unpack(read_exact(stream, DBF_FIELD.size))
+        fields.append((name.split(b'\0')[0].decode('ascii', errors='replace'),
+                       field_type.decode('ascii', errors='replace'), length, decimals))
+
+    # Terminador dos descritores (0x0D) e eventuais bytes até o início dos registros
+    remaining = header_length - DBF_HEADER.size - len(fields) * DBF_FIELD.size
+    terminator = read_exact(stream, remaining) if remaining > 0 else b''
+    if not terminator or terminator[0] != 0x0D:
+        raise ShapefileError('.dbf sem terminador de campos')
+    if sum(field[2] for field in fields) + 1 != record_length:
+        raise ShapefileError('.dbf com tamanho de registro incoerente com os campos')
+
+    yield record_count, [{'name': name, 'type': field_type, 'length': length, 'decimals': decimals}
+                         for name, field_type, length, decimals in fields]
+
+    for index in range(record_count):
+        record = read_exact(stream, record_length)
+        if record is None:
+            raise ShapefileError(f".dbf truncado no registro {index + 1} de {record_count}")
+        if record[:1] == b'*':
+            yield None
+            continue
+
+        attributes = {}
+        offset = 1
+        for name, field_type, length, decimals in fields:
+            attributes[name] = decode_dbf_value(record[offset:offset + length], field_type, decimals, encoding)
+            offset += length
+        yield attributes
+
+
+def group_layers(names):
+    """Agrupa os membros do zip por camada: nome sem extensão -> {extensão: membro}."""
+    layers = {}
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        extension = extension.lower()
+        if extension in REQUIRED_EXTENSIONS + ('.cpg',):
+            layers.setdefault(stem, {})[extension] = name
+    return layers
+
+
+def read_layer(archive, stem, members, with_geometry=False):
+    """Lê e valida uma camada do zip, retornando seu resumo e registros."""
+    infos = {extension: archive.getinfo(name) for extension, name in members.items()}
+    encoding = 'utf-8'
+    if '.cpg' in members:
+        with archive.open(members['.cpg']) as stream:
+            encoding = stream.read().decode('ascii', errors='ignore').strip() or encoding
+        try:
+            ''.encode(encoding)
+        except LookupError:
+            encoding = 'utf-8'
+
+    prj = None
+    if '.prj' in members:
+        with archive.open(members['.prj']) as stream:
+            prj = stream.read().decode('utf-8', errors='replace').strip()
+        if not prj:
+            raise ShapefileError('.prj vazio')
+
+    with archive.open(members['.shx']) as stream:
+        index_count = count_shx_records(stream, infos['.shx'].file_size)
+
+    with archive.open(members['.dbf']) as stream:
+        records = iter_dbf_records(stream, encoding)
+        record_count, fields = next(records)
+        attributes = list(records)
+
+    features = []
+    shape_count = 0
+    with archive.open(members['.shp']) as stream:
+        shapes = iter_shp_records(stream, infos['.shp'].file_size)
+        header = next(shapes)
+        for shape in shapes:
+            shape_count += 1
+            if shape_count > len(attributes):
+                raise ShapefileError('.shp com mais registros que o .dbf')
+            if attributes[shape_count - 1] is None or shape['bbox'] is None:
+                continue
+            feature = {'record': shape['number'], 'bbox': shape['bbox'], 'attributes': attributes[shape_count - 1]}
+            if with_geometry:
+                feature['geometry'] = shape_parts(shape['content'])
+            features.append(feature)
+
+    if not (shape_count == index_count == record_count):
+        raise ShapefileError(f"Quantidades divergentes: .shp={shape_count}, .shx={index_count}, .dbf={record_count}")
+
+    return {
+        'name': stem,
+        'shape_type': SHAPE_TYPES[header['shape_type']],
+        'bbox': header['bbox'],
+        'record_count': record_count,
+        'prj': prj,
+        'fields': fields,
+        'features': features,
+    }
+
+
+def _inspect_archive(archive, prefix, report, with_geometry):
+    names = archive.namelist()
+    layers = group_layers(names)
+
+    for stem, members in sorted(layers.items()):
+        layer_name = prefix + stem
+        missing = [extension for extension in REQUIRED_EXTENSIONS if extension not in members]
+        if missing:
+            report['errors'].append(f"Camada {layer_name} sem {', '.join(missing)}")
+            continue
+        try:
+            layer = read_layer(archive, stem, members, with_geometry)
+        except (ShapefileError, zipfile.BadZipFile, struct.error, OSError) as e:
+            report['errors'].append(f"Camada {layer_name}: {str(e)}")
+            continue
+        layer['name'] = layer_name
+        if not layer['record_count']:
+            report['errors'].append(f"Camada {layer_name} sem registros")
+        report['layers'].append(layer)
+
+    # O SICAR pode entregar zips dentro do zip; lidos sem extração
+    for name in names:
+        if name.lower().endswith('.zip'):
+            try:
+                with archive.open(name) as stream, zipfile.ZipFile(stream) as inner:
+                    _inspect_archive(inner, prefix + os.path.splitext(name)[0] + '/', report, with_geometry)
+            except zipfile.BadZipFile as e:
+                report['errors'].append(f"Zip interno {prefix + name} inválido: {str(e)}")
+
+
+def inspect_shapefile(path, with_geometry=False):
+    """
+    Valida um zip de shapefiles e extrai retângulos e atributos de cada registro.
+
+    Args:
+        path: Caminho do zip baixado
+        with_geometry: Inclui em cada feição 'geometry' = (tipo base, partes); ver shape_parts()
+
+    Returns:
+        dict: {'path', 'valid', 'errors', 'layers'}; cada camada tem nome, tipo de
+              geometria, bbox, quantidade de registros, .prj, campos e feições
+    """
+    report = {'path': str(path), 'valid': False, 'errors': [], 'layers': []}
+
+    try:
+        if os.path.getsize(path) == 0:
+            report['errors'].append('Arquivo vazio')
+            return report
+        with zipfile.ZipFile(path) as archive:
+            _inspect_archive(archive, '', report, with_geometry)
+    except (zipfile.BadZipFile, OSError) as e:
+        report['errors'].append(f"Zip inválido: {str(e)}")
+        return report
+
+    if not report['layers'] and not report['errors']:
+        report['errors'].append('Nenhum shapefile encontrado no zip')
+
+    report['valid'] = not report['errors']
+    if not report['valid']:
+        logger.warning(f"Shapefile inválido {path}: {'; '.join(report['errors'])}")
+    return report
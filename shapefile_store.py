@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Armazenamento local dos shapefiles baixados, endereçado pelo conteúdo.
+
+Cada arquivo é guardado uma única vez, com o nome igual ao seu hash SHA-256;
+um índice SQLite liga o código do CAR (ou UF/Município) aos arquivos e à
+data de cada download. Um imóvel baixado há menos tempo que a validade
+configurada é considerado atual e não precisa passar pelo navegador (nem
+pelo CAPTCHA) de novo.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger('shapefile_store')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS objects (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS entries (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        sha256 TEXT NOT NULL REFERENCES objects(sha256),
+        fetched_at REAL NOT NULL,
+        original_name TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS entries_key ON entries(key, fetched_at);
+"""
+
+ENTRY_FIELDS = ('key', 'sha256', 'fetched_at', 'original_name', 'size')
+
+# Padrão de validade: 30 dias
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def file_sha256(path):
+    """Calcula o SHA-256 de um arquivo lendo-o em blocos."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ShapefileStore:
+    """Arquivos por hash de conteúdo e índice de downloads por código do CAR."""
+
+    def __init__(self, root, ttl=DEFAULT_TTL):
+        """
+        Args:
+            root: Diretório do armazenamento (objetos e índice)
+            ttl: Validade de um download, em segundos
+        """
+        self.root = str(root)
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.ttl = ttl
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, 'index.db'), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def object_path(self, sha256):
+        """Caminho do arquivo de um hash (subdiretório pelos dois primeiros caracteres)."""
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}.zip")
+
+    def add(self, key, path, sha256=None, fetched_at=None):
+        """
+        Guarda um arquivo baixado e o associa a um código do CAR.
+
+        O arquivo de origem é movido para o armazenamento; se o mesmo conteúdo
+        já existe, a origem é apagada e o objeto existente é reaproveitado.
+
+        Args:
+            key: Código do CAR (ou UF/Município)
+            path: Arquivo baixado
+            sha256: Hash já calculado (ex.: pelo download direto)
+            fetched_at: Momento do download (padrão: agora)
+
+        Returns:
+            dict: Entrada registrada, com o caminho do objeto em 'path'
+        """
+        sha256 = sha256 or file_sha256(path)
+        fetched_at = fetched_at or time.time()
+        size = os.path.getsize(path)
+        target = self.object_path(sha256)
+
+        with self._lock:
+            if os.path.exists(target):
+                os.remove(path)
+                logger.info(f"Conteúdo de {key} já armazenado ({sha256[:12]}), arquivo duplicado descartado")
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute('INSERT OR IGNORE INTO objects (sha256, size, created_at) VALUES (?, ?, ?)',
+                                   (sha256, size, fetched_at))
+                self._conn.execute('INSERT INTO entries (key, sha256, fetched_at, original_name) VALUES (?, ?, ?, ?)',
+                                   (key, sha256, fetched_at, os.path.basename(path)))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        return self._entry((key, sha256, fetched_at, os.path.basename(path), size))
+
+    def latest(self, key):
+        """Último download registrado de um código do CAR, ou None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT e.key, e.sha256, e.fetched_at, e.original_name, o.size FROM entries e '
+                'JOIN objects o ON o.sha256 = e.sha256 WHERE e.key = ? ORDER BY e.fetched_at DESC LIMIT 1',
+                (key,)).fetchone()
+        return self._entry(row) if row else None
+
+    def fresh(self, key, ttl=None):
+        """
+        Retorna o último download de um código se ainda estiver dentro da validade.
+
+        Args:
+            key: Código do CAR (ou UF/Município)
+            ttl: Validade em segundos (padrão: a do armazenamento)
+
+        Returns:
+            dict: Entrada atual, ou None se não há download válido
+        """
+        entry = self.latest(key)
+        ttl = self.ttl if ttl is None else ttl
+        if not entry or time.time() - entry['fetched_at'] > ttl:
+            return None
+        if not os.path.exists(entry['path']):
+            logger.warning(f"Objeto {entry['sha256']} de {key} ausente no armazenamento")
+            return None
+        return entry
+
+    def history(self, key):
+        """Todos os downloads de um código do CAR, do mais recente ao mais antigo."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT e.key, e.sha256, e.fetched_at, e.original_name, o.size FROM entries e '
+                'JOIN objects o ON o.sha256 = e.sha256 WHERE e.key = ? ORDER BY e.fetched_at DESC',
+                (key,)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def stats(self):
+        """Quantidade de códigos, objetos e bytes armazenados."""
+        with self._lock:
+            keys = self._conn.execute('SELECT COUNT(DISTINCT key) FROM entries').fetchone()[0]
+            objects, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+        return {'keys': keys, 'objects': objects, 'bytes': size, 'ttl': self.ttl}
+
+    def close(self):
+        """Fecha o índice."""
+        with self._lock:
+            self._conn.close()
+
+    def _entry(self, row):
+        entry = dict(zip(ENTRY_FIELDS, row))
+        entry['path'] = self.object_path(entry['sha256'])
+        return entry
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Navegação automatizada no SICAR para as sessões do pool de downloads.
+
+As funções recebem o driver explicitamente, de modo que cada sessão do pool
+navegue de forma independente. A única etapa que depende de uma pessoa é a
+resolução do CAPTCHA, que é capturado aqui e encaminhado à fila de operadores.
+"""
+
+import os
+import time
+import logging
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+import politeness
+from readiness import Probe, PageReadiness, wait_until_ready, inside_frame, INTERACTIVE, LOADED
+
+logger = logging.getLogger('sicar_automation')
+
+# Endereço do SICAR; a variável de ambiente SICAR_BASE_URL aponta para outro
+# servidor, como o SICAR simulado de fake_sicar.py usado nos benchmarks
+SICAR_BASE_URL = os.environ.get('SICAR_BASE_URL', 'https://consultapublica.car.gov.br')
+SICAR_INDEX_PATH = '/publico/imoveis/index'
+SICAR_DOWNLOADS_PATH = '/publico/estados/downloads'
+
+# Campo e botão de busca de imóvel pelo código do CAR
+PROPERTY_SEARCH_INPUT_SELECTORS = [
+    (By.CSS_SELECTOR, "input[placeholder*='CAR']"),
+    (By.CSS_SELECTOR, "input[placeholder*='imóvel'], input[placeholder*='Imóvel']"),
+    (By.CSS_SELECTOR, "input[id*='busca'], input[name*='busca']"),
+    (By.CSS_SELECTOR, "input[id*='pesquisa'], input[name*='pesquisa']"),
+    (By.CSS_SELECTOR, "input[type='search']"),
+]
+
+PROPERTY_SEARCH_BUTTON_SELECTORS = [
+    (By.CSS_SELECTOR, "button[id*='busca'], button[id*='pesquisa']"),
+    (By.XPATH, "//button[contains(text(), 'Buscar') or contains(text(), 'Pesquisar')]"),
+    (By.CSS_SELECTOR, "button[type='submit']"),
+]
+
+# Lista de seletores possíveis para o botão de download
+DOWNLOAD_BUTTON_SELECTORS = [
+    (By.ID, "btnDownloadShapefileUC"),
+    (By.XPATH, "//button[contains(text(), 'Baixar Shapefile')]"),
+    (By.XPATH, "//button[contains(text(), 'Download') and contains(text(), 'Shapefile')]"),
+    (By.XPATH, "//a[contains(text(), 'Baixar Shapefile')]"),
+    (By.XPATH, "//a[contains(@href, 'shapefile') or contains(@href, 'download')]"),
+    (By.XPATH, "//button[contains(@onclick, 'shapefile') or contains(@onclick, 'download')]"),
+    (By.XPATH, "//button[@title='Baixar shapefile']"),
+    (By.XPATH, "//a[@title='Baixar shapefile']"),
+    (By.XPATH, "//button[contains(@class, 'download')]"),
+    (By.XPATH, "//a[contains(@class, 'download')]")
+]
+
+# Botão de download que só existe na página do imóvel: os seletores genéricos
+# de DOWNLOAD_BUTTON_SELECTORS (links com 'download' no endereço ou na classe)
+# também casam com links da página inicial e dariam a página como pronta antes da hora
+PROPERTY_DOWNLOAD_BUTTON_SELECTORS = [
+    (By.ID, "btnDownloadShapefileUC"),
+    (By.XPATH, "//button[contains(text(), 'Baixar Shapefile')]"),
+    (By.XPATH, "//button[contains(text(), 'Download') and contains(text(), 'Shapefile')]"),
+    (By.XPATH, "//a[contains(text(), 'Baixar Shapefile')]"),
+    (By.XPATH, "//button[@title='Baixar shapefile']"),
+    (By.XPATH, "//a[@title='Baixar shapefile']"),
+]
+
+# Imagem do CAPTCHA, da mais específica para a mais genérica
+CAPTCHA_IMAGE_SELECTORS = [
+    (By.XPATH, "//img[contains(@src, 'captcha')]"),
+    (By.XPATH, "//div[contains(@id, 'captcha') or contains(@class, 'captcha')]//img"),
+    (By.XPATH, "//img[contains(@id, 'captcha') or contains(@class, 'captcha')]"),
+]
+
+# Campo de resposta do CAPTCHA (mesmo critério de captcha_form)
+CAPTCHA_INPUT_SELECTORS = [
+    (By.CSS_SELECTOR, "input[id*='captcha'], input[name*='captcha']"),
+]
+
+# Prontidão de cada tipo de página: o que o fluxo precisa para seguir
+INDEX_PAGE = PageReadiness('index', [
+    Probe('busca', PROPERTY_SEARCH_INPUT_SELECTORS, INTERACTIVE),
+    Probe('botao_busca', PROPERTY_SEARCH_BUTTON_SELECTORS, INTERACTIVE, optional=True),
+])
+PROPERTY_PAGE = PageReadiness('imovel', [
+    Probe('botao_download', PROPERTY_DOWNLOAD_BUTTON_SELECTORS, INTERACTIVE),
+])
+DOWNLOAD_DIALOG = PageReadiness('dialogo_download', [
+    Probe('imagem_captcha', CAPTCHA_IMAGE_SELECTORS, LOADED),
+    Probe('campo_captcha', CAPTCHA_INPUT_SELECTORS, INTERACTIVE, optional=True),
+])
+
+POLL_INTERVAL = 0.25
+
+
+def sicar_url(path):
+    """Monta um endereço do SICAR a partir do caminho."""
+    return SICAR_BASE_URL.rstrip('/') + path
+
+
+def xpath_literal(value):
+    """Escreve um texto como literal XPath, mesmo que tenha aspas simples e duplas."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    parts = value.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in parts) + ")"
+
+
+def find_first_visible(driver, selectors):
+    """Retorna o primeiro elemento visível encontrado pelos seletores, ou None."""
+    for selector_type, selector_value in selectors:
+        try:
+            for element in driver.find_elements(selector_type, selector_value):
+                if element.is_displayed():
+                    return element
+        except Exception:
+            continue
+    return None
+
+
+def wait_for_any(driver, selectors, timeout):
+    """
+    Aguarda até que algum dos seletores encontre um elemento visível.
+
+    Args:
+        driver: Instância do WebDriver
+        selectors: Lista de tuplas (By, valor)
+        timeout: Tempo máximo de espera, em segundos
+
+    Returns:
+        WebElement: Elemento encontrado ou None
+    """
+    deadline = time.time() + timeout
+    while True:
+        element = find_first_visible(driver, selectors)
+        if element or time.time() >= deadline:
+            return element
+        time.sleep(POLL_INTERVAL)
+
+
+def load_page(driver, url, interactive=False):
+    """
+    Carrega uma página tolerando timeout de carregamento, como em open_sicar_browser().
+
+    Com a estratégia "eager" o retorno é no DOMContentLoaded; a prontidão da
+    página é verificada depois, pelas sondas de cada tipo de página. A
+    navegação aguarda a vez no controle de cortesia (politeness), que reduz a
+    taxa de pedidos quando o carregamento é lento ou termina em página de erro.
+
+    Args:
+        interactive: Navegação do navegador interativo, que usa as vagas
+            reservadas a ele no controle de cortesia
+    """
+    with politeness.scheduler.slot(url, interactive=interactive) as slot:
+        try:
+            driver.get(url)
+        except Exception as e:
+            logger.warning(f"Timeout ao carregar {url}, continuando: {str(e)}")
+        try:
+            title = driver.title
+        except Exception:
+            title = None
+        if politeness.is_error_page(title):
+            logger.warning(f"Página de erro ao carregar {url}: {title}")
+            slot.error()
+
+
+def open_property(driver, car_code, timeout=60):
+    """
+    Navega até o imóvel de um código do CAR.
+
+    Args:
+        driver: Instância do WebDriver
+        car_code: Código do imóvel no CAR (ex.: MT-5107925-...)
+        timeout: Tempo máximo para encontrar a busca e o botão de download
+
+    Returns:
+        bool: True se a página do imóvel com o botão de download foi aberta
+    """
+    load_page(driver, sicar_url(SICAR_INDEX_PATH))
+
+    index = wait_until_ready(driver, INDEX_PAGE, timeout)
+    if not index['ready']:
+        logger.warning(f"Campo de busca de imóvel não encontrado para {car_code}")
+        return False
+
+    search_input = index['elements']['busca']
+    search_input.clear()
+    search_input.send_keys(car_code)
+
+    search_button = index['elements'].get('botao_busca')
+    if search_button:
+        driver.execute_script("arguments[0].click();", search_button)
+    else:
+        search_input.send_keys(Keys.ENTER)
+
+    if not wait_until_ready(driver, PROPERTY_PAGE, timeout)['ready']:
+        logger.warning(f"Botão de download não apareceu para o imóvel {car_code}")
+        return False
+
+    logger.info(f"Imóvel {car_code} aberto")
+    return True
+
+
+def open_municipality(driver, uf, municipio, timeout=60):
+    """
+    Navega até o download de um município na página de downloads por estado.
+
+    Args:
+        driver: Instância do WebDriver
+        uf: Sigla do estado (ex.: MT)
+        municipio: Nome do município
+        timeout: Tempo máximo de espera por cada etapa
+
+    Returns:
+        bool: True se o link de download do município foi acionado
+    """
+    load_page(driver, sicar_url(SICAR_DOWNLOADS_PATH))
+
+    uf_literal = xpath_literal(uf)
+    state_selectors = [
+        (By.XPATH, f"//*[self::a or self::button or self::li][normalize-space()={uf_literal}]"),
+        (By.XPATH, f"//*[@data-estado={uf_literal} or @data-uf={uf_literal}]"),
+    ]
+    state_element = wait_for_any(driver, state_selectors, timeout)
+    if not state_element:
+        logger.warning(f"Estado {uf} não encontrado na página de downloads")
+        return False
+    driver.execute_script("arguments[0].click();", state_element)
+
+    municipio_literal = xpath_literal(municipio)
+    municipality_selectors = [
+        (By.XPATH, f"//tr[td[contains(normalize-space(), {municipio_literal})]]//*[self::a or self::button]"),
+        (By.XPATH, f"//*[self::a or self::button][contains(normalize-space(), {municipio_literal})]"),
+    ]
+    municipality_element = wait_for_any(driver, municipality_selectors, timeout)
+    if not municipality_element:
+        logger.warning(f"Município {municipio}/{uf} não encontrado")
+        return False
+    driver.execute_script("arguments[0].click();", municipality_element)
+
+    logger.info(f"Download do município {municipio}/{uf} acionado")
+    return True
+
+
+def click_download_button(driver):
+    """
+    Clica no botão de download do shapefile.
+
+    Returns:
+        bool: True se algum botão foi clicado
+    """
+    readiness = PROPERTY_PAGE.check(driver)
+    button = readiness['elements'].get('botao_download')
+    if not button:
+        return False
+
+    with inside_frame(driver, readiness):
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", button)
+        driver.execute_script("arguments[0].click();", button)
+    return True
+
+
+def capture_captcha(driver, timeout=15, network=None):
+    """
+    Aguarda a imagem do CAPTCHA carregar e a captura.
+
+    Args:
+        driver: Instância do WebDriver
+        timeout: Tempo máximo de espera, em segundos
+        network: NetworkCaptchaCapture da sessão; a imagem é obtida da rede
+            assim que chega, e o DOM só é consultado se nada chegar (ex.: cache)
+
+    Returns:
+        str: Imagem do CAPTCHA como data URL, ou None se não apareceu
+    """
+    if network:
+        captured = network.wait(timeout)
+        if captured:
+            return captured['image']
+        timeout = 0
+
+    readiness = wait_until_ready(driver, DOWNLOAD_DIALOG, timeout)
+    element = readiness['elements'].get('imagem_captcha')
+    if not element:
+        return None
+
+    try:
+        with inside_frame(driver, readiness):
+            return f"data:image/png;base64,{element.screenshot_as_base64}"
+    except Exception as e:
+        logger.warning(f"Erro ao capturar imagem do CAPTCHA: {str(e)}")
+        return None
+
+
+def captcha_present(driver):
+    """Verifica, sem esperar, se a imagem do CAPTCHA continua na página (ou em um iframe)."""
+    return DOWNLOAD_DIALOG.check(driver)['elements'].get('imagem_captcha') is not None
@@ -0,0 +1,68 @@
+"""Sessão falsa e utilitários comuns aos testes do agendador e do diário de trabalhos."""
+
+import os
+import time
+
+from captcha_queue import CaptchaQueue
+from job_scheduler import JobScheduler
+
+CAR_CODE = 'MT-5107925-0123456789ABCDEF0123456789ABCDEF'
+
+
+class FakeSession:
+    """Sessão sem Chrome: chega ao botão de download e, sem CAPTCHA, o arquivo chega ao diretório."""
+
+    def __init__(self, session_id, download_dir, reach=True, block=None):
+        self.session_id = session_id
+        self.download_dir = str(download_dir)
+        self.reach = reach
+        self.block = block
+        self.recycle_reason = None
+        self.pages_loaded = 0
+        self.current_job_id = None
+        self.closed = False
+
+    def ensure_driver(self):
+        pass
+
+    def reset_captures(self):
+        pass
+
+    def open_property(self, car_code, timeout=60):
+        if self.block:
+            self.block.wait(10)
+            return False
+        return self.reach
+
+    def open_municipality(self, uf, municipio, timeout=60):
+        return self.reach
+
+    def click_download_button(self):
+        return True
+
+    def capture_captcha(self, timeout=15):
+        # Chamado depois de listar o diretório: o download começa aqui
+        os.makedirs(self.download_dir, exist_ok=True)
+        with open(os.path.join(self.download_dir, f"{time.time_ns()}.zip"), 'wb') as output:
+            output.write(b'PK\x05\x06' + b'\x00' * 18)
+        return None
+
+    def is_alive(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def make_scheduler(factory, **options):
+    queue = CaptchaQueue(lambda *args: None)
+    return JobScheduler(factory, queue, pool_size=1, **options)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
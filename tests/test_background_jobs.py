@@ -0,0 +1,119 @@
+import threading
+
+from background_jobs import (BackgroundJobs, JobCancelled, TASK_CANCELLED, TASK_DONE, TASK_FAILED,
+                             TASK_RUNNING)
+from webdriver_tracing import tracer
+
+
+def make_jobs():
+    events = []
+    return BackgroundJobs(emit=lambda event, data: events.append((event, data))), events
+
+
+def test_result_and_progress_events():
+    jobs, events = make_jobs()
+
+    def work(job):
+        job.progress('metade')
+        return 42
+
+    job, coalesced = jobs.submit('principal', 'force_download', work)
+    job.future.result(5)
+    assert not coalesced
+    assert job.state == TASK_DONE and job.result == 42
+    assert ('background_job_progress', {'job_id': job.job_id, 'name': 'force_download',
+                                        'message': 'metade', 'level': 'info'}) in events
+    assert events[-1][0] == 'background_job' and events[-1][1]['state'] == TASK_DONE
+    jobs.shutdown()
+
+
+def test_repeated_request_coalesces_while_running():
+    jobs, _ = make_jobs()
+    started, release = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        release.wait(5)
+        return 'ok'
+
+    first, _ = jobs.submit('principal', 'force_download', work)
+    started.wait(5)
+    second, coalesced = jobs.submit('principal', 'force_download', work)
+    other, other_coalesced = jobs.submit('pool-1', 'force_download', work)
+    release.set()
+    first.future.result(5)
+    other.future.result(5)
+
+    assert coalesced and second is first
+    assert not other_coalesced and other is not first
+    # Terminada a tarefa, um novo pedido cria outra
+    third, coalesced = jobs.submit('principal', 'force_download', work)
+    third.future.result(5)
+    assert not coalesced and third is not first
+    jobs.shutdown()
+
+
+def test_cancel_running_job_stops_at_checkpoint():
+    jobs, _ = make_jobs()
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        job.sleep(10)
+        return 'não deveria terminar'
+
+    job, _ = jobs.submit('principal', 'force_download', work)
+    started.wait(5)
+    assert job.state == TASK_RUNNING
+    jobs.cancel(job.job_id)
+    job.future.result(5)
+    assert job.state == TASK_CANCELLED and job.result is None
+    jobs.shutdown()
+
+
+def test_cancel_queued_job_never_runs():
+    jobs, _ = make_jobs()
+    release = threading.Event()
+    ran = []
+
+    first, _ = jobs.submit('principal', 'primeira', lambda job: release.wait(5))
+    second, _ = jobs.submit('principal', 'segunda', lambda job: ran.append(True))
+    jobs.cancel(second.job_id)
+    release.set()
+    first.future.result(5)
+
+    assert second.state == TASK_CANCELLED
+    assert ran == []
+    jobs.shutdown()
+
+
+def test_failure_is_reported():
+    jobs, _ = make_jobs()
+
+    def work(job):
+        raise ValueError('botão não encontrado')
+
+    job, _ = jobs.submit('principal', 'force_download_button', work)
+    job.future.result(5)
+    assert job.state == TASK_FAILED
+    assert job.error == 'botão não encontrado'
+    jobs.shutdown()
+
+
+def test_cancelled_job_closes_its_trace():
+    jobs, _ = make_jobs()
+    depths = []
+
+    def cancelled(job):
+        raise JobCancelled()
+
+    def work(job):
+        depths.append(len(tracer._stack()))
+
+    jobs.submit('principal', 'cancelada', cancelled)[0].future.result(5)
+    jobs.submit('principal', 'seguinte', work)[0].future.result(5)
+
+    # A segunda tarefa, na mesma thread, abre um trace novo em vez de herdar a pilha
+    assert depths == [1]
+    assert any(summary['name'] == 'tarefa cancelada' for summary in tracer.recent())
+    jobs.shutdown()
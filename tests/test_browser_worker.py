@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+import socket
+import textwrap
+import threading
+from multiprocessing.connection import Connection
+
+import browser_worker
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_worker_child_does_not_run_parent_main(tmp_path):
+    # Script principal com efeito colateral no nível do módulo, como o captcha_mirror
+    marker = tmp_path / 'imports.txt'
+    script = tmp_path / 'app.py'
+    script.write_text(textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {REPO_DIR!r})
+        with open({str(marker)!r}, 'a') as f:
+            f.write(f"{{__name__}} {{os.getpid()}}\\n")
+
+        if __name__ == '__main__':
+            from browser_worker import WorkerSession
+            session = WorkerSession('teste', {str(tmp_path / 'downloads')!r}, start_timeout=60)
+            session._start()
+            print('alive', session.call('is_alive'), session.process.pid != os.getpid())
+            session.close()
+    """))
+
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert 'alive False True' in result.stdout
+    # O módulo principal rodou só no processo pai, e não de novo no filho
+    lines = marker.read_text().splitlines()
+    assert len(lines) == 1 and lines[0].startswith('__main__ ')
+
+
+class RunningProcess:
+    returncode = None
+
+    def poll(self):
+        return None
+
+
+def test_accept_rejects_connection_with_wrong_token():
+    session = browser_worker.WorkerSession('teste', '.', start_timeout=10)
+    token = 'a' * 64
+    server = socket.create_server(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+
+    def connect():
+        intruder = socket.create_connection(('127.0.0.1', port))
+        intruder.sendall(b'b' * 64)
+        worker = socket.create_connection(('127.0.0.1', port))
+        worker.sendall(token.encode('ascii'))
+        Connection(worker.detach()).send('pronto')
+        intruder.close()
+
+    thread = threading.Thread(target=connect)
+    thread.start()
+    try:
+        conn = session._accept(server, RunningProcess(), token)
+        assert conn.recv() == 'pronto'
+        conn.close()
+    finally:
+        thread.join()
+        server.close()
+
+
+def test_worker_round_trip_and_close(tmp_path):
+    session = browser_worker.WorkerSession('teste', str(tmp_path), start_timeout=60)
+    session._start()
+    try:
+        assert session.call('is_alive') is False
+        assert session.call('reset_captures') is None
+    finally:
+        session.close()
+    assert not session._running()
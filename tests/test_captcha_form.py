@@ -0,0 +1,99 @@
+from selenium.common.exceptions import StaleElementReferenceException
+
+from captcha_form import (FILL_AND_SUBMIT_SCRIPT, RESOLVE_HANDLES_SCRIPT, SUBMIT_NO_BUTTON, SUBMIT_OK, SUBMIT_STALE,
+                          resolve_captcha_handles, submit_captcha)
+
+URL = 'https://consultapublica.car.gov.br/publico/imoveis/index'
+
+
+class FakeElement:
+    """Referência a um elemento; fica obsoleta quando o documento é substituído."""
+
+    def __init__(self, name, document):
+        self.name = name
+        self.document = document
+
+
+class FakeDriver:
+    """Executa os scripts do formulário sobre um documento simulado e registra as chamadas."""
+
+    def __init__(self, has_submit=True):
+        self.current_url = URL
+        self.has_submit = has_submit
+        self.document = 0
+        self.calls = []
+        self.filled = []
+
+    def replace_document(self):
+        """Simula a troca da página (ex.: o formulário foi recarregado)."""
+        self.document += 1
+
+    def execute_script(self, script, *args):
+        if script == RESOLVE_HANDLES_SCRIPT:
+            self.calls.append('resolve')
+            submit = FakeElement('submit', self.document) if self.has_submit else None
+            return [FakeElement('input', self.document), submit]
+        if script == FILL_AND_SUBMIT_SCRIPT:
+            self.calls.append('fill')
+            input_element, submit, text = args
+            if input_element.document != self.document:
+                raise StaleElementReferenceException('stale element reference')
+            self.filled.append(text)
+            return SUBMIT_OK if submit else SUBMIT_NO_BUTTON
+        raise AssertionError('script inesperado')
+
+
+def test_cached_handles_are_reused_without_new_lookup():
+    driver = FakeDriver()
+    handles = resolve_captcha_handles(driver)
+    assert handles['url'] == URL
+    driver.calls.clear()
+
+    result, used = submit_captcha(driver, handles, 'abc12')
+    assert result == SUBMIT_OK
+    assert used is handles
+    # Só o preenchimento vai ao navegador: os elementos guardados bastam
+    assert driver.calls == ['fill']
+    assert driver.filled == ['abc12']
+
+
+def test_stale_handles_are_resolved_again():
+    driver = FakeDriver()
+    handles = resolve_captcha_handles(driver)
+    driver.replace_document()
+    driver.calls.clear()
+
+    result, used = submit_captcha(driver, handles, 'xyz9')
+    assert result == SUBMIT_OK
+    assert used is not handles
+    assert used['input'].document == driver.document
+    assert driver.calls == ['fill', 'resolve', 'fill']
+    assert driver.filled == ['xyz9']
+
+    # Os novos elementos são reaproveitados no envio seguinte
+    driver.calls.clear()
+    assert submit_captcha(driver, used, 'xyz9') == (SUBMIT_OK, used)
+    assert driver.calls == ['fill']
+
+
+def test_missing_handles_are_resolved():
+    driver = FakeDriver(has_submit=False)
+    result, used = submit_captcha(driver, None, 'abc12')
+    assert result == SUBMIT_NO_BUTTON
+    assert used['submit'] is None
+    assert driver.calls == ['resolve', 'fill']
+
+
+def test_stale_handles_without_form_report_stale():
+    class NoFormDriver(FakeDriver):
+        def execute_script(self, script, *args):
+            if script == RESOLVE_HANDLES_SCRIPT:
+                self.calls.append('resolve')
+                return None
+            return super().execute_script(script, *args)
+
+    driver = NoFormDriver()
+    stale = {'input': FakeElement('input', -1), 'submit': None}
+    assert submit_captcha(driver, stale, 'abc12') == (SUBMIT_STALE, None)
+    assert driver.calls == ['fill', 'resolve']
+    assert driver.filled == []
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from captcha_queue import CaptchaQueue, TASK_ASSIGNED, TASK_PENDING
+
+
+def make_queue():
+    sent = []
+    queue = CaptchaQueue(lambda operator_id, event, data: sent.append((operator_id, event, data)),
+                         assignment_timeout=30, task_ttl=60)
+    return queue, sent
+
+
+def test_task_goes_to_free_operator_and_solution_is_forwarded():
+    queue, sent = make_queue()
+    solutions = []
+    queue.register_operator('op1')
+    task = queue.submit('principal', 'data:image/png;base64,AAAA',
+                        on_solution=lambda task, text: solutions.append(text))
+
+    assert task.status == TASK_ASSIGNED and task.operator_id == 'op1'
+    assert sent[-1][:2] == ('op1', 'captcha_task')
+    assert queue.solve('op1', task.task_id, 'x7k2')
+    assert solutions == ['x7k2']
+    assert queue.free_operator_count() == 1
+
+
+def test_same_session_reuses_open_task():
+    queue, _ = make_queue()
+    first = queue.submit('principal', 'data:image/png;base64,AAAA')
+    second = queue.submit('principal', 'data:image/png;base64,BBBB')
+    assert second is first
+    assert first.image.endswith('BBBB')
+
+
+def test_task_claimed_by_another_node_is_not_assigned():
+    queue, _ = make_queue()
+    queue.claim = lambda task: False
+    queue.register_operator('op1')
+    task = queue.submit('principal', 'data:image/png;base64,AAAA')
+
+    assert task.status == TASK_PENDING and task.claimed is False
+    # A reserva perdida não é pedida de novo a cada distribuição
+    calls = []
+    queue.claim = lambda task: calls.append(task) or False
+    queue.register_operator('op2')
+    assert calls == [] and task.status == TASK_PENDING
+
+
+def test_claim_runs_outside_queue_lock():
+    queue, _ = make_queue()
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_claim(task):
+        entered.set()
+        release.wait(5)
+        return True
+
+    queue.claim = slow_claim
+    queue.register_operator('op1')
+    tasks = []
+    submitter = threading.Thread(target=lambda: tasks.append(queue.submit('principal', 'data:image/png;base64,AAAA')))
+    submitter.start()
+    assert entered.wait(5)
+
+    # Com a reserva em andamento, outros operadores continuam sendo atendidos
+    started = time.monotonic()
+    queue.register_operator('op2')
+    queue.metrics()
+    assert time.monotonic() - started < 1
+
+    release.set()
+    submitter.join(5)
+    assert tasks[0].status == TASK_ASSIGNED and tasks[0].claimed is True
+
+
+def test_failed_claim_is_retried_on_next_dispatch():
+    queue, _ = make_queue()
+    attempts = []
+
+    def flaky_claim(task):
+        attempts.append(task.task_id)
+        if len(attempts) == 1:
+            raise ConnectionError('Redis fora do ar')
+        return True
+
+    queue.claim = flaky_claim
+    queue.register_operator('op1')
+    task = queue.submit('principal', 'data:image/png;base64,AAAA')
+    assert task.status == TASK_PENDING and task.claimed is None
+
+    queue.register_operator('op2')
+    assert task.status == TASK_ASSIGNED and len(attempts) == 2
+
+
+def assigned_tasks(sent, operator_id):
+    return [data['task_id'] for op, event, data in sent if op == operator_id and event == 'captcha_task']
+
+
+def test_skipped_task_goes_to_another_free_operator():
+    queue, sent = make_queue()
+    queue.register_operator('op1')
+    task = queue.submit('s1', 'data:image/png;base64,AAAA')
+    queue.register_operator('op2')
+
+    assert queue.skip('op1', task.task_id)
+    assert task.operator_id == 'op2' and task.attempts == 2
+    # Quem recusou não recebe a tarefa de volta e fica livre para a próxima
+    assert queue.free_operator_count() == 1
+
+
+def test_skipped_task_waits_for_busy_operator():
+    queue, sent = make_queue()
+    queue.register_operator('op1')
+    queue.register_operator('op2')
+    first = queue.submit('s1', 'data:image/png;base64,AAAA')
+    second = queue.submit('s2', 'data:image/png;base64,BBBB')
+    assert (first.operator_id, second.operator_id) == ('op1', 'op2')
+
+    queue.skip('op1', first.task_id)
+    assert first.status == TASK_PENDING
+
+    queue.solve('op2', second.task_id, 'abcd')
+    assert first.operator_id == 'op2'
+
+
+def test_lone_operator_gets_skipped_task_back():
+    queue, _ = make_queue()
+    queue.register_operator('op1')
+    task = queue.submit('s1', 'data:image/png;base64,AAAA')
+    queue.skip('op1', task.task_id)
+    assert task.operator_id == 'op1' and task.excluded_operators == set()
+
+
+def test_disconnected_operator_does_not_count_as_excluded():
+    queue, _ = make_queue()
+    for operator_id in ('op1', 'op2', 'op3'):
+        queue.register_operator(operator_id)
+    task = queue.submit('s1', 'data:image/png;base64,AAAA')
+    other = queue.submit('s2', 'data:image/png;base64,BBBB')
+    busy = queue.submit('s3', 'data:image/png;base64,CCCC')
+    assert (task.operator_id, other.operator_id, busy.operator_id) == ('op1', 'op2', 'op3')
+
+    queue.skip('op1', task.task_id)
+    queue.solve('op2', other.task_id, 'abcd')
+    assert task.operator_id == 'op2'
+    queue.skip('op2', task.task_id)
+    queue.unregister_operator('op2')
+
+    # op1 recusou e op2 saiu: a tarefa espera op3, em vez de voltar para op1
+    assert task.status == TASK_PENDING
+    queue.solve('op3', busy.task_id, 'efgh')
+    assert task.operator_id == 'op3'
+
+
+def test_disconnect_requeues_assigned_task():
+    queue, sent = make_queue()
+    queue.register_operator('op1')
+    task = queue.submit('s1', 'data:image/png;base64,AAAA')
+    queue.register_operator('op2')
+
+    queue.unregister_operator('op1')
+    assert task.operator_id == 'op2'
+    assert assigned_tasks(sent, 'op2') == [task.task_id]
+    assert queue.metrics()['counters']['reassigned'] == 1
+
+
+def test_reassignment_after_timeout_measures_wait_from_requeue():
+    sent = []
+    queue = CaptchaQueue(lambda *args: sent.append(args), assignment_timeout=0.2, task_ttl=60)
+    queue.register_operator('op1')
+    queue.register_operator('op2')
+    task = queue.submit('s1', 'data:image/png;base64,AAAA')
+    assert task.operator_id == 'op1'
+
+    time.sleep(0.3)
+    queue.tick()
+    assert task.operator_id == 'op2'
+    assert ('op1', 'captcha_task_cancelled') in [(op, event) for op, event, _ in sent]
+    # As duas atribuições foram imediatas: o tempo com op1 não entra na espera
+    assert queue.metrics()['wait_avg'] < 0.1
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from captcha_queue import CaptchaQueue, TASK_ASSIGNED, TASK_PENDING
+from cluster import ClusterNode, LocalBus, MSG_CAPTCHA_SOLUTION, global_session_id, split_session_id
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def make_node(bus, node_id):
+    queue = CaptchaQueue(lambda operator_id, event, data: None, task_ttl=60)
+    node = ClusterNode(node_id, bus, queue, interval=60, offer_after=0)
+    node.start()
+    return node, queue
+
+
+def test_global_session_id_round_trip():
+    assert split_session_id(global_session_id('no-a:5001', 'pool-1')) == ('no-a:5001', 'pool-1')
+
+
+def test_waiting_captcha_is_solved_by_operator_on_another_node():
+    bus = LocalBus()
+    node_a, queue_a = make_node(bus, 'no-a')
+    node_b, queue_b = make_node(bus, 'no-b')
+    solutions = []
+    try:
+        task = queue_a.submit('principal', 'data:image/png;base64,AAAA',
+                              on_solution=lambda task, text: solutions.append(text))
+        node_a.tick()  # Sem operador em A: a tarefa é oferecida
+
+        queue_b.register_operator('op-b')
+        node_b.tick()  # B reserva a tarefa e a entrega ao seu operador
+        copy = queue_b._tasks[queue_b.open_task_ids().pop()]
+        assert copy.status == TASK_ASSIGNED and copy.claim_key == task.task_id
+
+        # Um operador que chega em A depois não recebe a tarefa reservada por B
+        queue_a.register_operator('op-a')
+        assert task.status == TASK_PENDING and task.claimed is False
+
+        assert queue_b.solve('op-b', copy.task_id, 'x7k2')
+        assert wait_for(lambda: solutions == ['x7k2'])
+        assert task.task_id not in queue_a.open_task_ids()
+    finally:
+        node_a.stop()
+        node_b.stop()
+
+
+def test_node_registry_lists_sessions_of_all_nodes():
+    bus = LocalBus()
+    node_a = ClusterNode('no-a', bus, CaptchaQueue(lambda *args: None), sessions=lambda: ['principal'], interval=60)
+    node_b = ClusterNode('no-b', bus, CaptchaQueue(lambda *args: None), sessions=lambda: ['pool-1'], interval=60)
+    node_a.tick()
+    node_b.tick()
+    sessions = {session['node_id']: session['session_id'] for session in node_a.sessions()}
+    assert sessions == {'no-a': 'principal', 'no-b': 'pool-1'}
+    assert node_b.owner(global_session_id('no-a', 'principal')) == 'no-a'
+
+
+def test_counters_and_offers_survive_concurrent_threads():
+    bus = LocalBus()
+    node, _ = make_node(bus, 'no-a')
+    other, _ = make_node(bus, 'no-b')
+    received = []
+    lock = threading.Lock()
+
+    def on_command(session_id, data):
+        with lock:
+            received.append(data)
+
+    node.handle('clique', on_command)
+    node.sessions_fn = lambda: ['pool-1']
+    node.tick()
+    try:
+        with node._lock:
+            node._offered.update({f'tarefa-{index}': 'pool-1' for index in range(200)})
+
+        def send_commands():
+            for index in range(100):
+                other.route(global_session_id('no-a', 'pool-1'), 'clique', {'index': index})
+
+        def solve_offers():
+            for index in range(200):
+                node._on_message({'type': MSG_CAPTCHA_SOLUTION, 'task_id': f'tarefa-{index}', 'text': 'x',
+                                  'node_id': 'no-b'})
+
+        threads = [threading.Thread(target=send_commands) for _ in range(4)]
+        threads += [threading.Thread(target=solve_offers), threading.Thread(target=node._forget_closed_offers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        assert wait_for(lambda: node.status()['counters']['commands_received'] == 400)
+        assert other.status()['counters']['commands_sent'] == 400
+        assert node.status()['offered_pending'] == 0
+        assert wait_for(lambda: len(received) == 400)
+    finally:
+        other.stop()
+        node.stop()
@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import os
+import re
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from direct_download import DirectDownloader, expected_checksums, filename_from_response
+
+BODY = b'PK\x05\x06' + bytes(range(256)) * 400
+MD5 = hashlib.md5(BODY)
+SHA256 = hashlib.sha256(BODY)
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def b64(digest):
+    return base64.b64encode(digest.digest()).decode()
+
+
+def test_expected_checksums_reads_content_md5_and_digest():
+    headers = {'Content-MD5': b64(MD5), 'Digest': f"SHA-256={b64(SHA256)}, unixsum=30637"}
+    assert expected_checksums(headers) == {'md5': MD5.hexdigest(), 'sha256': SHA256.hexdigest()}
+
+
+def test_expected_checksums_reads_repr_digest_structured_field():
+    headers = {'Repr-Digest': f"sha-256=:{b64(SHA256)}:"}
+    assert expected_checksums(headers) == {'sha256': SHA256.hexdigest()}
+
+
+def test_expected_checksums_without_headers():
+    assert expected_checksums({}) == {}
+
+
+def test_expected_checksums_ignores_malformed_values():
+    headers = {'Content-MD5': 'não é base64', 'Digest': f"sha-256=abc, md5={MD5.hexdigest()}"}
+    assert expected_checksums(headers) == {'md5': MD5.hexdigest()}
+
+
+def test_expected_checksums_accepts_hex_sha256():
+    assert expected_checksums({'Digest': f"sha-256={SHA256.hexdigest()}"}) == {'sha256': SHA256.hexdigest()}
+
+
+def test_filename_prefers_encoded_content_disposition():
+    response = FakeResponse({'Content-Disposition': "attachment; filename=\"x.zip\"; filename*=UTF-8''Im%C3%B3vel%20MT.zip"})
+    assert filename_from_response(response, 'https://car.gov.br/baixar') == 'Imóvel MT.zip'
+
+
+def test_filename_strips_directories_from_content_disposition():
+    response = FakeResponse({'Content-Disposition': 'attachment; filename="..\\..\\SHAPE_123.zip"'})
+    assert filename_from_response(response, 'https://car.gov.br/baixar') == 'SHAPE_123.zip'
+
+
+def test_filename_falls_back_to_suggested_then_url():
+    response = FakeResponse({})
+    assert filename_from_response(response, 'https://car.gov.br/a/b.zip', 'sugerido.zip') == 'sugerido.zip'
+    assert filename_from_response(response, 'https://car.gov.br/a/b.zip?x=1') == 'b.zip'
+    assert filename_from_response(response, 'https://car.gov.br/') == 'shapefile.zip'
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serve BODY, derrubando a conexão nas primeiras respostas conforme o servidor."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        etag = server.etags[min(len(server.requests), len(server.etags)) - 1]
+        offset = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match and server.ranges and self.headers.get('If-Range') in (None, etag):
+            offset = int(match.group(1))
+
+        body = BODY[offset:]
+        self.send_response(206 if offset else 200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if offset:
+            self.send_header('Content-Range', f"bytes {offset}-{len(BODY) - 1}/{len(BODY)}")
+        for name, value in server.extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if server.drops > 0:
+            server.drops -= 1
+            self.wfile.write(body[:len(body) // 3])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDriver:
+    def execute_cdp_cmd(self, command, params):
+        return {'cookies': [{'name': 'sessao', 'value': 'abc'}]}
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(drops=0, ranges=True, etags=('"v1"',), extra_headers=None):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        server.requests = []
+        server.drops = drops
+        server.ranges = ranges
+        server.etags = list(etags)
+        server.extra_headers = extra_headers or {}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def download(server, tmp_path, max_retries=3):
+    downloader = DirectDownloader(max_workers=1, chunk_size=4096, max_retries=max_retries)
+    done = threading.Event()
+    results = []
+
+    def on_done(info, error):
+        results.append((info, error))
+        done.set()
+
+    capture = {'url': f"http://127.0.0.1:{server.server_port}/baixar", 'method': 'GET',
+               'headers': {'Accept': '*/*', 'Range': 'bytes=0-'}, 'filename': 'imovel.zip'}
+    assert downloader.start(FakeDriver(), capture, tmp_path / 'job', on_done)
+    assert done.wait(30)
+    downloader.shutdown()
+    return results[0]
+
+
+def test_transfer_verifies_announced_checksums(serve, tmp_path):
+    server = serve(extra_headers={'Content-MD5': b64(MD5), 'Repr-Digest': f"sha-256=:{b64(SHA256)}:"})
+    info, error = download(server, tmp_path)
+    assert error is None
+    assert info['checksum_verified'] and info['retries'] == 0
+    assert open(info['path'], 'rb').read() == BODY
+    assert server.requests[0]['Cookie'] == 'sessao=abc' and 'Range' not in server.requests[0]
+
+
+def test_transfer_resumes_with_range_and_validator(serve, tmp_path):
+    server = serve(drops=1)
+    info, error = download(server, tmp_path)
+    assert error is None and info['retries'] == 1
+    assert open(info['path'], 'rb').read() == BODY
+    resumed = server.requests[1]
+    assert resumed['Range'].startswith('bytes=') and resumed['Range'] != 'bytes=0-'
+    assert resumed['If-Range'] == '"v1"'
+
+
+def test_transfer_restarts_when_file_changed(serve, tmp_path):
+    # O ETag mudou entre as respostas: o servidor ignora o Range e manda o arquivo inteiro
+    server = serve(drops=1, etags=('"v1"', '"v2"'))
+    info, error = download(server, tmp_path)
+    assert error is None and info['retries'] == 1
+    assert open(info['path'], 'rb').read() == BODY
+
+
+def test_transfer_restarts_without_range_support(serve, tmp_path):
+    server = serve(drops=1, ranges=False)
+    info, error = download(server, tmp_path)
+    assert error is None
+    assert 'Range' not in server.requests[1]
+    assert open(info['path'], 'rb').read() == BODY
+
+
+def test_transfer_fails_after_max_retries(serve, tmp_path):
+    server = serve(drops=5)
+    info, error = download(server, tmp_path, max_retries=1)
+    assert info is None and error
+    assert len(server.requests) == 2
+    assert os.listdir(tmp_path / 'job') == []
+
+
+def test_transfer_rejects_checksum_mismatch(serve, tmp_path):
+    server = serve(extra_headers={'Content-MD5': b64(hashlib.md5(b'outro arquivo'))})
+    info, error = download(server, tmp_path)
+    assert info is None and 'md5' in error
+    assert os.listdir(tmp_path / 'job') == []
+
+
+def test_transfer_with_malformed_checksum_still_reports(serve, tmp_path):
+    server = serve(extra_headers={'Content-MD5': '%%%', 'Digest': 'sha-256=nao-base64'})
+    info, error = download(server, tmp_path)
+    assert error is None and not info['checksum_verified']
@@ -0,0 +1,47 @@
+import os
+
+from download_watcher import DownloadWatcher
+
+
+def make_watcher(root):
+    completed, started = [], []
+    watcher = DownloadWatcher(root, completed.append, on_started=started.append)
+    return watcher, completed, started
+
+
+def test_concurrent_downloads_in_one_directory_keep_their_own_start(tmp_path):
+    watcher, completed, started = make_watcher(tmp_path)
+    session_dir = tmp_path / 'pool-1'
+    session_dir.mkdir()
+
+    (session_dir / 'a.zip.part').write_bytes(b'x')
+    watcher._partial_seen(str(session_dir), 'a.zip.part')
+    first = watcher._pending[str(session_dir / 'a.zip.part')]
+    (session_dir / 'b.zip.part').write_bytes(b'x')
+    watcher._partial_seen(str(session_dir), 'b.zip.part')
+    assert len(started) == 2 and started[0]['session_id'] == 'pool-1'
+
+    os.replace(session_dir / 'b.zip.part', session_dir / 'b.zip')
+    watcher._completed(str(session_dir), 'b.zip')
+    # O parcial de a.zip continua pendente, com o próprio início
+    assert watcher._pending == {str(session_dir / 'a.zip.part'): first}
+    assert completed[0]['path'] == str(session_dir / 'b.zip')
+
+
+def test_chrome_rename_keeps_a_single_download(tmp_path):
+    watcher, completed, started = make_watcher(tmp_path)
+    root = str(tmp_path)
+
+    (tmp_path / 'Unconfirmed 123.crdownload').write_bytes(b'x')
+    watcher._partial_seen(root, 'Unconfirmed 123.crdownload')
+    started_at = started[0]['started_at']
+
+    os.replace(tmp_path / 'Unconfirmed 123.crdownload', tmp_path / 'imovel.zip.crdownload')
+    watcher._partial_seen(root, 'imovel.zip.crdownload')
+    assert len(started) == 1
+
+    os.replace(tmp_path / 'imovel.zip.crdownload', tmp_path / 'imovel.zip')
+    watcher._completed(root, 'imovel.zip')
+    assert completed[0]['session_id'] == 'principal'
+    assert completed[0]['started_at'] == started_at
+    assert watcher._pending == {}
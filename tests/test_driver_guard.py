@@ -0,0 +1,90 @@
+import threading
+import time
+
+from driver_guard import DriverGuard
+
+
+def hold_shared(guard, release):
+    entered = threading.Event()
+
+    def run():
+        with guard.shared():
+            entered.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert entered.wait(5)
+    return thread
+
+
+def test_shared_users_do_not_block_each_other():
+    guard = DriverGuard()
+    release = threading.Event()
+    holder = hold_shared(guard, release)
+    started = time.monotonic()
+    with guard.shared():
+        pass
+    assert time.monotonic() - started < 1
+    release.set()
+    holder.join(5)
+
+
+def test_exclusive_is_deferred_while_driver_in_use():
+    guard = DriverGuard()
+    release = threading.Event()
+    holder = hold_shared(guard, release)
+
+    with guard.exclusive(timeout=0) as acquired:
+        assert not acquired
+    release.set()
+    holder.join(5)
+    with guard.exclusive(timeout=0) as acquired:
+        assert acquired
+
+
+def test_exclusive_waits_for_users_and_blocks_new_ones():
+    guard = DriverGuard()
+    release = threading.Event()
+    holder = hold_shared(guard, release)
+    order = []
+
+    def replace():
+        with guard.exclusive():
+            order.append('troca')
+            time.sleep(0.2)
+
+    def use():
+        with guard.shared():
+            order.append('uso')
+
+    replacer = threading.Thread(target=replace)
+    replacer.start()
+    time.sleep(0.2)
+    user = threading.Thread(target=use)
+    user.start()
+    time.sleep(0.2)
+    # O novo uso espera a troca, que espera o uso em andamento
+    assert order == []
+
+    release.set()
+    for thread in (holder, replacer, user):
+        thread.join(5)
+    assert order == ['troca', 'uso']
+
+
+def test_reentrant_and_owner_can_use_driver():
+    guard = DriverGuard()
+    with guard.exclusive() as acquired:
+        assert acquired
+        with guard.exclusive(timeout=0) as again:
+            assert again
+        with guard.shared():
+            pass
+
+    with guard.shared():
+        # Um uso em andamento pode pedir a troca se for o único
+        with guard.exclusive(timeout=0) as acquired:
+            assert acquired
+        with guard.shared():
+            pass
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from input_forwarding import (MAX_BATCH_SIZE, MODIFIER_CTRL, MODIFIER_SHIFT, ScreenStreamer, coalesce_events,
+                              dispatch_input_batch)
+
+
+class FakeDriver:
+    """Registra os comandos CDP; a área visível tem 800x600 pixels CSS."""
+
+    def __init__(self, fail=()):
+        self.commands = []
+        self.fail = fail
+
+    def execute_cdp_cmd(self, command, params):
+        self.commands.append((command, params))
+        if command == 'Page.getLayoutMetrics':
+            return {'cssLayoutViewport': {'clientWidth': 800, 'clientHeight': 600}}
+        if params.get('type') in self.fail:
+            raise RuntimeError('sessão perdida')
+        return {}
+
+    def dispatched(self):
+        return [params for command, params in self.commands if command != 'Page.getLayoutMetrics']
+
+
+def test_consecutive_moves_and_wheel_turns_are_coalesced():
+    events = [
+        {'type': 'mousemove', 'x': 0.1, 'y': 0.1, 'buttons': 0},
+        {'type': 'mousemove', 'x': 0.2, 'y': 0.2, 'buttons': 0},
+        {'type': 'mousemove', 'x': 0.3, 'y': 0.3, 'buttons': 1},
+        {'type': 'wheel', 'x': 0.5, 'y': 0.5, 'deltaY': 100},
+        {'type': 'wheel', 'x': 0.5, 'y': 0.5, 'deltaY': 50, 'deltaX': 10},
+        {'type': 'wheel', 'x': 0.6, 'y': 0.5, 'deltaY': 20},
+    ]
+    coalesced = coalesce_events(events)
+    assert [event['x'] for event in coalesced] == [0.2, 0.3, 0.5, 0.6]
+    assert coalesced[2]['deltaY'] == 150.0
+    assert coalesced[2]['deltaX'] == 10.0
+    # O lote original não é alterado
+    assert events[3]['deltaY'] == 100
+
+
+def test_batch_is_truncated():
+    events = [{'type': 'keydown', 'key': 'a'}] * (MAX_BATCH_SIZE + 10)
+    assert len(coalesce_events(events)) == MAX_BATCH_SIZE
+
+
+def test_batch_queries_viewport_once_and_maps_mouse_events():
+    driver = FakeDriver()
+    dispatched = dispatch_input_batch(driver, [
+        {'type': 'mousedown', 'x': 0.5, 'y': 0.25, 'button': 0, 'buttons': 1, 'detail': 2},
+        {'type': 'mousemove', 'x': 0.75, 'y': 0.5, 'buttons': 1, 'shiftKey': True},
+        {'type': 'mouseup', 'x': 1.5, 'y': -1, 'button': 0, 'buttons': 0},
+        {'type': 'wheel', 'x': 0, 'y': 0, 'deltaY': 120},
+    ])
+    assert dispatched == 4
+    assert [command for command, _ in driver.commands].count('Page.getLayoutMetrics') == 1
+
+    down, drag, up, wheel = driver.dispatched()
+    assert down == {'type': 'mousePressed', 'x': 400.0, 'y': 150.0, 'modifiers': 0, 'button': 'left',
+                    'buttons': 1, 'clickCount': 2}
+    # Durante o arrasto o botão pressionado acompanha o movimento
+    assert drag == {'type': 'mouseMoved', 'x': 600.0, 'y': 300.0, 'modifiers': MODIFIER_SHIFT, 'button': 'left',
+                    'buttons': 1}
+    # Coordenadas fora da imagem ficam na borda da área visível
+    assert (up['type'], up['x'], up['y'], up['clickCount']) == ('mouseReleased', 800.0, 0.0, 1)
+    assert wheel['type'] == 'mouseWheel' and wheel['button'] == 'none' and wheel['deltaY'] == 120.0
+
+
+def test_key_events_map_to_cdp_key_types():
+    driver = FakeDriver()
+    dispatch_input_batch(driver, [
+        {'type': 'keydown', 'key': 'a', 'code': 'KeyA', 'keyCode': 65},
+        {'type': 'keyup', 'key': 'a', 'code': 'KeyA', 'keyCode': 65},
+        {'type': 'keydown', 'key': 'Enter', 'code': 'Enter', 'keyCode': 13},
+        {'type': 'keydown', 'key': 'ArrowLeft', 'code': 'ArrowLeft', 'keyCode': 37},
+        {'type': 'keydown', 'key': 'c', 'code': 'KeyC', 'keyCode': 67, 'ctrlKey': True},
+    ])
+    assert [command for command, _ in driver.commands] == ['Input.dispatchKeyEvent'] * 5
+
+    letter, release, enter, arrow, copy = driver.dispatched()
+    assert (letter['type'], letter['text'], letter['windowsVirtualKeyCode']) == ('keyDown', 'a', 65)
+    assert release['type'] == 'keyUp' and 'text' not in release
+    assert (enter['type'], enter['text']) == ('keyDown', '\r')
+    assert arrow['type'] == 'rawKeyDown' and 'text' not in arrow
+    # Atalhos não digitam texto
+    assert copy['type'] == 'rawKeyDown' and copy['modifiers'] == MODIFIER_CTRL
+
+
+def test_failed_and_unknown_events_are_not_counted():
+    driver = FakeDriver(fail=('mousePressed',))
+    dispatched = dispatch_input_batch(driver, [
+        {'type': 'mousedown', 'x': 0.5, 'y': 0.5, 'button': 0, 'buttons': 1},
+        {'type': 'touchstart'},
+        {'type': 'keydown', 'key': 'b'},
+    ])
+    assert dispatched == 1
+    assert dispatch_input_batch(driver, []) == 0
+
+
+def test_screen_streamer_groups_requests_and_honours_delay():
+    frames = []
+    captured = threading.Event()
+
+    def capture():
+        frames.append(time.monotonic())
+        captured.set()
+        return 'data:image/png;base64,'
+
+    emitted = []
+    streamer = ScreenStreamer(capture, emitted.append, min_interval=0.2)
+    started = time.monotonic()
+    streamer.request_update(delay=0.3)
+    # Um pedido sem atraso não antecipa o pedido com atraso já pendente
+    streamer.request_update()
+    streamer.request_update()
+    assert captured.wait(2)
+    time.sleep(0.5)
+
+    assert len(frames) == 1
+    assert frames[0] - started >= 0.3
+    assert emitted == ['data:image/png;base64,']
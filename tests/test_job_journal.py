@@ -0,0 +1,85 @@
+import os
+import time
+
+from job_journal import JobJournal
+from job_scheduler import (DownloadJob, JOB_DONE, JOB_DOWNLOADING, JOB_FAILED, JOB_NAVIGATING, JOB_QUEUED,
+                           KIND_PROPERTY)
+from helpers import CAR_CODE, FakeSession, make_scheduler, wait_for
+
+OTHER_CODE = 'GO-5218805-FEDCBA9876543210FEDCBA9876543210'
+
+
+def record(journal, job, state, detail=None, **fields):
+    job.state = state
+    job.updated_at = time.time()
+    for name, value in fields.items():
+        setattr(job, name, value)
+    journal.record_transition(job, detail)
+
+
+def test_latest_states_replays_last_event(tmp_path):
+    journal = JobJournal(tmp_path / 'jobs.db')
+    job = DownloadJob(KIND_PROPERTY, CAR_CODE, 'lote-1')
+    journal.record_job(job)
+    record(journal, job, JOB_NAVIGATING, attempts=1, session_id='pool-1')
+    record(journal, job, JOB_DOWNLOADING, {'download_dir': '/tmp/x', 'requested_at': 1.0})
+    journal.close()
+
+    reopened = JobJournal(tmp_path / 'jobs.db')
+    try:
+        [latest] = reopened.latest_states()
+        assert latest['job_id'] == job.job_id and latest['batch_id'] == 'lote-1'
+        assert latest['state'] == JOB_DOWNLOADING and latest['attempts'] == 1
+        assert latest['detail'] == {'download_dir': '/tmp/x', 'requested_at': 1.0}
+        assert [event['state'] for event in reopened.history(job.job_id)] == [JOB_QUEUED, JOB_NAVIGATING,
+                                                                            JOB_DOWNLOADING]
+    finally:
+        reopened.close()
+
+
+def test_resume_requeues_unfinished_and_keeps_final_jobs(tmp_path):
+    journal = JobJournal(tmp_path / 'jobs.db')
+    done = DownloadJob(KIND_PROPERTY, CAR_CODE, 'lote-1')
+    failed = DownloadJob(KIND_PROPERTY, CAR_CODE + '0', 'lote-1')
+    pending = DownloadJob(KIND_PROPERTY, OTHER_CODE, 'lote-1')
+    for job in (done, failed, pending):
+        journal.record_job(job)
+    record(journal, done, JOB_DONE, file_path=str(tmp_path / 'antigo.zip'))
+    record(journal, failed, JOB_FAILED, error='Página não carregou')
+    record(journal, pending, JOB_NAVIGATING, attempts=1)
+
+    scheduler = make_scheduler(lambda index: FakeSession('pool-1', tmp_path / 'pool'), journal=journal)
+    try:
+        assert scheduler.resume() == 1
+        assert wait_for(lambda: scheduler._jobs[pending.job_id].state == JOB_DONE)
+        assert scheduler._jobs[done.job_id].state == JOB_DONE
+        assert scheduler._jobs[failed.job_id].state == JOB_FAILED
+        # Um segundo resume não duplica os trabalhos já carregados
+        assert scheduler.resume() == 0
+    finally:
+        scheduler.stop()
+        journal.close()
+
+
+def test_resume_recovers_download_finished_before_restart(tmp_path):
+    download_dir = tmp_path / 'pool'
+    download_dir.mkdir()
+    journal = JobJournal(tmp_path / 'jobs.db')
+    job = DownloadJob(KIND_PROPERTY, CAR_CODE, 'lote-1')
+    journal.record_job(job)
+    record(journal, job, JOB_DOWNLOADING, {'download_dir': str(download_dir), 'requested_at': time.time() - 1},
+           attempts=1)
+
+    # O arquivo terminou de chegar depois do pedido, e uma parcial ficou para trás
+    (download_dir / 'imovel.zip').write_bytes(b'PK\x05\x06' + b'\x00' * 18)
+    (download_dir / 'outro.zip.crdownload').write_bytes(b'PK')
+
+    scheduler = make_scheduler(lambda index: FakeSession('pool-1', download_dir), journal=journal)
+    try:
+        assert scheduler.resume() == 0
+        resumed = scheduler._jobs[job.job_id]
+        assert wait_for(lambda: resumed.state == JOB_DONE)
+        assert os.path.basename(resumed.file_path) == 'imovel.zip'
+    finally:
+        scheduler.stop()
+        journal.close()
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+
+from job_scheduler import (parse_batch, JOB_AWAITING_CAPTCHA, JOB_DONE, JOB_FAILED, JOB_QUEUED, KIND_MUNICIPALITY,
+                           KIND_PROPERTY)
+from helpers import CAR_CODE, FakeSession, make_scheduler, wait_for
+
+
+def test_parse_batch_accepts_codes_and_municipalities():
+    items = parse_batch({'car_codes': [CAR_CODE, ' '], 'municipios': ['mt/Cuiabá', {'uf': 'go', 'municipio': 'Rio Verde'}]})
+    assert items == [(KIND_PROPERTY, CAR_CODE), (KIND_MUNICIPALITY, 'MT/Cuiabá'), (KIND_MUNICIPALITY, 'GO/Rio Verde')]
+
+
+def test_job_downloads_file(tmp_path):
+    scheduler = make_scheduler(lambda index: FakeSession(f"pool-{index + 1}", tmp_path / 'pool'))
+    try:
+        _, jobs = scheduler.submit_batch([(KIND_PROPERTY, CAR_CODE)])
+        assert wait_for(lambda: jobs[0].state == JOB_DONE)
+        assert jobs[0].file_path.endswith('.zip')
+    finally:
+        scheduler.stop()
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    scheduler = make_scheduler(lambda index: FakeSession('pool-1', tmp_path, reach=False), max_attempts=2)
+    try:
+        _, jobs = scheduler.submit_batch([(KIND_PROPERTY, CAR_CODE)])
+        assert wait_for(lambda: jobs[0].state == JOB_FAILED)
+        assert jobs[0].attempts == 2
+    finally:
+        scheduler.stop()
+
+
+def test_job_interrupted_by_stop_runs_after_restart(tmp_path):
+    block = threading.Event()
+    sessions = [FakeSession('pool-1', tmp_path / 'a', block=block), FakeSession('pool-1', tmp_path / 'b')]
+    scheduler = make_scheduler(lambda index: sessions.pop(0))
+
+    _, jobs = scheduler.submit_batch([(KIND_PROPERTY, CAR_CODE)])
+    assert wait_for(lambda: jobs[0].attempts == 1)
+
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+    assert wait_for(scheduler._stop.is_set)
+    block.set()
+    stopper.join(10)
+    assert jobs[0].state == JOB_QUEUED and jobs[0].attempts == 0
+
+    scheduler.start()
+    try:
+        assert wait_for(lambda: jobs[0].state == JOB_DONE)
+    finally:
+        scheduler.stop()
+
+
+class CaptchaSession(FakeSession):
+    """Sessão que sempre para em um CAPTCHA, sem operador para resolvê-lo."""
+
+    def capture_captcha(self, timeout=15):
+        return 'data:image/png;base64,AAAA'
+
+    def prepare_captcha(self):
+        pass
+
+
+def test_stop_while_captcha_pending_does_not_leave_zombie_workers(tmp_path):
+    sessions = [CaptchaSession('pool-1', tmp_path / 'a'), FakeSession('pool-1', tmp_path / 'b')]
+    scheduler = make_scheduler(lambda index: sessions.pop(0), captcha_timeout=120)
+
+    _, jobs = scheduler.submit_batch([(KIND_PROPERTY, CAR_CODE)])
+    assert wait_for(lambda: jobs[0].state == JOB_AWAITING_CAPTCHA)
+    old_workers = list(scheduler._workers)
+
+    started = time.monotonic()
+    scheduler.stop()
+    assert time.monotonic() - started < 5
+    assert not any(worker.is_alive() for worker in old_workers)
+    assert jobs[0].state == JOB_QUEUED and jobs[0].attempts == 0
+    assert scheduler.captcha_queue.metrics()['queue_depth'] == 0
+
+    scheduler.start()
+    try:
+        assert wait_for(lambda: jobs[0].state == JOB_DONE)
+        workers = [thread for thread in threading.enumerate() if thread.name.startswith('job-worker-')]
+        assert len(workers) == scheduler.pool_size
+    finally:
+        scheduler.stop()
+
+
+class FakeCapture:
+    def wait(self, timeout):
+        return {'url': 'https://car.gov.br/baixar', 'method': 'GET', 'headers': {}}
+
+
+class FakeDirectDownloader:
+    """Registra o download direto sem transferir nada; o teste decide quando termina."""
+
+    def __init__(self):
+        self.started = []
+
+    def start(self, driver, capture, dest_dir, on_done, on_started=None):
+        path = os.path.join(str(dest_dir), 'imovel.zip')
+        on_started(path)
+        self.started.append((path, on_done))
+        return True
+
+    def active(self):
+        return {}
+
+
+def test_direct_download_is_attributed_by_file(tmp_path):
+    class DirectSession(FakeSession):
+        download_capture = FakeCapture()
+        driver = None
+
+        def capture_captcha(self, timeout=15):
+            return None
+
+    downloader = FakeDirectDownloader()
+    scheduler = make_scheduler(lambda index: DirectSession('pool-1', tmp_path / 'pool'),
+                               direct_downloader=downloader, direct_download_dir=tmp_path / 'direto')
+    try:
+        _, jobs = scheduler.submit_batch([(KIND_PROPERTY, CAR_CODE), (KIND_PROPERTY, CAR_CODE + '0')])
+        assert wait_for(lambda: len(downloader.started) == 2)
+        (first_path, first_done), _ = downloader.started
+
+        # A sessão já está livre (ou em outro trabalho): o arquivo continua sendo do primeiro
+        assert scheduler.notify_download({'session_id': 'pool-1', 'path': first_path,
+                                          'finished_at': time.time()}) is jobs[0]
+        assert scheduler._download_events['pool-1'].empty()
+
+        os.makedirs(os.path.dirname(first_path))
+        with open(first_path, 'wb') as output:
+            output.write(b'PK\x05\x06' + b'\x00' * 18)
+        first_done({'path': first_path, 'size': 22, 'sha256': None, 'checksum_verified': False, 'retries': 0}, None)
+        assert jobs[0].state == JOB_DONE
+        assert list(scheduler._direct_jobs.values()) == [jobs[1].job_id]
+    finally:
+        scheduler.stop()
@@ -0,0 +1,230 @@
+import time
+import threading
+from multiprocessing import Pipe
+
+import pytest
+
+import politeness
+import browser_worker
+from politeness import HostPolicy, PolitenessScheduler, PolitenessTimeout
+
+URL = 'http://sicar.teste/publico/imoveis/index'
+
+
+def make_scheduler(**limits):
+    policy = dict(rate=10, burst=1, max_concurrent=2, jitter=0, pause=0.3, slow_threshold=0.2,
+                  interactive_reserve=0)
+    policy.update(limits)
+    scheduler = PolitenessScheduler()
+    scheduler.configure(policy=HostPolicy(**policy))
+    return scheduler
+
+
+def host(scheduler):
+    return scheduler.status()['hosts'][0]
+
+
+def test_disabled_scheduler_does_not_wait():
+    scheduler = PolitenessScheduler()
+    started = time.monotonic()
+    for _ in range(20):
+        with scheduler.slot(URL):
+            pass
+    assert time.monotonic() - started < 0.1
+    assert scheduler.status()['hosts'] == []
+
+
+def test_token_bucket_spaces_requests():
+    scheduler = make_scheduler(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        with scheduler.slot(URL):
+            pass
+    # Dois pela rajada e quatro a 20/s
+    assert 0.15 <= time.monotonic() - started < 0.5
+    assert host(scheduler)['counters']['granted'] == 6
+
+
+def test_concurrency_limit():
+    scheduler = make_scheduler(rate=1000, burst=10, max_concurrent=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def request():
+        with scheduler.slot(URL):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+
+
+def test_busy_pool_leaves_reserved_slot_to_interactive_browser():
+    scheduler = make_scheduler(rate=1000, burst=10, max_concurrent=2, interactive_reserve=1)
+    held = scheduler.slot(URL, timed=False)
+
+    # O segundo pedido do pool espera: a vaga restante é do navegador interativo
+    with pytest.raises(PolitenessTimeout):
+        scheduler.slot(URL, timeout=0.2)
+
+    queued = []
+    waiter = threading.Thread(target=lambda: queued.append(scheduler.slot(URL)))
+    waiter.start()
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    with scheduler.slot(URL, interactive=True, timeout=1):
+        assert time.monotonic() - started < 0.5
+        assert host(scheduler)['active_interactive'] == 1
+        assert host(scheduler)['waiting'] == 1
+    assert not queued
+
+    held.release()
+    waiter.join(2)
+    assert queued
+    queued[0].release()
+    assert host(scheduler)['active'] == 0
+
+
+def test_interactive_request_goes_ahead_of_queued_pool_requests():
+    scheduler = make_scheduler(rate=1000, burst=10, max_concurrent=1, interactive_reserve=1)
+    held = scheduler.slot(URL)
+    order = []
+
+    def request(name, interactive):
+        with scheduler.slot(URL, interactive=interactive):
+            order.append(name)
+
+    pool = threading.Thread(target=request, args=('pool', False))
+    pool.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=request, args=('interativo', True))
+    interactive.start()
+    time.sleep(0.1)
+
+    held.release()
+    pool.join(2)
+    interactive.join(2)
+    assert order == ['interativo', 'pool']
+
+
+def test_error_halves_rate_and_pauses_host():
+    scheduler = make_scheduler()
+    with scheduler.slot(URL) as slot:
+        slot.error()
+    state = host(scheduler)
+    assert state['rate'] == 5
+    assert state['counters']['errors'] == 1
+    assert state['paused_for'] > 0
+
+    started = time.monotonic()
+    with scheduler.slot(URL):
+        pass
+    assert time.monotonic() - started >= 0.25
+
+
+def test_slow_response_halves_rate_and_normal_response_recovers():
+    scheduler = make_scheduler(increase=1)
+    with scheduler.slot(URL):
+        time.sleep(0.25)
+    assert host(scheduler)['rate'] == 5
+    assert host(scheduler)['counters']['slow'] == 1
+
+    with scheduler.slot(URL):
+        pass
+    assert host(scheduler)['rate'] == 6
+
+
+def test_local_exception_is_not_a_host_failure():
+    scheduler = make_scheduler()
+    with pytest.raises(RuntimeError):
+        with scheduler.slot(URL):
+            raise RuntimeError('Chrome caiu')
+    state = host(scheduler)
+    assert state['rate'] == 10
+    assert state['counters']['errors'] == 0
+    assert state['active'] == 0
+
+
+def test_untimed_slot_uses_reported_duration():
+    scheduler = make_scheduler()
+    with scheduler.slot(URL, timed=False):
+        time.sleep(0.25)
+    assert host(scheduler)['counters']['slow'] == 0
+
+    with scheduler.slot(URL, timed=False) as slot:
+        slot.report(elapsed=1.0)
+    assert host(scheduler)['counters']['slow'] == 1
+
+    with scheduler.slot(URL, timed=False) as slot:
+        slot.report(elapsed=0.01, error=True)
+    assert host(scheduler)['counters']['errors'] == 1
+
+
+def test_timeout_leaves_queue():
+    scheduler = make_scheduler(rate=0.1, burst=1)
+    with scheduler.slot(URL):
+        pass
+    with pytest.raises(PolitenessTimeout):
+        scheduler.slot(URL, timeout=0.1)
+    state = host(scheduler)
+    assert state['waiting'] == 0
+    assert state['counters']['timeouts'] == 1
+
+
+def test_collect_observations_with_disabled_scheduler():
+    scheduler = PolitenessScheduler()
+    with politeness.collect_observations() as observations:
+        with scheduler.slot(URL) as slot:
+            slot.error()
+        with scheduler.slot(URL, timed=False):
+            pass
+    assert len(observations) == 1
+    assert observations[0]['error'] is True
+
+
+def test_is_error_page():
+    assert politeness.is_error_page('503 Service Unavailable')
+    assert politeness.is_error_page('Acesso negado')
+    assert not politeness.is_error_page('Consulta Pública - SICAR')
+    assert not politeness.is_error_page(None)
+
+
+class RunningProcess:
+    pid = 0
+
+    def poll(self):
+        return None
+
+
+def test_worker_observations_reach_parent_slot():
+    scheduler = make_scheduler()
+    session = browser_worker.WorkerSession('teste', '.')
+    parent_conn, child_conn = Pipe()
+    session.process, session._conn = RunningProcess(), parent_conn
+    threading.Thread(target=session._read, args=(parent_conn,), daemon=True).start()
+
+    def child():
+        kind, request_id, name, kwargs = child_conn.recv()
+        child_conn.send((browser_worker.EVENT, request_id, 'politeness', [{'elapsed': 0.5, 'error': True}]))
+        child_conn.send((browser_worker.REPLY, request_id, False, 'TimeoutException: campo não encontrado'))
+
+    threading.Thread(target=child, daemon=True).start()
+    with pytest.raises(browser_worker.WorkerError):
+        with scheduler.slot(URL, timed=False) as slot:
+            session.call('open_property', {'car_code': 'MT-1'}, timeout=5, slot=slot)
+
+    # A página de erro vista pelo filho conta; a exceção local não conta de novo
+    state = host(scheduler)
+    assert state['counters']['errors'] == 1
+    assert state['rate'] == 5
+    parent_conn.close()
+    child_conn.close()
@@ -0,0 +1,128 @@
+import pytest
+
+from readiness import PageReadiness, Probe, INTERACTIVE, inside_frame, wait_until_ready
+import readiness
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def frame(self, frame):
+        if tuple(self.driver.path + [frame]) not in self.driver.documents:
+            raise RuntimeError('no such frame')
+        self.driver.path.append(frame)
+
+    def parent_frame(self):
+        self.driver.path.pop()
+
+    def default_content(self):
+        self.driver.path.clear()
+
+
+class FakeDriver:
+    """Documentos indexados pelo caminho de iframes: {(): {...}, ('f1',): {...}}."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.path = []
+        self.switch_to = FakeSwitchTo(self)
+
+    def execute_script(self, script, probes):
+        document = self.documents.get(tuple(self.path))
+        if document is None or document.get('detached'):
+            raise RuntimeError('frame detached')
+        return {'readyState': 'complete', 'elements': dict(document.get('elements', {})),
+                'frames': list(document.get('frames', []))}
+
+
+PAGE = PageReadiness('teste', [Probe('botao', [('id', 'botao')], INTERACTIVE)])
+
+
+def test_ready_in_main_document():
+    driver = FakeDriver({(): {'elements': {'botao': 'el'}, 'frames': ['f1']}})
+    result = PAGE.check(driver)
+    assert result['ready'] and not result['in_frame'] and result['frame_path'] == []
+    assert driver.path == []
+
+
+def test_finds_probe_inside_iframe_without_leaving_driver_there():
+    driver = FakeDriver({
+        (): {'frames': ['f1', 'f2']},
+        ('f1',): {},
+        ('f2',): {'elements': {'botao': 'el'}},
+    })
+    result = PAGE.check(driver)
+    assert result['ready'] and result['in_frame']
+    assert result['elements']['botao'] == 'el'
+    assert result['frame_path'] == ['f2']
+    assert driver.path == []
+
+    with inside_frame(driver, result):
+        assert driver.path == ['f2']
+    assert driver.path == []
+
+
+def test_nested_iframes_respect_depth():
+    documents = {
+        (): {'frames': ['a']},
+        ('a',): {'frames': ['b']},
+        ('a', 'b'): {'frames': ['c']},
+        ('a', 'b', 'c'): {'elements': {'botao': 'el'}},
+    }
+    driver = FakeDriver(documents)
+    result = PAGE.check(driver)
+    assert readiness.MAX_FRAME_DEPTH == 2
+    assert not result['ready']
+    assert result['missing'] == ['botao']
+
+    documents[('a', 'b')] = {'elements': {'botao': 'el'}}
+    result = PAGE.check(driver)
+    assert result['ready'] and result['frame_path'] == ['a', 'b']
+    assert driver.path == []
+
+
+def test_starts_from_main_document_even_if_caller_left_a_frame():
+    driver = FakeDriver({
+        (): {'elements': {'botao': 'el'}, 'frames': ['f1']},
+        ('f1',): {'detached': True},
+    })
+    # Outro código deixou o driver em um iframe que foi removido
+    driver.path = ['f1']
+    result = PAGE.check(driver)
+    assert result['ready'] and not result['in_frame']
+    assert driver.path == []
+
+
+def test_detached_iframe_is_skipped():
+    driver = FakeDriver({
+        (): {'frames': ['f1', 'f2']},
+        ('f1',): {'detached': True},
+        ('f2',): {'elements': {'botao': 'el'}},
+    })
+    result = PAGE.check(driver)
+    assert result['frame_path'] == ['f2']
+    assert driver.path == []
+
+
+def test_wait_until_ready_times_out_in_main_document():
+    driver = FakeDriver({(): {'frames': ['f1']}, ('f1',): {'detached': True}})
+    result = wait_until_ready(driver, PAGE, timeout=0.3, poll_interval=0.05)
+    assert not result['ready'] and result['missing'] == ['botao']
+    assert driver.path == []
+
+
+def test_inside_frame_returns_to_main_document_on_error():
+    driver = FakeDriver({(): {}, ('f1',): {}})
+    with pytest.raises(ValueError):
+        with inside_frame(driver, {'frame_path': ['f1']}):
+            assert driver.path == ['f1']
+            raise ValueError('falha')
+    assert driver.path == []
+
+
+def test_property_page_ignores_generic_download_links():
+    from sicar_automation import DOWNLOAD_BUTTON_SELECTORS, PROPERTY_PAGE
+    selectors = PROPERTY_PAGE.probes[0].selectors
+    generic = [s for s in DOWNLOAD_BUTTON_SELECTORS if '@href' in s[1] or '@class' in s[1]]
+    assert generic and not set(generic) & set(selectors)
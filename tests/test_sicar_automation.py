@@ -0,0 +1,24 @@
+import pytest
+
+from sicar_automation import xpath_literal
+
+# lxml é opcional (ver offline_detection.py)
+etree = pytest.importorskip('lxml.etree')
+
+
+def matches(name):
+    row = etree.SubElement(etree.Element('tbody'), 'tr')
+    etree.SubElement(row, 'td').text = name
+    return row.xpath(f"self::tr[td[contains(normalize-space(), {xpath_literal(name)})]]")
+
+
+def test_xpath_literal_quotes():
+    assert xpath_literal('Cuiabá') == "'Cuiabá'"
+    assert xpath_literal("Pingo-d'Água") == '"Pingo-d\'Água"'
+
+
+def test_xpath_literal_matches_names_with_both_quotes():
+    for name in ['Cuiabá', "Pingo-d'Água", 'Vila "Nova"', 'Sant\'Ana do "Sul"', "'"]:
+        assert matches(name), name
+    literal = xpath_literal('Vila "Nova"')
+    assert not etree.Element('td').xpath(f"contains('Vila Nova', {literal})")
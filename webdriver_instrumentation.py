@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Medição dos comandos WebDriver.
+
+Todo comando do Selenium (find_element, click, get_screenshot_as_base64,
+execute_cdp_cmd...) passa por WebDriver.execute; instrument_driver envolve
+esse método na instância do driver para contar os comandos e medir sua
+latência, por comando e por sessão. Outros módulos (ex.: webdriver_tracing)
+recebem cada comando registrando um ouvinte com add_command_listener.
+"""
+
+import time
+import logging
+
+from metrics import registry
+
+logger = logging.getLogger('webdriver_instrumentation')
+
+WEBDRIVER_COMMANDS = registry.counter(
+    'webdriver_commands_total', 'Comandos WebDriver executados', ('session', 'command', 'status'))
+WEBDRIVER_LATENCY = registry.histogram(
+    'webdriver_command_seconds', 'Latência dos comandos WebDriver', ('session', 'command'))
+
+# Funções (session_id, command, started, duration, status, params, response) chamadas a cada comando
+_listeners = []
+
+
+def add_command_listener(listener):
+    """Registra uma função chamada após cada comando WebDriver (started e duration em segundos)."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_command_listener(listener):
+    """Remove um ouvinte registrado com add_command_listener."""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def command_name(command, params):
+    """Nome do comando para os rótulos; comandos CDP levam o método (ex.: cdp:Network.getCookies)."""
+    if command == 'executeCdpCommand' and params and params.get('cmd'):
+        return f"cdp:{params['cmd']}"
+    return command
+
+
+def instrument_driver(driver, session_id):
+    """
+    Passa a medir os comandos de um driver.
+
+    Args:
+        driver: WebDriver do Selenium
+        session_id: Sessão dona do driver (rótulo das métricas)
+
+    Returns:
+        WebDriver: O mesmo driver
+    """
+    if getattr(driver, '_instrumented', False):
+        return driver
+
+    execute = driver.execute
+
+    def instrumented_execute(command, params=None):
+        name = command_name(command, params)
+        started = time.perf_counter()
+        status = 'ok'
+        response = None
+        try:
+            response = execute(command, params)
+            return response
+        except Exception:
+            status = 'erro'
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            WEBDRIVER_LATENCY.observe(duration, session=session_id, command=name)
+            WEBDRIVER_COMMANDS.inc(session=session_id, command=name, status=status)
+            for listener in list(_listeners):
+                try:
+                    listener(session_id, name, started, duration, status, params, response)
+                except Exception as e:
+                    logger.error(f"Erro no ouvinte de comandos WebDriver: {str(e)}")
+
+    driver.execute = instrumented_execute
+    driver._instrumented = True
+    return driver
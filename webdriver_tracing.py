@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Rastreamento dos comandos WebDriver por rota e por ciclo do monitor.
+
+Cada rota Flask (ou ciclo do monitor de CAPTCHA) abre um trace; os trechos
+aninhados (check_for_captcha, take_screenshot...) e cada comando WebDriver
+executado na mesma thread entram nele com início, duração e tamanho do
+pedido e da resposta. Os traces recentes ficam em memória e são exportados
+no formato JSON de trace do Chrome, que abre em chrome://tracing ou no
+Perfetto (ui.perfetto.dev), para decompor um /force_download lento comando
+a comando.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from metrics import payload_size
+from webdriver_instrumentation import add_command_listener
+
+logger = logging.getLogger('webdriver_tracing')
+
+# Traces mantidos em memória e máximo de eventos por trace
+DEFAULT_MAX_TRACES = 200
+MAX_EVENTS_PER_TRACE = 5000
+
+
+def now_us():
+    """Relógio monotônico em microssegundos (unidade do formato de trace do Chrome)."""
+    return time.perf_counter_ns() // 1000
+
+
+class Trace:
+    """Um trace: o trecho raiz (rota ou ciclo do monitor) e tudo que ocorreu dentro dele."""
+
+    def __init__(self, name, args=None):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.args = args or {}
+        self.started_at = time.time()
+        self.start_us = now_us()
+        self.duration_us = None
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.events = []
+        self.dropped = 0
+        self.commands = 0
+        self.webdriver_us = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = 0
+
+    def add_event(self, name, category, start_us, duration_us, args=None):
+        if len(self.events) >= MAX_EVENTS_PER_TRACE:
+            self.dropped += 1
+            return
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start_us,
+            'dur': duration_us,
+            'pid': os.getpid(),
+            'tid': self.thread_id,
+            'args': args or {},
+        })
+
+    def summary(self):
+        """Resumo do trace, sem os eventos."""
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'args': self.args,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_us / 1000 if self.duration_us is not None else None,
+            'commands': self.commands,
+            'webdriver_ms': self.webdriver_us / 1000,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'errors': self.errors,
+            'dropped_events': self.dropped,
+        }
+
+    def to_chrome(self):
+        """Trace no formato JSON de trace do Chrome."""
+        metadata = [
+            {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': 'captcha_mirror'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': self.thread_id,
+             'args': {'name': self.thread_name}},
+        ]
+        return {
+            'traceEvents': metadata + sorted(self.events, key=lambda event: (event['ts'], -event['dur'])),
+            'displayTimeUnit': 'ms',
+            'otherData': self.summary(),
+        }
+
+
+class Tracer:
+    """Mantém o trace aberto de cada thread e os traces concluídos mais recentes."""
+
+    def __init__(self, max_traces=DEFAULT_MAX_TRACES, enabled=True, keep_empty=False):
+        """
+        Args:
+            max_traces: Traces concluídos mantidos em memória
+            enabled: Com False, nenhum trace é aberto (os trechos viram no-ops)
+            keep_empty: Mantém também os traces sem comandos WebDriver nem erros
+                        (por padrão descartados, para que rotas de consulta não
+                        ocupem a memória)
+        """
+        self.enabled = enabled
+        self.keep_empty = keep_empty
+        self._local = threading.local()
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        add_command_listener(self.record_command)
+
+    # Trechos
+
+    def begin(self, name, category='app', **args):
+        """
+        Abre um trecho na thread atual; o primeiro trecho aberto inicia um trace.
+
+        Deve ser fechado com end() na mesma thread (ver span() para o uso em bloco).
+        """
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if not stack:
+            self._local.trace = Trace(name, args)
+        stack.append((name, category, now_us(), args))
+
+    def end(self, error=None):
+        """Fecha o trecho aberto mais recente; fechar o trecho raiz conclui o trace."""
+        stack = self._stack()
+        if not stack:
+            return None
+        name, category, start_us, args = stack.pop()
+        trace = self._local.trace
+        duration_us = now_us() - start_us
+        if error is not None:
+            args = dict(args, erro=str(error))
+            trace.errors += 1
+        trace.add_event(name, category, start_us, duration_us, args)
+
+        if stack:
+            return None
+        trace.duration_us = duration_us
+        self._local.trace = None
+        if trace.commands or trace.errors or self.keep_empty:
+            with self._lock:
+                self._traces.append(trace)
+        return trace
+
+    @contextmanager
+    def span(self, name, category='app', **args):
+        """
+        Bloco medido como trecho do trace da thread atual.
+
+        Fecha o trecho também em BaseException (ex.: JobCancelled de
+        background_jobs), para não deixar a pilha da thread aberta.
+        """
+        self.begin(name, category, **args)
+        try:
+            yield
+        except BaseException as e:
+            self.end(error=e if str(e) else type(e).__name__)
+            raise
+        else:
+            self.end()
+
+    def traced(self, name=None, category='app'):
+        """Decorador que mede cada chamada da função como um trecho."""
+        def decorator(function):
+            span_name = name or function.__name__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_command(self, session_id, command, started, duration, status, params, response):
+        """Ouvinte de webdriver_instrumentation: anexa o comando ao trace aberto na thread."""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        request_bytes = payload_size(params)
+        response_bytes = payload_size(response.get('value') if isinstance(response, dict) else response)
+        duration_us = int(duration * 1_000_000)
+        trace.commands += 1
+        trace.webdriver_us += duration_us
+        trace.request_bytes += request_bytes
+        trace.response_bytes += response_bytes
+        trace.add_event(command, 'webdriver', int(started * 1_000_000), duration_us, {
+            'session': session_id,
+            'status': status,
+            'request_bytes': request_bytes,
+            'response_bytes': response_bytes,
+        })
+
+    # Consulta e exportação
+
+    def recent(self, limit=50, name=None, min_duration_ms=None):
+        """Resumos dos traces concluídos, do mais recente ao mais antigo."""
+        with self._lock:
+            traces = list(self._traces)
+        summaries = []
+        for trace in reversed(traces):
+            if name and trace.name != name:
+                continue
+            if min_duration_ms is not None and trace.duration_us / 1000 < min_duration_ms:
+                continue
+            summaries.append(trace.summary())
+            if len(summaries) >= limit:
+                break
+        return summaries
+
+    def get(self, trace_id):
+        """Trace concluído pelo identificador, ou None."""
+        with self._lock:
+            return next((trace for trace in self._traces if trace.trace_id == trace_id), None)
+
+    def export(self, path, trace_ids=None):
+        """
+        Grava traces concluídos em um arquivo JSON de trace do Chrome.
+
+        Args:
+            path: Arquivo de destino
+            trace_ids: Traces a exportar (padrão: todos os mantidos em memória)
+
+        Returns:
+            int: Quantidade de traces exportados
+        """
+        with self._lock:
+            traces = [trace for trace in self._traces if trace_ids is None or trace.trace_id in trace_ids]
+
+        events = []
+        threads = set()
+        for trace in traces:
+            chrome = trace.to_chrome()
+            for event in chrome['traceEvents']:
+                if event['ph'] == 'M':
+                    # Metadados repetidos entre traces da mesma thread
+                    key = (event['name'], event.get('tid'))
+                    if key in threads:
+                        continue
+                    threads.add(key)
+                events.append(event)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as output:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'traces': [trace.summary() for trace in traces]}}, output)
+        os.replace(temporary, path)
+        logger.info(f"{len(traces)} traces exportados para {path}")
+        return len(traces)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+# Rastreador global usado pela aplicação
+tracer = Tracer()